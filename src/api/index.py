@@ -1,4 +1,8 @@
-from fastapi import APIRouter, status
+from fastapi import APIRouter, Depends, HTTPException, status
+
+from core.dependencies import get_access_user
+from core.metrics import metrics
+from schemas.user import AccessUser
 
 router = APIRouter(tags=["test route"])
 
@@ -9,3 +13,14 @@ router = APIRouter(tags=["test route"])
 )
 async def healthcheck():
     return
+
+
+@router.get(
+    "/metrics",
+    status_code=status.HTTP_200_OK,
+)
+async def get_metrics(current_user: AccessUser = Depends(get_access_user)):
+    # внутренние счётчики воркера: только root
+    if current_user.role != "root":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not enough permissions")
+    return metrics.snapshot()
@@ -2,7 +2,7 @@ from fastapi import APIRouter, Depends, Form, HTTPException
 
 from core.dependencies import check_project_access
 from schemas.auth import RefreshRequest, Token
-from schemas.user import UserCreate, UserPublic, UserInDB
+from schemas.user import AccessUser, UserCreate, UserPublic
 from services.auth_service import AuthService, get_auth_service
 from fastapi import Response
 
@@ -55,7 +55,7 @@ async def refresh(body: RefreshRequest, service: AuthService = Depends(get_auth_
 )
 async def list_users(
         service: AuthService = Depends(get_auth_service),
-        current_user: UserInDB = Depends(check_project_access),
+        current_user: AccessUser = Depends(check_project_access),
 ):
     if current_user.role == "root":
         return await service.list_users()
@@ -65,7 +65,8 @@ async def list_users(
 async def assign_manager_to_project(
     project_id: str,
     user_id: str,
-    service: AuthService = Depends(get_auth_service)
+    service: AuthService = Depends(get_auth_service),
+    current_user: AccessUser = Depends(check_project_access),
 ):
     # проверка, что пользователь существует
     target_user = await service.get_user_by_id(user_id)
@@ -73,17 +74,31 @@ async def assign_manager_to_project(
         raise HTTPException(status_code=404, detail="User not found")
     # добавим проект в список менеджера
     await service.add_project_to_user(user_id, project_id)
-    return Response(status_code=204)
+    return await _grants_changed_response(service, user_id, current_user)
 
 @router.post("/manager/projects/{project_id}/revoke-manager/{user_id}", status_code=204, dependencies=[Depends(check_project_access)])
 async def revoke_manager_from_project(
     project_id: str,
     user_id: str,
-    service: AuthService = Depends(get_auth_service)
+    service: AuthService = Depends(get_auth_service),
+    current_user: AccessUser = Depends(check_project_access),
 ):
     target_user = await service.get_user_by_id(user_id)
     if not target_user:
         raise HTTPException(status_code=404, detail="User not found")
     await service.remove_project_from_user(user_id, project_id)
-    return Response(status_code=204)
+    return await _grants_changed_response(service, user_id, current_user)
+
+
+async def _grants_changed_response(service: AuthService, user_id: str, current_user: AccessUser) -> Response:
+    """
+    204 после изменения прав. Себе — сразу новый access с актуальными claims; остальные
+    получат его в X-New-Access-Token при следующем запросе (их claims устарели).
+    """
+    response = Response(status_code=204)
+    if user_id == current_user.id:
+        new_access = await service.reissue_access_token(user_id)
+        if new_access:
+            response.headers["X-New-Access-Token"] = new_access
+    return response
 
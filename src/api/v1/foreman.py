@@ -1,20 +1,25 @@
 import datetime
 from pathlib import Path
-from typing import List
+from typing import List, Literal, Optional
 
 import aiofiles
-from fastapi import APIRouter, Depends, File, HTTPException, UploadFile, status
+from fastapi import APIRouter, Depends, File, Header, HTTPException, Query, Response, UploadFile, status
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, StreamingResponse
 from starlette.requests import Request
 
 from core.dependencies import get_current_user
 from core.environment_config import settings
-from core.functions import _safe_name
+from core.functions import _safe_name, etag_headers, etag_matches, split_csv
 from schemas.request.project_change import UploadResult
+from schemas.request.shift import BulkShiftRequest
 from schemas.response.construction import (
+    BulkShiftResult,
     OperationResult,
     ProjectSummary,
     ShiftHistoryEntry,
     ShiftStatus,
+    TaskSearchMatch,
     WorkStage,
 )
 from schemas.user import UserInDB
@@ -29,10 +34,51 @@ router = APIRouter(prefix="/api/foreman", tags=["foreman"])
     response_model=List[ProjectSummary],
 )
 async def get_projects(
+    response: Response,
+    status_filter: Optional[str] = Query(None, alias="status", description="Есть этап в этом статусе"),
+    name_prefix: Optional[str] = Query(None, description="Название проекта начинается с (без учёта регистра)"),
+    cursor: Optional[str] = Query(None, description="Курсор из заголовка X-Next-Cursor предыдущей страницы"),
+    limit: int = Query(100, ge=1, le=1000, description="Размер страницы"),
+    pit: bool = Query(False, description="Читать все страницы из одного снимка индекса (point-in-time)"),
     service: ForemanService = Depends(get_foreman_service),
     current_user: UserInDB = Depends(get_current_user),
 ):
-    return await service.list_projects(current_user.id)
+    try:
+        projects, next_cursor = await service.list_projects(
+            current_user.id, status_filter, name_prefix, cursor, limit, pit
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e)) from e
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return projects
+
+
+@router.get(
+    "/tasks/search",
+    status_code=status.HTTP_200_OK,
+    response_model=List[TaskSearchMatch],
+)
+async def search_tasks(
+    response: Response,
+    q: str = Query(..., min_length=2, max_length=200, description="Текст для поиска в названиях и описаниях"),
+    project_id: Optional[str] = Query(None, description="Только в этом проекте"),
+    cursor: Optional[str] = Query(None, description="Курсор из заголовка X-Next-Cursor предыдущей страницы"),
+    limit: int = Query(20, ge=1, le=100, description="Размер страницы"),
+    service: ForemanService = Depends(get_foreman_service),
+    current_user: UserInDB = Depends(get_current_user),
+):
+    """
+    Задачи и подзадачи проектов прораба, в названии или описании которых есть q: путь
+    к совпадению в дереве проекта и подсветка, по убыванию релевантности.
+    """
+    try:
+        matches, next_cursor = await service.search_tasks(current_user.id, q, project_id, cursor, limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e)) from e
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return matches
 
 
 @router.get(
@@ -42,10 +88,31 @@ async def get_projects(
 )
 async def get_tasks(
     project_id: str,
+    response: Response,
+    fields: Optional[str] = Query(None, description="Только эти поля этапа через запятую (пути от этапа)"),
+    exclude: Optional[str] = Query(None, description="Исключить эти поля этапа через запятую (пути от этапа)"),
+    stage_id: Optional[str] = Query(None, description="Только этот этап"),
+    work_kind_id: Optional[str] = Query(None, description="Только этот тип работ"),
+    if_none_match: Optional[str] = Header(None),
     service: ForemanService = Depends(get_foreman_service),
     current_user: UserInDB = Depends(get_current_user),
 ):
-    return await service.list_tasks(current_user.id, project_id)
+    if if_none_match:
+        # сначала только версия документа: при совпадении этапы не читаются и не сериализуются
+        version = await service.project_version(current_user.id, project_id)
+        if etag_matches(if_none_match, version):
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=etag_headers(version))
+    try:
+        stages, version = await service.list_tasks(
+            current_user.id, project_id, split_csv(fields), split_csv(exclude), stage_id, work_kind_id
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e)) from e
+    if fields or exclude:
+        # без незапрошенных полей: значения по умолчанию моделей не подставляются
+        return JSONResponse(jsonable_encoder(stages, exclude_unset=True), headers=etag_headers(version))
+    response.headers.update(etag_headers(version))
+    return stages
 
 @router.post(
     "/projects/{project_id}/shift/start",
@@ -59,8 +126,8 @@ async def start_shift(
     service: ForemanService = Depends(get_foreman_service),
     current_user: UserInDB = Depends(get_current_user),
 ):
-    await service.start_shift(current_user.id, project_id, task_ids, subtask_ids)
-    return {"result": "shift started"}
+    seq_no = await service.start_shift(current_user.id, project_id, task_ids, subtask_ids)
+    return {"result": "shift started", "project_id": project_id, "seq_no": seq_no}
 
 
 @router.post(
@@ -75,8 +142,21 @@ async def stop_shift(
     service: ForemanService = Depends(get_foreman_service),
     current_user: UserInDB = Depends(get_current_user),
 ):
-    await service.stop_shift(current_user.id, project_id, task_ids, subtask_ids)
-    return {"result": "shift stopped"}
+    seq_no = await service.stop_shift(current_user.id, project_id, task_ids, subtask_ids)
+    return {"result": "shift stopped", "project_id": project_id, "seq_no": seq_no}
+
+
+@router.post(
+    "/shift/bulk",
+    status_code=status.HTTP_200_OK,
+    response_model=BulkShiftResult,
+)
+async def bulk_shift(
+    body: BulkShiftRequest,
+    service: ForemanService = Depends(get_foreman_service),
+    current_user: UserInDB = Depends(get_current_user),
+):
+    return await service.bulk_shift(current_user.id, body)
 
 
 @router.get(
@@ -86,10 +166,33 @@ async def stop_shift(
 )
 async def shift_history(
     project_id: str,
+    min_seq_no: Optional[int] = Query(
+        None,
+        description="seq_no из ответа start/stop: дождаться, пока эта запись станет видна в истории "
+                    "(не дождались за пару секунд — 503 с Retry-After)",
+    ),
+    date_from: Optional[datetime.datetime] = Query(None, alias="from", description="Начало смены не раньше"),
+    date_to: Optional[datetime.datetime] = Query(None, alias="to", description="Начало смены раньше"),
+    cursor: Optional[str] = Query(None, description="Курсор из заголовка X-Next-Cursor предыдущей страницы"),
+    limit: Optional[int] = Query(None, ge=1, le=1000, description="Размер страницы; без него — вся история"),
+    response_format: Literal["json", "ndjson"] = Query("json", alias="format"),
     service: ForemanService = Depends(get_foreman_service),
     current_user: UserInDB = Depends(get_current_user),
 ):
-    return await service.shift_history(current_user.id, project_id)
+    try:
+        if response_format == "ndjson":
+            stream = await service.stream_shift_history(
+                current_user.id, project_id, min_seq_no, date_from, date_to, cursor
+            )
+            return StreamingResponse(stream, media_type="application/x-ndjson")
+        history, next_cursor = await service.shift_history(
+            current_user.id, project_id, min_seq_no, date_from, date_to, cursor, limit
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e)) from e
+    # тело уже сериализовано сервисом: response_model остаётся только для документации
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor else None
+    return Response(content=history, media_type="application/json", headers=headers)
 
 
 @router.get(
@@ -1,17 +1,27 @@
-from typing import List
+from datetime import datetime
+from typing import List, Literal, Optional
 
-from fastapi import APIRouter, Depends, status
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request, Response, status
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, StreamingResponse
 
-from core.dependencies import check_project_access, get_current_user
-from schemas.request.project_change import ChangeProjectRequest
+from core.dependencies import check_project_access, get_access_user
+from core.functions import _safe_name, etag_headers, etag_matches, split_csv
+from schemas.request.project_change import ChangeProjectRequest, ProjectPatchRequest
 from schemas.request.project_create import ProjectCreate
 from schemas.response.construction import (
     OperationResult,
+    ProjectImportResult,
+    ProjectPatchResult,
+    ProjectProgress,
     ProjectSummary,
     ShiftHistoryEntry,
     StageWithProject,
+    TaskSearchMatch,
+    WorkedHoursReport,
 )
-from schemas.user import UserInDB
+from schemas.response.export import EXPORT_MEDIA_TYPES
+from schemas.user import AccessUser
 from services.manager_service import ManagerService, get_manager_service
 
 router = APIRouter(prefix="/api/manager", tags=["manager"])
@@ -23,13 +33,33 @@ router = APIRouter(prefix="/api/manager", tags=["manager"])
     response_model=List[ProjectSummary],
 )
 async def get_projects(
+        response: Response,
+        foreman_id: Optional[str] = Query(None, description="Только проекты этого прораба"),
+        status_filter: Optional[str] = Query(None, alias="status", description="Есть этап в этом статусе"),
+        name_prefix: Optional[str] = Query(None, description="Название проекта начинается с (без учёта регистра)"),
+        cursor: Optional[str] = Query(None, description="Курсор из заголовка X-Next-Cursor предыдущей страницы"),
+        limit: int = Query(100, ge=1, le=1000, description="Размер страницы"),
+        pit: bool = Query(False, description="Читать все страницы из одного снимка индекса (point-in-time)"),
         service: ManagerService = Depends(get_manager_service),
-        current_user: UserInDB = Depends(get_current_user),
+        current_user: AccessUser = Depends(get_access_user),
 ):
     if current_user.role == "root":
-        return await service.list_projects()
+        project_ids = None
     elif current_user.role == "project_manager":
-        return current_user.managed_projects
+        if not current_user.managed_projects:
+            return []
+        project_ids = current_user.managed_projects
+    else:
+        return None
+    try:
+        projects, next_cursor = await service.list_projects(
+            foreman_id, project_ids, status_filter, name_prefix, cursor, limit, pit
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e)) from e
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return projects
 
 @router.post(
     "/projects",
@@ -39,11 +69,30 @@ async def get_projects(
 async def create_project(
     project: ProjectCreate,
     service: ManagerService = Depends(get_manager_service),
-    current_user: UserInDB = Depends(get_current_user),
+    current_user: AccessUser = Depends(get_access_user),
 ):
     if current_user.role in ["root", "project_manager"]:
         return await service.create_project(project)
 
+@router.post(
+    "/projects/import",
+    status_code=status.HTTP_200_OK,
+    response_model=ProjectImportResult,
+)
+async def import_projects(
+    request: Request,
+    overwrite: bool = Query(True, description="Перезаписывать существующие проекты; иначе такие строки — ошибки"),
+    service: ManagerService = Depends(get_manager_service),
+    current_user: AccessUser = Depends(get_access_user),
+):
+    """
+    Импорт проектов из тела application/x-ndjson: по проекту (как в POST /projects) на строку.
+    Тело читается потоком, ошибки возвращаются по номерам строк вместе со статистикой записи.
+    """
+    if current_user.role not in ["root", "project_manager"]:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not enough permissions")
+    return await service.import_projects(request.stream(), overwrite)
+
 @router.patch(
     "/projects/{project_id}",
     status_code=status.HTTP_200_OK,
@@ -55,7 +104,67 @@ async def change_project(
     body: ChangeProjectRequest,
     service: ManagerService = Depends(get_manager_service),
 ):
-    return await service.change_project(project_id, body.key, body.value)
+    try:
+        return await service.change_project(project_id, body.key, body.value)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e)) from e
+
+
+@router.patch(
+    "/projects/{project_id}/batch",
+    status_code=status.HTTP_200_OK,
+    response_model=ProjectPatchResult,
+    dependencies=[Depends(check_project_access)],
+)
+async def patch_project(
+    project_id: str,
+    body: ProjectPatchRequest,
+    service: ManagerService = Depends(get_manager_service),
+):
+    """
+    Несколько правок проекта одной записью: операции применяются по порядку и все сразу.
+    Если хоть одна не применима, документ не меняется (result = rejected),
+    а в operations указано, какая и почему.
+    """
+    result = await service.patch_project(project_id, body)
+    if result.result == "not_found":
+        raise HTTPException(status_code=404, detail="not_found")
+    return result
+
+
+@router.get(
+    "/tasks/search",
+    status_code=status.HTTP_200_OK,
+    response_model=List[TaskSearchMatch],
+)
+async def search_tasks(
+        response: Response,
+        q: str = Query(..., min_length=2, max_length=200, description="Текст для поиска в названиях и описаниях"),
+        project_id: Optional[str] = Query(None, description="Только в этом проекте"),
+        cursor: Optional[str] = Query(None, description="Курсор из заголовка X-Next-Cursor предыдущей страницы"),
+        limit: int = Query(20, ge=1, le=100, description="Размер страницы"),
+        service: ManagerService = Depends(get_manager_service),
+        current_user: AccessUser = Depends(get_access_user),
+):
+    """
+    Задачи и подзадачи доступных проектов (root — всех, project_manager — managed_projects),
+    в названии или описании которых есть q, по убыванию релевантности.
+    """
+    if current_user.role == "root":
+        project_ids = None
+    elif current_user.role == "project_manager":
+        if not current_user.managed_projects:
+            return []
+        project_ids = current_user.managed_projects
+    else:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not enough permissions")
+    try:
+        matches, next_cursor = await service.search_tasks(q, project_ids, project_id, cursor, limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e)) from e
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return matches
 
 
 @router.get(
@@ -65,10 +174,29 @@ async def change_project(
 )
 async def get_tasks(
         project_id: str,
+        response: Response,
+        fields: Optional[str] = Query(None, description="Только эти поля этапа через запятую (пути от этапа)"),
+        exclude: Optional[str] = Query(None, description="Исключить эти поля этапа через запятую (пути от этапа)"),
+        stage_id: Optional[str] = Query(None, description="Только этот этап"),
+        work_kind_id: Optional[str] = Query(None, description="Только этот тип работ"),
+        if_none_match: Optional[str] = Header(None),
         service: ManagerService = Depends(get_manager_service),
-        current_user: UserInDB = Depends(check_project_access),
+        current_user: AccessUser = Depends(check_project_access),
     ):
-    return await service.list_tasks(project_id)
+    if if_none_match:
+        version = await service.project_version(project_id)
+        if etag_matches(if_none_match, version):
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=etag_headers(version))
+    try:
+        stages, version = await service.list_tasks(
+            project_id, split_csv(fields), split_csv(exclude), stage_id, work_kind_id
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e)) from e
+    if fields or exclude:
+        return JSONResponse(jsonable_encoder(stages, exclude_unset=True), headers=etag_headers(version))
+    response.headers.update(etag_headers(version))
+    return stages
 
 @router.get(
     "/projects/{project_id}/shifts",
@@ -77,7 +205,112 @@ async def get_tasks(
     dependencies=[Depends(check_project_access)],
 )
 async def get_all_shifts(
+        project_id: str,
+        date_from: Optional[datetime] = Query(None, alias="from", description="Начало смены не раньше"),
+        date_to: Optional[datetime] = Query(None, alias="to", description="Начало смены раньше"),
+        cursor: Optional[str] = Query(None, description="Курсор из заголовка X-Next-Cursor предыдущей страницы"),
+        limit: Optional[int] = Query(None, ge=1, le=1000, description="Размер страницы; без него — вся история"),
+        response_format: Literal["json", "ndjson"] = Query("json", alias="format"),
+        service: ManagerService = Depends(get_manager_service),
+):
+    try:
+        if response_format == "ndjson":
+            stream = await service.stream_shift_history(project_id, date_from, date_to, cursor)
+            return StreamingResponse(stream, media_type="application/x-ndjson")
+        history, next_cursor = await service.shift_history(project_id, date_from, date_to, cursor, limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e)) from e
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor else None
+    return Response(content=history, media_type="application/json", headers=headers)
+
+
+@router.get(
+    "/projects/{project_id}/export/tasks",
+    status_code=status.HTTP_200_OK,
+    response_class=StreamingResponse,
+    dependencies=[Depends(check_project_access)],
+)
+async def export_tasks(
+        project_id: str,
+        export_format: Literal["ndjson", "csv"] = Query("ndjson", alias="format"),
+        service: ManagerService = Depends(get_manager_service),
+):
+    """Задачи и подзадачи проекта плоскими строками (NDJSON или CSV), потоком."""
+    stream = await service.export_tasks(project_id, export_format)
+    if stream is None:
+        raise HTTPException(status_code=404, detail="not_found")
+    return StreamingResponse(
+        stream,
+        media_type=EXPORT_MEDIA_TYPES[export_format],
+        headers={"Content-Disposition": f'attachment; filename="{_safe_name(project_id)}-tasks.{export_format}"'},
+    )
+
+
+@router.get(
+    "/projects/{project_id}/export/shifts",
+    status_code=status.HTTP_200_OK,
+    response_class=StreamingResponse,
+    dependencies=[Depends(check_project_access)],
+)
+async def export_shifts(
+        project_id: str,
+        export_format: Literal["ndjson", "csv"] = Query("ndjson", alias="format"),
+        date_from: Optional[datetime] = Query(None, alias="from", description="Начало смены не раньше"),
+        date_to: Optional[datetime] = Query(None, alias="to", description="Начало смены раньше"),
+        service: ManagerService = Depends(get_manager_service),
+):
+    """
+    Интервалы работы по проекту (как в /shifts) потоком NDJSON или CSV. Страницы событий
+    читаются из одного point-in-time снимка, память не растёт с размером истории.
+    """
+    stream = await service.export_shift_history(project_id, export_format, date_from, date_to)
+    if stream is None:
+        raise HTTPException(status_code=404, detail="not_found")
+    return StreamingResponse(
+        stream,
+        media_type=EXPORT_MEDIA_TYPES[export_format],
+        headers={"Content-Disposition": f'attachment; filename="{_safe_name(project_id)}-shifts.{export_format}"'},
+    )
+
+
+@router.get(
+    "/projects/{project_id}/worked-hours",
+    status_code=status.HTTP_200_OK,
+    response_model=WorkedHoursReport,
+    dependencies=[Depends(check_project_access)],
+)
+async def get_worked_hours(
+        project_id: str,
+        date_from: Optional[datetime] = Query(None, alias="from", description="Начало интервала не раньше"),
+        date_to: Optional[datetime] = Query(None, alias="to", description="Начало интервала раньше"),
+        time_zone: str = Query("UTC", alias="tz", description="Часовой пояс IANA для разбивки по дням"),
+        service: ManagerService = Depends(get_manager_service),
+):
+    try:
+        report = await service.worked_hours(project_id, date_from, date_to, time_zone)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e)) from e
+    if report is None:
+        raise HTTPException(status_code=404, detail="not_found")
+    return report
+
+
+@router.get(
+    "/projects/{project_id}/progress",
+    status_code=status.HTTP_200_OK,
+    response_model=ProjectProgress,
+    dependencies=[Depends(check_project_access)],
+)
+async def get_progress(
         project_id: str,
         service: ManagerService = Depends(get_manager_service),
 ):
-    return await service.shift_history(project_id)
+    """
+    Прогресс проекта: плановый и фактический объём, подзадачи по статусам и активные смены
+    по проекту, этапам и видам работ. Сводка обновляется при каждой правке проекта
+    и старте/стопе смен, поэтому чтение не разбирает дерево проекта.
+    """
+    report = await service.progress(project_id)
+    if report is None:
+        raise HTTPException(status_code=404, detail="not_found")
+    return report
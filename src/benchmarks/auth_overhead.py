@@ -0,0 +1,84 @@
+"""
+Накладные расходы авторизации на запрос: try_decode_access и get_current_user целиком.
+
+Один и тот же access-токен проверяется --repeat раз — как за жизнь токена при обычной
+работе клиента. Режимы: без кэша (verified_tokens с maxsize 0, PyJWT decode + HMAC на
+каждый запрос) и с кэшем проверенных токенов. get_current_user вызывается напрямую
+с репозиторием пользователей в памяти, чтобы в замер не попадали ES и Redis;
+отдельной строкой — токен в окне превентивного обновления (X-New-Access-Token).
+
+Запуск из src/: python -m benchmarks.auth_overhead [--repeat 20000]
+"""
+import argparse
+import asyncio
+import inspect
+import time
+from datetime import timedelta
+from typing import Any, Callable, Optional
+
+from fastapi import Response
+
+from core import security
+from core.cache import TTLCache
+from core.dependencies import get_current_user
+from core.environment_config import settings
+from schemas.user import UserInDB
+
+USER_ID = "bench-user"
+
+
+class MemoryUserRepository:
+    """Ровно то, что нужно get_current_user."""
+
+    def __init__(self, user: UserInDB):
+        self.user = user
+
+    async def get_user_profile(self, user_id: str) -> Optional[UserInDB]:
+        return self.user
+
+
+async def per_call_us(repeat: int, operation: Callable[[], Any]) -> float:
+    for _ in range(min(repeat, 100)):
+        result = operation()
+        if inspect.isawaitable(result):
+            await result
+    started = time.perf_counter()
+    for _ in range(repeat):
+        result = operation()
+        if inspect.isawaitable(result):
+            await result
+    return (time.perf_counter() - started) / repeat * 1e6
+
+
+async def run(args: argparse.Namespace) -> None:
+    repo = MemoryUserRepository(UserInDB(id=USER_ID, email="bench@example.com", hashed_password=""))
+    token = security.create_access_token(USER_ID)
+    # exp попадает в окно превентивного обновления
+    expiring = security._create_token(
+        {"sub": USER_ID}, timedelta(seconds=settings.jwt.access_token_proactive_refresh_seconds / 2), "access"
+    )
+
+    print(f"{'operation':<32} {'no cache, us':>14} {'cache, us':>14} {'speedup':>9}")
+    for label, operation in (
+        ("try_decode_access", lambda: security.try_decode_access(token)),
+        ("get_current_user", lambda: get_current_user(Response(), token, None, repo)),
+        ("get_current_user, expiring", lambda: get_current_user(Response(), expiring, None, repo)),
+    ):
+        row = []
+        for size in (0, args.cache_size):
+            security.verified_tokens = TTLCache(size, settings.jwt.access_token_expire_minutes * 60)
+            security.reissued_tokens = TTLCache(size, settings.jwt.access_token_proactive_refresh_seconds)
+            row.append(await per_call_us(args.repeat, operation))
+        print(f"{label:<32} {row[0]:>14.2f} {row[1]:>14.2f} {row[0] / row[1]:>8.1f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=20000)
+    parser.add_argument("--cache-size", type=int, default=settings.jwt.verified_token_cache_size)
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
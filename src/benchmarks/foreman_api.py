@@ -0,0 +1,334 @@
+"""
+Нагрузочный бенчмарк API прораба: задержки p50/p95/p99 и пропускная способность.
+
+Запросы идут через ASGI-приложение с роутером api.v1.foreman (без сети и uvicorn),
+авторизация подменяется. ES — FakeElasticsearch в памяти процесса или настоящий
+кластер (--es-url, индексы с префиксом --index-prefix пересоздаются). В обоих случаях
+индексы создаются по mapping из dev-data/actual_es_commands и заполняются
+синтетическими проектами.
+
+Результаты пишутся в JSON (--output) вместе с коммитом и параметрами запуска;
+--compare <старый.json> печатает изменение p50/p95/p99 и RPS относительно него.
+
+Запуск из src/: python -m benchmarks.foreman_api [--projects 20] [--requests 500] [--concurrency 20]
+"""
+import argparse
+import asyncio
+import json
+import math
+import random
+import subprocess
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from elasticsearch._async.client import AsyncElasticsearch
+from fastapi import FastAPI, Request
+
+from api.v1 import foreman
+from tests.fake_elastic import FakeElasticsearch, load_index_mappings
+from benchmarks.synthetic import make_project, subtask_ids
+from core.dependencies import get_current_user
+from core.environment_config import settings
+from repository.base.elastic_repository import PATH_INDEX_FIELD, BaseElasticRepository
+from repository.elasticsearch_implementation.foreman_repository import ElasticForemanRepository
+from schemas.user import UserInDB
+from services.foreman_service import ForemanService, get_foreman_service
+
+RESULTS_DIR = Path(__file__).resolve().parent / "results"
+BENCH_USER_HEADER = "x-bench-user"
+
+Scenario = Callable[[int], Tuple[str, str, Optional[Dict[str, Any]], Dict[str, str]]]
+
+
+async def asgi_request(
+        app: FastAPI,
+        method: str,
+        path: str,
+        body: Optional[Dict[str, Any]] = None,
+        headers: Optional[Dict[str, str]] = None,
+) -> Tuple[int, bytes]:
+    """Один HTTP-запрос к приложению напрямую через ASGI."""
+    path, _, query = path.partition("?")
+    payload = json.dumps(body).encode() if body is not None else b""
+    raw_headers = [(b"content-type", b"application/json")]
+    raw_headers += [(name.encode(), value.encode()) for name, value in (headers or {}).items()]
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": query.encode(),
+        "root_path": "",
+        "headers": raw_headers,
+        "client": ("127.0.0.1", 0),
+        "server": ("bench", 80),
+    }
+    sent = False
+
+    async def receive() -> Dict[str, Any]:
+        nonlocal sent
+        if sent:
+            return {"type": "http.disconnect"}
+        sent = True
+        return {"type": "http.request", "body": payload, "more_body": False}
+
+    status = 500
+    chunks: List[bytes] = []
+
+    async def send(message: Dict[str, Any]) -> None:
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+        elif message["type"] == "http.response.body":
+            chunks.append(message.get("body", b""))
+
+    await app(scope, receive, send)
+    return status, b"".join(chunks)
+
+
+def build_app(repo: ElasticForemanRepository) -> FastAPI:
+    app = FastAPI()
+    app.include_router(foreman.router)
+
+    async def bench_user(request: Request) -> UserInDB:
+        foreman_id = request.headers[BENCH_USER_HEADER]
+        return UserInDB(id=foreman_id, email=f"{foreman_id}@example.com", hashed_password="", role="foreman")
+
+    app.dependency_overrides[get_current_user] = bench_user
+    app.dependency_overrides[get_foreman_service] = lambda: ForemanService(repo)
+    return app
+
+
+async def seed(client: Any, names: Dict[str, str], args: argparse.Namespace) -> List[Dict[str, Any]]:
+    """Создаёт индексы по mapping из dev-data и пишет проекты; возвращает их описание для сценариев."""
+    mappings = load_index_mappings()
+    for source_name, index in names.items():
+        if not isinstance(client, FakeElasticsearch) and await client.indices.exists(index=index):
+            await client.indices.delete(index=index)
+        await client.indices.create(index=index, mappings=mappings[source_name])
+
+    projects = []
+    operations: List[Dict[str, Any]] = []
+    for i in range(args.projects):
+        project_id = f"bench-p{i}"
+        foreman_id = f"bench-f{i % args.foremen}"
+        src = make_project(
+            project_id=project_id,
+            foreman_id=foreman_id,
+            stages=args.stages,
+            work_kinds=2,
+            work_types=2,
+            tasks=5,
+            subtasks=args.subtasks_per_task,
+        )
+        src[PATH_INDEX_FIELD] = BaseElasticRepository.build_path_index(src)
+        operations += [{"index": {"_index": names["construction"], "_id": project_id}}, src]
+        projects.append({"project_id": project_id, "foreman_id": foreman_id, "subtask_ids": subtask_ids(src)})
+        if len(operations) >= 100:
+            await client.bulk(operations=operations)
+            operations = []
+    if operations:
+        await client.bulk(operations=operations)
+    if not isinstance(client, FakeElasticsearch):
+        await client.indices.refresh(index=",".join(names.values()))
+    return projects
+
+
+def scenarios(projects: List[Dict[str, Any]], seed_value: int) -> Dict[str, Scenario]:
+    """Имя сценария -> функция номера запроса, возвращающая (method, path, body, headers)."""
+    rng = random.Random(seed_value)
+    # одна и та же подзадача стартует в start и останавливается в stop, история заполняется событиями
+    picks = [(rng.choice(projects), rng.random()) for _ in range(4096)]
+
+    def pick(n: int) -> Tuple[Dict[str, Any], str, Dict[str, str]]:
+        project, r = picks[n % len(picks)]
+        subtask_id = project["subtask_ids"][int(r * len(project["subtask_ids"]))]
+        return project, subtask_id, {BENCH_USER_HEADER: project["foreman_id"]}
+
+    def projects_list(n):
+        project, _, headers = pick(n)
+        return "GET", "/api/foreman/projects", None, headers
+
+    def tasks(n):
+        project, _, headers = pick(n)
+        return "GET", f"/api/foreman/projects/{project['project_id']}/tasks", None, headers
+
+    def shift_start(n):
+        project, subtask_id, headers = pick(n)
+        body = {"task_ids": [], "subtask_ids": [subtask_id]}
+        return "POST", f"/api/foreman/projects/{project['project_id']}/shift/start", body, headers
+
+    def shift_stop(n):
+        project, subtask_id, headers = pick(n)
+        body = {"task_ids": [], "subtask_ids": [subtask_id]}
+        return "POST", f"/api/foreman/projects/{project['project_id']}/shift/stop", body, headers
+
+    def shift_history(n):
+        project, _, headers = pick(n)
+        return "GET", f"/api/foreman/projects/{project['project_id']}/shift/history?limit=100", None, headers
+
+    def shift_status(n):
+        project, _, headers = pick(n)
+        return "GET", f"/api/foreman/projects/{project['project_id']}/shift/status", None, headers
+
+    return {
+        "projects": projects_list,
+        "tasks": tasks,
+        "shift_start": shift_start,
+        "shift_status": shift_status,
+        "shift_stop": shift_stop,
+        "shift_history": shift_history,
+    }
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Nearest-rank перцентиль по отсортированной выборке."""
+    return values[max(math.ceil(q / 100 * len(values)) - 1, 0)]
+
+
+async def run_scenario(
+        app: FastAPI, scenario: Scenario, requests: int, concurrency: int, warmup: int
+) -> Dict[str, Any]:
+    for n in range(warmup):
+        method, path, body, headers = scenario(n)
+        await asgi_request(app, method, path, body, headers)
+
+    latencies: List[float] = []
+    errors = 0
+    counter = iter(range(warmup, warmup + requests))
+
+    async def worker() -> None:
+        nonlocal errors
+        for n in counter:
+            method, path, body, headers = scenario(n)
+            started = time.perf_counter()
+            try:
+                status, _ = await asgi_request(app, method, path, body, headers)
+            except Exception:
+                status = 500
+            latencies.append(time.perf_counter() - started)
+            if status >= 400:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "p50_ms": percentile(latencies, 50) * 1e3,
+        "p95_ms": percentile(latencies, 95) * 1e3,
+        "p99_ms": percentile(latencies, 99) * 1e3,
+        "mean_ms": sum(latencies) / len(latencies) * 1e3,
+        "rps": len(latencies) / elapsed,
+    }
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=Path(__file__).parent, text=True, stderr=subprocess.DEVNULL
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_comparison(results: Dict[str, Dict[str, Any]], baseline_path: Path) -> None:
+    baseline = json.loads(baseline_path.read_text())
+    print(f"\nChange vs {baseline_path.name} (commit {baseline.get('commit')}):")
+    for name, current in results.items():
+        previous = baseline["results"].get(name)
+        if previous is None:
+            continue
+        deltas = [
+            f"{key} {(current[key] - previous[key]) / previous[key] * 100:+.1f}%"
+            for key in ("p50_ms", "p95_ms", "p99_ms", "rps")
+            if previous[key]
+        ]
+        print(f"  {name:<15} " + ", ".join(deltas))
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    names = {
+        "construction": f"{args.index_prefix}{settings.elasticsearch.index}",
+        "shift_events": f"{args.index_prefix}{settings.elasticsearch.shift_events_index}",
+        "shift_state": f"{args.index_prefix}{settings.elasticsearch.shift_state_index}",
+    }
+    if args.es_url:
+        client = AsyncElasticsearch(args.es_url, basic_auth=args.es_auth.split(":", 1) if args.es_auth else None)
+    else:
+        client = FakeElasticsearch(latency_ms=args.latency_ms)
+    try:
+        projects = await seed(client, names, args)
+        repo = ElasticForemanRepository(
+            client,
+            names["construction"],
+            names["shift_events"],
+            names["shift_state"],
+            write_buffer_ms=args.write_buffer_ms,
+            write_buffer_max_batch=settings.elasticsearch.shift_write_buffer_max_batch,
+        )
+        app = build_app(repo)
+        results = {}
+        for name, scenario in scenarios(projects, args.seed).items():
+            results[name] = await run_scenario(app, scenario, args.requests, args.concurrency, args.warmup)
+            row = results[name]
+            print(
+                f"{name:<15} p50 {row['p50_ms']:8.2f} ms  p95 {row['p95_ms']:8.2f} ms  "
+                f"p99 {row['p99_ms']:8.2f} ms  {row['rps']:8.0f} rps  errors {row['errors']}"
+            )
+        await repo.close()
+    finally:
+        await client.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--projects", type=int, default=20)
+    parser.add_argument("--foremen", type=int, default=5)
+    parser.add_argument("--stages", type=int, default=2, help="Этапов в проекте (по 2x2x5 задач в каждом)")
+    parser.add_argument("--subtasks-per-task", type=int, default=10)
+    parser.add_argument("--requests", type=int, default=500, help="Запросов на сценарий")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--latency-ms", type=float, default=0.5, help="Задержка FakeElasticsearch на запрос")
+    parser.add_argument("--write-buffer-ms", type=int, default=settings.elasticsearch.shift_write_buffer_ms)
+    parser.add_argument("--es-url", help="Настоящий ES вместо FakeElasticsearch")
+    parser.add_argument("--es-auth", help="login:password для --es-url")
+    parser.add_argument("--index-prefix", default="bench_")
+    parser.add_argument("--output", type=Path, help="Файл результатов (по умолчанию results/foreman_api-<commit>.json)")
+    parser.add_argument("--compare", type=Path, help="Предыдущий файл результатов для сравнения")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    commit = git_commit()
+    report = {
+        "benchmark": "foreman_api",
+        "commit": commit,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "backend": args.es_url or "fake",
+        "params": {
+            key: value for key, value in vars(args).items()
+            if key not in ("output", "compare", "es_auth")
+        },
+        "results": results,
+    }
+    output = args.output or RESULTS_DIR / f"foreman_api-{commit or 'local'}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2, default=str))
+    print(f"\nResults written to {output}")
+    if args.compare:
+        print_comparison(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
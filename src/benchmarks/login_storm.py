@@ -0,0 +1,187 @@
+"""
+Шторм логинов: задержка постороннего эндпоинта (/healthcheck), пока воркер проверяет пароли.
+
+Через ASGI-приложение с роутерами auth и index (без сети и uvicorn) идут --logins логинов
+с параллельностью --concurrency, а зонд раз в --probe-interval-ms запрашивает /healthcheck
+(задержка зонда — от запланированного момента запроса до ответа).
+Пользователи — в памяти процесса. Режимы:
+
+  * inline  — хеш прямо в event loop (PASSWORD_HASH_WORKERS=0, поведение до пула);
+  * thread  — PasswordHashPool на --workers потоков с очередью --queue-limit,
+              логины сверх очереди получают 503;
+  * process — то же на --workers процессах.
+
+--scheme auto берёт bcrypt, только если у passlib backend из пакета bcrypt (отпускает GIL);
+иначе (os_crypt держит GIL) — pbkdf2_sha256 с --pbkdf2-rounds через hashlib, который
+GIL тоже отпускает. Выбранная схема и время одного хеша печатаются в начале.
+
+Запуск из src/: python -m benchmarks.login_storm [--logins 200] [--concurrency 50] [--workers 2]
+"""
+import argparse
+import asyncio
+import time
+from typing import Any, Dict, List, Optional
+
+from fastapi import FastAPI
+from passlib.context import CryptContext
+from passlib.exc import MissingBackendError
+from passlib.hash import bcrypt
+
+from api import index
+from api.v1 import auth
+from benchmarks.foreman_api import asgi_request, percentile
+from common.exception_handlers.init_handlers import init_handlers
+from core import security
+from core.password_pool import PasswordHashPool
+from schemas.user import UserInDB
+from services.auth_service import AuthService, get_auth_service
+
+PASSWORD = "bench-password"
+MODES = ("inline", "thread", "process")
+
+
+class MemoryUserRepository:
+    """Ровно то, что нужно AuthService.authenticate_user."""
+
+    def __init__(self, users: Dict[str, UserInDB]):
+        self.users = users
+
+    async def get_user_by_email(self, email: str) -> Optional[UserInDB]:
+        return self.users.get(email)
+
+
+def password_context(args: argparse.Namespace) -> CryptContext:
+    scheme = args.scheme
+    if scheme == "auto":
+        try:
+            scheme = "bcrypt" if bcrypt.get_backend() == "bcrypt" else "pbkdf2_sha256"
+        except MissingBackendError:
+            scheme = "pbkdf2_sha256"
+    if scheme == "bcrypt":
+        return CryptContext(schemes=["bcrypt"], bcrypt__rounds=args.bcrypt_rounds)
+    return CryptContext(schemes=["pbkdf2_sha256"], pbkdf2_sha256__rounds=args.pbkdf2_rounds)
+
+
+def build_app(users: int) -> FastAPI:
+    hashed = security.hash_password(PASSWORD)
+    repo = MemoryUserRepository({
+        f"user{i}@example.com": UserInDB(id=f"user{i}", email=f"user{i}@example.com", hashed_password=hashed)
+        for i in range(users)
+    })
+    app = FastAPI()
+    app.include_router(index.router)
+    app.include_router(auth.router)
+    init_handlers(app)
+    app.dependency_overrides[get_auth_service] = lambda: AuthService(repo)
+    return app
+
+
+def summary(latencies: List[float]) -> Dict[str, float]:
+    latencies = sorted(latencies)
+    return {
+        "count": len(latencies),
+        "p50_ms": percentile(latencies, 50) * 1e3,
+        "p95_ms": percentile(latencies, 95) * 1e3,
+        "p99_ms": percentile(latencies, 99) * 1e3,
+        "max_ms": latencies[-1] * 1e3,
+    }
+
+
+async def storm(app: FastAPI, args: argparse.Namespace) -> Dict[str, Any]:
+    probes: List[float] = []
+    logins: List[float] = []
+    statuses: Dict[int, int] = {}
+    counter = iter(range(args.logins))
+    done = asyncio.Event()
+
+    async def probe() -> None:
+        # задержка считается от момента, когда запрос должен был прийти: пока event loop
+        # занят хешем, зонд не может даже начать запрос, и все пропущенные слоты ждут до его конца
+        interval = args.probe_interval_ms / 1e3
+        due = time.perf_counter()
+        while not done.is_set():
+            await asyncio.sleep(max(due - time.perf_counter(), 0))
+            await asgi_request(app, "GET", "/healthcheck")
+            finished = time.perf_counter()
+            while due <= finished:
+                probes.append(finished - due)
+                due += interval
+
+    async def login() -> None:
+        for n in counter:
+            body = {"email": f"user{n % args.users}@example.com", "password": PASSWORD}
+            started = time.perf_counter()
+            status, _ = await asgi_request(app, "POST", "/auth/login", body)
+            logins.append(time.perf_counter() - started)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    prober = asyncio.create_task(probe())
+    started = time.perf_counter()
+    await asyncio.gather(*(login() for _ in range(args.concurrency)))
+    elapsed = time.perf_counter() - started
+    done.set()
+    await prober
+    return {
+        "healthcheck": summary(probes),
+        "login": summary(logins),
+        "statuses": statuses,
+        "logins_per_second": len(logins) / elapsed,
+    }
+
+
+async def idle(app: FastAPI, args: argparse.Namespace) -> Dict[str, float]:
+    probes = []
+    for _ in range(args.idle_probes):
+        started = time.perf_counter()
+        await asgi_request(app, "GET", "/healthcheck")
+        probes.append(time.perf_counter() - started)
+    return summary(probes)
+
+
+def print_row(name: str, row: Dict[str, float]) -> None:
+    print(
+        f"  {name:<12} p50 {row['p50_ms']:8.2f} ms  p95 {row['p95_ms']:8.2f} ms  "
+        f"p99 {row['p99_ms']:8.2f} ms  max {row['max_ms']:8.2f} ms  n {row['count']}"
+    )
+
+
+async def run(args: argparse.Namespace) -> None:
+    security.pwd_context = password_context(args)
+    print(f"hash scheme: {security.pwd_context.default_scheme()}")
+    app = build_app(args.users)
+    started = time.perf_counter()
+    security.verify_password(PASSWORD, security.hash_password(PASSWORD))
+    print(f"one hash+verify: {(time.perf_counter() - started) * 1e3:.1f} ms\n")
+
+    for mode in args.modes:
+        workers = 0 if mode == "inline" else args.workers
+        executor = "process" if mode == "process" else "thread"
+        security.password_pool = PasswordHashPool(workers, args.queue_limit, executor)
+        print(f"{mode} (workers {workers}, queue limit {args.queue_limit if workers else '-'})")
+        print_row("idle health", await idle(app, args))
+        result = await storm(app, args)
+        print_row("healthcheck", result["healthcheck"])
+        print_row("login", result["login"])
+        print(f"  statuses {result['statuses']}, {result['logins_per_second']:.0f} logins/s\n")
+        security.password_pool.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--queue-limit", type=int, default=32)
+    parser.add_argument("--probe-interval-ms", type=float, default=5)
+    parser.add_argument("--idle-probes", type=int, default=200)
+    parser.add_argument("--bcrypt-rounds", type=int, default=12)
+    parser.add_argument("--pbkdf2-rounds", type=int, default=200000)
+    parser.add_argument("--scheme", choices=("auto", "bcrypt", "pbkdf2_sha256"), default="auto")
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=list(MODES))
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
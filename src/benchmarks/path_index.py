@@ -0,0 +1,139 @@
+"""
+Стоимость поиска задачи/подзадачи в дереве проекта до и после path_index.
+
+Painless здесь не запустить, поэтому сравниваются эквивалентные операции на Python
+и объём JSON, который передаётся между приложением и ES за одну операцию:
+  * nested walk   — обход stage -> work_kind -> work_type -> task -> subtask до нужного id
+                    (так работали скрипты start/stop и add_report_links);
+  * indexed       — переход по индексам из path_index (ADD_REPORT_LINKS_SCRIPT);
+  * toggle lookup — разбор скелета проекта (collect_shift_targets) против чтения записей path_index.
+
+Запуск из src/: python -m benchmarks.path_index [--subtasks-per-task 10] [--repeat 200]
+"""
+import argparse
+import json
+import random
+import timeit
+from typing import Any, Dict, List, Optional
+
+from benchmarks.synthetic import make_project, subtask_ids
+from repository.base.elastic_repository import PATH_INDEX_FIELD, BaseElasticRepository
+
+
+def nested_walk(src: Dict[str, Any], subtask_id: str) -> Optional[Dict[str, Any]]:
+    for stage in src.get("work_stages") or []:
+        for wk in stage.get("work_kinds") or []:
+            for wt in wk.get("work_types") or []:
+                for task in wt.get("tasks") or []:
+                    for sub in task.get("subtasks") or []:
+                        if sub.get("subtask_id") == subtask_id:
+                            return sub
+    return None
+
+
+def indexed(src: Dict[str, Any], path: List[int]) -> Dict[str, Any]:
+    s, k, t, a, b = path
+    return src["work_stages"][s]["work_kinds"][k]["work_types"][t]["tasks"][a]["subtasks"][b]
+
+
+def skeleton(src: Dict[str, Any]) -> Dict[str, Any]:
+    """То, что отдаёт get с _source_includes=PROJECT_TARGET_FIELDS."""
+    return {
+        "project_id": src["project_id"],
+        "project_name": src["project_name"],
+        "foreman_id": src["foreman_id"],
+        "work_stages": [
+            {"work_kinds": [
+                {
+                    "work_kind_id": wk["work_kind_id"],
+                    "work_kind_name": wk["work_kind_name"],
+                    "work_types": [
+                        {
+                            "work_type_id": wt["work_type_id"],
+                            "work_type_name": wt["work_type_name"],
+                            "tasks": [
+                                {
+                                    "task_id": task["task_id"],
+                                    "task_name": task["task_name"],
+                                    "subtasks": [
+                                        {"subtask_id": sub["subtask_id"], "subtask_name": sub["subtask_name"]}
+                                        for sub in task["subtasks"]
+                                    ],
+                                }
+                                for task in wt["tasks"]
+                            ],
+                        }
+                        for wt in wk["work_types"]
+                    ],
+                }
+                for wk in stage["work_kinds"]
+            ]}
+            for stage in src["work_stages"]
+        ],
+    }
+
+
+def measure(label: str, func, repeat: int) -> float:
+    per_call = min(timeit.repeat(func, number=repeat, repeat=3)) / repeat
+    print(f"{label:<48} {per_call * 1e6:12.1f} us")
+    return per_call
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--subtasks-per-task", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    src = make_project(subtasks=args.subtasks_per_task, intervals=2)
+    ids = subtask_ids(src)
+    path_index = BaseElasticRepository.build_path_index(src)
+    src[PATH_INDEX_FIELD] = path_index
+    rng = random.Random(args.seed)
+    targets = [rng.choice(ids) for _ in range(args.repeat)]
+    keys = [BaseElasticRepository.shift_target_key("subtask", target) for target in targets]
+    print(f"subtasks: {len(ids)}, path_index entries: {len(path_index)}\n")
+
+    print("Script targeting (one subtask)")
+    cursor = iter(range(10 ** 9))
+    before = measure(
+        "  nested walk", lambda: nested_walk(src, targets[next(cursor) % len(targets)]), args.repeat
+    )
+    after = measure(
+        "  indexed via path_index",
+        lambda: indexed(src, path_index[keys[next(cursor) % len(keys)]]["path"]),
+        args.repeat,
+    )
+    print(f"  speedup: x{before / after:.0f}\n")
+
+    print("Shift toggle target lookup (one subtask)")
+    skeleton_src = skeleton(src)
+    before = measure(
+        "  collect_shift_targets(skeleton)",
+        lambda: BaseElasticRepository.collect_shift_targets(skeleton_src),
+        max(args.repeat // 20, 1),
+    )
+    after = measure(
+        "  path_index entries",
+        lambda: {keys[0]: path_index[keys[0]]},
+        args.repeat,
+    )
+    print(f"  speedup: x{before / after:.0f}\n")
+
+    print("JSON over the wire per operation (ES still rewrites the document on update)")
+    skeleton_bytes = len(json.dumps(skeleton_src, ensure_ascii=False).encode())
+    entry_bytes = len(json.dumps({PATH_INDEX_FIELD: {keys[0]: path_index[keys[0]]}}).encode())
+    document_bytes = len(json.dumps(src, ensure_ascii=False).encode())
+    params_bytes = len(json.dumps({
+        "path": path_index[keys[0]]["path"],
+        "subtask_id": targets[0],
+        "links": [{"title": "report.pdf", "href": "http://files/report.pdf"}],
+    }).encode())
+    print(f"  toggle read: skeleton {skeleton_bytes} B -> path_index entry {entry_bytes} B")
+    print(f"  report link: get+index document {2 * document_bytes} B -> get entry + script params "
+          f"{entry_bytes + params_bytes} B")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Байты между приложением и ES на одну правку проекта (change_project).
+
+  * get + index  — как было: полный get документа, правка в Python, index всего документа
+                   вместе с пересобранным path_index;
+  * script       — get без _source (только _seq_no/_primary_term) и _update скриптом
+                   с путём и значением в params;
+  * script + path_index — правка id/структуры: get скелета проекта и тот же скрипт,
+                   но с пересобранным path_index в params.
+Считается JSON запросов и ответов (без HTTP-заголовков). ES по-прежнему переписывает
+документ на своей стороне, меняется только то, что ходит по сети и разбирается в приложении.
+
+Запуск из src/: python -m benchmarks.project_update [--subtasks-per-task 10]
+"""
+import argparse
+import copy
+import json
+import time
+from typing import Any, Dict
+
+from benchmarks.path_index import skeleton
+from benchmarks.synthetic import make_project
+from repository.base.elastic_repository import PATH_INDEX_FIELD
+from repository.elasticsearch_implementation.manager_repository import PATCH_PROJECT_SCRIPT, ElasticManagerRepository
+
+GET_META = {"_index": "construction", "_id": "bench-project", "_version": 7, "_seq_no": 42, "_primary_term": 1}
+UPDATE_RESPONSE = {**GET_META, "result": "updated", "_shards": {"total": 2, "successful": 1, "failed": 0}}
+
+
+def size(body: Any) -> int:
+    return len(json.dumps(body, ensure_ascii=False).encode())
+
+
+def get_and_index(src: Dict[str, Any], key: str, value: Any) -> int:
+    got = {**GET_META, "found": True, "_source": src}
+    document = copy.deepcopy(src)
+    ElasticManagerRepository._patch_set(document, ElasticManagerRepository._script_path(key), value)
+    document[PATH_INDEX_FIELD] = ElasticManagerRepository.build_path_index(document)
+    return size(got) + size(document) + size(UPDATE_RESPONSE)
+
+
+def scripted(src: Dict[str, Any], key: str, value: Any) -> int:
+    params = {
+        "operations": [
+            {"op": "set", "path": ElasticManagerRepository._script_path(key), "value": value, "from_path": None}
+        ],
+        "path_index_field": PATH_INDEX_FIELD,
+        "path_index": None,
+    }
+    if ElasticManagerRepository._touches_path_index(key):
+        got = {**GET_META, "found": True, "_source": skeleton(src)}
+        ElasticManagerRepository._patch_set(got["_source"], ElasticManagerRepository._script_path(key), value)
+        params["path_index"] = ElasticManagerRepository.build_path_index(got["_source"])
+    else:
+        got = {**GET_META, "found": True}
+    request = {"script": {"lang": "painless", "source": PATCH_PROJECT_SCRIPT, "params": params}}
+    return size(got) + size(request) + size(UPDATE_RESPONSE)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--subtasks-per-task", type=int, default=10)
+    args = parser.parse_args()
+
+    src = make_project(subtasks=args.subtasks_per_task, intervals=2)
+    src[PATH_INDEX_FIELD] = ElasticManagerRepository.build_path_index(src)
+    edits = {
+        "rename task": ("work_stages.3.work_kinds.1.work_types.2.tasks.4.task_name", "Новое название"),
+        "subtask quantity": ("work_stages.3.work_kinds.1.work_types.2.tasks.4.subtasks.7.actualQty", 7.5),
+        "change task id": ("work_stages.3.work_kinds.1.work_types.2.tasks.4.task_id", "task-renamed"),
+    }
+    print(f"document: {size(src)} B\n")
+    print(f"{'edit':<20} {'get + index':>14} {'script':>14} {'ratio':>8} {'python ms':>10}")
+    for label, (key, value) in edits.items():
+        started = time.perf_counter()
+        before = get_and_index(src, key, value)
+        before_ms = (time.perf_counter() - started) * 1e3
+        started = time.perf_counter()
+        after = scripted(src, key, value)
+        after_ms = (time.perf_counter() - started) * 1e3
+        print(f"{label:<20} {before:>12} B {after:>12} B {before / after:>7.0f}x {before_ms:>5.0f}->{after_ms:<4.0f}")
+
+
+if __name__ == "__main__":
+    main()
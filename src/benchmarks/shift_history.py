@@ -0,0 +1,71 @@
+"""
+Сериализация истории смен: pydantic против быстрого пути без валидации.
+
+  * pydantic  — как было: parse_obj на каждую строку, затем FastAPI снова валидирует
+                response_model=List[ShiftHistoryEntry] и кодирует ответ (serialize_response + json);
+  * fast path — строки истории сразу в записи со __slots__ и один orjson.dumps.
+Перед замером проверяется, что оба пути дают побайтно одинаковое тело ответа.
+
+Запуск из src/: python -m benchmarks.shift_history [--intervals 5] [--subtasks-per-task 1]
+"""
+import argparse
+import asyncio
+import json
+import time
+from typing import Any, Dict, List
+
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+
+from benchmarks.synthetic import make_project
+from repository.base.elastic_repository import BaseElasticRepository
+from schemas.response.construction import ShiftHistoryEntry, SubtaskShiftEntry, TaskShiftEntry
+from schemas.response.shift_history import dump_shift_history
+
+RESPONSE_FIELD = create_response_field(name="response", type_=List[ShiftHistoryEntry])
+
+
+def pydantic_path(history: List[Dict[str, Any]]) -> bytes:
+    entries = [
+        SubtaskShiftEntry.parse_obj(item) if item.get("type") == "subtask" else TaskShiftEntry.parse_obj(item)
+        for item in history
+    ]
+    content = asyncio.run(serialize_response(field=RESPONSE_FIELD, response_content=entries))
+    # так кодирует JSONResponse
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode()
+
+
+def best_of(func, history: List[Dict[str, Any]], repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func(history)
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--intervals", type=int, default=5, help="Интервалов на задачу и подзадачу")
+    parser.add_argument("--subtasks-per-task", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    src = make_project(subtasks=args.subtasks_per_task, intervals=args.intervals)
+    history = BaseElasticRepository().parse_shift_history([{"_source": src}])
+    history[0]["end_time"] = None
+    history[0]["status"] = "active"
+
+    before_body, after_body = pydantic_path(history), dump_shift_history(history)
+    assert before_body == after_body, "fast path changed the response body"
+
+    before = best_of(pydantic_path, history, args.repeat)
+    after = best_of(dump_shift_history, history, args.repeat)
+    print(f"intervals: {len(history)}, response: {len(after_body)} B (pydantic path {len(before_body)} B)\n")
+    print(f"{'pydantic':<12} {before * 1e3:10.1f} ms  {before / len(history) * 1e6:8.2f} us/row")
+    print(f"{'fast path':<12} {after * 1e3:10.1f} ms  {after / len(history) * 1e6:8.2f} us/row")
+    print(f"speedup: x{before / after:.0f}")
+
+
+if __name__ == "__main__":
+    main()
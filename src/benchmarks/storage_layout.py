@@ -0,0 +1,179 @@
+"""
+Раскладка проекта: один документ с nested-деревом против заголовка и документов этапов.
+
+  * write amplification — что ES переиндексирует на одну правку подзадачи (ссылка на отчёт,
+                   patch одного поля): в nested-раскладке любой _update переписывает весь
+                   _source и все документы Lucene проекта (корень + каждый nested-объект
+                   по mapping construction), в раздельной — заголовок и документ одного этапа
+                   (work_kinds в нём не индексируются, это один документ Lucene);
+  * latency      — get_tasks всего проекта и одного этапа, add_report_links и patch_project
+                   через репозитории на FakeElasticsearch с задержкой --latency-ms на запрос.
+                   Скриптовые _update и nested-запросы FakeElasticsearch не выполняет,
+                   для nested-раскладки измеряется только get_tasks всего проекта.
+
+Запуск из src/: python -m benchmarks.storage_layout [--stages 10] [--subtasks-per-task 10] [--repeat 50]
+"""
+import argparse
+import asyncio
+import json
+import random
+import statistics
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Set
+
+from tests.fake_elastic import FakeElasticsearch, load_index_mappings
+from benchmarks.synthetic import make_project
+from db.elastic.mappings import PROJECT_HEADER_MAPPING, PROJECT_STAGES_MAPPING
+from repository.base.elastic_repository import PATH_INDEX_FIELD, BaseElasticRepository
+from repository.elasticsearch_implementation.foreman_repository import (
+    ElasticForemanRepository,
+    SplitForemanRepository,
+)
+from repository.elasticsearch_implementation.manager_repository import (
+    ElasticManagerRepository,
+    SplitManagerRepository,
+)
+
+NESTED_INDEX = "construction"
+SPLIT_INDEX = "construction_split"
+STAGES_INDEX = "project_stages"
+PROJECT_ID = "bench-project"
+FOREMAN_ID = "bench-foreman"
+
+
+def size(body: Any) -> int:
+    return len(json.dumps(body, ensure_ascii=False).encode())
+
+
+def nested_paths(properties: Dict[str, Any], prefix: str = "") -> Set[str]:
+    paths = set()
+    for name, spec in properties.items():
+        if spec.get("type") == "nested":
+            paths.add(f"{prefix}{name}")
+        if "properties" in spec:
+            paths |= nested_paths(spec["properties"], f"{prefix}{name}.")
+    return paths
+
+
+def lucene_docs(src: Any, nested: Set[str], prefix: str = "") -> int:
+    """Документы Lucene под src, не считая его самого: по одному на каждый nested-объект."""
+    if isinstance(src, list):
+        return sum(lucene_docs(item, nested, prefix) for item in src)
+    if not isinstance(src, dict):
+        return 0
+    count = 0
+    for key, value in src.items():
+        path = f"{prefix}{key}"
+        items = value if isinstance(value, list) else [value]
+        if path in nested:
+            count += sum(1 + lucene_docs(item, nested, f"{path}.") for item in items if isinstance(item, dict))
+        else:
+            count += lucene_docs(value, nested, f"{path}.")
+    return count
+
+
+def write_amplification(src: Dict[str, Any], nested: Set[str]) -> None:
+    document = {**src, PATH_INDEX_FIELD: BaseElasticRepository.build_path_index(src)}
+    header, stages = SplitManagerRepository.split_project(PROJECT_ID, src, 0)
+    stage_bytes = statistics.mean(size(stage) for _, stage in stages)
+    nested_docs = 1 + lucene_docs(document, nested)
+    print("write amplification per subtask edit (reindexed by ES)")
+    print(f"{'layout':<10} {'bytes':>12} {'lucene docs':>12}")
+    print(f"{'nested':<10} {size(document):>12} {nested_docs:>12}")
+    print(f"{'split':<10} {size(header) + stage_bytes:>12.0f} {2:>12}")
+    print(f"{'':<10} {size(document) / (size(header) + stage_bytes):>11.1f}x {nested_docs / 2:>11.0f}x\n")
+
+
+async def measure(
+        client: FakeElasticsearch, repeat: int, operation: Callable[[int], Awaitable[Any]]
+) -> Dict[str, float]:
+    timings: List[float] = []
+    requests = client.requests
+    for i in range(repeat):
+        started = time.perf_counter()
+        await operation(i)
+        timings.append((time.perf_counter() - started) * 1e3)
+    return {"p50": statistics.median(timings), "requests": (client.requests - requests) / repeat}
+
+
+async def latency(src: Dict[str, Any], args: argparse.Namespace) -> None:
+    client = FakeElasticsearch(args.latency_ms)
+    mappings = load_index_mappings()
+    for index in (NESTED_INDEX, SPLIT_INDEX):
+        await client.indices.create(index=index, mappings=mappings["construction"])
+    await client.indices.put_mapping(index=SPLIT_INDEX, **PROJECT_HEADER_MAPPING)
+    await client.indices.create(index=STAGES_INDEX, mappings=PROJECT_STAGES_MAPPING)
+
+    foreman = {
+        "nested": ElasticForemanRepository(client, NESTED_INDEX, "shift_events", "shift_state"),
+        "split": SplitForemanRepository(client, SPLIT_INDEX, "shift_events", "shift_state", stages_index=STAGES_INDEX),
+    }
+    manager = {
+        "nested": ElasticManagerRepository(client, NESTED_INDEX, "shift_events"),
+        "split": SplitManagerRepository(client, SPLIT_INDEX, "shift_events", stages_index=STAGES_INDEX),
+    }
+    for repository in manager.values():
+        await repository.create_project(src)
+
+    subtasks = [entry for entry in BaseElasticRepository.build_path_index(src).values() if "subtask_id" in entry]
+    random.seed(0)
+    picks = [random.choice(subtasks) for _ in range(args.repeat)]
+    stage_id = src["work_stages"][len(src["work_stages"]) // 2]["stage_id"]
+
+    def add_links(repository: ElasticForemanRepository) -> Callable[[int], Awaitable[Any]]:
+        def run(i: int) -> Awaitable[Any]:
+            entry = picks[i]
+            return repository.add_report_links(
+                PROJECT_ID, entry["stage_id"], entry["work_type_id"], entry["work_kind_id"], entry["task_id"],
+                entry["subtask_id"], [{"title": "Отчёт", "href": f"https://files/{i}"}],
+            )
+        return run
+
+    def patch(repository: ElasticManagerRepository) -> Callable[[int], Awaitable[Any]]:
+        def run(i: int) -> Awaitable[Any]:
+            s, k, t, a, b = picks[i]["path"]
+            path = f"work_stages.{s}.work_kinds.{k}.work_types.{t}.tasks.{a}.subtasks.{b}.actualQty"
+            return repository.patch_project(PROJECT_ID, [{"op": "set", "path": path, "value": float(i)}])
+        return run
+
+    print(f"latency, FakeElasticsearch +{args.latency_ms} ms per request, p50 ms (requests per call)")
+    print(f"{'operation':<18} {'nested':>20} {'split':>20}")
+    row = [
+        await measure(client, args.repeat, lambda i: foreman[layout].get_tasks(FOREMAN_ID, PROJECT_ID))
+        for layout in ("nested", "split")
+    ]
+    print(f"{'get_tasks':<18} " + " ".join(f"{r['p50']:.2f} ({r['requests']:.0f})".rjust(20) for r in row))
+    # nested: этап выбирается nested-запросом с inner_hits, split: mget одного документа этапа
+    for label, result, nested_kind in (
+        (
+            "get_tasks stage",
+            await measure(
+                client, args.repeat, lambda i: foreman["split"].get_tasks(FOREMAN_ID, PROJECT_ID, stage_id=stage_id)
+            ),
+            "search",
+        ),
+        ("add_report_links", await measure(client, args.repeat, add_links(foreman["split"])), "script"),
+        ("patch_project", await measure(client, args.repeat, patch(manager["split"])), "script"),
+    ):
+        split = f"{result['p50']:.2f} ({result['requests']:.0f})"
+        print(f"{label:<18} {nested_kind:>20} {split:>20}")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--stages", type=int, default=10)
+    parser.add_argument("--subtasks-per-task", type=int, default=10)
+    parser.add_argument("--intervals", type=int, default=2)
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--latency-ms", type=float, default=1.0)
+    args = parser.parse_args()
+
+    src = make_project(
+        PROJECT_ID, FOREMAN_ID, stages=args.stages, subtasks=args.subtasks_per_task, intervals=args.intervals
+    )
+    nested = nested_paths(load_index_mappings()["construction"]["properties"])
+    write_amplification(src, nested)
+    asyncio.run(latency(src, args))
+
+
+if __name__ == "__main__":
+    main()
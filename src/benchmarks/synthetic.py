@@ -0,0 +1,87 @@
+from typing import Any, Dict, List
+
+
+def make_project(
+    project_id: str = "bench-project",
+    foreman_id: str = "bench-foreman",
+    stages: int = 10,
+    work_kinds: int = 5,
+    work_types: int = 4,
+    tasks: int = 5,
+    subtasks: int = 10,
+    intervals: int = 0,
+) -> Dict[str, Any]:
+    """
+    Синтетический проект в формате индекса construction.
+    По умолчанию 10 * 5 * 4 * 5 * 10 = 10 000 подзадач.
+    """
+    def time_intervals() -> List[Dict[str, Any]]:
+        return [
+            {
+                "start_time": f"2025-01-{day % 28 + 1:02d}T08:00:00+00:00",
+                "end_time": f"2025-01-{day % 28 + 1:02d}T17:00:00+00:00",
+                "status": "closed",
+            }
+            for day in range(intervals)
+        ]
+
+    return {
+        "project_id": project_id,
+        "project_name": f"Project {project_id}",
+        "foreman_id": foreman_id,
+        "work_stages": [
+            {
+                "stage_id": f"s{si}",
+                "stage_name": f"Stage {si}",
+                "stage_status": "В работе",
+                "work_kinds": [
+                    {
+                        "work_kind_id": f"s{si}-k{ki}",
+                        "work_kind_name": f"Work kind {si}.{ki}",
+                        "work_types": [
+                            {
+                                "work_type_id": f"s{si}-k{ki}-t{ti}",
+                                "work_type_name": f"Work type {si}.{ki}.{ti}",
+                                "work_type_status": "В работе",
+                                "tasks": [
+                                    {
+                                        "task_id": f"s{si}-k{ki}-t{ti}-a{ai}",
+                                        "task_name": f"Task {si}.{ki}.{ti}.{ai}",
+                                        "task_status": "В работе",
+                                        "time_intervals": time_intervals(),
+                                        "subtasks": [
+                                            {
+                                                "subtask_id": f"s{si}-k{ki}-t{ti}-a{ai}-b{bi}",
+                                                "subtask_name": f"Subtask {si}.{ki}.{ti}.{ai}.{bi}",
+                                                "subtask_status": "В работе",
+                                                "plannedQty": 10.0,
+                                                "actualQty": 5.0,
+                                                "reportLinks": [],
+                                                "time_intervals": time_intervals(),
+                                            }
+                                            for bi in range(subtasks)
+                                        ],
+                                    }
+                                    for ai in range(tasks)
+                                ],
+                            }
+                            for ti in range(work_types)
+                        ],
+                    }
+                    for ki in range(work_kinds)
+                ],
+            }
+            for si in range(stages)
+        ],
+    }
+
+
+def subtask_ids(project: Dict[str, Any]) -> List[str]:
+    return [
+        sub["subtask_id"]
+        for stage in project["work_stages"]
+        for wk in stage["work_kinds"]
+        for wt in wk["work_types"]
+        for task in wt["tasks"]
+        for sub in task["subtasks"]
+    ]
@@ -0,0 +1,82 @@
+"""
+Отработанные часы: выгрузка всей истории и суммирование на клиенте против корзин агрегации ES.
+
+  * flatten-and-sum — то, что делали менеджеры: история смен проекта (parse_shift_history ->
+                      ShiftHistoryEntry -> JSON ответа), затем сумма интервалов по задачам;
+  * aggregation     — ES отдаёт корзины (target_key, день) с суммой duration_seconds,
+                      приложение сворачивает их summarize_worked_time.
+Сами агрегации ES здесь не запускаются: корзины строятся из тех же синтетических интервалов.
+
+Запуск из src/: python -m benchmarks.worked_hours [--intervals 5] [--subtasks-per-task 10]
+"""
+import argparse
+import json
+import time
+from collections import defaultdict
+from typing import Any, Dict, List
+
+from benchmarks.synthetic import make_project
+from core.functions import parse_datetime
+from repository.base.elastic_repository import BaseElasticRepository
+from repository.elasticsearch_implementation.manager_repository import ElasticManagerRepository
+from schemas.response.construction import SubtaskShiftEntry, TaskShiftEntry
+
+
+def flatten_and_sum(src: Dict[str, Any]) -> Dict[str, float]:
+    history = BaseElasticRepository().parse_shift_history([{"_source": src}])
+    entries = [
+        SubtaskShiftEntry.parse_obj(item) if item["type"] == "subtask" else TaskShiftEntry.parse_obj(item)
+        for item in history
+    ]
+    body = json.dumps([json.loads(entry.json()) for entry in entries])
+    totals: Dict[str, float] = defaultdict(float)
+    for item in json.loads(body):
+        if item["end_time"]:
+            seconds = (parse_datetime(item["end_time"]) - parse_datetime(item["start_time"])).total_seconds()
+            totals[item["task_id"]] += seconds
+    flatten_and_sum.response_bytes = len(body.encode())
+    return totals
+
+
+def es_buckets(src: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Ответ composite-агрегации по (target_key, день) для тех же интервалов."""
+    sums: Dict[tuple, float] = defaultdict(float)
+    for item in BaseElasticRepository().parse_shift_history([{"_source": src}]):
+        target_id = item["subtask_id"] if item["type"] == "subtask" else item["task_id"]
+        key = (BaseElasticRepository.shift_target_key(item["type"], target_id), item["start_time"][:10])
+        sums[key] += (parse_datetime(item["end_time"]) - parse_datetime(item["start_time"])).total_seconds()
+    return [
+        {"key": {"target_key": target_key, "day": day}, "seconds": {"value": seconds}}
+        for (target_key, day), seconds in sums.items()
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--intervals", type=int, default=5, help="Интервалов на задачу и подзадачу")
+    parser.add_argument("--subtasks-per-task", type=int, default=10)
+    args = parser.parse_args()
+
+    src = make_project(subtasks=args.subtasks_per_task, intervals=args.intervals)
+    targets = BaseElasticRepository.collect_shift_targets(src, with_brigades=True)
+    buckets = es_buckets(src)
+
+    started = time.perf_counter()
+    flatten_and_sum(src)
+    before = time.perf_counter() - started
+
+    started = time.perf_counter()
+    report = ElasticManagerRepository.summarize_worked_time(buckets, targets)
+    after = time.perf_counter() - started
+
+    buckets_bytes = len(json.dumps({"aggregations": {"worked": {"buckets": buckets}}}).encode())
+    report_bytes = len(json.dumps(report).encode())
+    print(f"targets: {len(targets)}, buckets: {len(buckets)}, hours: {report['total_hours']:.0f}\n")
+    print(f"{'flatten-and-sum':<20} {before * 1e3:10.1f} ms  response {flatten_and_sum.response_bytes} B")
+    print(f"{'aggregation rollup':<20} {after * 1e3:10.1f} ms  ES buckets {buckets_bytes} B, "
+          f"report {report_bytes} B")
+    print(f"speedup: x{before / after:.0f}")
+
+
+if __name__ == "__main__":
+    main()
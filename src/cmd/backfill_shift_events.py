@@ -0,0 +1,217 @@
+import asyncio
+from cmd.base.base_command import BaseCommand
+from typing import Any, AsyncIterator, Dict, List
+
+from elasticsearch._async.client import AsyncElasticsearch
+from elasticsearch.helpers import async_bulk, async_scan
+from loguru import logger
+
+from core.environment_config import settings
+from db.elastic.mappings import SHIFT_EVENTS_MAPPING, SHIFT_STATE_MAPPING
+from db.elastic.session_manager import elastic_db_manager
+from repository.base.elastic_repository import SHIFT_EVENT_START, SHIFT_EVENT_STOP, BaseElasticRepository
+from repository.elasticsearch_implementation.foreman_repository import ElasticForemanRepository
+
+
+class Command(BaseCommand):
+    help: str = (
+        "Backfill shift events and shift state indices from time_intervals of project documents, "
+        "fill missing durations of stop events"
+    )
+
+    def add_arguments(self):
+        self.parser.add_argument("--chunk-size", type=int, default=500)
+        self.parser.add_argument("--dry-run", action="store_true")
+
+    def execute(self):
+        asyncio.run(self._backfill())
+
+    async def _backfill(self):
+        elastic_db_manager.init(settings.elasticsearch.url, settings.elasticsearch.login, settings.elasticsearch.password)
+        async with elastic_db_manager.session() as client:
+            events_index = settings.elasticsearch.shift_events_index
+            state_index = settings.elasticsearch.shift_state_index
+            if not self.args.dry_run:
+                for index, mappings in ((events_index, SHIFT_EVENTS_MAPPING), (state_index, SHIFT_STATE_MAPPING)):
+                    if not await client.indices.exists(index=index):
+                        await client.indices.create(index=index, mappings=mappings)
+                        logger.info(f"Index {index} created")
+                    else:
+                        # новые поля (start_time, duration_seconds, pending_events) в уже созданных индексах
+                        await client.indices.put_mapping(index=index, **mappings)
+
+            if self.args.dry_run:
+                total = 0
+                async for _ in self._iter_events(client):
+                    total += 1
+                logger.info(f"Dry run: {total} shift events would be written")
+                return
+
+            written, errors = await async_bulk(
+                client,
+                self._iter_actions(client, events_index),
+                chunk_size=self.args.chunk_size,
+                raise_on_error=False,
+                refresh="wait_for",
+            )
+            # 409 — событие уже перенесено предыдущим запуском
+            errors = [error for error in errors if error.get("create", {}).get("status") != 409]
+            logger.info(f"Shift events written: {written}, errors: {len(errors)}")
+            for error in errors:
+                logger.error(error)
+
+            # состояние создаётся только там, где его ещё нет, чтобы не затереть живые смены
+            written, errors = await async_bulk(
+                client,
+                self._iter_state_actions(client, state_index),
+                chunk_size=self.args.chunk_size,
+                raise_on_error=False,
+            )
+            errors = [error for error in errors if error.get("create", {}).get("status") != 409]
+            logger.info(f"Shift states written: {written}, errors: {len(errors)}")
+            for error in errors:
+                logger.error(error)
+
+            # stop-события, записанные до появления duration_seconds
+            written, errors = await async_bulk(
+                client,
+                self._iter_duration_actions(client, events_index),
+                chunk_size=self.args.chunk_size,
+                raise_on_error=False,
+                refresh="wait_for",
+            )
+            logger.info(f"Shift durations filled: {written}, errors: {len(errors)}")
+            for error in errors:
+                logger.error(error)
+
+    async def _iter_actions(self, client: AsyncElasticsearch, events_index: str) -> AsyncIterator[Dict[str, Any]]:
+        async for event in self._iter_events(client):
+            yield {"_op_type": "create", "_index": events_index, "_id": event["event_id"], "_source": event}
+
+    async def _iter_duration_actions(
+        self, client: AsyncElasticsearch, events_index: str
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """Для stop без duration_seconds ищет предшествующий start той же задачи (msearch на пачку)."""
+        stops = []
+        async for hit in async_scan(
+            client,
+            index=events_index,
+            query={"query": {"bool": {
+                "filter": [{"term": {"event": SHIFT_EVENT_STOP}}],
+                "must_not": [{"exists": {"field": "duration_seconds"}}],
+            }}},
+        ):
+            stops.append(hit["_source"])
+            if len(stops) >= self.args.chunk_size:
+                async for action in self._duration_actions(client, events_index, stops):
+                    yield action
+                stops = []
+        async for action in self._duration_actions(client, events_index, stops):
+            yield action
+
+    @staticmethod
+    async def _duration_actions(
+        client: AsyncElasticsearch, events_index: str, stops: List[Dict[str, Any]]
+    ) -> AsyncIterator[Dict[str, Any]]:
+        if not stops:
+            return
+        searches: List[Dict[str, Any]] = []
+        for stop in stops:
+            searches.append({"index": events_index})
+            searches.append({
+                "query": {"bool": {"filter": [
+                    {"term": {"project_id": stop["project_id"]}},
+                    {"term": {"target_key": stop["target_key"]}},
+                    {"term": {"event": SHIFT_EVENT_START}},
+                    {"range": {"timestamp": {"lte": stop["timestamp"]}}},
+                ]}},
+                "size": 1,
+                "sort": [{"timestamp": "desc"}, {"event_id": "desc"}],
+                "_source": ["timestamp"],
+            })
+        resp = await client.msearch(searches=searches)
+        for stop, item in zip(stops, resp["responses"]):
+            hits = item.get("hits", {}).get("hits", [])
+            if not hits:
+                continue
+            shift_event = BaseElasticRepository.make_shift_event(
+                foreman_id=stop.get("foreman_id"),
+                project_id=stop["project_id"],
+                target_type=stop["target_type"],
+                task_id=stop.get("task_id"),
+                subtask_id=stop.get("subtask_id"),
+                event=SHIFT_EVENT_STOP,
+                timestamp=stop["timestamp"],
+                start_time=hits[0]["_source"]["timestamp"],
+            )
+            yield {
+                "_op_type": "update",
+                "_index": events_index,
+                "_id": stop["event_id"],
+                "doc": {
+                    "start_time": shift_event["start_time"],
+                    "duration_seconds": shift_event["duration_seconds"],
+                },
+            }
+
+    @staticmethod
+    async def _iter_state_actions(client: AsyncElasticsearch, state_index: str) -> AsyncIterator[Dict[str, Any]]:
+        """Документы состояния смен из незакрытых интервалов: по одному на пару проект/прораб."""
+        repository = BaseElasticRepository()
+        async for hit in async_scan(
+            client,
+            index=settings.elasticsearch.index,
+            query={"query": {"match_all": {}}},
+            _source=["project_id", "project_name", "foreman_id", "work_stages"],
+        ):
+            foreman_id = hit["_source"].get("foreman_id")
+            if not foreman_id:
+                continue
+            project_id = hit["_source"].get("project_id") or hit["_id"]
+            active = []
+            for entry in repository.parse_shift_history([hit]):
+                if not entry["start_time"] or entry["end_time"]:
+                    continue
+                target_id = entry.get("subtask_id") if entry["type"] == "subtask" else entry.get("task_id")
+                active.append({
+                    "target_key": BaseElasticRepository.shift_target_key(entry["type"], target_id),
+                    "start_time": entry["start_time"],
+                })
+            if not active:
+                continue
+            yield {
+                "_op_type": "create",
+                "_index": state_index,
+                "_id": ElasticForemanRepository.shift_state_id(foreman_id, project_id),
+                "_source": {
+                    "project_id": project_id,
+                    "foreman_id": foreman_id,
+                    "active": active,
+                    "updated_at": max(item["start_time"] for item in active),
+                },
+            }
+
+    @staticmethod
+    async def _iter_events(client: AsyncElasticsearch) -> AsyncIterator[Dict[str, Any]]:
+        repository = BaseElasticRepository()
+        async for hit in async_scan(
+            client,
+            index=settings.elasticsearch.index,
+            query={"query": {"match_all": {}}},
+            _source=["project_id", "project_name", "foreman_id", "work_stages"],
+        ):
+            foreman_id = hit["_source"].get("foreman_id")
+            for entry in repository.parse_shift_history([hit]):
+                for event, timestamp in ((SHIFT_EVENT_START, entry["start_time"]), (SHIFT_EVENT_STOP, entry["end_time"])):
+                    if not timestamp:
+                        continue
+                    yield BaseElasticRepository.make_shift_event(
+                        foreman_id=foreman_id,
+                        project_id=entry["project_id"] or hit["_id"],
+                        target_type=entry["type"],
+                        task_id=entry.get("task_id"),
+                        subtask_id=entry.get("subtask_id"),
+                        event=event,
+                        timestamp=timestamp,
+                        start_time=entry["start_time"],
+                    )
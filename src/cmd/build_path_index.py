@@ -0,0 +1,67 @@
+import asyncio
+from cmd.base.base_command import BaseCommand
+from typing import Any, AsyncIterator, Dict
+
+from elasticsearch._async.client import AsyncElasticsearch
+from elasticsearch.helpers import async_bulk, async_scan
+from loguru import logger
+
+from core.environment_config import settings
+from db.elastic.mappings import PROJECT_PATH_INDEX_MAPPING
+from db.elastic.session_manager import elastic_db_manager
+from repository.base.elastic_repository import PATH_INDEX_FIELD, PROJECT_TARGET_FIELDS, BaseElasticRepository
+from repository.base.split_layout import REVISION_FIELD
+
+SET_PATH_INDEX_SCRIPT = f"ctx._source.{PATH_INDEX_FIELD} = params.path_index"
+
+
+class Command(BaseCommand):
+    help: str = "Add path_index mapping to projects index and rebuild path_index of every project"
+
+    def add_arguments(self):
+        self.parser.add_argument("--chunk-size", type=int, default=100)
+
+    def execute(self):
+        asyncio.run(self._build())
+
+    async def _build(self):
+        elastic_db_manager.init(settings.elasticsearch.url, settings.elasticsearch.login, settings.elasticsearch.password)
+        async with elastic_db_manager.session() as client:
+            index = settings.elasticsearch.index
+            # mapping нужен до записи path_index, иначе каждый ключ станет отдельным полем
+            await client.indices.put_mapping(index=index, **PROJECT_PATH_INDEX_MAPPING)
+
+            written, errors = await async_bulk(
+                client,
+                self._iter_actions(client, index),
+                chunk_size=self.args.chunk_size,
+                raise_on_error=False,
+                refresh="wait_for",
+            )
+            logger.info(f"Projects updated: {written}, errors: {len(errors)}")
+            for error in errors:
+                logger.error(error)
+
+    @staticmethod
+    async def _iter_actions(client: AsyncElasticsearch, index: str) -> AsyncIterator[Dict[str, Any]]:
+        async for hit in async_scan(
+            client,
+            index=index,
+            # заголовки раздельной раскладки без этапов: их path_index пишут репозитории и split_project_stages
+            query={"query": {"bool": {"must_not": [{"exists": {"field": REVISION_FIELD}}]}}},
+            _source=PROJECT_TARGET_FIELDS + ["work_stages.stage_id"],
+            seq_no_primary_term=True,
+        ):
+            # if_seq_no: проект, изменённый во время прохода, уже получил path_index от репозитория
+            yield {
+                "_op_type": "update",
+                "_index": index,
+                "_id": hit["_id"],
+                "if_seq_no": hit["_seq_no"],
+                "if_primary_term": hit["_primary_term"],
+                "script": {
+                    "lang": "painless",
+                    "source": SET_PATH_INDEX_SCRIPT,
+                    "params": {"path_index": BaseElasticRepository.build_path_index(hit["_source"])},
+                },
+            }
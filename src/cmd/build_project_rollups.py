@@ -0,0 +1,88 @@
+import asyncio
+from cmd.base.base_command import BaseCommand
+from typing import Any, AsyncIterator, Dict, Tuple
+
+from elasticsearch._async.client import AsyncElasticsearch
+from elasticsearch.helpers import async_bulk, async_scan
+from loguru import logger
+
+from core.environment_config import settings
+from db.elastic.mappings import PROJECT_ROLLUPS_MAPPING
+from db.elastic.session_manager import elastic_db_manager
+from repository.base.elastic_repository import PROJECT_ROLLUP_FIELDS
+from repository.base.split_layout import STAGE_REFS_FIELD, SplitLayoutMixin
+from repository.elasticsearch_implementation.project_rollup_repository import (
+    ElasticProjectRollupRepository,
+    build_project_rollup_repository,
+)
+
+
+class Command(BaseCommand):
+    help: str = "Create project_rollups index and rebuild progress rollups of every project and its active shifts"
+
+    def add_arguments(self):
+        self.parser.add_argument("--chunk-size", type=int, default=100)
+
+    def execute(self):
+        asyncio.run(self._build())
+
+    async def _build(self):
+        elastic_db_manager.init(settings.elasticsearch.url, settings.elasticsearch.login, settings.elasticsearch.password)
+        async with elastic_db_manager.session() as client:
+            repository = build_project_rollup_repository(client)
+            if not await client.indices.exists(index=repository.rollups_index):
+                await client.indices.create(index=repository.rollups_index, mappings=PROJECT_ROLLUPS_MAPPING)
+                logger.info(f"Index {repository.rollups_index} created")
+
+            # итоги и состояния смен пишутся скриптами с проверкой _seq_no: записи репозиториев,
+            # сделанные во время прохода, не откатываются
+            for name, actions in (
+                ("Project rollups", self._iter_projects(client, repository)),
+                ("Active shift states", self._iter_states(client, repository)),
+            ):
+                written, errors = await async_bulk(
+                    client, actions, chunk_size=self.args.chunk_size, raise_on_error=False
+                )
+                logger.info(f"{name} written: {written}, errors: {len(errors)}")
+                for error in errors:
+                    logger.error(error)
+
+    @staticmethod
+    def _bulk_action(action: Tuple[Dict[str, Any], Dict[str, Any]]) -> Dict[str, Any]:
+        header, body = action
+        return {"_op_type": "update", **header["update"], **body}
+
+    async def _iter_projects(
+            self, client: AsyncElasticsearch, repository: ElasticProjectRollupRepository
+    ) -> AsyncIterator[Dict[str, Any]]:
+        split = isinstance(repository, SplitLayoutMixin)
+        source = PROJECT_ROLLUP_FIELDS
+        if split:
+            header_includes, stage_includes, _ = repository.split_includes(PROJECT_ROLLUP_FIELDS)
+            source = header_includes + [STAGE_REFS_FIELD]
+        async for hit in async_scan(
+            client,
+            index=repository.index,
+            query={"query": {"match_all": {}}},
+            _source=source,
+            seq_no_primary_term=True,
+        ):
+            if split:
+                # заголовок переписывается каждой записью дерева: его _seq_no упорядочивает итоги
+                await repository._attach_stages(hit["_id"], hit["_source"], stage_includes)
+            yield self._bulk_action(repository.tree_action(hit["_id"], hit["_seq_no"], hit["_source"]))
+
+    async def _iter_states(
+            self, client: AsyncElasticsearch, repository: ElasticProjectRollupRepository
+    ) -> AsyncIterator[Dict[str, Any]]:
+        async for hit in async_scan(
+            client,
+            index=repository.state_index,
+            query={"query": {"match_all": {}}},
+            seq_no_primary_term=True,
+        ):
+            src = hit["_source"]
+            active = [item["target_key"] for item in src.get("active") or []]
+            yield self._bulk_action(
+                repository.active_action(src["project_id"], src["foreman_id"], hit["_seq_no"], active)
+            )
@@ -0,0 +1,78 @@
+import asyncio
+from cmd.base.base_command import BaseCommand
+from collections import defaultdict
+from typing import Any, AsyncIterator, DefaultDict, Dict, List
+
+from elasticsearch._async.client import AsyncElasticsearch
+from elasticsearch.helpers import async_bulk, async_scan
+from loguru import logger
+
+from core.environment_config import settings
+from db.elastic.mappings import USER_EMAILS_MAPPING
+from db.elastic.session_manager import elastic_db_manager
+from repository.elasticsearch_implementation.user_repository import email_key
+
+
+class Command(BaseCommand):
+    help: str = "Create the email -> user index and fill it from the users index"
+    # email -> все пользователи с ним в users: при конфликте видно, кто дубль
+    users_by_email: DefaultDict[str, List[str]] = None
+
+    def add_arguments(self):
+        self.parser.add_argument("--chunk-size", type=int, default=500)
+
+    def execute(self):
+        asyncio.run(self._build())
+
+    async def _build(self):
+        self.users_by_email = defaultdict(list)
+        elastic_db_manager.init(settings.elasticsearch.url, settings.elasticsearch.login, settings.elasticsearch.password)
+        async with elastic_db_manager.session() as client:
+            index = settings.elasticsearch.user_emails_index
+            if not await client.indices.exists(index=index):
+                await client.indices.create(index=index, mappings=USER_EMAILS_MAPPING)
+                logger.info(f"Index {index} created")
+
+            # op_type=create, как при регистрации: уже записанные документы не перезаписываются
+            written, errors = await async_bulk(
+                client,
+                self._iter_actions(client, index),
+                chunk_size=self.args.chunk_size,
+                raise_on_error=False,
+            )
+            conflicts = [error["create"] for error in errors if error.get("create", {}).get("status") == 409]
+            duplicates = await self._duplicates(client, index, conflicts)
+            logger.info(
+                f"Emails written: {written}, already present: {len(conflicts) - len(duplicates)}, "
+                f"duplicates: {len(duplicates)}, errors: {len(errors) - len(conflicts)}"
+            )
+            for error in errors:
+                if error.get("create", {}).get("status") != 409:
+                    logger.error(error)
+            for duplicate in duplicates:
+                logger.error(f"Email {duplicate['email']} belongs to {duplicate['user_ids']}")
+
+    async def _iter_actions(self, client: AsyncElasticsearch, index: str) -> AsyncIterator[Dict[str, Any]]:
+        async for hit in async_scan(client, index=settings.elasticsearch.users_index, _source=["email"]):
+            email = hit["_source"].get("email")
+            if not email:
+                logger.warning(f"User {hit['_id']} has no email")
+                continue
+            self.users_by_email[email_key(email)].append(hit["_id"])
+            yield {"_op_type": "create", "_index": index, "_id": email_key(email), "_source": {"user_id": hit["_id"]}}
+
+    async def _duplicates(
+            self, client: AsyncElasticsearch, index: str, conflicts: List[Dict[str, Any]]
+    ) -> List[Dict[str, Any]]:
+        """Конфликты, где email уже занят другим пользователем, — дубли, созданные гонкой регистраций."""
+        if not conflicts:
+            return []
+        ids = sorted({conflict["_id"] for conflict in conflicts})
+        emails = await client.mget(index=index, ids=ids)
+        owners = {doc["_id"]: doc["_source"]["user_id"] for doc in emails["docs"] if doc.get("found")}
+        duplicates = []
+        for email in ids:
+            others = [user_id for user_id in self.users_by_email[email] if user_id != owners.get(email)]
+            if others:
+                duplicates.append({"email": email, "user_ids": [owners.get(email), *others]})
+        return duplicates
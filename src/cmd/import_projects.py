@@ -0,0 +1,49 @@
+import asyncio
+import sys
+from cmd.base.base_command import BaseCommand
+from typing import AsyncIterator
+
+import aiofiles
+from loguru import logger
+
+from core.environment_config import settings
+from db.elastic.session_manager import elastic_db_manager
+from repository.elasticsearch_implementation.manager_repository import build_manager_repository
+from repository.elasticsearch_implementation.project_rollup_repository import build_project_rollup_repository
+from services.manager_service import ManagerService
+
+READ_CHUNK_BYTES = 1 << 20
+
+
+class Command(BaseCommand):
+    help: str = "Import projects from an NDJSON file (one project per line, as in POST /api/manager/projects)"
+
+    def add_arguments(self):
+        self.parser.add_argument("path", help="NDJSON file, '-' for stdin")
+        self.parser.add_argument("--no-overwrite", action="store_true", help="Existing projects are reported as errors")
+
+    def execute(self):
+        asyncio.run(self._import())
+
+    async def _import(self):
+        elastic_db_manager.init(settings.elasticsearch.url, settings.elasticsearch.login, settings.elasticsearch.password)
+        async with elastic_db_manager.session() as client:
+            repository = build_manager_repository(client, build_project_rollup_repository(client))
+            result = await ManagerService(repository).import_projects(self._read(), not self.args.no_overwrite)
+
+        for error in result.errors:
+            logger.error(f"line {error.line} ({error.project_id or '-'}): {error.error}")
+        logger.info(
+            f"Projects imported from {result.lines} lines: created {result.created}, updated {result.updated}, "
+            f"failed {result.failed}; {result.chunks} bulk requests, {result.bytes} bytes in {result.seconds:.1f}s "
+            f"({result.projects_per_second:.0f} projects/s, {result.megabytes_per_second:.1f} MB/s)"
+        )
+
+    async def _read(self) -> AsyncIterator[bytes]:
+        if self.args.path == "-":
+            while chunk := sys.stdin.buffer.read(READ_CHUNK_BYTES):
+                yield chunk
+            return
+        async with aiofiles.open(self.args.path, "rb") as source:
+            while chunk := await source.read(READ_CHUNK_BYTES):
+                yield chunk
@@ -0,0 +1,69 @@
+import asyncio
+from cmd.base.base_command import BaseCommand
+from typing import Set
+
+from elasticsearch.helpers import async_scan
+from loguru import logger
+
+from core.environment_config import settings
+from db.elastic.session_manager import elastic_db_manager
+from db.redis.session_manager import redis_db_manager
+from repository.redis_implementation.active_shift_repository import RedisActiveShiftRepository
+
+
+class Command(BaseCommand):
+    help: str = "Rebuild Redis active shift state from shift_state index or check it for consistency"
+
+    def add_arguments(self):
+        self.parser.add_argument("--check", action="store_true", help="Only report mismatches, do not write")
+
+    def execute(self):
+        asyncio.run(self._rebuild())
+
+    async def _rebuild(self):
+        elastic_db_manager.init(settings.elasticsearch.url, settings.elasticsearch.login, settings.elasticsearch.password)
+        redis_db_manager.init(settings.redis.host, settings.redis.port)
+        async with elastic_db_manager.session() as client, redis_db_manager.session() as redis_client:
+            repository = RedisActiveShiftRepository(redis_client, expire=settings.redis.shift_state_expire)
+            seen: Set[str] = set()
+            total = mismatched = 0
+
+            async for hit in async_scan(
+                client,
+                index=settings.elasticsearch.shift_state_index,
+                query={"query": {"match_all": {}}},
+                seq_no_primary_term=True,
+            ):
+                src = hit["_source"]
+                foreman_id, project_id = src["foreman_id"], src["project_id"]
+                seen.add(repository.key(foreman_id, project_id))
+                total += 1
+
+                active = sorted(item["target_key"] for item in src.get("active") or [])
+                cached = await repository.get_state(foreman_id, project_id)
+                if cached is not None and cached["seq_no"] > hit["_seq_no"]:
+                    # состояние поменялось уже после снимка scan
+                    continue
+                if cached is not None and cached["active"] == active:
+                    continue
+
+                mismatched += 1
+                logger.warning(
+                    f"Active shift state mismatch for project {project_id}, foreman {foreman_id}: "
+                    f"redis={cached}, elastic={active} (seq_no {hit['_seq_no']})"
+                )
+                if not self.args.check:
+                    await repository.delete_state(foreman_id, project_id)
+                    await repository.set_state(foreman_id, project_id, hit["_seq_no"], active)
+
+            orphaned = 0
+            async for key in redis_client.scan_iter(match=f"{repository.prefix}:*"):
+                key = key.decode()
+                if key in seen or not int(await redis_client.hget(key, "active_count") or 0):
+                    continue
+                orphaned += 1
+                logger.warning(f"Active shift state without shift_state document: {key}")
+                if not self.args.check:
+                    await redis_client.delete(key)
+
+            logger.info(f"Shift states checked: {total}, mismatched: {mismatched}, orphaned: {orphaned}")
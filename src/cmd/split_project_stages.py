@@ -0,0 +1,131 @@
+import asyncio
+from cmd.base.base_command import BaseCommand
+from typing import Any, Dict, List
+
+from elasticsearch._async.client import AsyncElasticsearch
+from elasticsearch.helpers import async_bulk, async_scan
+from loguru import logger
+
+from core.environment_config import settings
+from db.elastic.mappings import PROJECT_HEADER_MAPPING, PROJECT_STAGES_MAPPING
+from db.elastic.session_manager import elastic_db_manager
+from repository.base.elastic_repository import PATH_INDEX_FIELD
+from repository.base.split_layout import REVISION_FIELD
+from repository.elasticsearch_implementation.manager_repository import SplitManagerRepository
+
+
+class Command(BaseCommand):
+    help: str = (
+        "Move stages of every project into separate documents of the stages index (split layout), "
+        "or back into project documents with --rollback"
+    )
+
+    def add_arguments(self):
+        self.parser.add_argument("--chunk-size", type=int, default=50, help="Projects per bulk request")
+        self.parser.add_argument("--rollback", action="store_true", help="Split layout -> nested project documents")
+
+    def execute(self):
+        asyncio.run(self._migrate())
+
+    async def _migrate(self):
+        elastic_db_manager.init(settings.elasticsearch.url, settings.elasticsearch.login, settings.elasticsearch.password)
+        async with elastic_db_manager.session() as client:
+            repository = SplitManagerRepository(
+                client,
+                settings.elasticsearch.index,
+                settings.elasticsearch.shift_events_index,
+                settings.elasticsearch.request_timeout,
+                stages_index=settings.elasticsearch.project_stages_index,
+            )
+            if not await client.indices.exists(index=repository.stages_index):
+                await client.indices.create(index=repository.stages_index, mappings=PROJECT_STAGES_MAPPING)
+                logger.info(f"Index {repository.stages_index} created")
+            await client.indices.put_mapping(index=repository.index, **PROJECT_HEADER_MAPPING)
+
+            # заголовок в раздельной раскладке всегда содержит revision
+            split = {"exists": {"field": REVISION_FIELD}}
+            query = {"bool": {"filter": [split]}} if self.args.rollback else {"bool": {"must_not": [split]}}
+            migrate = self._join_chunk if self.args.rollback else self._split_chunk
+            totals = {"projects": 0, "errors": 0}
+            chunk: List[Dict[str, Any]] = []
+            async for hit in async_scan(
+                client,
+                index=repository.index,
+                query={"query": query},
+                _source=not self.args.rollback,
+                seq_no_primary_term=True,
+            ):
+                chunk.append(hit)
+                if len(chunk) >= self.args.chunk_size:
+                    await migrate(client, repository, chunk, totals)
+                    chunk = []
+            if chunk:
+                await migrate(client, repository, chunk, totals)
+            logger.info(f"Projects migrated: {totals['projects']}, errors: {totals['errors']}")
+
+    async def _split_chunk(
+            self,
+            client: AsyncElasticsearch,
+            repository: SplitManagerRepository,
+            hits: List[Dict[str, Any]],
+            totals: Dict[str, int],
+    ) -> None:
+        """Сначала документы этапов, потом заголовки с if_seq_no: проект, изменённый во время прохода, не теряется."""
+        stage_actions, header_actions = [], []
+        for hit in hits:
+            header, stages = repository.split_project(hit["_id"], hit["_source"], 0)
+            stage_actions += [
+                {"_index": repository.stages_index, "_id": ref["doc"], "_routing": hit["_id"], "_source": document}
+                for ref, document in stages
+            ]
+            header_actions.append({
+                "_index": repository.index,
+                "_id": hit["_id"],
+                "if_seq_no": hit["_seq_no"],
+                "if_primary_term": hit["_primary_term"],
+                "_source": header,
+            })
+        await self._bulk(client, stage_actions, "Stage documents", totals)
+        totals["projects"] += await self._bulk(client, header_actions, "Project headers", totals)
+
+    async def _join_chunk(
+            self,
+            client: AsyncElasticsearch,
+            repository: SplitManagerRepository,
+            hits: List[Dict[str, Any]],
+            totals: Dict[str, int],
+    ) -> None:
+        """Проекты целиком из заголовков и этапов, затем удаление документов этапов."""
+        project_actions, delete_actions = [], []
+        for hit in hits:
+            read = await repository._read_project_for_write(hit["_id"])
+            if read is None:
+                continue
+            src = repository.assemble_project(read)
+            src[PATH_INDEX_FIELD] = repository.build_path_index(src)
+            project_actions.append({
+                "_index": repository.index,
+                "_id": hit["_id"],
+                "if_seq_no": read["header"]["_seq_no"],
+                "if_primary_term": read["header"]["_primary_term"],
+                "_source": src,
+            })
+            delete_actions += [
+                {"_op_type": "delete", "_index": repository.stages_index, "_id": ref["doc"], "_routing": hit["_id"]}
+                for ref in read["header"]["_source"].get("stage_refs") or []
+            ]
+        totals["projects"] += await self._bulk(client, project_actions, "Projects", totals)
+        await self._bulk(client, delete_actions, "Stage documents deleted", totals)
+
+    @staticmethod
+    async def _bulk(
+            client: AsyncElasticsearch, actions: List[Dict[str, Any]], name: str, totals: Dict[str, int]
+    ) -> int:
+        if not actions:
+            return 0
+        written, errors = await async_bulk(client, actions, raise_on_error=False, refresh="wait_for")
+        logger.info(f"{name}: {written}, errors: {len(errors)}")
+        for error in errors:
+            logger.error(error)
+        totals["errors"] += len(errors)
+        return written
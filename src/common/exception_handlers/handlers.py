@@ -1,7 +1,11 @@
-from fastapi import status
+from fastapi import Response, status
+from starlette.requests import Request
 
 from common.exception_handlers.base_exception_handler import RequestIdJsonExceptionHandler
 from common.exceptions.authorisation import AuthorisationException
+from common.exceptions.not_found import NotFoundException
+from common.exceptions.not_implemented import NotImplementedException
+from common.exceptions.service_unavailable import ServiceUnavailableException
 
 
 class AuthorisationExceptionHandler(RequestIdJsonExceptionHandler):
@@ -9,6 +13,26 @@ class AuthorisationExceptionHandler(RequestIdJsonExceptionHandler):
     message = "Authorisation exception"
     exception = AuthorisationException
 
+class ServiceUnavailableExceptionHandler(RequestIdJsonExceptionHandler):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    message = "Service unavailable"
+    exception = ServiceUnavailableException
+
+    def build_response(self, request: Request, exc: Exception) -> Response:
+        response = super().build_response(request, exc)
+        response.headers["Retry-After"] = str(exc.params.get("retry_after", 1))
+        return response
+
+class NotFoundExceptionHandler(RequestIdJsonExceptionHandler):
+    status_code = status.HTTP_404_NOT_FOUND
+    message = "Not found"
+    exception = NotFoundException
+
+class NotImplementedExceptionHandler(RequestIdJsonExceptionHandler):
+    status_code = status.HTTP_501_NOT_IMPLEMENTED
+    message = "Not implemented"
+    exception = NotImplementedException
+
 class UnexpectedExceptionHandler(RequestIdJsonExceptionHandler):
     status_code = status.HTTP_500_INTERNAL_SERVER_ERROR
     message = "Unexpected exception"
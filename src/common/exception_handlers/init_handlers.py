@@ -1,5 +1,7 @@
 from fastapi import FastAPI
 
+# handlers импортируется ради объявления подклассов RequestIdJsonExceptionHandler
+from common.exception_handlers import handlers  # noqa: F401
 from common.exception_handlers.base_exception_handler import RequestIdJsonExceptionHandler
 
 
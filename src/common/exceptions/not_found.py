@@ -0,0 +1,5 @@
+from common.exceptions.base import AppException
+
+
+class NotFoundException(AppException):
+    pass
@@ -0,0 +1,5 @@
+from common.exceptions.base import AppException
+
+
+class ServiceUnavailableException(AppException):
+    pass
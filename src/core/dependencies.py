@@ -4,10 +4,18 @@ from fastapi import Depends, Header, HTTPException, Response, status
 from fastapi.security import OAuth2PasswordBearer
 
 from core.environment_config import settings
-from core.security import create_access_token, is_token_expiring_soon, try_decode_access, try_decode_refresh
+from core.security import (
+    claims_outdated,
+    create_access_token,
+    is_token_expiring_soon,
+    reissue_access_token,
+    token_user,
+    try_decode_access,
+    try_decode_refresh,
+)
 from repository.abc.user_repository import ABCUserRepository
 from repository.elasticsearch_implementation.user_repository import get_user_elastic_repository
-from schemas.user import UserInDB
+from schemas.user import AccessUser, UserInDB
 from fastapi import Path
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/v1/auth/loginform")
@@ -26,14 +34,16 @@ async def get_current_user(
         if not user_id:
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
 
-        # Превентивно обновим access, если вот-вот истечёт
-        if is_token_expiring_soon(payload, settings.jwt.access_token_proactive_refresh_seconds):
-            new_access = create_access_token(user_id)
-            response.headers["X-New-Access-Token"] = new_access
-
-        user = await repo.get_user_by_id(user_id=user_id)
+        user = await repo.get_user_profile(user_id)
         if not user or not user.is_active:
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="User not found or inactive")
+
+        # Превентивно обновим access, если вот-вот истечёт или права в нём устарели
+        if (
+            is_token_expiring_soon(payload, settings.jwt.access_token_proactive_refresh_seconds)
+            or claims_outdated(payload)
+        ):
+            response.headers["X-New-Access-Token"] = reissue_access_token(token, payload, user)
         return user
 
     # 2) Если access невалиден/истёк — пробуем refresh (если передан)
@@ -49,20 +59,42 @@ async def get_current_user(
     if not user_id:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Unauthorized, user_id not found")
 
-    user = await repo.get_user_by_id(user_id)
+    user = await repo.get_user_profile(user_id)
     if not user or not user.is_active:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="User not found or inactive")
 
     # Выпускаем новый access и возвращаем его в заголовке; запрос продолжается
-    new_access = create_access_token(user_id)
+    new_access = create_access_token(user_id, user)
     response.headers["X-New-Access-Token"] = new_access
     return user
 
 
+async def get_access_user(
+        response: Response,
+        token: str = Depends(oauth2_scheme),
+        refresh_token: Optional[str] = Header(default=None, alias="X-Refresh-Token"),
+        repo: ABCUserRepository = Depends(get_user_elastic_repository)
+) -> AccessUser:
+    """
+    Пользователь для проверки прав. В режиме JWT_ACCESS_TOKEN_CLAIMS роль и проекты
+    берутся из access-токена без чтения users; иначе, а также если claims нет, не полны,
+    устарели или токен скоро истекает — get_current_user (он же выдаст новый токен).
+    """
+    if token:
+        payload, err = try_decode_access(token)
+        if not err and payload.get("sub"):
+            user = token_user(payload)
+            if user is not None and not is_token_expiring_soon(
+                payload, settings.jwt.access_token_proactive_refresh_seconds
+            ):
+                return user
+    return await get_current_user(response, token, refresh_token, repo)
+
+
 async def check_project_access(
     project_id: str = Path(...),
-    current_user: UserInDB = Depends(get_current_user)
-) -> UserInDB:
+    current_user: AccessUser = Depends(get_access_user)
+) -> AccessUser:
     # root всегда OK
     if current_user.role == "root":
         return current_user
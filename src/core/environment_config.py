@@ -22,9 +22,26 @@ class RedisConfig(BaseSettings):
     func_expire: int = Field(default=3600, env="FUNC_EXPIRE")
     search_expire: int = Field(default=3600, env="SEARCH_EXPIRE")
     expire_manager: int = Field(default=300, env="EXPIRE_MANAGER")
+    shift_state_expire: int = Field(default=604800, env="SHIFT_STATE_EXPIRE")
+    # кэш пользователей get_current_user: в памяти воркера (LRU + TTL) и общий в Redis
+    user_cache_enabled: bool = Field(default=True, env="USER_CACHE_ENABLED")
+    user_cache_local_size: int = Field(default=10000, env="USER_CACHE_LOCAL_SIZE")
+    user_cache_local_ttl: float = Field(default=30, env="USER_CACHE_LOCAL_TTL")
+    user_cache_expire: int = Field(default=300, env="USER_CACHE_EXPIRE")
+    user_cache_channel: str = Field(default="user:invalidate", env="USER_CACHE_CHANNEL")
 
     @classmethod
-    @validator("port", "func_expire", "search_expire", "expire_manager", pre=True, each_item=True)
+    @validator(
+        "port",
+        "func_expire",
+        "search_expire",
+        "expire_manager",
+        "shift_state_expire",
+        "user_cache_local_size",
+        "user_cache_expire",
+        pre=True,
+        each_item=True,
+    )
     def validate_integer_fields(cls, value):
         if isinstance(value, str):
             return int(float(value))
@@ -47,8 +64,18 @@ class ElasticConfig(BaseSettings):
     password: Optional[str] = Field(default=None, env="ELASTIC_PASSWORD")
     index: str = Field(default="construction", env="ELASTIC_INDEX")
     users_index: str = Field(default="users", env="ELASTIC_USERS_INDEX")
+    user_emails_index: str = Field(default="user_emails", env="ELASTIC_USER_EMAILS_INDEX")
     brigades_index: str = Field(default="brigades", env="ELASTIC_BIGRADES_INDEX")
+    shift_events_index: str = Field(default="shift_events", env="ELASTIC_SHIFT_EVENTS_INDEX")
+    shift_state_index: str = Field(default="shift_state", env="ELASTIC_SHIFT_STATE_INDEX")
+    project_rollups_index: str = Field(default="project_rollups", env="ELASTIC_PROJECT_ROLLUPS_INDEX")
+    # nested — проект одним документом с вложенным деревом, split — этапы отдельными документами
+    storage_layout: str = Field(default="nested", env="ELASTIC_STORAGE_LAYOUT")
+    project_stages_index: str = Field(default="project_stages", env="ELASTIC_PROJECT_STAGES_INDEX")
     request_timeout: int = Field(default=10, env="ELASTIC_REQUEST_TIMEOUT")
+    # окно склейки старт/стоп смен в одну запись; 0 — писать каждую операцию сразу
+    shift_write_buffer_ms: int = Field(default=20, env="SHIFT_WRITE_BUFFER_MS")
+    shift_write_buffer_max_batch: int = Field(default=200, env="SHIFT_WRITE_BUFFER_MAX_BATCH")
 
 
 class JWTConfig(BaseSettings):
@@ -57,12 +84,28 @@ class JWTConfig(BaseSettings):
     access_token_expire_minutes: int = Field(default=30, env="JWT_ACCESS_TOKEN_EXPIRE_MINUTES")
     refresh_token_expire_days: int = Field(default=30, env="REFRESH_TOKEN_EXPIRE_DAYS")
     access_token_proactive_refresh_seconds: int = Field(default=120, env="ACCESS_TOKEN_PROACTIVE_REFRESH_SECONDS")
+    # проверенных access-токенов в памяти воркера; 0 — проверять подпись на каждый запрос
+    verified_token_cache_size: int = Field(default=10000, env="JWT_VERIFIED_TOKEN_CACHE_SIZE")
+    # роль и проекты в access-токене: проверка прав без чтения users (нужен USER_CACHE_ENABLED)
+    access_token_claims: bool = Field(default=False, env="JWT_ACCESS_TOKEN_CLAIMS")
+    # больше проектов в токен не пишется — права project_manager тогда проверяются по ES
+    access_token_max_projects: int = Field(default=30, env="JWT_ACCESS_TOKEN_MAX_PROJECTS")
+    # изменений пользователей за время жизни access в памяти воркера; сверх — claims устаревают у всех
+    access_token_claims_changes_max: int = Field(default=100000, env="JWT_ACCESS_TOKEN_CLAIMS_CHANGES_MAX")
+
+class SecurityConfig(BaseSettings):
+    # bcrypt в пуле воркера: thread или process; 0 потоков — считать прямо в event loop
+    password_hash_executor: str = Field(default="thread", env="PASSWORD_HASH_EXECUTOR")
+    password_hash_workers: int = Field(default=2, env="PASSWORD_HASH_WORKERS")
+    # сверх занятых потоков в очереди ждут не больше стольких хешей, остальным — 503
+    password_hash_queue_limit: int = Field(default=32, env="PASSWORD_HASH_QUEUE_LIMIT")
 
 class Settings(BaseSettings):
     project: ProjectConfig = ProjectConfig()
     redis: RedisConfig = RedisConfig()
     elasticsearch: ElasticConfig = ElasticConfig()
     jwt: JWTConfig = JWTConfig()
+    security: SecurityConfig = SecurityConfig()
 
 @lru_cache()
 def get_settings() -> Settings:
@@ -1,4 +1,9 @@
+import base64
+import json
 import re
+from datetime import datetime, timezone
+from typing import Any, AsyncIterator, Dict, List, Optional
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
 
 _filename_safe_re = re.compile(r"[^A-Za-z0-9._-]+")
 
@@ -6,3 +11,82 @@ def _safe_name(name: str) -> str:
     name = (name or "unnamed.bin").strip().replace(" ", "_")
     name = _filename_safe_re.sub("_", name)
     return name[:255]
+
+
+def split_csv(value: Optional[str]) -> Optional[List[str]]:
+    """Query-параметр вида "a,b,c" -> ["a", "b", "c"]; пустой — None."""
+    if not value:
+        return None
+    return [item.strip() for item in value.split(",") if item.strip()] or None
+
+
+def etag_headers(version: Optional[str]) -> Dict[str, str]:
+    """ETag из версии документа; клиент обязан перепроверять его на каждом запросе."""
+    if version is None:
+        return {}
+    return {"ETag": f'"{version}"', "Cache-Control": "private, no-cache"}
+
+
+def etag_matches(if_none_match: Optional[str], version: Optional[str]) -> bool:
+    """If-None-Match совпадает с версией: "*", список через запятую, слабое сравнение (W/ игнорируется)."""
+    if not if_none_match or version is None:
+        return False
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag == "*":
+            return True
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        if tag.strip('"') == version:
+            return True
+    return False
+
+
+async def iter_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    """Строки потока байтов без перевода строки; последняя может им и не заканчиваться."""
+    buffer = bytearray()
+    async for chunk in chunks:
+        start = len(buffer)
+        buffer += chunk
+        # перевод строки ищется только в новой части буфера
+        end = buffer.find(b"\n", start)
+        start = 0
+        while end >= 0:
+            yield bytes(buffer[start:end])
+            start = end + 1
+            end = buffer.find(b"\n", start)
+        del buffer[:start]
+    if buffer:
+        yield bytes(buffer)
+
+
+def encode_cursor(sort_values: List[Any]) -> str:
+    """Непрозрачный курсор пагинации из sort-значений последнего хита (search_after)."""
+    return base64.urlsafe_b64encode(json.dumps(sort_values).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> List[Any]:
+    try:
+        sort_values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError) as e:
+        raise ValueError("Invalid cursor") from e
+    if not isinstance(sort_values, list):
+        raise ValueError("Invalid cursor")
+    return sort_values
+
+
+def check_time_zone(name: str) -> str:
+    """IANA-имя часового пояса для агрегаций ES; неизвестное — ValueError, а не ошибка ES."""
+    try:
+        ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError) as e:
+        raise ValueError(f"Unknown time zone: {name}") from e
+    return name
+
+
+def parse_datetime(value: str) -> datetime:
+    """ISO-дата из ES/документов проекта; без зоны считается UTC (fromisoformat в 3.9 не знает "Z")."""
+    parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
@@ -0,0 +1,36 @@
+from collections import defaultdict
+from typing import Any, Dict
+
+
+class Metrics:
+    """
+    Счётчики и сводки (count/sum/min/max) в памяти процесса.
+    У каждого воркера gunicorn свои значения.
+    """
+
+    def __init__(self) -> None:
+        self._counters: Dict[str, int] = defaultdict(int)
+        self._summaries: Dict[str, Dict[str, float]] = {}
+
+    def incr(self, name: str, value: int = 1) -> None:
+        self._counters[name] += value
+
+    def observe(self, name: str, value: float) -> None:
+        summary = self._summaries.get(name)
+        if summary is None:
+            self._summaries[name] = {"count": 1, "sum": value, "min": value, "max": value}
+            return
+        summary["count"] += 1
+        summary["sum"] += value
+        summary["min"] = min(summary["min"], value)
+        summary["max"] = max(summary["max"], value)
+
+    def snapshot(self) -> Dict[str, Any]:
+        summaries = {
+            name: {**summary, "avg": summary["sum"] / summary["count"]}
+            for name, summary in self._summaries.items()
+        }
+        return {"counters": dict(self._counters), "summaries": summaries}
+
+
+metrics = Metrics()
@@ -0,0 +1,83 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Optional, Tuple, TypeVar
+
+from common.exceptions.service_unavailable import ServiceUnavailableException
+from core.environment_config import settings
+from core.metrics import metrics
+
+T = TypeVar("T")
+
+
+class PasswordHashPool:
+    """
+    Пул для bcrypt: хеш считается десятки миллисекунд и в event loop останавливает
+    все запросы воркера. Пакет bcrypt отпускает GIL, поэтому по умолчанию хватает потоков;
+    executor="process" — для backend, который держит GIL (os_crypt у passlib без пакета
+    bcrypt), ценой отдельных процессов на каждый воркер gunicorn. Одновременно в работе
+    и в очереди не больше workers + queue_limit хешей; сверх этого —
+    ServiceUnavailableException (503), чтобы шторм логинов не копил очередь, которую
+    клиенты всё равно не дождутся. workers=0 — считать прямо в event loop, как раньше.
+    """
+
+    def __init__(self, workers: int, queue_limit: int, executor: str = "thread", retry_after: int = 1):
+        if executor not in ("thread", "process"):
+            raise ValueError(f"Unknown password hash executor: {executor}")
+        self.workers = workers
+        self.executor = executor
+        self.queue_limit = queue_limit
+        self.retry_after = retry_after
+        self._slots = threading.BoundedSemaphore(workers + queue_limit) if workers > 0 else None
+        self._executor: Optional[Executor] = None
+
+    async def run(self, name: str, func: Callable[..., T], *args) -> T:
+        if self._slots is None:
+            started = time.perf_counter()
+            result = func(*args)
+            metrics.observe(f"password_hash.{name}.run_seconds", time.perf_counter() - started)
+            return result
+        if not self._slots.acquire(blocking=False):
+            metrics.incr(f"password_hash.{name}.rejected")
+            raise ServiceUnavailableException("Password hashing is overloaded", retry_after=self.retry_after)
+
+        submitted = time.perf_counter()
+        try:
+            future = self._get_executor().submit(self._timed, func, *args)
+        except RuntimeError:
+            self._slots.release()
+            raise
+        # слот освобождается, когда поток закончил хеш, даже если запрос уже отменён
+        future.add_done_callback(lambda _: self._slots.release())
+        result, started, finished = await asyncio.wrap_future(future)
+        metrics.observe(f"password_hash.{name}.wait_seconds", started - submitted)
+        metrics.observe(f"password_hash.{name}.run_seconds", finished - started)
+        return result
+
+    @staticmethod
+    def _timed(func: Callable[..., T], *args) -> Tuple[T, float, float]:
+        # метрики не потокобезопасны и у процессов свои: времена пишутся уже в event loop
+        started = time.perf_counter()
+        result = func(*args)
+        return result, started, time.perf_counter()
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            if self.executor == "process":
+                self._executor = ProcessPoolExecutor(self.workers)
+            else:
+                self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix="password-hash")
+        return self._executor
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+
+password_pool = PasswordHashPool(
+    settings.security.password_hash_workers,
+    settings.security.password_hash_queue_limit,
+    settings.security.password_hash_executor,
+)
@@ -1,29 +1,126 @@
+import hashlib
+import time
 from datetime import datetime, timedelta, timezone
-from typing import Optional, Tuple
+from typing import Any, Dict, Optional, Tuple
 
 import jwt
 from passlib.context import CryptContext
 
+from core.cache import TTLCache
 from core.environment_config import settings
+from core.metrics import metrics
+from core.password_pool import password_pool
+from schemas.user import TokenUser, UserInDB
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
+# Проверенные access-токены воркера: sha256 токена -> payload, запись живёт до exp токена.
+# Тот же токен приходит сотни раз за свою жизнь — подпись и claims проверяются один раз.
+verified_tokens: "TTLCache[dict]" = TTLCache(
+    settings.jwt.verified_token_cache_size, settings.jwt.access_token_expire_minutes * 60
+)
+# Токен, выпущенный взамен истекающего (X-New-Access-Token): sha256 старого -> новый, до exp старого
+reissued_tokens: "TTLCache[str]" = TTLCache(
+    settings.jwt.verified_token_cache_size, settings.jwt.access_token_proactive_refresh_seconds
+)
+
+# Claims access-токена в режиме JWT_ACCESS_TOKEN_CLAIMS
+ROLE_CLAIM = "role"
+PROJECTS_CLAIM = "prj"
+
+# Когда менялся пользователь (права, активность) по каналу инвалидаций кэша пользователей:
+# user_id -> time.time(), в порядке изменений. Claims токенов, выпущенных не позже, устарели.
+# Запись живёт, пока могут жить такие токены, и не вытесняется: без неё устаревшие claims
+# снова стали бы действительны. Сверх access_token_claims_changes_max записей устаревают claims всех.
+changed_users: Dict[str, float] = {}
+# Claims токенов, выпущенных не позже, устарели у всех: изменения за время без подписки потеряны
+claims_valid_since = 0.0
+
 def hash_password(password: str) -> str:
     return pwd_context.hash(password)
 
 def verify_password(password: str, hashed: str) -> bool:
     return pwd_context.verify(password, hashed)
 
+async def hash_password_async(password: str) -> str:
+    """hash_password в пуле password_pool, не блокируя event loop; при переполненном пуле — 503."""
+    return await password_pool.run("hash", hash_password, password)
+
+async def verify_password_async(password: str, hashed: str) -> bool:
+    """verify_password в пуле password_pool, не блокируя event loop; при переполненном пуле — 503."""
+    return await password_pool.run("verify", verify_password, password, hashed)
+
+def access_claims_enabled() -> bool:
+    # изменения прав приходят через канал инвалидаций кэша пользователей — без него claims не проверить
+    return settings.jwt.access_token_claims and settings.redis.user_cache_enabled
+
+def access_claims(user: UserInDB) -> Dict[str, Any]:
+    """
+    Роль и, для project_manager, управляемые проекты. Проекты, которые не помещаются
+    в access_token_max_projects, в токен не пишутся — доступ тогда проверяется по ES.
+    """
+    if not access_claims_enabled():
+        return {}
+    claims: Dict[str, Any] = {ROLE_CLAIM: user.role}
+    if user.role == "project_manager" and len(user.managed_projects) <= settings.jwt.access_token_max_projects:
+        claims[PROJECTS_CLAIM] = list(user.managed_projects)
+    return claims
+
+def token_user(payload: dict) -> Optional[TokenUser]:
+    """Пользователь из claims проверенного access-токена; None — claims нет, не полны или устарели."""
+    if not access_claims_enabled() or ROLE_CLAIM not in payload:
+        return None
+    if payload[ROLE_CLAIM] == "project_manager" and PROJECTS_CLAIM not in payload:
+        return None
+    if claims_outdated(payload):
+        return None
+    return TokenUser(id=payload["sub"], role=payload[ROLE_CLAIM], managed_projects=payload.get(PROJECTS_CLAIM, []))
+
+def claims_outdated(payload: dict) -> bool:
+    """Токен с claims выпущен до последнего изменения пользователя (или до (пере)подписки на канал)."""
+    if ROLE_CLAIM not in payload:
+        return False
+    issued = payload.get("iat", 0)
+    return issued <= claims_valid_since or issued <= changed_users.get(payload["sub"], float("-inf"))
+
+def mark_user_changed(user_id: Optional[str] = None) -> None:
+    """
+    Claims ранее выпущенных токенов пользователя (без user_id — всех) больше не используются.
+    Если изменение некуда записать, устаревают claims всех: ошибиться можно только в сторону ES.
+    """
+    global claims_valid_since
+    now = time.time()
+    if user_id is not None:
+        changed_users.pop(user_id, None)
+        changed_users[user_id] = now
+        _expire_changed_users(now)
+        if len(changed_users) <= settings.jwt.access_token_claims_changes_max:
+            return
+        metrics.incr("jwt_claims.changes_overflow")
+    claims_valid_since = now
+    changed_users.clear()
+
+def _expire_changed_users(now: float) -> None:
+    # токены, выпущенные до изменения старше срока жизни access, уже истекли
+    horizon = now - settings.jwt.access_token_expire_minutes * 60
+    while changed_users:
+        user_id, changed = next(iter(changed_users.items()))
+        if changed > horizon:
+            break
+        del changed_users[user_id]
+
 def _create_token(data: dict, expires_delta: timedelta, token_type: str) -> str:
     to_encode = data.copy()
     now = datetime.now(timezone.utc)
     expire = now + (expires_delta or timedelta(minutes=settings.jwt.access_token_expire_minutes))
-    to_encode.update({"exp": expire, "iat": now, "type": token_type})
+    # iat с долями секунды: claims_outdated сравнивает его со временем изменения пользователя
+    to_encode.update({"exp": expire, "iat": now.timestamp(), "type": token_type})
     return jwt.encode(to_encode, settings.jwt.secret_key, algorithm=settings.jwt.algorithm)
 
-def create_access_token(sub: str) -> str:
+def create_access_token(sub: str, user: Optional[UserInDB] = None) -> str:
+    """С user в режиме JWT_ACCESS_TOKEN_CLAIMS в токен пишутся роль и проекты пользователя."""
     return _create_token(
-        {"sub": sub},
+        {"sub": sub, **(access_claims(user) if user is not None else {})},
         timedelta(minutes=settings.jwt.access_token_expire_minutes),
         token_type="access"
     )
@@ -38,6 +135,24 @@ def create_refresh_token(sub: str) -> str:
 def decode_jwt_token(token: str) -> dict:
     return jwt.decode(token, settings.jwt.secret_key, algorithms=[settings.jwt.algorithm])
 
+def token_digest(token: str) -> bytes:
+    return hashlib.sha256(token.encode()).digest()
+
+def _seconds_left(payload: dict) -> float:
+    return payload.get("exp", 0) - time.time()
+
+def reissue_access_token(token: str, payload: dict, user: Optional[UserInDB] = None) -> str:
+    """
+    Новый access взамен истекающего token или token с устаревшими claims. Все запросы
+    со старым токеном получают один и тот же новый, а не подписывают свой.
+    """
+    key = token_digest(token)
+    new_access = reissued_tokens.get(key)
+    if new_access is None:
+        new_access = create_access_token(payload["sub"], user)
+        reissued_tokens.set(key, new_access, ttl=_seconds_left(payload))
+    return new_access
+
 def is_token_expiring_soon(payload: dict, threshold_seconds: int) -> bool:
     """Проверка, что до exp осталось меньше threshold_seconds."""
     exp = payload.get("exp")
@@ -47,11 +162,20 @@ def is_token_expiring_soon(payload: dict, threshold_seconds: int) -> bool:
     return (exp - now) <= threshold_seconds
 
 def try_decode_access(token: str) -> Tuple[dict, Optional[Exception]]:
+    key = token_digest(token)
+    cached = verified_tokens.get(key)
+    if cached is not None:
+        metrics.incr("jwt_cache.hits")
+        return dict(cached), None
+    metrics.incr("jwt_cache.misses")
     try:
         payload = decode_jwt_token(token)
         if payload.get("type") != "access":
             raise jwt.exceptions.InvalidTokenError("Invalid token type")
         else:
+            # exp обязателен для кэша: запись не должна пережить токен
+            if "exp" in payload:
+                verified_tokens.set(key, dict(payload), ttl=_seconds_left(payload))
             return payload, None
     except jwt.exceptions.ExpiredSignatureError as e:
         raise jwt.exceptions.InvalidTokenError("Invalid token type") from e
@@ -0,0 +1,91 @@
+SHIFT_EVENTS_MAPPING = {
+    "properties": {
+        "event_id": {"type": "keyword"},
+        "foreman_id": {"type": "keyword"},
+        "project_id": {"type": "keyword"},
+        "target_type": {"type": "keyword"},
+        "target_key": {"type": "keyword"},
+        "task_id": {"type": "keyword"},
+        "subtask_id": {"type": "keyword"},
+        "event": {"type": "keyword"},
+        "timestamp": {"type": "date"},
+        "state_seq_no": {"type": "long"},
+        "start_time": {"type": "date"},
+        "duration_seconds": {"type": "double"},
+    }
+}
+
+SHIFT_STATE_MAPPING = {
+    "properties": {
+        "project_id": {"type": "keyword"},
+        "foreman_id": {"type": "keyword"},
+        "active": {
+            "properties": {
+                "target_key": {"type": "keyword"},
+                "start_time": {"type": "date"},
+            }
+        },
+        "updated_at": {"type": "date"},
+        # события последнего перехода до их записи в индекс событий: только хранятся
+        "pending_events": {"type": "object", "enabled": False},
+    }
+}
+
+# path_index хранится как есть и не индексируется: ключи — id задач и подзадач
+PROJECT_PATH_INDEX_MAPPING = {
+    "properties": {
+        "path_index": {"type": "object", "enabled": False},
+    }
+}
+
+# Заголовок проекта в раздельной раскладке: ссылки на документы этапов (статус — для фильтра списка)
+PROJECT_HEADER_MAPPING = {
+    "properties": {
+        "revision": {"type": "long"},
+        "stage_refs": {
+            "properties": {
+                "doc": {"type": "keyword", "index": False},
+                "stage_id": {"type": "keyword"},
+                "stage_status": {"type": "keyword"},
+                "revision": {"type": "long", "index": False},
+            }
+        },
+    }
+}
+
+# Этапы проектов отдельными документами (routing = project_id): читаются только mget по id,
+# поэтому индексируются лишь поля этапа верхнего уровня, дерево хранится в _source без nested
+PROJECT_STAGES_MAPPING = {
+    "dynamic": False,
+    "properties": {
+        "project_id": {"type": "keyword"},
+        "revision": {"type": "long"},
+        "stage_id": {"type": "keyword"},
+        "stage_name": {"type": "text"},
+        "stage_status": {"type": "keyword"},
+        "work_kinds": {"type": "object", "enabled": False},
+    },
+}
+
+# Сводки прогресса проектов: ищутся только по _id, итоги хранятся как есть
+PROJECT_ROLLUPS_MAPPING = {
+    "dynamic": False,
+    "properties": {
+        "project_id": {"type": "keyword"},
+        "project_seq_no": {"type": "long"},
+        "updated_at": {"type": "date"},
+        "totals": {"type": "object", "enabled": False},
+        "stages": {"type": "object", "enabled": False},
+        "work_types": {"type": "object", "enabled": False},
+        "targets": {"type": "object", "enabled": False},
+        "active": {"type": "object", "enabled": False},
+    },
+}
+
+# email -> пользователь: _id документа — email в нижнем регистре, поиск по индексу не нужен
+USER_EMAILS_MAPPING = {
+    "dynamic": False,
+    "properties": {
+        "user_id": {"type": "keyword"},
+    },
+}
@@ -1,17 +1,28 @@
+import asyncio
 import contextlib
 from typing import AsyncIterator
 
 from fastapi import FastAPI
 
 from core.environment_config import settings
+from core.password_pool import password_pool
 from db.elastic.session_manager import elastic_db_manager
 from db.redis.session_manager import redis_db_manager
+from repository.base.write_buffer import drain_write_buffers
+from repository.redis_implementation.user_cache_repository import listen_user_invalidations
 
 
 @contextlib.asynccontextmanager
 async def lifespan(app: FastAPI) -> AsyncIterator[None]:
     elastic_db_manager.init(settings.elasticsearch.url, settings.elasticsearch.login, settings.elasticsearch.password)
     redis_db_manager.init(settings.redis.host, settings.redis.port)
+    invalidations = asyncio.create_task(listen_user_invalidations()) if settings.redis.user_cache_enabled else None
     yield
+    if invalidations is not None:
+        invalidations.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await invalidations
+    await drain_write_buffers()
     await elastic_db_manager.close()
     await redis_db_manager.close()
+    password_pool.shutdown()
@@ -0,0 +1,20 @@
+from abc import ABC, abstractmethod
+from typing import List, Optional
+
+
+class ABCActiveShiftRepository(ABC):
+    @abstractmethod
+    async def get_active_count(self, foreman_id: str, project_id: str) -> Optional[int]:
+        ...
+
+    @abstractmethod
+    async def get_state(self, foreman_id: str, project_id: str) -> Optional[dict]:
+        ...
+
+    @abstractmethod
+    async def set_state(self, foreman_id: str, project_id: str, seq_no: int, active: List[str]) -> bool:
+        ...
+
+    @abstractmethod
+    async def delete_state(self, foreman_id: str, project_id: str) -> None:
+        ...
@@ -1,26 +1,90 @@
 from abc import ABC, abstractmethod
-from typing import Any, Dict, List
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
 
 
 class ABCForemanRepository(ABC):
+    # есть ли у раскладки хранения индекс для поиска задач (search_tasks)
+    supports_task_search: bool = True
+
+    @abstractmethod
+    async def get_projects(
+            self,
+            foreman_id: str,
+            status: Optional[str] = None,
+            name_prefix: Optional[str] = None,
+            cursor: Optional[str] = None,
+            limit: int = 100,
+            use_pit: bool = False,
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        ...
+
     @abstractmethod
-    async def get_projects(self, foreman_id: str) -> List[Dict[str, Any]]:
+    async def get_tasks(
+            self,
+            foreman_id: str,
+            project_id: str,
+            fields: Optional[List[str]] = None,
+            exclude: Optional[List[str]] = None,
+            stage_id: Optional[str] = None,
+            work_kind_id: Optional[str] = None,
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        ...
+
+    @abstractmethod
+    async def search_tasks(
+            self,
+            foreman_id: str,
+            text: str,
+            project_id: Optional[str] = None,
+            cursor: Optional[str] = None,
+            limit: int = 20,
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
         ...
 
     @abstractmethod
-    async def get_tasks(self, foreman_id: str, project_id: str) -> List[Dict[str, Any]]:
+    async def get_project_version(self, project_id: str, foreman_id: Optional[str] = None) -> Optional[str]:
         ...
 
     @abstractmethod
-    async def start_shift(self, foreman_id: str, project_id: str, task_ids: List[str], subtask_ids: List[str]) -> None:
+    async def start_shift(
+            self, foreman_id: str, project_id: str, task_ids: List[str], subtask_ids: List[str]
+    ) -> Optional[int]:
         ...
 
     @abstractmethod
-    async def stop_shift(self, foreman_id: str, project_id: str, task_ids: List[str], subtask_ids: List[str]) -> None:
+    async def stop_shift(
+            self, foreman_id: str, project_id: str, task_ids: List[str], subtask_ids: List[str]
+    ) -> Optional[int]:
         ...
 
     @abstractmethod
-    async def get_shift_history(self, foreman_id: str, project_id: str) -> List[Dict[str, Any]]:
+    async def bulk_shift(self, foreman_id: str, operations: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        ...
+
+    @abstractmethod
+    async def get_shift_history(
+            self,
+            foreman_id: str,
+            project_id: str,
+            min_seq_no: Optional[int] = None,
+            date_from: Optional[datetime] = None,
+            date_to: Optional[datetime] = None,
+            cursor: Optional[str] = None,
+            limit: Optional[int] = None,
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        ...
+
+    @abstractmethod
+    def iter_shift_history(
+            self,
+            foreman_id: str,
+            project_id: str,
+            min_seq_no: Optional[int] = None,
+            date_from: Optional[datetime] = None,
+            date_to: Optional[datetime] = None,
+            cursor: Optional[str] = None,
+    ) -> AsyncIterator[Dict[str, Any]]:
         ...
 
     @abstractmethod
@@ -1,24 +1,113 @@
 from abc import ABC, abstractmethod
-from typing import Any, Dict, List
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Tuple
 
 
 class ABCManagerRepository(ABC):
+    # есть ли у раскладки хранения индекс для поиска задач (search_tasks)
+    supports_task_search: bool = True
+
+    @abstractmethod
+    async def get_projects(
+            self,
+            foreman_id: Optional[str] = None,
+            project_ids: Optional[List[str]] = None,
+            status: Optional[str] = None,
+            name_prefix: Optional[str] = None,
+            cursor: Optional[str] = None,
+            limit: int = 100,
+            use_pit: bool = False,
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        ...
+
+    @abstractmethod
+    async def get_tasks(
+            self,
+            project_id: str,
+            fields: Optional[List[str]] = None,
+            exclude: Optional[List[str]] = None,
+            stage_id: Optional[str] = None,
+            work_kind_id: Optional[str] = None,
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        ...
+
+    @abstractmethod
+    async def search_tasks(
+            self,
+            text: str,
+            project_ids: Optional[List[str]] = None,
+            project_id: Optional[str] = None,
+            cursor: Optional[str] = None,
+            limit: int = 20,
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        ...
+
+    @abstractmethod
+    async def get_project_version(self, project_id: str, foreman_id: Optional[str] = None) -> Optional[str]:
+        ...
+
+    @abstractmethod
+    async def get_shift_history(
+        self,
+        project_id: str,
+        date_from: Optional[datetime] = None,
+        date_to: Optional[datetime] = None,
+        cursor: Optional[str] = None,
+        limit: Optional[int] = None,
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        ...
+
+    @abstractmethod
+    def iter_shift_history(
+        self,
+        project_id: str,
+        date_from: Optional[datetime] = None,
+        date_to: Optional[datetime] = None,
+        cursor: Optional[str] = None,
+    ) -> AsyncIterator[Dict[str, Any]]:
+        ...
+
+    @abstractmethod
+    async def export_tasks(self, project_id: str) -> Optional[Iterator[Dict[str, Any]]]:
+        ...
+
     @abstractmethod
-    async def get_projects(self) -> List[Dict[str, Any]]:
+    async def export_shift_history(
+        self,
+        project_id: str,
+        date_from: Optional[datetime] = None,
+        date_to: Optional[datetime] = None,
+    ) -> Optional[AsyncIterator[Dict[str, Any]]]:
         ...
 
     @abstractmethod
-    async def get_tasks(self, project_id: str) -> List[Dict[str, Any]]:
+    async def get_worked_hours(
+        self,
+        project_id: str,
+        date_from: Optional[datetime] = None,
+        date_to: Optional[datetime] = None,
+        time_zone: str = "UTC",
+    ) -> Optional[Dict[str, Any]]:
         ...
 
     @abstractmethod
-    async def get_shift_history(self, project_id: str) -> List[Dict[str, Any]]:
+    async def get_progress(self, project_id: str) -> Optional[Dict[str, Any]]:
         ...
 
     @abstractmethod
     async def create_project(self, project_data: Dict[str, Any]) -> Dict[str, Any]:
         ...
 
+    @abstractmethod
+    async def import_projects(
+            self, projects: AsyncIterator[Tuple[int, Dict[str, Any]]], overwrite: bool = True
+    ) -> Dict[str, Any]:
+        ...
+
     @abstractmethod
     async def change_project(self, project_id: str, key: str, value: Any) -> Dict[str, Any]:
         ...
+
+    @abstractmethod
+    async def patch_project(self, project_id: str, operations: List[Dict[str, Any]]) -> Dict[str, Any]:
+        ...
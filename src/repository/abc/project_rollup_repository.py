@@ -0,0 +1,24 @@
+from abc import ABC, abstractmethod
+from typing import Any, Dict, List, Optional
+
+
+class ABCProjectRollupRepository(ABC):
+    @abstractmethod
+    async def get_rollup(self, project_id: str) -> Optional[Dict[str, Any]]:
+        ...
+
+    @abstractmethod
+    async def write_tree(self, project_id: str, seq_no: int, src: Dict[str, Any]) -> None:
+        ...
+
+    @abstractmethod
+    async def write_trees(self, projects: List[Dict[str, Any]]) -> None:
+        ...
+
+    @abstractmethod
+    async def write_active(self, states: List[Dict[str, Any]]) -> None:
+        ...
+
+    @abstractmethod
+    async def rebuild(self, project_id: str) -> Optional[Dict[str, Any]]:
+        ...
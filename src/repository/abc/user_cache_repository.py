@@ -0,0 +1,18 @@
+from abc import ABC, abstractmethod
+from typing import Optional
+
+from schemas.user import UserInDB
+
+
+class ABCUserCacheRepository(ABC):
+    @abstractmethod
+    async def get_user(self, user_id: str) -> Optional[UserInDB]:
+        ...
+
+    @abstractmethod
+    async def set_user(self, user: UserInDB, seq_no: int) -> None:
+        ...
+
+    @abstractmethod
+    async def invalidate_user(self, user_id: str, seq_no: Optional[int] = None) -> None:
+        ...
@@ -11,12 +11,18 @@ class ABCUserRepository(ABC):
 
     @abstractmethod
     async def get_user_by_email(self, email: str) -> Optional[UserInDB]:
-       ...
+        """Пользователь с hashed_password — для проверки пароля."""
+        ...
 
     @abstractmethod
     async def get_user_by_id(self, user_id: str) -> Optional[UserInDB]:
         ...
 
+    @abstractmethod
+    async def get_user_profile(self, user_id: str) -> Optional[UserInDB]:
+        """Пользователь для проверки прав, с пустым hashed_password — как он лежит в кэше."""
+        ...
+
     @abstractmethod
     async def get_all_users(self) -> list[dict[str, Any]]:
         ...
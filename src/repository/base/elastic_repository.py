@@ -1,7 +1,344 @@
-from typing import Any, Dict, List, Optional
+import asyncio
+import re
+from datetime import datetime
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from elasticsearch._async.client import AsyncElasticsearch
+from elasticsearch.exceptions import NotFoundError
+from loguru import logger
+
+from common.exceptions.service_unavailable import ServiceUnavailableException
+from core.functions import decode_cursor, encode_cursor, parse_datetime
+from core.metrics import metrics
+
+SHIFT_EVENT_START = "start"
+SHIFT_EVENT_STOP = "stop"
+
+# Поля дерева проекта, которых достаточно, чтобы сопоставить события смен с задачами
+PROJECT_TARGET_FIELDS = [
+    "project_id",
+    "project_name",
+    "foreman_id",
+    "work_stages.work_kinds.work_kind_id",
+    "work_stages.work_kinds.work_kind_name",
+    "work_stages.work_kinds.work_types.work_type_id",
+    "work_stages.work_kinds.work_types.work_type_name",
+    "work_stages.work_kinds.work_types.tasks.task_id",
+    "work_stages.work_kinds.work_types.tasks.task_name",
+    "work_stages.work_kinds.work_types.tasks.subtasks.subtask_id",
+    "work_stages.work_kinds.work_types.tasks.subtasks.subtask_name",
+]
+
+# Бригада подзадачи — для разбивки отработанного времени по бригадам
+SUBTASK_BRIGADE_FIELD = "work_stages.work_kinds.work_types.tasks.subtasks.brigade_id"
+
+# Поля дерева проекта, из которых считается сводка прогресса (индекс project_rollups)
+PROJECT_ROLLUP_FIELDS = [
+    "project_id",
+    "work_stages.stage_id",
+    "work_stages.stage_name",
+    "work_stages.work_kinds.work_kind_id",
+    "work_stages.work_kinds.work_types.work_type_id",
+    "work_stages.work_kinds.work_types.work_type_name",
+    "work_stages.work_kinds.work_types.tasks.task_id",
+    "work_stages.work_kinds.work_types.tasks.subtasks.subtask_id",
+    "work_stages.work_kinds.work_types.tasks.subtasks.subtask_status",
+    "work_stages.work_kinds.work_types.tasks.subtasks.plannedQty",
+    "work_stages.work_kinds.work_types.tasks.subtasks.actualQty",
+    "work_stages.work_kinds.work_types.tasks.subtasks.reportLinks",
+    SUBTASK_BRIGADE_FIELD,
+]
+# Поля, правка которых (кроме структуры дерева и id) меняет сводку прогресса
+PROJECT_ROLLUP_LEAF_FIELDS = {
+    "stage_name", "work_type_name", "subtask_status", "plannedQty", "actualQty", "reportLinks", "brigade_id",
+}
+
+# Поле документа проекта с картой task/subtask -> индексы в массивах дерева (mapping: enabled=false)
+PATH_INDEX_FIELD = "path_index"
+
+# Размер страницы истории смен: событий start на один search (и подзапросов в msearch)
+SHIFT_HISTORY_PAGE_SIZE = 500
+
+# id уровней дерева этапов: запрошенные поля вложенного уровня тянут за собой id его родителей
+STAGE_TREE_ID_FIELDS = {
+    "work_kinds": "work_kind_id",
+    "work_types": "work_type_id",
+    "tasks": "task_id",
+    "subtasks": "subtask_id",
+}
+# Без этих полей не пройдёт валидация WorkStage/Task/Subtask
+STAGE_TREE_REQUIRED_FIELDS = {
+    "stage_id",
+    "work_kinds.work_types.tasks.task_id",
+    "work_kinds.work_types.tasks.subtasks.subtask_id",
+}
+_STAGE_FIELD_RE = re.compile(r"^[A-Za-z0-9_*]+(\.[A-Za-z0-9_*]+)*$")
+# inner_hits по умолчанию отдают 3 совпадения; больше 100 ES не разрешает (max_inner_result_window)
+STAGES_INNER_HITS_SIZE = 100
+
+# Полнотекстовый поиск задач и подзадач: nested-пути, поля для поиска и поля совпадения в ответе.
+# Совпадения берутся из inner_hits, а их у проекта не больше 100 (max_inner_result_window):
+# дальше этого окна страницы не листаются.
+TASKS_PATH = "work_stages.work_kinds.work_types.tasks"
+SUBTASKS_PATH = f"{TASKS_PATH}.subtasks"
+TASK_SEARCH_FIELDS = ["task_name", "task_description"]
+SUBTASK_SEARCH_FIELDS = ["subtask_name", "subtask_description"]
+TASK_SEARCH_WINDOW = 100
+# Поля проекта для пути к совпадению: id и названия уровней дерева, без подзадач
+TASK_SEARCH_PROJECT_FIELDS = [
+    "project_id",
+    "project_name",
+    "work_stages.stage_id",
+    "work_stages.stage_name",
+    "work_stages.work_kinds.work_kind_id",
+    "work_stages.work_kinds.work_kind_name",
+    "work_stages.work_kinds.work_types.work_type_id",
+    "work_stages.work_kinds.work_types.work_type_name",
+    f"{TASKS_PATH}.task_id",
+    f"{TASKS_PATH}.task_name",
+]
+
+# Размер страницы списка проектов по умолчанию и время жизни point-in-time между страницами
+PROJECTS_PAGE_SIZE = 100
+PROJECTS_PIT_KEEP_ALIVE = "2m"
+# Выгрузка истории смен читает события из одного снимка; между страницами — запись ответа клиенту
+EXPORT_PIT_KEEP_ALIVE = "5m"
+
+# Поля проекта для выгрузки задач (iter_task_rows): без интервалов, отчётов и path_index
+TASK_EXPORT_FIELDS = PROJECT_TARGET_FIELDS + [
+    "work_stages.stage_id",
+    "work_stages.stage_name",
+    "work_stages.work_kinds.work_types.tasks.task_status",
+    "work_stages.work_kinds.work_types.tasks.subtasks.subtask_status",
+    "work_stages.work_kinds.work_types.tasks.subtasks.plannedQty",
+    "work_stages.work_kinds.work_types.tasks.subtasks.actualQty",
+    "work_stages.work_kinds.work_types.tasks.subtasks.properties",
+    "work_stages.work_kinds.work_types.tasks.subtasks.deadline",
+    SUBTASK_BRIGADE_FIELD,
+]
+
+# Сколько ждать появления только что записанных событий в поиске (refresh_interval по умолчанию — 1s)
+SHIFT_READ_WAIT_SECONDS = 2.0
+SHIFT_READ_POLL_SECONDS = 0.1
+SHIFT_READ_RETRY_AFTER = 1
 
 
 class BaseElasticRepository:
+    client: AsyncElasticsearch
+    index: str
+    events_index: str
+    timeout: int
+
+    @classmethod
+    def projects_filters(
+        cls,
+        foreman_id: Optional[str] = None,
+        project_ids: Optional[List[str]] = None,
+        status: Optional[str] = None,
+        name_prefix: Optional[str] = None,
+    ) -> List[Dict[str, Any]]:
+        """Фильтры списка проектов; status — проекты, у которых есть этап в этом статусе."""
+        filters: List[Dict[str, Any]] = []
+        if foreman_id is not None:
+            filters.append({"term": {"foreman_id": foreman_id}})
+        if project_ids is not None:
+            filters.append({"terms": {"project_id": project_ids}})
+        if status is not None:
+            filters.append(cls.stage_status_filter(status))
+        if name_prefix:
+            filters.append({
+                "prefix": {"project_name.keyword": {"value": name_prefix, "case_insensitive": True}}
+            })
+        return filters
+
+    @staticmethod
+    def stage_status_filter(status: str) -> Dict[str, Any]:
+        return {"nested": {"path": "work_stages", "query": {"term": {"work_stages.stage_status": status}}}}
+
+    async def _projects_page(
+        self,
+        filters: List[Dict[str, Any]],
+        cursor: Optional[str] = None,
+        limit: int = PROJECTS_PAGE_SIZE,
+        use_pit: bool = False,
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """
+        Страница проектов по project_id (search_after). С use_pit первая страница открывает
+        point-in-time, и все следующие читают тот же снимок индекса; его id едет в курсоре,
+        а после последней страницы PIT закрывается.
+        """
+        search_after, pit_id = None, None
+        if cursor is not None:
+            values = decode_cursor(cursor)
+            if len(values) != 2 or not isinstance(values[0], list) or not isinstance(values[1], (str, type(None))):
+                raise ValueError("Invalid cursor")
+            search_after, pit_id = values
+        elif use_pit:
+            pit = await self.client.open_point_in_time(
+                index=self.index, keep_alive=PROJECTS_PIT_KEEP_ALIVE, request_timeout=self.timeout
+            )
+            pit_id = pit["id"]
+
+        params: Dict[str, Any] = {}
+        if pit_id is not None:
+            params["pit"] = {"id": pit_id, "keep_alive": PROJECTS_PIT_KEEP_ALIVE}
+        else:
+            params["index"] = self.index
+        if search_after is not None:
+            params["search_after"] = search_after
+        try:
+            resp = await self.client.search(
+                size=limit,
+                query={"bool": {"filter": filters}},
+                sort=[{"project_id": "asc"}],
+                _source=["project_id", "project_name"],
+                request_timeout=self.timeout,
+                **params,
+            )
+        except NotFoundError as e:
+            if pit_id is not None:
+                # PIT истёк между страницами
+                raise ValueError("Cursor expired") from e
+            raise
+        hits = resp["hits"]["hits"]
+        pit_id = resp.get("pit_id", pit_id)
+        projects = [hit["_source"] for hit in hits]
+        if len(hits) < limit:
+            if pit_id is not None:
+                await self.client.close_point_in_time(id=pit_id, request_timeout=self.timeout)
+            return projects, None
+        return projects, encode_cursor([hits[-1]["sort"], pit_id])
+
+    @staticmethod
+    def task_search_query(text: str, filters: List[Dict[str, Any]], size: int) -> Dict[str, Any]:
+        """
+        Проекты, где text нашёлся в задаче или подзадаче, с самими совпадениями в inner_hits
+        (и подсветкой). score_mode=max и dis_max дают проекту score его лучшего совпадения:
+        тогда лучшие size совпадений всех проектов лежат в первых size проектах.
+        """
+        def nested(path: str, fields: List[str], name: str, source: List[str]) -> Dict[str, Any]:
+            full = [f"{path}.{field}" for field in fields]
+            return {
+                "nested": {
+                    "path": path,
+                    "score_mode": "max",
+                    "query": {"multi_match": {"query": text, "fields": full}},
+                    "inner_hits": {
+                        "name": name,
+                        "size": size,
+                        # пути и от корня, и от вложенного объекта: лишние includes ничего не отбирают
+                        "_source": {"includes": source + [f"{path}.{field}" for field in source]},
+                        "highlight": {"fields": {field: {} for field in full}},
+                    },
+                }
+            }
+
+        return {
+            "bool": {
+                "filter": filters,
+                "must": [{
+                    "dis_max": {
+                        "queries": [
+                            nested(TASKS_PATH, TASK_SEARCH_FIELDS, "tasks", ["task_id", "task_name", "task_status"]),
+                            nested(
+                                SUBTASKS_PATH,
+                                SUBTASK_SEARCH_FIELDS,
+                                "subtasks",
+                                ["subtask_id", "subtask_name", "subtask_status"],
+                            ),
+                        ]
+                    }
+                }],
+            }
+        }
+
+    @staticmethod
+    def task_search_match(project: Dict[str, Any], inner: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Совпадение из inner_hits -> путь по смещениям _nested, id и названия уровней, подсветка."""
+        path: List[int] = []
+        identity = inner.get("_nested")
+        while identity is not None:
+            path.append(identity["offset"])
+            identity = identity.get("_nested")
+        if len(path) not in (4, 5):
+            return None
+        try:
+            stage = project["work_stages"][path[0]]
+            wk = stage["work_kinds"][path[1]]
+            wt = wk["work_types"][path[2]]
+            task = wt["tasks"][path[3]]
+        except (KeyError, IndexError, TypeError):
+            return None
+        src = inner.get("_source") or {}
+        match = {
+            "project_id": project.get("project_id"),
+            "project_name": project.get("project_name"),
+            "kind": "subtask" if len(path) == 5 else "task",
+            "path": path,
+            "score": inner.get("_score") or 0.0,
+            "stage_id": stage.get("stage_id"),
+            "stage_name": stage.get("stage_name"),
+            "work_kind_id": wk.get("work_kind_id"),
+            "work_kind_name": wk.get("work_kind_name"),
+            "work_type_id": wt.get("work_type_id"),
+            "work_type_name": wt.get("work_type_name"),
+            "task_id": task.get("task_id"),
+            "task_name": task.get("task_name"),
+            "highlight": {
+                field.rsplit(".", 1)[-1]: fragments for field, fragments in (inner.get("highlight") or {}).items()
+            },
+        }
+        if len(path) == 5:
+            match.update(
+                subtask_id=src.get("subtask_id"), subtask_name=src.get("subtask_name"), status=src.get("subtask_status")
+            )
+        else:
+            match["status"] = src.get("task_status")
+        return match
+
+    async def _search_tasks(
+        self,
+        text: str,
+        filters: List[Dict[str, Any]],
+        cursor: Optional[str] = None,
+        limit: int = 20,
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """
+        Страница совпадений text в задачах и подзадачах проектов под filters, по убыванию
+        релевантности. Курсор — смещение в общем списке совпадений; окно — TASK_SEARCH_WINDOW.
+        """
+        offset = 0
+        if cursor is not None:
+            values = decode_cursor(cursor)
+            if len(values) != 1 or not isinstance(values[0], int) or values[0] < 0:
+                raise ValueError("Invalid cursor")
+            offset = values[0]
+        end = offset + limit
+        if end > TASK_SEARCH_WINDOW:
+            raise ValueError(f"Search results are limited to the first {TASK_SEARCH_WINDOW} matches")
+        resp = await self.client.search(
+            index=self.index,
+            size=end,
+            query=self.task_search_query(text, filters, end),
+            _source=TASK_SEARCH_PROJECT_FIELDS,
+            track_total_hits=end + 1,
+            request_timeout=self.timeout,
+        )
+        hits = resp["hits"]["hits"]
+        more = resp["hits"]["total"]["value"] > len(hits)
+        matches = []
+        for hit in hits:
+            for inner in (hit.get("inner_hits") or {}).values():
+                more = more or inner["hits"]["total"]["value"] > len(inner["hits"]["hits"])
+                for inner_hit in inner["hits"]["hits"]:
+                    match = self.task_search_match(hit["_source"], inner_hit)
+                    if match is not None:
+                        matches.append(match)
+        matches.sort(key=lambda match: (-match["score"], match["project_id"] or "", match["path"]))
+        more = more or len(matches) > end
+        next_cursor = encode_cursor([end]) if more and end < TASK_SEARCH_WINDOW else None
+        return matches[offset:end], next_cursor
+
     def parse_shift_history(self, shifts: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
         results: List[Dict[str, Any]] = []
         for hit in shifts:
@@ -35,17 +372,11 @@ class BaseElasticRepository:
             return
 
         for task in tasks:
+            base = BaseElasticRepository._task_entry_base(project, task, work_type, work_kind)
             for ti in task.get("time_intervals", []):
                 results.append({
                     "type": "task",
-                    "project_id": project.get("project_id"),
-                    "project_name": project.get("project_name"),
-                    "task_id": task.get("task_id"),
-                    "task_name": task.get("task_name"),
-                    "work_type_id": work_type.get("work_type_id") if work_type else None,
-                    "work_type_name": work_type.get("work_type_name") if work_type else None,
-                    "work_kind_id": work_kind.get("work_kind_id") if work_kind else None,
-                    "work_kind_name": work_kind.get("work_kind_name") if work_kind else None,
+                    **base,
                     "start_time": ti.get("start_time"),
                     "end_time": ti.get("end_time"),
                     "status": ti.get("status"),
@@ -54,17 +385,681 @@ class BaseElasticRepository:
                 for ti in sub.get("time_intervals", []):
                     results.append({
                         "type": "subtask",
-                        "project_id": project.get("project_id"),
-                        "project_name": project.get("project_name"),
-                        "task_id": task.get("task_id"),
-                        "task_name": task.get("task_name"),
+                        **base,
                         "subtask_id": sub.get("subtask_id"),
                         "subtask_name": sub.get("subtask_name"),
-                        "work_type_id": work_type.get("work_type_id") if work_type else None,
-                        "work_type_name": work_type.get("work_type_name") if work_type else None,
-                        "work_kind_id": work_kind.get("work_kind_id") if work_kind else None,
-                        "work_kind_name": work_kind.get("work_kind_name") if work_kind else None,
                         "start_time": ti.get("start_time"),
                         "end_time": ti.get("end_time"),
                         "status": ti.get("status"),
                     })
+
+    @staticmethod
+    def _task_entry_base(
+        project: Dict[str, Any],
+        task: Dict[str, Any],
+        work_type: Optional[Dict[str, Any]],
+        work_kind: Optional[Dict[str, Any]],
+    ) -> Dict[str, Any]:
+        """Общие поля плоской строки задачи: проект, задача, вид и тип работ."""
+        return {
+            "project_id": project.get("project_id"),
+            "project_name": project.get("project_name"),
+            "task_id": task.get("task_id"),
+            "task_name": task.get("task_name"),
+            "work_type_id": work_type.get("work_type_id") if work_type else None,
+            "work_type_name": work_type.get("work_type_name") if work_type else None,
+            "work_kind_id": work_kind.get("work_kind_id") if work_kind else None,
+            "work_kind_name": work_kind.get("work_kind_name") if work_kind else None,
+        }
+
+    @classmethod
+    def iter_task_rows(cls, src: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+        """
+        Задачи и подзадачи проекта плоскими строками в порядке дерева (для выгрузки):
+        поля как в записях истории смен плюс этап, статус, бригада, объёмы и сроки подзадачи.
+        """
+        project = {"project_id": src.get("project_id"), "project_name": src.get("project_name")}
+        for stage in src.get("work_stages") or []:
+            for wk in stage.get("work_kinds") or []:
+                for wt in wk.get("work_types") or []:
+                    for task in wt.get("tasks") or []:
+                        base = {
+                            "stage_id": stage.get("stage_id"),
+                            "stage_name": stage.get("stage_name"),
+                            **cls._task_entry_base(project, task, wt, wk),
+                        }
+                        yield {"type": "task", **base, "status": task.get("task_status")}
+                        for sub in task.get("subtasks") or []:
+                            deadline = sub.get("deadline") or {}
+                            properties = sub.get("properties") or {}
+                            yield {
+                                "type": "subtask",
+                                **base,
+                                "subtask_id": sub.get("subtask_id"),
+                                "subtask_name": sub.get("subtask_name"),
+                                "status": sub.get("subtask_status"),
+                                "brigade_id": sub.get("brigade_id"),
+                                "planned_qty": sub.get("plannedQty"),
+                                "actual_qty": sub.get("actualQty"),
+                                "start_time": deadline.get("start_time") or properties.get("start"),
+                                "end_time": deadline.get("end_time") or properties.get("end"),
+                            }
+
+    @staticmethod
+    def shift_target_key(target_type: str, target_id: str) -> str:
+        return f"{target_type}:{target_id}"
+
+    @classmethod
+    def collect_shift_targets(
+        cls, src: Dict[str, Any], with_brigades: bool = False
+    ) -> Dict[str, Dict[str, Any]]:
+        """
+        Строит словарь target_key -> шаблон записи истории смен
+        (имена проекта, задачи, подзадачи, вида и типа работ) по дереву проекта.
+        with_brigades добавляет brigade_id подзадач (поле должно быть в _source).
+        """
+        targets: Dict[str, Dict[str, Any]] = {}
+        project_id = src.get("project_id")
+        project_name = src.get("project_name")
+        for stage in src.get("work_stages") or []:
+            for wk in stage.get("work_kinds") or []:
+                for wt in wk.get("work_types") or []:
+                    for task in wt.get("tasks") or []:
+                        base = {
+                            "project_id": project_id,
+                            "project_name": project_name,
+                            "task_id": task.get("task_id"),
+                            "task_name": task.get("task_name"),
+                            "work_type_id": wt.get("work_type_id"),
+                            "work_type_name": wt.get("work_type_name"),
+                            "work_kind_id": wk.get("work_kind_id"),
+                            "work_kind_name": wk.get("work_kind_name"),
+                        }
+                        targets[cls.shift_target_key("task", task.get("task_id"))] = {"type": "task", **base}
+                        for sub in task.get("subtasks") or []:
+                            target = {
+                                "type": "subtask",
+                                **base,
+                                "subtask_id": sub.get("subtask_id"),
+                                "subtask_name": sub.get("subtask_name"),
+                            }
+                            if with_brigades:
+                                target["brigade_id"] = sub.get("brigade_id")
+                            targets[cls.shift_target_key("subtask", sub.get("subtask_id"))] = target
+        return targets
+
+    @classmethod
+    def build_path_index(cls, src: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+        """
+        Карта target_key -> путь к элементу в дереве проекта: индексы
+        [stage, work_kind, work_type, task(, subtask)] и id родителей.
+        Хранится в документе проекта, чтобы обновления шли сразу в нужный элемент.
+        """
+        path_index: Dict[str, Dict[str, Any]] = {}
+        for si, stage in enumerate(src.get("work_stages") or []):
+            for ki, wk in enumerate(stage.get("work_kinds") or []):
+                for ti, wt in enumerate(wk.get("work_types") or []):
+                    for ai, task in enumerate(wt.get("tasks") or []):
+                        base = {
+                            "stage_id": stage.get("stage_id"),
+                            "work_kind_id": wk.get("work_kind_id"),
+                            "work_type_id": wt.get("work_type_id"),
+                            "task_id": task.get("task_id"),
+                        }
+                        path_index[cls.shift_target_key("task", task.get("task_id"))] = {
+                            "path": [si, ki, ti, ai],
+                            **base,
+                        }
+                        for bi, sub in enumerate(task.get("subtasks") or []):
+                            path_index[cls.shift_target_key("subtask", sub.get("subtask_id"))] = {
+                                "path": [si, ki, ti, ai, bi],
+                                **base,
+                                "subtask_id": sub.get("subtask_id"),
+                            }
+        return path_index
+
+    @staticmethod
+    def _progress_metrics() -> Dict[str, Any]:
+        return {
+            "planned_qty": 0.0, "actual_qty": 0.0, "tasks": 0, "subtasks": 0, "subtask_status": {}, "report_links": 0,
+        }
+
+    @staticmethod
+    def _add_progress(into: Dict[str, Any], row: Dict[str, Any]) -> None:
+        for key in ("planned_qty", "actual_qty", "tasks", "subtasks", "report_links"):
+            into[key] += row[key]
+        for status, count in row["subtask_status"].items():
+            into["subtask_status"][status] = into["subtask_status"].get(status, 0) + count
+
+    @staticmethod
+    def _qty(value: Any) -> float:
+        return float(value) if isinstance(value, (int, float)) and not isinstance(value, bool) else 0.0
+
+    @classmethod
+    def build_project_rollup(cls, src: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Сводка прогресса по дереву проекта (достаточно полей PROJECT_ROLLUP_FIELDS):
+        суммы plannedQty/actualQty, число задач, подзадач по subtask_status и ссылок
+        на отчёты — по видам работ, этапам и проекту. targets — target_key -> номер вида
+        работ в сводке (и бригада подзадачи): по нему раскладываются активные смены.
+        """
+        totals = cls._progress_metrics()
+        stages: List[Dict[str, Any]] = []
+        work_types: List[Dict[str, Any]] = []
+        targets: Dict[str, Dict[str, Any]] = {}
+        for stage in src.get("work_stages") or []:
+            stage_row = {"stage_id": stage.get("stage_id"), "stage_name": stage.get("stage_name")}
+            stage_row.update(cls._progress_metrics())
+            for wk in stage.get("work_kinds") or []:
+                for wt in wk.get("work_types") or []:
+                    row = {
+                        "stage_id": stage.get("stage_id"),
+                        "work_kind_id": wk.get("work_kind_id"),
+                        "work_type_id": wt.get("work_type_id"),
+                        "work_type_name": wt.get("work_type_name"),
+                    }
+                    row.update(cls._progress_metrics())
+                    position = len(work_types)
+                    for task in wt.get("tasks") or []:
+                        row["tasks"] += 1
+                        targets[cls.shift_target_key("task", task.get("task_id"))] = {"work_type": position}
+                        for sub in task.get("subtasks") or []:
+                            row["subtasks"] += 1
+                            row["planned_qty"] += cls._qty(sub.get("plannedQty"))
+                            row["actual_qty"] += cls._qty(sub.get("actualQty"))
+                            row["report_links"] += len(sub.get("reportLinks") or [])
+                            status = sub.get("subtask_status")
+                            if status:
+                                row["subtask_status"][status] = row["subtask_status"].get(status, 0) + 1
+                            targets[cls.shift_target_key("subtask", sub.get("subtask_id"))] = {
+                                "work_type": position,
+                                "brigade_id": sub.get("brigade_id"),
+                            }
+                    work_types.append(row)
+                    cls._add_progress(stage_row, row)
+            stages.append(stage_row)
+            cls._add_progress(totals, stage_row)
+        return {
+            "project_id": src.get("project_id"),
+            "totals": totals,
+            "stages": stages,
+            "work_types": work_types,
+            "targets": targets,
+        }
+
+    @classmethod
+    def summarize_project_rollup(cls, rollup: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Ответ по сохранённой сводке: к итогам добавляются активные смены — задачи и
+        подзадачи в работе и число разных бригад на них (active — по прорабам, см. project_rollups).
+        """
+        work_types = rollup.get("work_types") or []
+        active: Dict[str, Optional[Dict[str, Any]]] = {}
+        for state in (rollup.get("active") or {}).values():
+            active.update(state.get("targets") or {})
+
+        def active_row() -> Dict[str, Any]:
+            return {"active_tasks": 0, "active_subtasks": 0, "brigades": set()}
+
+        total = active_row()
+        by_work_type: Dict[int, Dict[str, Any]] = {}
+        by_stage: Dict[Any, Dict[str, Any]] = {}
+        for key, location in active.items():
+            rows = [total]
+            position = (location or {}).get("work_type")
+            if position is not None and position < len(work_types):
+                rows.append(by_work_type.setdefault(position, active_row()))
+                rows.append(by_stage.setdefault(work_types[position]["stage_id"], active_row()))
+            subtask = key.startswith("subtask:")
+            for row in rows:
+                row["active_subtasks" if subtask else "active_tasks"] += 1
+                if subtask and (location or {}).get("brigade_id"):
+                    row["brigades"].add(location["brigade_id"])
+
+        def finish(row: Dict[str, Any], active_counts: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+            active_counts = active_counts or active_row()
+            planned = row["planned_qty"]
+            return {
+                **row,
+                "progress": row["actual_qty"] / planned if planned else None,
+                "active_tasks": active_counts["active_tasks"],
+                "active_subtasks": active_counts["active_subtasks"],
+                "active_crews": len(active_counts["brigades"]),
+            }
+
+        return {
+            "project_id": rollup.get("project_id"),
+            "seq_no": rollup.get("project_seq_no"),
+            "updated_at": rollup.get("updated_at"),
+            "totals": finish(rollup.get("totals") or cls._progress_metrics(), total),
+            "by_stage": [finish(row, by_stage.get(row["stage_id"])) for row in rollup.get("stages") or []],
+            "by_work_type": [finish(row, by_work_type.get(i)) for i, row in enumerate(work_types)],
+        }
+
+    @classmethod
+    def make_shift_event(
+        cls,
+        *,
+        foreman_id: Optional[str],
+        project_id: str,
+        target_type: str,
+        task_id: Optional[str],
+        subtask_id: Optional[str],
+        event: str,
+        timestamp: str,
+        start_time: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        """
+        Документ индекса событий смен: одна запись на каждый старт/стоп задачи или подзадачи.
+        _id детерминирован, поэтому повторная загрузка (backfill) не создаёт дублей.
+        Событие stop с известным start_time хранит и длительность интервала — по ней
+        считаются отработанные часы агрегациями ES.
+        """
+        target_id = subtask_id if target_type == "subtask" else task_id
+        target_key = cls.shift_target_key(target_type, target_id)
+        shift_event = {
+            "event_id": f"{project_id}:{target_key}:{event}:{timestamp}",
+            "foreman_id": foreman_id,
+            "project_id": project_id,
+            "target_type": target_type,
+            "target_key": target_key,
+            "task_id": task_id,
+            "subtask_id": subtask_id,
+            "event": event,
+            "timestamp": timestamp,
+        }
+        if event == SHIFT_EVENT_STOP and start_time:
+            shift_event["start_time"] = start_time
+            shift_event["duration_seconds"] = (
+                parse_datetime(timestamp) - parse_datetime(start_time)
+            ).total_seconds()
+        return shift_event
+
+    @staticmethod
+    def stage_source_filter(
+        fields: Optional[List[str]] = None, exclude: Optional[List[str]] = None
+    ) -> Tuple[Optional[List[str]], List[str]]:
+        """
+        Поля этапа (пути относительно этапа, как в ответе /tasks) -> _source includes/excludes
+        документа проекта. Для вложенных полей добавляются id всех уровней по пути.
+        """
+        for field in (fields or []) + (exclude or []):
+            if not _STAGE_FIELD_RE.match(field):
+                raise ValueError(f"Invalid field: {field}")
+        includes = None
+        if fields:
+            selected = {"stage_id"}
+            for field in fields:
+                selected.add(field)
+                parts = field.split(".")
+                for depth, part in enumerate(parts[:-1]):
+                    if part in STAGE_TREE_ID_FIELDS:
+                        selected.add(".".join(parts[:depth + 1] + [STAGE_TREE_ID_FIELDS[part]]))
+            includes = sorted(f"work_stages.{field}" for field in selected)
+        for field in exclude or []:
+            if field in STAGE_TREE_REQUIRED_FIELDS:
+                raise ValueError(f"Field {field} cannot be excluded")
+        excludes = [f"work_stages.{field}" for field in exclude or []]
+        return includes, excludes
+
+    @staticmethod
+    def document_version(hit: Dict[str, Any]) -> str:
+        """Версия документа для ETag: _primary_term и _seq_no меняются при каждой записи."""
+        return f"{hit['_primary_term']}.{hit['_seq_no']}"
+
+    async def _get_project_version(self, project_id: str, foreman_id: Optional[str] = None) -> Optional[str]:
+        """
+        Версия документа проекта realtime get'ом без _source (с foreman_id — только его поле
+        для проверки владельца). None — проекта нет или он другого прораба.
+        """
+        params: Dict[str, Any] = {"_source_includes": ["foreman_id"]} if foreman_id is not None else {"_source": False}
+        try:
+            got = await self.client.get(index=self.index, id=project_id, request_timeout=self.timeout, **params)
+        except NotFoundError:
+            return None
+        if foreman_id is not None and got["_source"].get("foreman_id") != foreman_id:
+            return None
+        return self.document_version(got)
+
+    async def _get_stages(
+        self,
+        project_id: str,
+        fields: Optional[List[str]] = None,
+        exclude: Optional[List[str]] = None,
+        stage_id: Optional[str] = None,
+        work_kind_id: Optional[str] = None,
+    ) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+        """
+        project_id, foreman_id и этапы проекта только с запрошенными полями и версия документа,
+        из которого они прочитаны; (None, None) — проекта нет.
+        Без фильтров — realtime get с source filtering. С stage_id/work_kind_id — search с
+        nested-запросом: совпавшие этапы (и типы работ внутри них) приходят через inner_hits,
+        остальной документ не читается.
+        """
+        includes, excludes = self.stage_source_filter(fields, exclude)
+        if stage_id is None and work_kind_id is None:
+            params: Dict[str, Any] = {"_source_includes": ["project_id", "foreman_id"] + (includes or ["work_stages"])}
+            if excludes:
+                params["_source_excludes"] = excludes
+            try:
+                got = await self.client.get(index=self.index, id=project_id, request_timeout=self.timeout, **params)
+            except NotFoundError:
+                return None, None
+            return got["_source"], self.document_version(got)
+
+        stage_filters: List[Dict[str, Any]] = []
+        stage_source: Dict[str, Any] = {"excludes": excludes}
+        if includes is not None:
+            stage_source["includes"] = includes
+        if stage_id is not None:
+            stage_filters.append({"term": {"work_stages.stage_id": stage_id}})
+        if work_kind_id is not None:
+            kind_source: Dict[str, Any] = {"excludes": excludes}
+            if includes is not None:
+                kind_source["includes"] = [field for field in includes if field.startswith("work_stages.work_kinds.")]
+            stage_filters.append({
+                "nested": {
+                    "path": "work_stages.work_kinds",
+                    "query": {"term": {"work_stages.work_kinds.work_kind_id": work_kind_id}},
+                    "inner_hits": {"name": "work_kinds", "size": STAGES_INNER_HITS_SIZE, "_source": kind_source},
+                }
+            })
+            # типы работ этапа заменяются совпавшими из вложенных inner_hits
+            stage_source["excludes"] = excludes + ["work_stages.work_kinds"]
+        resp = await self.client.search(
+            index=self.index,
+            size=1,
+            query={"bool": {"filter": [
+                {"term": {"project_id": project_id}},
+                {
+                    "nested": {
+                        "path": "work_stages",
+                        "query": {"bool": {"filter": stage_filters}},
+                        "inner_hits": {"name": "work_stages", "size": STAGES_INNER_HITS_SIZE, "_source": stage_source},
+                    }
+                },
+            ]}},
+            _source=["project_id", "foreman_id"],
+            seq_no_primary_term=True,
+            request_timeout=self.timeout,
+        )
+        hits = resp["hits"]["hits"]
+        if not hits:
+            return None, None
+        stages = []
+        for stage_hit in self._inner_hits(hits[0], "work_stages"):
+            stage = stage_hit["_source"]
+            if work_kind_id is not None:
+                stage["work_kinds"] = [hit["_source"] for hit in self._inner_hits(stage_hit, "work_kinds")]
+            stages.append(stage)
+        return {**hits[0]["_source"], "work_stages": stages}, self.document_version(hits[0])
+
+    @staticmethod
+    def _inner_hits(hit: Dict[str, Any], name: str) -> List[Dict[str, Any]]:
+        """inner_hits в порядке элементов в документе (по умолчанию они отсортированы по score)."""
+        inner = hit.get("inner_hits", {}).get(name, {}).get("hits", {}).get("hits", [])
+        return sorted(inner, key=lambda item: item["_nested"]["offset"])
+
+    async def _get_project_source(
+        self, project_id: str, includes: Optional[List[str]] = None
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Realtime get проекта с деревом этапов (только поля includes, без них — целиком)
+        вместе с _seq_no/_primary_term; None — проекта нет. В раздельной раскладке
+        (SplitLayoutMixin) дерево собирается из документов этапов.
+        """
+        params: Dict[str, Any] = {"_source_includes": includes} if includes is not None else {}
+        try:
+            return await self.client.get(index=self.index, id=project_id, request_timeout=self.timeout, **params)
+        except NotFoundError:
+            return None
+
+    async def _get_project_targets(
+        self, project_id: str, foreman_id: Optional[str] = None
+    ) -> Optional[Dict[str, Dict[str, Any]]]:
+        """
+        Realtime get скелета проекта (только id и имена). Возвращает None,
+        если проекта нет или он принадлежит другому прорабу.
+        """
+        got = await self._get_project_source(project_id, PROJECT_TARGET_FIELDS)
+        if got is None:
+            return None
+        src = got["_source"]
+        if foreman_id is not None and src.get("foreman_id") != foreman_id:
+            return None
+        return self.collect_shift_targets(src)
+
+    async def _get_path_entries(
+        self, project_id: str, target_keys: List[str]
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Realtime get только нужных записей path_index (source filtering по ключам).
+        Возвращает _source с foreman_id и path_index вместе с _seq_no/_primary_term,
+        None — если проекта нет.
+        """
+        try:
+            got = await self.client.get(
+                index=self.index,
+                id=project_id,
+                _source_includes=["foreman_id"] + [f"{PATH_INDEX_FIELD}.{key}" for key in target_keys],
+                request_timeout=self.timeout,
+            )
+        except NotFoundError:
+            return None
+        return got
+
+    def _shift_events_query(
+        self,
+        project_id: str,
+        foreman_id: Optional[str] = None,
+        target_keys: Optional[Iterable[str]] = None,
+        event: Optional[str] = None,
+        date_from: Optional[datetime] = None,
+        date_to: Optional[datetime] = None,
+    ) -> Dict[str, Any]:
+        filters: List[Dict[str, Any]] = [{"term": {"project_id": project_id}}]
+        if foreman_id is not None:
+            filters.append({"term": {"foreman_id": foreman_id}})
+        if target_keys is not None:
+            filters.append({"terms": {"target_key": list(target_keys)}})
+        if event is not None:
+            filters.append({"term": {"event": event}})
+        if date_from is not None or date_to is not None:
+            time_range: Dict[str, Any] = {}
+            if date_from is not None:
+                time_range["gte"] = date_from.isoformat()
+            if date_to is not None:
+                time_range["lt"] = date_to.isoformat()
+            filters.append({"range": {"timestamp": time_range}})
+        return {"bool": {"filter": filters}}
+
+    async def _write_shift_events(self, events: List[Dict[str, Any]]) -> None:
+        if not events:
+            return
+        operations: List[Dict[str, Any]] = []
+        for event in events:
+            operations.append({"create": {"_index": self.events_index, "_id": event["event_id"]}})
+            operations.append(event)
+        # без refresh: чтение своих записей обеспечивается ожиданием state_seq_no в _wait_for_shift_events
+        resp = await self.client.bulk(operations=operations, request_timeout=self.timeout)
+        if resp.get("errors"):
+            failed = [
+                item["create"] for item in resp["items"]
+                if item["create"].get("error") and item["create"].get("status") != 409
+            ]
+            if failed:
+                logger.error(f"Shift events bulk errors: {failed}")
+                raise RuntimeError("Failed to write shift events")
+
+    async def _wait_for_shift_events(
+        self,
+        project_id: str,
+        foreman_id: Optional[str],
+        min_state_seq_no: int,
+        on_missing: Optional[Callable[[], Awaitable[None]]] = None,
+    ) -> None:
+        """
+        Ждёт, пока события версии состояния min_state_seq_no (её вернул start/stop)
+        станут видимы поиску, вместо принудительного refresh индекса. on_missing
+        вызывается один раз, если с первого запроса событий нет. Не дождались за
+        SHIFT_READ_WAIT_SECONDS — ServiceUnavailableException (503 с Retry-After), а не
+        страница без только что записанной смены.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + SHIFT_READ_WAIT_SECONDS
+        query = self._shift_events_query(project_id, foreman_id)
+        query["bool"]["filter"].append({"range": {"state_seq_no": {"gte": min_state_seq_no}}})
+        while loop.time() < deadline:
+            resp = await self.client.count(
+                index=self.events_index,
+                query=query,
+                ignore_unavailable=True,
+                request_timeout=self.timeout,
+            )
+            if resp["count"]:
+                return
+            if on_missing is not None:
+                await on_missing()
+                on_missing = None
+            await asyncio.sleep(SHIFT_READ_POLL_SECONDS)
+        metrics.incr("shift_history.wait_timeouts")
+        raise ServiceUnavailableException(
+            f"Shift events up to seq_no {min_state_seq_no} are not visible yet", retry_after=SHIFT_READ_RETRY_AFTER
+        )
+
+    async def _find_stop_events(
+        self, starts: List[Dict[str, Any]]
+    ) -> List[Optional[Dict[str, Any]]]:
+        """Для каждого события start — ближайший следующий stop той же задачи (один msearch)."""
+        searches: List[Dict[str, Any]] = []
+        for start in starts:
+            query = self._shift_events_query(
+                start["project_id"], start.get("foreman_id"), [start["target_key"]], SHIFT_EVENT_STOP
+            )
+            query["bool"]["filter"].append({"range": {"timestamp": {"gte": start["timestamp"]}}})
+            searches.append({"index": self.events_index, "ignore_unavailable": True})
+            searches.append({
+                "query": query,
+                "size": 1,
+                "sort": [{"timestamp": "asc"}, {"event_id": "asc"}],
+                "_source": ["timestamp"],
+            })
+        resp = await self.client.msearch(searches=searches, request_timeout=self.timeout)
+        stops: List[Optional[Dict[str, Any]]] = []
+        for item in resp["responses"]:
+            hits = item.get("hits", {}).get("hits", [])
+            stops.append(hits[0]["_source"] if hits else None)
+        return stops
+
+    @staticmethod
+    def make_shift_history_entry(
+        start: Dict[str, Any],
+        stop: Optional[Dict[str, Any]],
+        targets: Dict[str, Dict[str, Any]],
+    ) -> Dict[str, Any]:
+        """Запись истории смен из пары событий start/stop. Без stop — активный интервал."""
+        template = targets.get(start.get("target_key")) or {
+            "type": start.get("target_type"),
+            "project_id": start.get("project_id"),
+            "task_id": start.get("task_id"),
+            "subtask_id": start.get("subtask_id"),
+        }
+        return {
+            **template,
+            "start_time": start.get("timestamp"),
+            "end_time": stop.get("timestamp") if stop else None,
+            "status": "closed" if stop else "active",
+        }
+
+    async def _shift_history_page(
+        self,
+        project_id: str,
+        targets: Dict[str, Dict[str, Any]],
+        foreman_id: Optional[str] = None,
+        date_from: Optional[datetime] = None,
+        date_to: Optional[datetime] = None,
+        cursor: Optional[str] = None,
+        limit: int = SHIFT_HISTORY_PAGE_SIZE,
+        pit: Optional[Dict[str, Any]] = None,
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """
+        Страница истории смен: интервалы по времени начала (from включительно, to — нет).
+        Курсор — search_after по (timestamp, event_id) событий start; индекс событий
+        только дописывается, поэтому порядок страниц стабилен и без point-in-time.
+        pit — {"id": ...} открытого point-in-time: страница читается из снимка, id обновляется.
+        """
+        params: Dict[str, Any] = {}
+        if cursor is not None:
+            values = decode_cursor(cursor)
+            # sort-значения (timestamp в epoch millis, event_id) уходят в ES как есть
+            if (
+                len(values) != 2
+                or not isinstance(values[0], int)
+                or isinstance(values[0], bool)
+                or not isinstance(values[1], str)
+            ):
+                raise ValueError("Invalid cursor")
+            params["search_after"] = values
+        if pit is not None:
+            params["pit"] = {"id": pit["id"], "keep_alive": EXPORT_PIT_KEEP_ALIVE}
+        else:
+            params.update(index=self.events_index, ignore_unavailable=True)
+        resp = await self.client.search(
+            size=limit,
+            query=self._shift_events_query(
+                project_id, foreman_id, event=SHIFT_EVENT_START, date_from=date_from, date_to=date_to
+            ),
+            sort=[{"timestamp": "asc"}, {"event_id": "asc"}],
+            request_timeout=self.timeout,
+            **params,
+        )
+        if pit is not None:
+            pit["id"] = resp.get("pit_id", pit["id"])
+        hits = resp["hits"]["hits"]
+        if not hits:
+            return [], None
+        starts = [hit["_source"] for hit in hits]
+        stops = await self._find_stop_events(starts)
+        entries = [self.make_shift_history_entry(start, stop, targets) for start, stop in zip(starts, stops)]
+        next_cursor = encode_cursor(hits[-1]["sort"]) if len(hits) == limit else None
+        return entries, next_cursor
+
+    async def _iter_shift_history(
+        self,
+        project_id: str,
+        targets: Dict[str, Dict[str, Any]],
+        foreman_id: Optional[str] = None,
+        date_from: Optional[datetime] = None,
+        date_to: Optional[datetime] = None,
+        cursor: Optional[str] = None,
+        use_pit: bool = False,
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Вся история смен постранично, без накопления в памяти. use_pit — все страницы из одного
+        снимка индекса событий (для выгрузки: записи во время чтения в неё не попадут).
+        """
+        pit = None
+        if use_pit:
+            opened = await self.client.open_point_in_time(
+                index=self.events_index,
+                keep_alive=EXPORT_PIT_KEEP_ALIVE,
+                ignore_unavailable=True,
+                request_timeout=self.timeout,
+            )
+            pit = {"id": opened["id"]}
+        try:
+            while True:
+                entries, cursor = await self._shift_history_page(
+                    project_id, targets, foreman_id, date_from, date_to, cursor, pit=pit
+                )
+                for entry in entries:
+                    yield entry
+                if cursor is None:
+                    return
+        finally:
+            if pit is not None:
+                try:
+                    await self.client.close_point_in_time(id=pit["id"], request_timeout=self.timeout)
+                except Exception as e:
+                    # PIT всё равно истечёт через EXPORT_PIT_KEEP_ALIVE
+                    logger.warning(f"Failed to close point-in-time: {e}")
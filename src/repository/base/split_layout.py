@@ -0,0 +1,372 @@
+import uuid
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from elasticsearch.exceptions import NotFoundError
+from loguru import logger
+
+from repository.base.elastic_repository import PATH_INDEX_FIELD, BaseElasticRepository
+
+STORAGE_LAYOUT_NESTED = "nested"
+STORAGE_LAYOUT_SPLIT = "split"
+
+# Поля заголовка проекта в раздельной раскладке: ссылки на документы этапов по порядку
+# ({"doc", "stage_id", "stage_status", "revision"}) и номер последней записи дерева
+STAGE_REFS_FIELD = "stage_refs"
+REVISION_FIELD = "revision"
+# Служебные поля документа этапа, которых нет в этапе дерева проекта
+STAGE_DOC_FIELDS = ("project_id", REVISION_FIELD)
+
+# Сколько раз перечитывать заголовок, если документы его этапов уже удалила следующая запись
+SPLIT_READ_RETRIES = 3
+
+
+class SplitLayoutMixin(BaseElasticRepository):
+    """
+    Раздельная раскладка проекта: в основном индексе — заголовок (поля проекта, path_index,
+    stage_refs), каждый этап — отдельный документ индекса stages_index с routing=project_id.
+    Правка одного этапа переписывает только его документ и заголовок, а не весь проект
+    со всеми вложенными (nested) документами.
+
+    Чтение — realtime get заголовка и mget этапов по stage_refs. Документ этапа не
+    переписывается на месте: изменённый этап пишется новым документом (свой id, ревизия
+    записи), и только потом заголовок с if_seq_no прочитанной версии — он точка фиксации.
+    Не записался заголовок — новые документы удаляются; записался — удаляются документы,
+    на которые он больше не ссылается. Читатель берёт только документы, ревизия которых
+    совпадает со ссылкой заголовка; если документа уже нет, заголовок перечитывается.
+    """
+    stages_index: str
+    # дерево этапов здесь хранится в _source без индекса (work_kinds enabled=false)
+    supports_task_search = False
+
+    @staticmethod
+    def stage_status_filter(status: str) -> Dict[str, Any]:
+        return {"term": {f"{STAGE_REFS_FIELD}.stage_status": status}}
+
+    @staticmethod
+    def stage_doc_id(project_id: str, stage_id: Optional[str]) -> str:
+        """
+        id нового документа этапа: project_id:stage_id и случайный суффикс — запись не задевает
+        документ, на который ещё ссылается текущий заголовок (в том числе при импорте поверх).
+        """
+        return f"{project_id}:{stage_id}:{uuid.uuid4().hex[:12]}"
+
+    @classmethod
+    def stage_ref(
+        cls, project_id: str, stage: Dict[str, Any], revision: int, ref: Optional[Dict[str, Any]] = None
+    ) -> Dict[str, Any]:
+        """Ссылка заголовка на этап: прежняя ref (id документа и ревизия) или новый документ ревизии revision."""
+        if ref is None:
+            ref = {"doc": cls.stage_doc_id(project_id, stage.get("stage_id")), REVISION_FIELD: revision}
+        return {
+            "doc": ref["doc"],
+            "stage_id": stage.get("stage_id"),
+            "stage_status": stage.get("stage_status"),
+            REVISION_FIELD: ref[REVISION_FIELD],
+        }
+
+    @classmethod
+    def split_project(
+        cls,
+        project_id: str,
+        src: Dict[str, Any],
+        revision: int,
+        refs: Optional[List[Optional[Dict[str, Any]]]] = None,
+    ) -> Tuple[Dict[str, Any], List[Tuple[Dict[str, Any], Dict[str, Any]]]]:
+        """
+        Документ проекта -> заголовок и пары (ссылка, документ этапа). refs — прежние ссылки
+        этапов по порядку (None — новый или изменённый этап): у них сохраняются id документа
+        и ревизия, остальные этапы получают новые документы ревизии revision.
+        """
+        stages = src.get("work_stages") or []
+        refs = refs or [None] * len(stages)
+        stage_refs, documents = [], []
+        for stage, ref in zip(stages, refs):
+            stage = stage or {}
+            ref = cls.stage_ref(project_id, stage, revision, ref)
+            stage_refs.append(ref)
+            documents.append((ref, {"project_id": project_id, REVISION_FIELD: ref[REVISION_FIELD], **stage}))
+        header = {key: value for key, value in src.items() if key != "work_stages"}
+        header.update({
+            STAGE_REFS_FIELD: stage_refs,
+            REVISION_FIELD: revision,
+            PATH_INDEX_FIELD: cls.build_path_index(src),
+        })
+        return header, documents
+
+    @staticmethod
+    def stage_from_doc(doc: Dict[str, Any]) -> Dict[str, Any]:
+        return {key: value for key, value in doc["_source"].items() if key not in STAGE_DOC_FIELDS}
+
+    @staticmethod
+    def split_includes(includes: Optional[List[str]]) -> Tuple[Optional[List[str]], Optional[List[str]], bool]:
+        """
+        includes проекта -> includes заголовка, includes документа этапа (None — целиком)
+        и нужны ли этапы вообще.
+        """
+        if includes is None:
+            return None, None, True
+        header: List[str] = []
+        stage: Optional[List[str]] = []
+        for field in includes:
+            if field == "work_stages":
+                stage = None
+            elif field.startswith("work_stages."):
+                if stage is not None:
+                    stage.append(field[len("work_stages."):])
+            else:
+                header.append(field)
+        with_stages = stage is None or bool(stage)
+        return header, stage, with_stages
+
+    async def _get_header(self, project_id: str, includes: Optional[List[str]] = None) -> Optional[Dict[str, Any]]:
+        params: Dict[str, Any] = {"_source_includes": includes} if includes is not None else {}
+        try:
+            return await self.client.get(index=self.index, id=project_id, request_timeout=self.timeout, **params)
+        except NotFoundError:
+            return None
+
+    async def _mget_stages(
+        self,
+        project_id: str,
+        refs: List[Dict[str, Any]],
+        includes: Optional[List[str]] = None,
+        excludes: Optional[List[str]] = None,
+    ) -> List[Optional[Dict[str, Any]]]:
+        """
+        Документы этапов по ссылкам (realtime mget, один шард — routing); None — документа нет
+        или его ревизия не совпадает со ссылкой.
+        """
+        if not refs:
+            return []
+        source: Dict[str, Any] = {}
+        if includes is not None:
+            # ревизия нужна, чтобы сверить документ со ссылкой заголовка
+            source["includes"] = includes + [REVISION_FIELD]
+        if excludes:
+            source["excludes"] = excludes
+        docs = []
+        for ref in refs:
+            doc: Dict[str, Any] = {"_index": self.stages_index, "_id": ref["doc"], "routing": project_id}
+            if source:
+                doc["_source"] = source
+            docs.append(doc)
+        resp = await self.client.mget(docs=docs, request_timeout=self.timeout)
+        return [
+            doc if doc.get("found") and doc["_source"].get(REVISION_FIELD) == ref.get(REVISION_FIELD) else None
+            for doc, ref in zip(resp["docs"], refs)
+        ]
+
+    async def _read_header_and_stages(
+        self,
+        project_id: str,
+        header_includes: Optional[List[str]],
+        select: Callable[[List[Dict[str, Any]]], List[Dict[str, Any]]],
+        stage_includes: Optional[List[str]] = None,
+        stage_excludes: Optional[List[str]] = None,
+    ) -> Optional[Tuple[Dict[str, Any], List[Dict[str, Any]], List[Optional[Dict[str, Any]]]]]:
+        """
+        Заголовок, выбранные select ссылки его этапов и их документы (None — документа нет).
+        Документа нет, если следующая запись уже сменила заголовок и удалила старые документы:
+        тогда заголовок перечитывается. Если заголовок не менялся, а документа всё равно нет,
+        повторять бесполезно — возвращается как есть. None — проекта нет.
+        """
+        if header_includes is not None:
+            header_includes = header_includes + [STAGE_REFS_FIELD]
+        previous = None
+        for _ in range(SPLIT_READ_RETRIES):
+            got = await self._get_header(project_id, header_includes)
+            if got is None:
+                return None
+            refs = select(got["_source"].get(STAGE_REFS_FIELD) or [])
+            docs = await self._mget_stages(project_id, refs, stage_includes, stage_excludes)
+            if all(doc is not None for doc in docs) or got["_seq_no"] == previous:
+                break
+            previous = got["_seq_no"]
+        missing = [ref["doc"] for ref, doc in zip(refs, docs) if doc is None]
+        if missing:
+            logger.error(f"Project {project_id} references missing stage documents: {missing}")
+        return got, refs, docs
+
+    async def _attach_stages(
+        self, project_id: str, src: Dict[str, Any], includes: Optional[List[str]] = None
+    ) -> Dict[str, Any]:
+        """
+        Заменяет stage_refs заголовка деревом этапов (только поля includes этапа) — для уже
+        прочитанного заголовка (scan), без перечитывания.
+        """
+        refs = src.pop(STAGE_REFS_FIELD, None) or []
+        src.pop(REVISION_FIELD, None)
+        docs = await self._mget_stages(project_id, refs, includes)
+        src["work_stages"] = [self.stage_from_doc(doc) for doc in docs if doc is not None]
+        return src
+
+    async def _get_project_source(
+        self, project_id: str, includes: Optional[List[str]] = None
+    ) -> Optional[Dict[str, Any]]:
+        header_includes, stage_includes, with_stages = self.split_includes(includes)
+        if not with_stages:
+            got = await self._get_header(project_id, header_includes)
+            if got is not None:
+                got["_source"].pop(STAGE_REFS_FIELD, None)
+            return got
+        read = await self._read_header_and_stages(project_id, header_includes, lambda refs: refs, stage_includes)
+        if read is None:
+            return None
+        got, _, docs = read
+        got["_source"].pop(STAGE_REFS_FIELD, None)
+        got["_source"].pop(REVISION_FIELD, None)
+        got["_source"]["work_stages"] = [self.stage_from_doc(doc) for doc in docs if doc is not None]
+        return got
+
+    async def _get_stages(
+        self,
+        project_id: str,
+        fields: Optional[List[str]] = None,
+        exclude: Optional[List[str]] = None,
+        stage_id: Optional[str] = None,
+        work_kind_id: Optional[str] = None,
+    ) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+        """
+        Этапы проекта с запрошенными полями: stage_id выбирается по stage_refs заголовка,
+        work_kind_id — из прочитанных документов этапов. Версия — версия заголовка:
+        каждая запись дерева его переписывает.
+        """
+        includes, excludes = self.stage_source_filter(fields, exclude)
+        stage_includes = [field[len("work_stages."):] for field in includes] if includes is not None else None
+        if work_kind_id is not None and stage_includes is not None:
+            stage_includes.append("work_kinds.work_kind_id")
+        stage_excludes = [field[len("work_stages."):] for field in excludes]
+        read = await self._read_header_and_stages(
+            project_id,
+            ["project_id", "foreman_id"],
+            lambda refs: [ref for ref in refs if stage_id is None or ref.get("stage_id") == stage_id],
+            stage_includes,
+            stage_excludes,
+        )
+        if read is None:
+            return None, None
+        got, _, docs = read
+        src = got["_source"]
+        src.pop(STAGE_REFS_FIELD, None)
+        stages = []
+        for doc in docs:
+            if doc is None:
+                continue
+            stage = self.stage_from_doc(doc)
+            if work_kind_id is not None:
+                kinds = [wk for wk in stage.get("work_kinds") or [] if wk.get("work_kind_id") == work_kind_id]
+                if not kinds:
+                    continue
+                stage["work_kinds"] = kinds
+            stages.append(stage)
+        return {**src, "work_stages": stages}, self.document_version(got)
+
+    async def _read_project_for_write(
+        self,
+        project_id: str,
+        positions: Optional[List[int]] = None,
+        header_includes: Optional[List[str]] = None,
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Заголовок (целиком или только header_includes) и документы этапов на позициях
+        positions (без них — все) для последующей _write_project. None — проекта нет.
+        """
+        if header_includes is not None:
+            header_includes = header_includes + [REVISION_FIELD]
+        selected: List[int] = []
+
+        def select(refs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+            selected[:] = range(len(refs)) if positions is None else [i for i in positions if 0 <= i < len(refs)]
+            return [refs[i] for i in selected]
+
+        read = await self._read_header_and_stages(project_id, header_includes, select)
+        if read is None:
+            return None
+        got, refs, docs = read
+        if any(doc is None for doc in docs):
+            # заголовок фиксируется только после своих этапов: значит, документы удалены извне
+            raise RuntimeError(f"Project {project_id} stage documents are missing")
+        return {
+            "header": got,
+            "full": header_includes is None,
+            "stages": {i: self.stage_from_doc(doc) for i, doc in zip(selected, docs)},
+        }
+
+    @staticmethod
+    def assemble_project(read: Dict[str, Any]) -> Dict[str, Any]:
+        """Документ проекта из полного чтения _read_project_for_write (все этапы)."""
+        src = {
+            key: value for key, value in read["header"]["_source"].items()
+            if key not in (STAGE_REFS_FIELD, REVISION_FIELD)
+        }
+        src["work_stages"] = [read["stages"][i] for i in sorted(read["stages"])]
+        return src
+
+    async def _write_project(
+        self,
+        project_id: str,
+        header: Dict[str, Any],
+        stages: List[Tuple[Dict[str, Any], Dict[str, Any]]],
+        deleted: Iterable[Dict[str, Any]] = (),
+        read: Optional[Dict[str, Any]] = None,
+    ) -> Dict[str, Any]:
+        """
+        Новые документы этапов stages [(ссылка, документ)], затем заголовок — точка фиксации
+        записи, затем удаление документов по ссылкам deleted, которые заголовку больше не нужны.
+        С read заголовок пишется с if_seq_no прочитанной версии (ConflictError — перечитать
+        и повторить): целиком, если он и читался целиком, иначе — только поля header.
+        Без read — перезапись проекта целиком. Заголовок не записан — новые документы
+        этапов удаляются: на них никто не ссылается.
+        """
+        written = [ref for ref, _ in stages]
+        if stages:
+            operations: List[Dict[str, Any]] = []
+            for ref, document in stages:
+                operations.append({"index": {"_index": self.stages_index, "_id": ref["doc"], "routing": project_id}})
+                operations.append(document)
+            # этапы ищутся только mget по id: refresh им не нужен
+            bulk = await self.client.bulk(operations=operations, request_timeout=self.timeout)
+            if bulk.get("errors"):
+                failed = [info for item in bulk["items"] for info in item.values() if info.get("error")]
+                logger.error(f"Project stages bulk errors: {failed}")
+                await self._delete_stage_docs(project_id, written)
+                raise RuntimeError("Failed to write project stages")
+
+        params: Dict[str, Any] = {"refresh": "wait_for", "request_timeout": self.timeout}
+        try:
+            if read is None:
+                resp = await self.client.index(index=self.index, id=project_id, document=header, **params)
+            else:
+                params.update(if_seq_no=read["header"]["_seq_no"], if_primary_term=read["header"]["_primary_term"])
+                if read["full"]:
+                    resp = await self.client.index(index=self.index, id=project_id, document=header, **params)
+                else:
+                    resp = await self.client.update(index=self.index, id=project_id, doc=header, **params)
+        except Exception:
+            await self._delete_stage_docs(project_id, written)
+            raise
+        await self._delete_stage_docs(project_id, deleted)
+        return resp
+
+    async def _delete_stage_docs(self, project_id: str, refs: Iterable[Dict[str, Any]]) -> None:
+        """
+        Удаляет документы этапов, на которые не ссылается заголовок. Ошибка только пишется
+        в лог: оставшийся документ ни на что не влияет, читатели его не увидят.
+        """
+        operations = [
+            {"delete": {"_index": self.stages_index, "_id": ref["doc"], "routing": project_id}} for ref in refs
+        ]
+        if not operations:
+            return
+        try:
+            bulk = await self.client.bulk(operations=operations, request_timeout=self.timeout)
+        except Exception as e:
+            logger.error(f"Project stages delete failed: {e}")
+            return
+        if bulk.get("errors"):
+            failed = [
+                info for item in bulk["items"] for info in item.values()
+                if info.get("error") and info.get("status") != 404
+            ]
+            if failed:
+                logger.error(f"Project stages delete errors: {failed}")
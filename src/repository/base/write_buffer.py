@@ -0,0 +1,90 @@
+import asyncio
+import time
+import weakref
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from core.metrics import metrics
+
+# все буферы процесса, чтобы сбросить их при остановке приложения
+write_buffers: "weakref.WeakSet[CoalescingWriteBuffer]" = weakref.WeakSet()
+
+
+class CoalescingWriteBuffer:
+    """
+    Копит операции записи не дольше window_ms (или до max_batch штук) и отдаёт их
+    одной пачкой в flush. submit возвращает результат своей операции только после
+    того, как flush всей пачки завершился, — ответ клиенту означает подтверждённую запись.
+    """
+
+    def __init__(
+        self,
+        flush: Callable[[List[Dict[str, Any]]], Awaitable[List[Dict[str, Any]]]],
+        window_ms: int,
+        max_batch: int,
+        metrics_prefix: str,
+    ):
+        self.flush = flush
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self.metrics_prefix = metrics_prefix
+        self._pending: List[Tuple[Dict[str, Any], asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._flushes: Set[asyncio.Task] = set()
+        write_buffers.add(self)
+
+    async def submit(self, operation: Dict[str, Any]) -> Dict[str, Any]:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((operation, future))
+        if len(self._pending) >= self.max_batch:
+            self._start_flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._start_flush)
+        return await future
+
+    def _start_flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+        task = asyncio.ensure_future(self._flush(batch))
+        self._flushes.add(task)
+        task.add_done_callback(self._flushes.discard)
+
+    async def _flush(self, batch: List[Tuple[Dict[str, Any], asyncio.Future]]) -> None:
+        started = time.perf_counter()
+        results: Optional[List[Dict[str, Any]]] = None
+        error: BaseException = RuntimeError("Write buffer flush returned no result for the operation")
+        try:
+            results = await self.flush([operation for operation, _ in batch])
+        except Exception as e:
+            metrics.incr(f"{self.metrics_prefix}.flush_errors")
+            error = e
+        except BaseException:
+            # отмена (остановка воркера): отправителям — ошибка, сама отмена идёт дальше
+            metrics.incr(f"{self.metrics_prefix}.flush_errors")
+            error = RuntimeError("Write buffer flush was interrupted")
+            raise
+        finally:
+            metrics.observe(f"{self.metrics_prefix}.batch_size", len(batch))
+            metrics.observe(f"{self.metrics_prefix}.flush_seconds", time.perf_counter() - started)
+            # ответ получает каждый отправитель, даже если результатов меньше, чем операций
+            for (_, future), result in zip(batch, results or []):
+                if not future.done():
+                    future.set_result(result)
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(error)
+
+    async def drain(self) -> None:
+        """Сбрасывает накопленное и ждёт незавершённые flush (остановка приложения)."""
+        self._start_flush()
+        if self._flushes:
+            await asyncio.gather(*self._flushes, return_exceptions=True)
+
+
+async def drain_write_buffers() -> None:
+    for buffer in list(write_buffers):
+        await buffer.drain()
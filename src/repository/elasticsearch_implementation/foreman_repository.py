@@ -1,305 +1,587 @@
 from datetime import datetime, timezone
 from functools import lru_cache
-from typing import Any, Dict, List
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
 
 import elasticsearch
 from elasticsearch._async.client import AsyncElasticsearch
 from fastapi import Depends
+from loguru import logger
+from redis.exceptions import RedisError
 
+from common.exceptions.not_found import NotFoundException
 from core.environment_config import settings
+from core.metrics import metrics
 from db.elastic.connection import get_elastic_client
+from repository.abc.active_shift_repository import ABCActiveShiftRepository
 from repository.abc.foreman_repository import ABCForemanRepository
-from repository.base.elastic_repository import BaseElasticRepository
+from repository.abc.project_rollup_repository import ABCProjectRollupRepository
+from repository.base.elastic_repository import (
+    PATH_INDEX_FIELD,
+    PROJECT_ROLLUP_FIELDS,
+    PROJECTS_PAGE_SIZE,
+    SHIFT_EVENT_START,
+    SHIFT_EVENT_STOP,
+    BaseElasticRepository,
+)
+from repository.base.split_layout import (
+    REVISION_FIELD,
+    STAGE_REFS_FIELD,
+    STORAGE_LAYOUT_SPLIT,
+    SplitLayoutMixin,
+)
+from repository.base.write_buffer import CoalescingWriteBuffer
+from repository.elasticsearch_implementation.project_rollup_repository import get_project_rollup_repository
+from repository.redis_implementation.active_shift_repository import (
+    EMPTY_STATE_SEQ_NO,
+    get_active_shift_redis_repository,
+)
+
+# Сколько раз перечитывать состояние смен при конфликте версий
+SHIFT_STATE_MAX_RETRIES = 5
+
+# Добавление ссылок на отчёты по индексам из path_index; если по пути лежит другая подзадача — noop
+ADD_REPORT_LINKS_SCRIPT = """
+def p = params.path;
+def sub = ctx._source.work_stages[p[0]].work_kinds[p[1]].work_types[p[2]].tasks[p[3]].subtasks[p[4]];
+if (sub.subtask_id != params.subtask_id) { ctx.op = 'noop'; return; }
+if (sub.reportLinks == null) { sub.reportLinks = new ArrayList(); }
+sub.reportLinks.addAll(params.links);
+"""
 
 
 class ElasticForemanRepository(ABCForemanRepository, BaseElasticRepository):
-    def __init__(self, client: AsyncElasticsearch, index: str, timeout: int = 30):
+    def __init__(
+            self,
+            client: AsyncElasticsearch,
+            index: str,
+            events_index: str,
+            state_index: str,
+            timeout: int = 30,
+            active_shifts: Optional[ABCActiveShiftRepository] = None,
+            write_buffer_ms: int = 0,
+            write_buffer_max_batch: int = 200,
+            rollups: Optional[ABCProjectRollupRepository] = None,
+    ):
         self.client = client
         self.index = index
+        self.events_index = events_index
+        self.state_index = state_index
         self.timeout = timeout
+        self.active_shifts = active_shifts
+        self.write_buffer_ms = write_buffer_ms
+        self.write_buffer_max_batch = write_buffer_max_batch
+        self._write_buffer: Optional[CoalescingWriteBuffer] = None
+        self.rollups = rollups
 
-    async def get_projects(self, foreman_id: str) -> List[Dict[str, Any]]:
-        resp = await self.client.search(
-            index=self.index,
-            size=100,
-            query={"term": {"foreman_id": foreman_id}},
-            _source=["project_id", "project_name"],
-            request_timeout=self.timeout,
-        )
-        return [hit["_source"] for hit in resp["hits"]["hits"]]
-
-    async def get_tasks(self, foreman_id: str, project_id: str) -> List[Dict[str, Any]]:
-        resp = await self.client.search(
-            index=self.index,
-            size=100,
-            query={
-                "bool": {
-                    "must": [
-                        {"term": {"foreman_id": foreman_id}},
-                        {"term": {"project_id": project_id}},
-                    ]
-                }
-            },
-            _source=["work_stages"],
-            request_timeout=self.timeout,
-        )
-        results = []
-        for hit in resp["hits"]["hits"]:
-            ws = hit["_source"].get("work_stages", [])
-            for stage in ws:
-                results.append(stage)
-        return results
+    async def get_projects(
+            self,
+            foreman_id: str,
+            status: Optional[str] = None,
+            name_prefix: Optional[str] = None,
+            cursor: Optional[str] = None,
+            limit: int = PROJECTS_PAGE_SIZE,
+            use_pit: bool = False,
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        filters = self.projects_filters(foreman_id=foreman_id, status=status, name_prefix=name_prefix)
+        return await self._projects_page(filters, cursor, limit, use_pit)
+
+    async def get_tasks(
+            self,
+            foreman_id: str,
+            project_id: str,
+            fields: Optional[List[str]] = None,
+            exclude: Optional[List[str]] = None,
+            stage_id: Optional[str] = None,
+            work_kind_id: Optional[str] = None,
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        # project_id — это _id документа: без фильтров realtime get видит последние записи без refresh
+        src, version = await self._get_stages(project_id, fields, exclude, stage_id, work_kind_id)
+        if src is None or src.get("foreman_id") != foreman_id:
+            return [], None
+        return list(src.get("work_stages") or []), version
+
+    async def search_tasks(
+            self,
+            foreman_id: str,
+            text: str,
+            project_id: Optional[str] = None,
+            cursor: Optional[str] = None,
+            limit: int = 20,
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        filters = self.projects_filters(foreman_id=foreman_id, project_ids=[project_id] if project_id else None)
+        return await self._search_tasks(text, filters, cursor, limit)
+
+    async def get_project_version(self, project_id: str, foreman_id: Optional[str] = None) -> Optional[str]:
+        return await self._get_project_version(project_id, foreman_id)
+
+    async def start_shift(
+            self, foreman_id: str, project_id: str, task_ids: List[str], subtask_ids: List[str]
+    ) -> Optional[int]:
+        return await self._submit_shift(foreman_id, project_id, task_ids, subtask_ids, SHIFT_EVENT_START)
+
+    async def stop_shift(
+            self, foreman_id: str, project_id: str, task_ids: List[str], subtask_ids: List[str]
+    ) -> Optional[int]:
+        return await self._submit_shift(foreman_id, project_id, task_ids, subtask_ids, SHIFT_EVENT_STOP)
+
+    async def _submit_shift(
+            self, foreman_id: str, project_id: str, task_ids: List[str], subtask_ids: List[str], event: str
+    ) -> Optional[int]:
+        """
+        С включённым буфером (write_buffer_ms > 0) старт/стоп ждут общей пачки и пишутся
+        через _bulk_shift вместе с операциями других прорабов; иначе — сразу _toggle_shift.
+        Нет проекта или он не этого прораба — NotFoundException.
+        """
+        if self.write_buffer_ms <= 0:
+            return await self._toggle_shift(foreman_id, project_id, task_ids, subtask_ids, event)
+        if self._write_buffer is None:
+            self._write_buffer = CoalescingWriteBuffer(
+                self._bulk_shift, self.write_buffer_ms, self.write_buffer_max_batch, "shift_write_buffer"
+            )
+        result = await self._write_buffer.submit({
+            "foreman_id": foreman_id,
+            "project_id": project_id,
+            "action": event,
+            "task_ids": task_ids,
+            "subtask_ids": subtask_ids,
+        })
+        if result["result"] == "not_found":
+            raise NotFoundException("Project not found", project_id=project_id)
+        if result["result"] == "conflict":
+            raise elasticsearch.ConflictError(
+                "Shift state was modified concurrently", meta=None, body={"project_id": project_id}
+            )
+        if result["result"] == "error":
+            raise RuntimeError("Failed to write shift state")
+        return result["seq_no"]
 
-    async def start_shift(self, foreman_id: str, project_id: str, task_ids: List[str], subtask_ids: List[str]) -> None:
-        now = datetime.now(timezone.utc).isoformat()
-        body = {
-            "query": {
-                "bool": {
-                    "must": [
-                        {"term": {"foreman_id": foreman_id}},
-                        {"term": {"project_id": project_id}},
-                    ]
-                }
-            },
-            "script": {
-                "source": """
-                    boolean updated = false;
-            
-                    if (ctx._source.work_stages != null) {
-                        for (stage in ctx._source.work_stages) {
-                            if (stage.work_kinds != null && !stage.work_kinds.isEmpty()) {
-                                for (wkind in stage.work_kinds) {
-                                    if (wkind.work_types != null && !wkind.work_types.isEmpty()) {
-                                        for (wtype in wkind.work_types) {
-                                            if (wtype.tasks != null && !wtype.tasks.isEmpty()) {
-                                                for (task in wtype.tasks) {
-                                                    // Обработка задач
-                                                    if (params.task_ids.contains(task.task_id)) {
-                                                        if (task.time_intervals == null) {
-                                                            task.time_intervals = [];
-                                                        }
-                                                        // Проверяем, есть ли активный интервал
-                                                        boolean hasActiveInterval = false;
-                                                        if (!task.time_intervals.isEmpty()) {
-                                                            def lastInterval = task.time_intervals.get(task.time_intervals.size() - 1);
-                                                            if (lastInterval.end_time == null) {
-                                                                hasActiveInterval = true;
-                                                            }
-                                                        }
-                                                        if (!hasActiveInterval) {
-                                                            def newInterval = [
-                                                                'start_time': params.now,
-                                                                'end_time': null,
-                                                                'status': 'active'
-                                                            ];
-                                                            task.time_intervals.add(newInterval);
-                                                            updated = true;
-                                                        }
-                                                    }
-
-                                                    // Обработка подзадач
-                                                    if (task.subtasks != null && !task.subtasks.isEmpty()) {
-                                                        for (sub in task.subtasks) {
-                                                            if (params.subtask_ids.contains(sub.subtask_id)) {
-                                                                if (sub.time_intervals == null) {
-                                                                    sub.time_intervals = [];
-                                                                }
-                                                                // Проверяем, есть ли активный интервал
-                                                                boolean hasActiveSubInterval = false;
-                                                                if (!sub.time_intervals.isEmpty()) {
-                                                                    def lastSubInterval = sub.time_intervals.get(sub.time_intervals.size() - 1);
-                                                                    if (lastSubInterval.end_time == null) {
-                                                                        hasActiveSubInterval = true;
-                                                                    }
-                                                                }
-                                                                if (!hasActiveSubInterval) {
-                                                                    def newSubInterval = [
-                                                                        'start_time': params.now,
-                                                                        'end_time': null,
-                                                                        'status': 'active'
-                                                                    ];
-                                                                    sub.time_intervals.add(newSubInterval);
-                                                                    updated = true;
-                                                                }
-                                                            }
-                                                        }
-                                                    }
-                                                }
-                                            }
-                                        }
-                                    }
-                                }
-                            }
-                        }
-                    }
-            
-                    if (!updated) {
-                        ctx.op = 'noop';
-                    }
-                """,
-                "params": {"task_ids": task_ids, "subtask_ids": subtask_ids, "now": now},
-                "lang": "painless"
-            }
+    async def close(self) -> None:
+        if self._write_buffer is not None:
+            await self._write_buffer.drain()
 
-        }
+    @staticmethod
+    def shift_state_id(foreman_id: str, project_id: str) -> str:
+        return f"{project_id}:{foreman_id}"
 
+    async def _get_shift_state(self, foreman_id: str, project_id: str) -> Dict[str, Any]:
+        """Realtime get документа состояния смен прораба по проекту вместе с _seq_no/_primary_term."""
         try:
-            await self.client.update_by_query(
-                index=self.index,
-                body=body,
-                refresh=True
+            return await self.client.get(
+                index=self.state_index,
+                id=self.shift_state_id(foreman_id, project_id),
+                request_timeout=self.timeout,
             )
-        except Exception as e:
-            print(f"Elasticsearch error: {e}")
-            raise
-
-    async def stop_shift(self, foreman_id: str, project_id: str, task_ids: List[str], subtask_ids: List[str]) -> None:
-        now = datetime.now(timezone.utc).isoformat()
-        body = {
-            "query": {
-                "bool": {
-                    "must": [
-                        {"term": {"foreman_id": foreman_id}},
-                        {"term": {"project_id": project_id}},
-                    ]
-                }
-            },
-            "script": {
-                "source": """
-                    boolean updated = false;
-            
-                    if (ctx._source.work_stages != null) {
-                        for (stage in ctx._source.work_stages) {
-                            if (stage.work_kinds != null && !stage.work_kinds.isEmpty()) {
-                                for (wkind in stage.work_kinds) {
-                                    if (wkind.work_types != null && !wkind.work_types.isEmpty()) {
-                                        for (wtype in wkind.work_types) {
-                                            if (wtype.tasks != null && !wtype.tasks.isEmpty()) {
-                                                for (task in wtype.tasks) {
-                                                    // Обработка задач
-                                                    if (params.task_ids.contains(task.task_id)) {
-                                                        if (task.time_intervals != null && !task.time_intervals.isEmpty()) {
-                                                            def lastTaskInterval = task.time_intervals.get(task.time_intervals.size() - 1);
-                                                            if (lastTaskInterval.end_time == null) {
-                                                                lastTaskInterval.end_time = params.now;
-                                                                lastTaskInterval.status = 'closed';
-                                                                updated = true;
-                                                            }
-                                                        }
-                                                    }
-
-                                                    // Обработка подзадач
-                                                    if (task.subtasks != null && !task.subtasks.isEmpty()) {
-                                                        for (sub in task.subtasks) {
-                                                            if (params.subtask_ids.contains(sub.subtask_id)) {
-                                                                if (sub.time_intervals != null && !sub.time_intervals.isEmpty()) {
-                                                                    def lastSubInterval = sub.time_intervals.get(sub.time_intervals.size() - 1);
-                                                                    if (lastSubInterval.end_time == null) {
-                                                                        lastSubInterval.end_time = params.now;
-                                                                        lastSubInterval.status = 'closed';
-                                                                        updated = true;
-                                                                    }
-                                                                }
-                                                            }
-                                                        }
-                                                    }
-                                                }
-                                            }
-                                        }
-                                    }
-                                }
-                            }
-                        }
-                    }
-            
-                    if (!updated) {
-                        ctx.op = 'noop';
-                    }
-                """,
-                "params": {"task_ids": task_ids, "subtask_ids": subtask_ids, "now": now},
-                "lang": "painless"
-    }
+        except elasticsearch.exceptions.NotFoundError:
+            return {"_source": {}, "_seq_no": None, "_primary_term": None}
+
+    async def _cache_shift_state(
+            self, foreman_id: str, project_id: str, seq_no: Optional[int], active: List[str]
+    ) -> None:
+        """Копирует состояние смен в Redis; ошибка Redis не ломает запись в ES."""
+        if self.active_shifts is None:
+            return
+        try:
+            await self.active_shifts.set_state(
+                foreman_id, project_id, EMPTY_STATE_SEQ_NO if seq_no is None else seq_no, active
+            )
+        except RedisError as e:
+            logger.warning(f"Redis error: {e}")
 
+    async def _rollup_shift_states(self, states: List[Dict[str, Any]]) -> None:
+        """Активные задачи из записанных состояний смен — в сводки прогресса проектов."""
+        if self.rollups is not None and states:
+            await self.rollups.write_active(states)
+
+    async def _get_toggle_targets(
+            self, foreman_id: str, project_id: str, target_keys: List[str]
+    ) -> Optional[Dict[str, Dict[str, Any]]]:
+        """
+        Запрошенные задачи/подзадачи проекта по path_index: читаются только их записи,
+        а не всё дерево. Для документов без path_index — разбор скелета проекта.
+        """
+        got = await self._get_path_entries(project_id, target_keys)
+        if got is None or got["_source"].get("foreman_id") != foreman_id:
+            return None
+        entries = got["_source"].get(PATH_INDEX_FIELD)
+        if entries is None:
+            if not target_keys:
+                return {}
+            return await self._get_project_targets(project_id, foreman_id)
+        return self._path_entries_to_targets(entries)
+
+    @staticmethod
+    def _path_entries_to_targets(entries: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+        return {
+            key: {"type": key.split(":", 1)[0], "task_id": entry.get("task_id"), "subtask_id": entry.get("subtask_id")}
+            for key, entry in entries.items()
         }
 
+    @classmethod
+    def requested_target_keys(cls, task_ids: List[str], subtask_ids: List[str]) -> List[str]:
+        requested = [cls.shift_target_key("task", task_id) for task_id in task_ids]
+        requested += [cls.shift_target_key("subtask", subtask_id) for subtask_id in subtask_ids]
+        return list(dict.fromkeys(requested))
+
+    def _apply_shift_event(
+            self,
+            foreman_id: str,
+            project_id: str,
+            active: Dict[str, Dict[str, Any]],
+            targets: Dict[str, Dict[str, Any]],
+            requested: List[str],
+            event: str,
+            now: str,
+    ) -> List[Dict[str, Any]]:
+        """
+        Применяет start/stop к набору активных задач (на месте) и возвращает события
+        для изменившихся задач. Старт пропускается для уже активных задач, стоп — для неактивных.
+        """
+        events = []
+        for key in requested:
+            if key not in targets or (key in active) == (event == SHIFT_EVENT_START):
+                continue
+            start_time = None
+            if event == SHIFT_EVENT_START:
+                active[key] = {"target_key": key, "start_time": now}
+            else:
+                start_time = active.pop(key)["start_time"]
+            target = targets[key]
+            events.append(self.make_shift_event(
+                foreman_id=foreman_id,
+                project_id=project_id,
+                target_type=target["type"],
+                task_id=target.get("task_id"),
+                subtask_id=target.get("subtask_id"),
+                event=event,
+                timestamp=now,
+                start_time=start_time,
+            ))
+        return events
+
+    @staticmethod
+    def _shift_state_doc(
+            foreman_id: str,
+            project_id: str,
+            active: Dict[str, Dict[str, Any]],
+            now: str,
+            events: List[Dict[str, Any]],
+    ) -> Dict[str, Any]:
+        return {
+            "project_id": project_id,
+            "foreman_id": foreman_id,
+            "active": list(active.values()),
+            "updated_at": now,
+            # события перехода, записавшего эту версию: пишутся в индекс событий после неё
+            # и досылаются повторно (create по детерминированному _id), если та запись не дошла
+            "pending_events": events,
+        }
+
+    @staticmethod
+    def _pending_events(state: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """События из документа состояния с его _seq_no — для повторной записи."""
+        if state["_seq_no"] is None:
+            return []
+        return [
+            {**shift_event, "state_seq_no": state["_seq_no"]}
+            for shift_event in state["_source"].get("pending_events") or []
+        ]
+
+    async def _write_pending_events(self, events: List[Dict[str, Any]]) -> None:
+        """
+        Пишет события после записи состояния. Ошибка не возвращается клиенту: состояние
+        уже записано вместе с pending_events, и события дошлёт следующий переход
+        или чтение истории с min_seq_no (_replay_pending_events).
+        """
         try:
-            await self.client.update_by_query(
-                index=self.index,
-                body=body,
-                refresh=True
-            )
+            await self._write_shift_events(events)
         except Exception as e:
-            print(f"Elasticsearch error: {e}")
-            raise
+            metrics.incr("shift_events.deferred")
+            logger.error(f"Elasticsearch error: {e}")
 
-    async def get_shift_history(self, foreman_id: str, project_id: str) -> List[Dict[str, Any]]:
-        resp = await self.client.search(
-            index=self.index,
-            size=50,
-            query={
-                "bool": {
-                    "must": [
-                        {"term": {"foreman_id": foreman_id}},
-                        {"term": {"project_id": project_id}},
-                    ]
-                }
-            },
-            _source=[
-                "project_id",
-                "project_name",
-                "work_stages.work_kinds.work_types.tasks.task_id",
-                "work_stages.work_kinds.work_types.tasks.task_name",
-                "work_stages.work_kinds.work_types.tasks.time_intervals",
-                "work_stages.work_kinds.work_types.tasks.subtasks.subtask_id",
-                "work_stages.work_kinds.work_types.tasks.subtasks.subtask_name",
-                "work_stages.work_kinds.work_types.tasks.subtasks.time_intervals",
-                "work_stages.work_kinds.work_types.work_type_id",
-                "work_stages.work_kinds.work_types.work_type_name",
-                "work_stages.work_kinds.work_kind_id",
-                "work_stages.work_kinds.work_kind_name",
-            ],
+    async def _replay_pending_events(self, foreman_id: str, project_id: str) -> None:
+        state = await self._get_shift_state(foreman_id, project_id)
+        await self._write_shift_events(self._pending_events(state))
+
+    async def _toggle_shift(
+            self,
+            foreman_id: str,
+            project_id: str,
+            task_ids: List[str],
+            subtask_ids: List[str],
+            event: str,
+    ) -> Optional[int]:
+        """
+        Меняет набор активных задач в документе состояния смен (_update по id с
+        if_seq_no/if_primary_term и повтором при конфликте). События start/stop записываются
+        в тот же документ (pending_events), а затем в индекс событий — вместе с событиями
+        предыдущей версии на случай, если их запись тогда не дошла.
+        Возвращает _seq_no состояния, которого можно дождаться при чтении истории.
+        """
+        requested = self.requested_target_keys(task_ids, subtask_ids)
+        targets = await self._get_toggle_targets(foreman_id, project_id, requested)
+        if targets is None:
+            raise NotFoundException("Project not found", project_id=project_id)
+
+        for _ in range(SHIFT_STATE_MAX_RETRIES):
+            state = await self._get_shift_state(foreman_id, project_id)
+            active = {item["target_key"]: item for item in state["_source"].get("active") or []}
+            now = datetime.now(timezone.utc).isoformat()
+            events = self._apply_shift_event(foreman_id, project_id, active, targets, requested, event, now)
+            if not events:
+                await self._cache_shift_state(foreman_id, project_id, state["_seq_no"], list(active))
+                return state["_seq_no"]
+
+            doc = self._shift_state_doc(foreman_id, project_id, active, now, events)
+            try:
+                if state["_seq_no"] is None:
+                    resp = await self.client.create(
+                        index=self.state_index,
+                        id=self.shift_state_id(foreman_id, project_id),
+                        document=doc,
+                        request_timeout=self.timeout,
+                    )
+                else:
+                    resp = await self.client.update(
+                        index=self.state_index,
+                        id=self.shift_state_id(foreman_id, project_id),
+                        doc=doc,
+                        if_seq_no=state["_seq_no"],
+                        if_primary_term=state["_primary_term"],
+                        request_timeout=self.timeout,
+                    )
+            except elasticsearch.ConflictError:
+                continue
+            break
+        else:
+            raise elasticsearch.ConflictError(
+                "Shift state was modified concurrently", meta=None, body={"project_id": project_id}
+            )
+
+        await self._cache_shift_state(foreman_id, project_id, resp["_seq_no"], list(active))
+        await self._rollup_shift_states([
+            {"project_id": project_id, "foreman_id": foreman_id, "seq_no": resp["_seq_no"], "active": list(active)}
+        ])
+        replayed = self._pending_events(state)
+        await self._write_pending_events(
+            replayed + [{**shift_event, "state_seq_no": resp["_seq_no"]} for shift_event in events]
         )
+        return resp["_seq_no"]
 
-        return self.parse_shift_history(resp["hits"]["hits"])
+    async def bulk_shift(self, foreman_id: str, operations: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        return await self._bulk_shift([{**op, "foreman_id": foreman_id} for op in operations])
 
-    async def get_shift_status(self, foreman_id: str, project_id: str) -> str:
-        resp = await self.client.search(
-            index=self.index,
-            size=1,
-            query={
-                "bool": {
-                    "must": [
-                        {"term": {"foreman_id": foreman_id}},
-                        {"term": {"project_id": project_id}},
-                    ]
+    async def _bulk_shift(self, operations: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Старт/стоп смен пачкой операций (у каждой свой foreman_id и project_id). Операции одного
+        документа состояния применяются по порядку, все состояния пишутся одним _bulk
+        (с if_seq_no/if_primary_term; конфликтующие перечитываются и повторяются) вместе
+        с pending_events, события — вторым _bulk, как в _toggle_shift.
+        Результат — по элементу на каждую операцию.
+        """
+        results = [
+            {"project_id": op["project_id"], "action": op["action"], "result": None, "seq_no": None}
+            for op in operations
+        ]
+        ops_by_state: Dict[Tuple[str, str], List[int]] = {}
+        for i, op in enumerate(operations):
+            ops_by_state.setdefault((op["foreman_id"], op["project_id"]), []).append(i)
+        requested = {
+            i: self.requested_target_keys(op.get("task_ids") or [], op.get("subtask_ids") or [])
+            for i, op in enumerate(operations)
+        }
+
+        targets_by_state = await self._mget_toggle_targets({
+            state_key: list(dict.fromkeys(key for i in indices for key in requested[i]))
+            for state_key, indices in ops_by_state.items()
+        })
+        pending = []
+        for state_key, indices in ops_by_state.items():
+            if targets_by_state.get(state_key) is None:
+                for i in indices:
+                    results[i]["result"] = "not_found"
+            else:
+                pending.append(state_key)
+
+        written_events: List[Dict[str, Any]] = []
+        written_states: List[Dict[str, Any]] = []
+        for _ in range(SHIFT_STATE_MAX_RETRIES):
+            if not pending:
+                break
+            states = await self._mget_shift_states(pending)
+            now = datetime.now(timezone.utc).isoformat()
+            bulk_operations: List[Dict[str, Any]] = []
+            planned = []
+            for state_key in pending:
+                foreman_id, project_id = state_key
+                state = states[state_key]
+                active = {item["target_key"]: item for item in state["_source"].get("active") or []}
+                events = []
+                for i in ops_by_state[state_key]:
+                    event = SHIFT_EVENT_START if operations[i]["action"] == "start" else SHIFT_EVENT_STOP
+                    events += self._apply_shift_event(
+                        foreman_id, project_id, active, targets_by_state[state_key], requested[i], event, now
+                    )
+                if not events:
+                    self._set_bulk_results(results, ops_by_state[state_key], state["_seq_no"])
+                    await self._cache_shift_state(foreman_id, project_id, state["_seq_no"], list(active))
+                    continue
+                header: Dict[str, Any] = {
+                    "_index": self.state_index,
+                    "_id": self.shift_state_id(foreman_id, project_id),
+                }
+                if state["_seq_no"] is None:
+                    bulk_operations.append({"create": header})
+                else:
+                    header.update(if_seq_no=state["_seq_no"], if_primary_term=state["_primary_term"])
+                    bulk_operations.append({"index": header})
+                bulk_operations.append(self._shift_state_doc(foreman_id, project_id, active, now, events))
+                planned.append((state_key, state, active, events))
+
+            if not bulk_operations:
+                pending = []
+                break
+            resp = await self.client.bulk(operations=bulk_operations, request_timeout=self.timeout)
+            pending = []
+            for item, (state_key, state, active, events) in zip(resp["items"], planned):
+                (info,) = item.values()
+                if info.get("status") == 409:
+                    pending.append(state_key)
+                    continue
+                if info.get("error"):
+                    logger.error(f"Shift state bulk error for {state_key}: {info['error']}")
+                    for i in ops_by_state[state_key]:
+                        results[i]["result"] = "error"
+                    continue
+                written_events += self._pending_events(state)
+                written_events += [{**shift_event, "state_seq_no": info["_seq_no"]} for shift_event in events]
+                self._set_bulk_results(results, ops_by_state[state_key], info["_seq_no"])
+                await self._cache_shift_state(*state_key, info["_seq_no"], list(active))
+                written_states.append({
+                    "project_id": state_key[1],
+                    "foreman_id": state_key[0],
+                    "seq_no": info["_seq_no"],
+                    "active": list(active),
+                })
+
+        for state_key in pending:
+            for i in ops_by_state[state_key]:
+                results[i]["result"] = "conflict"
+        await self._rollup_shift_states(written_states)
+        await self._write_pending_events(written_events)
+        return results
+
+    @staticmethod
+    def _set_bulk_results(results: List[Dict[str, Any]], indices: List[int], seq_no: Optional[int]) -> None:
+        for i in indices:
+            results[i]["result"] = "shift started" if results[i]["action"] == "start" else "shift stopped"
+            results[i]["seq_no"] = seq_no
+
+    async def _mget_toggle_targets(
+            self, requested_by_state: Dict[Tuple[str, str], List[str]]
+    ) -> Dict[Tuple[str, str], Optional[Dict[str, Dict[str, Any]]]]:
+        """_get_toggle_targets для нескольких пар (foreman_id, project_id) одним mget."""
+        resp = await self.client.mget(
+            docs=[
+                {
+                    "_index": self.index,
+                    "_id": project_id,
+                    "_source": {"includes": ["foreman_id"] + [f"{PATH_INDEX_FIELD}.{key}" for key in keys]},
                 }
-            },
-            _source=[
-                "work_stages.work_kinds.work_types.tasks.time_intervals",
-                "work_stages.work_kinds.work_types.tasks.subtasks.time_intervals",
+                for (_, project_id), keys in requested_by_state.items()
             ],
+            request_timeout=self.timeout,
+        )
+        targets_by_state: Dict[Tuple[str, str], Optional[Dict[str, Dict[str, Any]]]] = {}
+        for doc, (state_key, keys) in zip(resp["docs"], requested_by_state.items()):
+            foreman_id, project_id = state_key
+            if not doc.get("found") or doc["_source"].get("foreman_id") != foreman_id:
+                targets_by_state[state_key] = None
+                continue
+            entries = doc["_source"].get(PATH_INDEX_FIELD)
+            if entries is None:
+                targets_by_state[state_key] = (
+                    await self._get_project_targets(project_id, foreman_id) if keys else {}
+                )
+                continue
+            targets_by_state[state_key] = self._path_entries_to_targets(entries)
+        return targets_by_state
+
+    async def _mget_shift_states(self, state_keys: List[Tuple[str, str]]) -> Dict[Tuple[str, str], Dict[str, Any]]:
+        resp = await self.client.mget(
+            index=self.state_index,
+            ids=[self.shift_state_id(foreman_id, project_id) for foreman_id, project_id in state_keys],
+            request_timeout=self.timeout,
         )
+        states = {}
+        for doc, state_key in zip(resp["docs"], state_keys):
+            if doc.get("found"):
+                states[state_key] = doc
+            else:
+                states[state_key] = {"_source": {}, "_seq_no": None, "_primary_term": None}
+        return states
+
+    async def get_shift_history(
+            self,
+            foreman_id: str,
+            project_id: str,
+            min_seq_no: Optional[int] = None,
+            date_from: Optional[datetime] = None,
+            date_to: Optional[datetime] = None,
+            cursor: Optional[str] = None,
+            limit: Optional[int] = None,
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """Страница истории и курсор следующей; без limit — вся история и курсор None."""
+        targets = await self._get_project_targets(project_id, foreman_id)
+        if targets is None:
+            return [], None
+        if min_seq_no is not None:
+            await self._wait_for_shift_events(
+                project_id, foreman_id, min_seq_no, lambda: self._replay_pending_events(foreman_id, project_id)
+            )
+        if limit is not None:
+            return await self._shift_history_page(
+                project_id, targets, foreman_id, date_from, date_to, cursor, limit
+            )
+        history = [
+            entry async for entry in self._iter_shift_history(
+                project_id, targets, foreman_id, date_from, date_to, cursor
+            )
+        ]
+        return history, None
 
-        for hit in resp["hits"]["hits"]:
-            ws = hit["_source"].get("work_stages", [])
-            for stage in ws:
-                for wk in stage.get("work_kinds", []):
-                    for wt in wk.get("work_types", []):
-                        if self._has_active_intervals(wt):
-                            return "working"
-        return "not_working"
+    async def iter_shift_history(
+            self,
+            foreman_id: str,
+            project_id: str,
+            min_seq_no: Optional[int] = None,
+            date_from: Optional[datetime] = None,
+            date_to: Optional[datetime] = None,
+            cursor: Optional[str] = None,
+    ) -> AsyncIterator[Dict[str, Any]]:
+        targets = await self._get_project_targets(project_id, foreman_id)
+        if targets is None:
+            return
+        if min_seq_no is not None:
+            await self._wait_for_shift_events(
+                project_id, foreman_id, min_seq_no, lambda: self._replay_pending_events(foreman_id, project_id)
+            )
+        async for entry in self._iter_shift_history(project_id, targets, foreman_id, date_from, date_to, cursor):
+            yield entry
 
-    @staticmethod
-    def _has_active_intervals(container: Dict[str, Any]) -> bool:
-        for task in container.get("tasks", []):
-            for ti in task.get("time_intervals", []):
-                if ti.get("end_time") in (None, "") or ti.get("status") == "active":
-                    return True
-            for sub in task.get("subtasks", []):
-                for ti in sub.get("time_intervals", []):
-                    if ti.get("end_time") in (None, "") or ti.get("status") == "active":
-                        return True
-        return False
+    async def get_shift_status(self, foreman_id: str, project_id: str) -> str:
+        active_count = None
+        if self.active_shifts is not None:
+            try:
+                active_count = await self.active_shifts.get_active_count(foreman_id, project_id)
+            except RedisError as e:
+                logger.warning(f"Redis error: {e}")
+        if active_count is None:
+            # холодный старт: читаем состояние из ES и кладём в Redis
+            state = await self._get_shift_state(foreman_id, project_id)
+            active = [item["target_key"] for item in state["_source"].get("active") or []]
+            await self._cache_shift_state(foreman_id, project_id, state["_seq_no"], active)
+            active_count = len(active)
+        return "working" if active_count else "not_working"
 
     async def add_report_links(
             self,
@@ -315,50 +597,73 @@ class ElasticForemanRepository(ABCForemanRepository, BaseElasticRepository):
         Добавляет элементы в work_stages[].work_kinds[].work_types[].tasks[].subtasks[].reportLinks.
         links: [{ "title": "...", "href": "..."}, ...]
         """
+        enriched_links = [{"title": link.get("title") or "Файл", "href": link.get("href")} for link in links]
+        key = self.shift_target_key("subtask", subtask_id)
+        got = await self._get_path_entries(project_id, [key])
+        if got is None:
+            return {"result": "not_found", "project_id": project_id}
+        entry = (got["_source"].get(PATH_INDEX_FIELD) or {}).get(key)
+        expected = {
+            "stage_id": stage_id,
+            "work_kind_id": work_kind_id,
+            "work_type_id": work_type_id,
+            "task_id": task_id,
+        }
+        if entry is None or any(entry.get(field) != value for field, value in expected.items()):
+            # нет path_index или путь не совпал — полный разбор дерева с точной причиной ошибки
+            return await self._add_report_links_scan(
+                project_id, stage_id, work_type_id, work_kind_id, task_id, subtask_id, enriched_links
+            )
+
+        # с включёнными сводками ES вернёт поля для пересчёта вместе с ответом на запись
+        params = {"source_includes": PROJECT_ROLLUP_FIELDS} if self.rollups is not None else {}
+        try:
+            resp = await self.client.update(
+                index=self.index,
+                id=project_id,
+                script={
+                    "lang": "painless",
+                    "source": ADD_REPORT_LINKS_SCRIPT,
+                    "params": {"path": entry["path"], "subtask_id": subtask_id, "links": enriched_links},
+                },
+                refresh="wait_for",
+                if_seq_no=got["_seq_no"],
+                if_primary_term=got["_primary_term"],
+                request_timeout=self.timeout,
+                **params,
+            )
+        except elasticsearch.ConflictError:
+            resp = {"result": "noop"}
+        if resp.get("result") == "noop":
+            # документ изменился между чтением пути и записью
+            return await self._add_report_links_scan(
+                project_id, stage_id, work_type_id, work_kind_id, task_id, subtask_id, enriched_links
+            )
+        if self.rollups is not None and "get" in resp:
+            await self.rollups.write_tree(project_id, resp["_seq_no"], resp["get"]["_source"])
+        return resp
+
+    async def _add_report_links_scan(
+            self,
+            project_id: str,
+            stage_id: str,
+            work_type_id: str,
+            work_kind_id: str,
+            task_id: str,
+            subtask_id: str,
+            links: List[Dict[str, str]],
+    ) -> Dict[str, Any]:
         try:
             got = await self.client.get(index=self.index, id=project_id)
         except elasticsearch.exceptions.NotFoundError:
             return {"result": "not_found", "project_id": project_id}
 
         src = got["_source"]
-
-        ws = src.get("work_stages", [])
-        stage = next((s for s in ws if s.get("stage_id") == stage_id), None)
-        if not stage:
-            return {"result": "stage_not_found", "stage_id": stage_id}
-
-        work_kinds = stage.get("work_kinds") or []
-        work_kind = next((wk for wk in work_kinds if wk.get("work_kind_id") == work_kind_id), None)
-        if not work_kind:
-            return {"result": "work_kind_not_found", "work_kind_id": work_kind_id}
-
-        work_types = work_kind.get("work_types") or []
-        work_type = next((wt for wt in work_types if wt.get("work_type_id") == work_type_id), None)
-        if not work_type:
-            return {"result": "work_type_not_found", "work_type_id": work_type_id}
-
-        tasks: List[Dict[str, Any]] = work_type.get("tasks", [])
-
-        task = next((t for t in tasks if t.get("task_id") == task_id), None)
-        if not task:
-            return {"result": "task_not_found", "task_id": task_id}
-
-        subtasks = task.get("subtasks", [])
-        subtask = next((st for st in subtasks if st.get("subtask_id") == subtask_id), None)
-        if not subtask:
-            return {"result": "subtask_not_found", "subtask_id": subtask_id}
-
-        rlinks = subtask.get("reportLinks")
-        if rlinks is None or not isinstance(rlinks, list):
-            rlinks = []
-            subtask["reportLinks"] = rlinks
-
-        for link in links:
-            enriched = {
-                "title": link.get("title") or "Файл",
-                "href": link.get("href"),
-            }
-            rlinks.append(enriched)
+        path, error = self.find_subtask_path(src, stage_id, work_type_id, work_kind_id, task_id, subtask_id)
+        if error is not None:
+            return error
+        self.append_report_links(self.subtask_at(src["work_stages"][path[0]], path[1:]), links)
+        src[PATH_INDEX_FIELD] = self.build_path_index(src)
 
         resp = await self.client.index(
             index=self.index,
@@ -368,13 +673,163 @@ class ElasticForemanRepository(ABCForemanRepository, BaseElasticRepository):
             if_seq_no=got.get("_seq_no"),
             if_primary_term=got.get("_primary_term"),
         )
+        if self.rollups is not None:
+            await self.rollups.write_tree(project_id, resp["_seq_no"], src)
         return resp
 
+    @staticmethod
+    def find_subtask_path(
+            src: Dict[str, Any],
+            stage_id: str,
+            work_type_id: str,
+            work_kind_id: str,
+            task_id: str,
+            subtask_id: str,
+    ) -> Tuple[Optional[List[int]], Optional[Dict[str, Any]]]:
+        """Путь [stage, work_kind, work_type, task, subtask] к подзадаче по id или ответ с причиной ошибки."""
+        levels = [
+            ("work_stages", "stage_id", stage_id, "stage_not_found"),
+            ("work_kinds", "work_kind_id", work_kind_id, "work_kind_not_found"),
+            ("work_types", "work_type_id", work_type_id, "work_type_not_found"),
+            ("tasks", "task_id", task_id, "task_not_found"),
+            ("subtasks", "subtask_id", subtask_id, "subtask_not_found"),
+        ]
+        path: List[int] = []
+        node = src
+        for container, id_field, item_id, error in levels:
+            items = node.get(container) or []
+            position = next((i for i, item in enumerate(items) if item and item.get(id_field) == item_id), None)
+            if position is None:
+                return None, {"result": error, id_field: item_id}
+            path.append(position)
+            node = items[position]
+        return path, None
+
+    @staticmethod
+    def subtask_at(stage: Dict[str, Any], path: List[int]) -> Dict[str, Any]:
+        """Подзадача этапа по индексам [work_kind, work_type, task, subtask]."""
+        k, t, a, b = path
+        return stage["work_kinds"][k]["work_types"][t]["tasks"][a]["subtasks"][b]
+
+    @staticmethod
+    def append_report_links(subtask: Dict[str, Any], links: List[Dict[str, str]]) -> None:
+        if not isinstance(subtask.get("reportLinks"), list):
+            subtask["reportLinks"] = []
+        subtask["reportLinks"].extend(links)
+
+
+class SplitForemanRepository(SplitLayoutMixin, ElasticForemanRepository):
+    """
+    Репозиторий прораба в раздельной раскладке (см. SplitLayoutMixin): чтение дерева
+    общее с ElasticForemanRepository, ссылки на отчёты переписывают документ одного этапа.
+    """
+
+    def __init__(self, *args: Any, stages_index: str, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        self.stages_index = stages_index
+
+    async def add_report_links(
+            self,
+            project_id: str,
+            stage_id: str,
+            work_type_id: str,
+            work_kind_id: str,
+            task_id: str,
+            subtask_id: str,
+            links: List[Dict[str, str]],
+    ) -> Dict[str, Any]:
+        """
+        Путь к подзадаче — из path_index заголовка, читается и переписывается только её этап.
+        Если пути нет или по нему лежит другая подзадача — полное чтение проекта, поиск
+        по id и пересборка path_index (как _add_report_links_scan).
+        """
+        enriched_links = [{"title": link.get("title") or "Файл", "href": link.get("href")} for link in links]
+        key = self.shift_target_key("subtask", subtask_id)
+        expected = {
+            "stage_id": stage_id,
+            "work_kind_id": work_kind_id,
+            "work_type_id": work_type_id,
+            "task_id": task_id,
+        }
+        for _ in range(SHIFT_STATE_MAX_RETRIES):
+            got = await self._get_path_entries(project_id, [key])
+            if got is None:
+                return {"result": "not_found", "project_id": project_id}
+            entry = (got["_source"].get(PATH_INDEX_FIELD) or {}).get(key)
+            read = None
+            if entry is not None and all(entry.get(field) == value for field, value in expected.items()):
+                path = entry["path"]
+                read = await self._read_project_for_write(project_id, [path[0]], ["foreman_id"])
+                if read is None:
+                    return {"result": "not_found", "project_id": project_id}
+                try:
+                    subtask = self.subtask_at(read["stages"][path[0]], path[1:])
+                except (KeyError, IndexError, TypeError):
+                    subtask = None
+                if subtask is None or subtask.get("subtask_id") != subtask_id:
+                    read = None
+
+            header: Dict[str, Any] = {}
+            if read is None:
+                read = await self._read_project_for_write(project_id)
+                if read is None:
+                    return {"result": "not_found", "project_id": project_id}
+                src = self.assemble_project(read)
+                path, error = self.find_subtask_path(src, stage_id, work_type_id, work_kind_id, task_id, subtask_id)
+                if error is not None:
+                    return error
+                header = {**read["header"]["_source"], PATH_INDEX_FIELD: self.build_path_index(src)}
+
+            stage = read["stages"][path[0]]
+            self.append_report_links(self.subtask_at(stage, path[1:]), enriched_links)
+            revision = (read["header"]["_source"].get(REVISION_FIELD) or 0) + 1
+            refs = list(read["header"]["_source"].get(STAGE_REFS_FIELD) or [])
+            replaced = refs[path[0]]
+            refs[path[0]] = self.stage_ref(project_id, stage, revision)
+            header.update({STAGE_REFS_FIELD: refs, REVISION_FIELD: revision})
+            document = {"project_id": project_id, REVISION_FIELD: revision, **stage}
+            try:
+                resp = await self._write_project(
+                    project_id, header, [(refs[path[0]], document)], [replaced], read=read
+                )
+            except elasticsearch.ConflictError:
+                continue
+            if self.rollups is not None:
+                rollup_src = await self._get_project_source(project_id, PROJECT_ROLLUP_FIELDS)
+                if rollup_src is not None:
+                    await self.rollups.write_tree(project_id, resp["_seq_no"], rollup_src["_source"])
+            return resp
+        raise elasticsearch.ConflictError(
+            "Project was modified concurrently", meta=None, body={"project_id": project_id}
+        )
+
+
+def build_foreman_repository(
+    client: AsyncElasticsearch,
+    active_shifts: Optional[ABCActiveShiftRepository] = None,
+    rollups: Optional[ABCProjectRollupRepository] = None,
+) -> ElasticForemanRepository:
+    """Репозиторий прораба в раскладке проектов из настроек (ELASTIC_STORAGE_LAYOUT)."""
+    args = (
+        client,
+        settings.elasticsearch.index,
+        settings.elasticsearch.shift_events_index,
+        settings.elasticsearch.shift_state_index,
+        settings.elasticsearch.request_timeout,
+        active_shifts,
+        settings.elasticsearch.shift_write_buffer_ms,
+        settings.elasticsearch.shift_write_buffer_max_batch,
+        rollups,
+    )
+    if settings.elasticsearch.storage_layout == STORAGE_LAYOUT_SPLIT:
+        return SplitForemanRepository(*args, stages_index=settings.elasticsearch.project_stages_index)
+    return ElasticForemanRepository(*args)
+
 
 @lru_cache
 def get_foreman_elastic_repository(
     client: AsyncElasticsearch = Depends(get_elastic_client),
+    active_shifts: ABCActiveShiftRepository = Depends(get_active_shift_redis_repository),
+    rollups: ABCProjectRollupRepository = Depends(get_project_rollup_repository),
 ) -> ABCForemanRepository:
-    return ElasticForemanRepository(
-        client, settings.elasticsearch.index, settings.elasticsearch.request_timeout
-    )
+    return build_foreman_repository(client, active_shifts, rollups)
@@ -1,150 +1,921 @@
+import asyncio
+import copy
+import re
+from datetime import datetime
 from functools import lru_cache
-from typing import Any, Dict, List, Union
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Set, Tuple, Union
 
+import orjson
+from elasticsearch import ApiError, TransportError
 from elasticsearch._async.client import AsyncElasticsearch
-from elasticsearch.exceptions import NotFoundError
+from elasticsearch.exceptions import BadRequestError, ConflictError, NotFoundError
 from fastapi import Depends
+from loguru import logger
 
 from core.environment_config import settings
 from db.elastic.connection import get_elastic_client
 from repository.abc.manager_repository import ABCManagerRepository
-from repository.base.elastic_repository import BaseElasticRepository
+from repository.abc.project_rollup_repository import ABCProjectRollupRepository
+from repository.base.elastic_repository import (
+    PATH_INDEX_FIELD,
+    PROJECT_ROLLUP_FIELDS,
+    PROJECT_ROLLUP_LEAF_FIELDS,
+    PROJECTS_PAGE_SIZE,
+    PROJECT_TARGET_FIELDS,
+    SHIFT_EVENT_STOP,
+    SUBTASK_BRIGADE_FIELD,
+    TASK_EXPORT_FIELDS,
+    BaseElasticRepository,
+)
+from repository.base.split_layout import REVISION_FIELD, STAGE_REFS_FIELD, STORAGE_LAYOUT_SPLIT, SplitLayoutMixin
+from repository.elasticsearch_implementation.project_rollup_repository import get_project_rollup_repository
+
+# Корзин composite-агрегации отработанного времени за один запрос
+WORKED_TIME_BUCKETS_PAGE_SIZE = 1000
+
+PROJECT_UPDATE_MAX_RETRIES = 5
+
+# Импорт проектов: _bulk кусками по байтам, размер куска подстраивается под время ответа ES
+IMPORT_CHUNK_BYTES = 1 << 20
+IMPORT_CHUNK_MIN_BYTES = 256 << 10
+IMPORT_CHUNK_MAX_BYTES = 16 << 20
+IMPORT_CHUNK_MAX_DOCS = 1000
+IMPORT_TARGET_SECONDS = 1.0
+# Кусков в ES одновременно; пока все заняты, тело запроса дальше не читается
+IMPORT_CONCURRENCY = 4
+IMPORT_BULK_TIMEOUT = 60
+# Повторы строк, отклонённых ES с 429, и пауза перед первым (дальше — вдвое больше)
+IMPORT_MAX_RETRIES = 3
+IMPORT_RETRY_SECONDS = 0.5
+# Сколько ошибок по строкам возвращать (счётчик failed — всегда полный)
+IMPORT_MAX_ERRORS = 1000
+
+# Поля, из которых строится path_index: их правка требует его пересборки
+PATH_INDEX_ID_FIELDS = {"stage_id", "work_kind_id", "work_type_id", "task_id", "subtask_id"}
+PATH_INDEX_CONTAINERS = {"work_stages", "work_kinds", "work_types", "tasks", "subtasks"}
+
+# Метка в тексте ошибки скрипта: номер операции, на которой он остановился
+PATCH_ERROR_PATTERN = re.compile(r"patch_op:(\d+):(.*)")
+
+# Операции правки проекта по dot-path (params.operations, по порядку):
+#   set    — как _patch_set: недостающие объекты/массивы создаются, массив дополняется null;
+#   add    — вставка в массив по индексу ("-" — в конец) или ключ объекта, родитель должен существовать;
+#   remove — удаление элемента массива или ключа объекта;
+#   move   — remove из from_path и add в path.
+# Любая ошибка прерывает скрипт — документ не меняется ни одной операцией.
+PATCH_PROJECT_SCRIPT = """
+void fail(int op, def message) {
+  throw new IllegalArgumentException('patch_op:' + op + ':' + message);
+}
+def parent(def root, def path, boolean create, int op) {
+  def cur = root;
+  for (int i = 0; i < path.size() - 1; i++) {
+    def part = path[i];
+    boolean nextIsIndex = path[i + 1] instanceof Integer;
+    def child = null;
+    if (part instanceof Integer) {
+      if (!(cur instanceof List)) { fail(op, part + ' is not an array index'); }
+      if (create) {
+        while (cur.size() <= part) { cur.add(null); }
+      }
+      if (part < cur.size()) { child = cur[part]; }
+    } else {
+      if (!(cur instanceof Map)) { fail(op, part + ' is not an object key'); }
+      child = cur[part];
+    }
+    if (child == null || (create && nextIsIndex && !(child instanceof List))) {
+      if (!create) { fail(op, 'path not found at ' + part); }
+      child = nextIsIndex ? new ArrayList() : new HashMap();
+      cur[part] = child;
+    }
+    cur = child;
+  }
+  return cur;
+}
+def take(def container, def key, int op) {
+  if (container instanceof List) {
+    if (!(key instanceof Integer) || key >= container.size()) { fail(op, 'no array element ' + key); }
+    return container.remove((int) key);
+  }
+  if (!(container instanceof Map) || !container.containsKey(key)) { fail(op, 'no key ' + key); }
+  return container.remove(key);
+}
+def src = ctx._source;
+def ops = params.operations;
+for (int i = 0; i < ops.size(); i++) {
+  def op = ops[i];
+  def value = op.value;
+  def path = op.path;
+  def last = path[path.size() - 1];
+  if (op.op == 'move') {
+    value = take(parent(src, op.from_path, false, i), op.from_path[op.from_path.size() - 1], i);
+  }
+  if (op.op == 'remove') {
+    take(parent(src, path, false, i), last, i);
+  } else if (op.op == 'set') {
+    def target = parent(src, path, true, i);
+    if (last instanceof Integer) {
+      if (!(target instanceof List)) { fail(i, last + ' is not an array index'); }
+      while (target.size() <= last) { target.add(null); }
+    } else if (!(target instanceof Map)) {
+      fail(i, last + ' is not an object key');
+    }
+    target[last] = value;
+  } else {
+    def target = parent(src, path, false, i);
+    if (target instanceof List) {
+      if (last == '-') {
+        target.add(value);
+      } else if (last instanceof Integer && last <= target.size()) {
+        target.add((int) last, value);
+      } else {
+        fail(i, 'cannot insert at ' + last);
+      }
+    } else if (target instanceof Map && !(last instanceof Integer)) {
+      target[last] = value;
+    } else {
+      fail(i, 'cannot insert at ' + last);
+    }
+  }
+}
+if (params.path_index != null) {
+  ctx._source[params.path_index_field] = params.path_index;
+}
+"""
 
 
 class ElasticManagerRepository(ABCManagerRepository, BaseElasticRepository):
-    def __init__(self, client: AsyncElasticsearch, index: str, timeout: int = 30):
+    def __init__(
+            self,
+            client: AsyncElasticsearch,
+            index: str,
+            events_index: str,
+            timeout: int = 30,
+            rollups: Optional[ABCProjectRollupRepository] = None,
+    ):
         self.client = client
         self.index = index
+        self.events_index = events_index
         self.timeout = timeout
+        self.rollups = rollups
 
-    async def get_projects(self) -> List[Dict[str, Any]]:
-        resp = await self.client.search(
-            index=self.index,
-            size=100,
-            _source=["project_id", "project_name"]
-        )
-        return [hit["_source"] for hit in resp["hits"]["hits"]]
+    async def get_projects(
+            self,
+            foreman_id: Optional[str] = None,
+            project_ids: Optional[List[str]] = None,
+            status: Optional[str] = None,
+            name_prefix: Optional[str] = None,
+            cursor: Optional[str] = None,
+            limit: int = PROJECTS_PAGE_SIZE,
+            use_pit: bool = False,
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        filters = self.projects_filters(foreman_id, project_ids, status, name_prefix)
+        return await self._projects_page(filters, cursor, limit, use_pit)
 
-    async def get_tasks(self, project_id: str) -> List[Dict[str, Any]]:
-        resp = await self.client.search(
-            index=self.index,
-            size=100,
-            query={"term": {"project_id": project_id}},
-            _source=["work_stages", "project_id", "project_name"]
-        )
+    async def get_tasks(
+            self,
+            project_id: str,
+            fields: Optional[List[str]] = None,
+            exclude: Optional[List[str]] = None,
+            stage_id: Optional[str] = None,
+            work_kind_id: Optional[str] = None,
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        src, version = await self._get_stages(project_id, fields, exclude, stage_id, work_kind_id)
+        if src is None:
+            return [], None
+        project_id = src.get("project_id", "")
+        return [dict(project_id=project_id, **stage) for stage in src.get("work_stages") or []], version
 
-        results = []
-        for hit in resp["hits"]["hits"]:
-            ws = hit["_source"].get("work_stages", [])
-            project_id = hit["_source"].get("project_id", "")
-            for stage in ws:
-                results.append(dict(project_id=project_id, **stage))
-        return results
+    async def search_tasks(
+            self,
+            text: str,
+            project_ids: Optional[List[str]] = None,
+            project_id: Optional[str] = None,
+            cursor: Optional[str] = None,
+            limit: int = 20,
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        if project_id is not None:
+            if project_ids is not None and project_id not in project_ids:
+                return [], None
+            project_ids = [project_id]
+        return await self._search_tasks(text, self.projects_filters(project_ids=project_ids), cursor, limit)
 
+    async def get_project_version(self, project_id: str, foreman_id: Optional[str] = None) -> Optional[str]:
+        return await self._get_project_version(project_id, foreman_id)
 
-    async def get_shift_history(self, project_id: str) -> List[Dict[str, Any]]:
-        resp = await self.client.search(
-            index=self.index,
-            size=100,
-            query={"term": {"project_id": project_id}},
-            _source=[
-                "project_id",
-                "project_name",
-                "work_stages.work_kinds.work_types.tasks.task_id",
-                "work_stages.work_kinds.work_types.tasks.task_name",
-                "work_stages.work_kinds.work_types.tasks.time_intervals",
-                "work_stages.work_kinds.work_types.tasks.subtasks.subtask_id",
-                "work_stages.work_kinds.work_types.tasks.subtasks.subtask_name",
-                "work_stages.work_kinds.work_types.tasks.subtasks.time_intervals",
-                "work_stages.work_kinds.work_types.work_type_id",
-                "work_stages.work_kinds.work_types.work_type_name",
-                "work_stages.work_kinds.work_kind_id",
-                "work_stages.work_kinds.work_kind_name",
-            ],
-        )
-        return self.parse_shift_history(resp["hits"]["hits"])
+    async def get_shift_history(
+        self,
+        project_id: str,
+        date_from: Optional[datetime] = None,
+        date_to: Optional[datetime] = None,
+        cursor: Optional[str] = None,
+        limit: Optional[int] = None,
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        targets = await self._get_project_targets(project_id)
+        if targets is None:
+            return [], None
+        if limit is not None:
+            return await self._shift_history_page(project_id, targets, None, date_from, date_to, cursor, limit)
+        history = [
+            entry async for entry in self._iter_shift_history(project_id, targets, None, date_from, date_to, cursor)
+        ]
+        return history, None
+
+    async def iter_shift_history(
+        self,
+        project_id: str,
+        date_from: Optional[datetime] = None,
+        date_to: Optional[datetime] = None,
+        cursor: Optional[str] = None,
+    ) -> AsyncIterator[Dict[str, Any]]:
+        targets = await self._get_project_targets(project_id)
+        if targets is None:
+            return
+        async for entry in self._iter_shift_history(project_id, targets, None, date_from, date_to, cursor):
+            yield entry
+
+    async def export_tasks(self, project_id: str) -> Optional[Iterator[Dict[str, Any]]]:
+        """Плоские строки задач и подзадач проекта (iter_task_rows); None — проекта нет."""
+        got = await self._get_project_source(project_id, TASK_EXPORT_FIELDS)
+        if got is None:
+            return None
+        return self.iter_task_rows(got["_source"])
+
+    async def export_shift_history(
+        self,
+        project_id: str,
+        date_from: Optional[datetime] = None,
+        date_to: Optional[datetime] = None,
+    ) -> Optional[AsyncIterator[Dict[str, Any]]]:
+        """Вся история смен проекта из одного point-in-time снимка; None — проекта нет."""
+        targets = await self._get_project_targets(project_id)
+        if targets is None:
+            return None
+        return self._iter_shift_history(project_id, targets, None, date_from, date_to, use_pit=True)
+
+    async def get_worked_hours(
+        self,
+        project_id: str,
+        date_from: Optional[datetime] = None,
+        date_to: Optional[datetime] = None,
+        time_zone: str = "UTC",
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Отработанное время по закрытым интервалам проекта (день — по началу интервала).
+        Суммы по задаче/подзадаче и дню считает composite-агрегация ES над stop-событиями,
+        в Python остаётся только свернуть эти корзины до видов/типов работ и бригад.
+        """
+        got = await self._get_project_source(project_id, PROJECT_TARGET_FIELDS + [SUBTASK_BRIGADE_FIELD])
+        if got is None:
+            return None
+        targets = self.collect_shift_targets(got["_source"], with_brigades=True)
+
+        query = self._shift_events_query(project_id, event=SHIFT_EVENT_STOP)
+        if date_from is not None or date_to is not None:
+            time_range: Dict[str, Any] = {}
+            if date_from is not None:
+                time_range["gte"] = date_from.isoformat()
+            if date_to is not None:
+                time_range["lt"] = date_to.isoformat()
+            query["bool"]["filter"].append({"range": {"start_time": time_range}})
+
+        buckets = [bucket async for bucket in self._worked_time_buckets(query, time_zone)]
+        return {
+            "project_id": project_id,
+            "period": {"start_time": date_from, "end_time": date_to},
+            **self.summarize_worked_time(buckets, targets),
+        }
+
+    @staticmethod
+    def summarize_worked_time(
+        buckets: List[Dict[str, Any]], targets: Dict[str, Dict[str, Any]]
+    ) -> Dict[str, Any]:
+        """Сворачивает корзины (target_key, день) в итоги по задачам, видам/типам работ, бригадам и дням."""
+        groups: Dict[str, Dict[str, Dict[str, Any]]] = {
+            name: {} for name in ("task", "subtask", "work_type", "work_kind", "brigade", "day")
+        }
+        total = 0.0
+
+        def add(group: str, key: Optional[str], name: Optional[str], seconds: float) -> None:
+            if key is None:
+                return
+            row = groups[group].setdefault(key, {"id": key, "name": name, "seconds": 0.0})
+            row["seconds"] += seconds
+
+        for bucket in buckets:
+            seconds = bucket["seconds"]["value"] or 0.0
+            total += seconds
+            target = targets.get(bucket["key"]["target_key"]) or {}
+            add("day", bucket["key"]["day"], None, seconds)
+            add("task", target.get("task_id"), target.get("task_name"), seconds)
+            add("work_type", target.get("work_type_id"), target.get("work_type_name"), seconds)
+            add("work_kind", target.get("work_kind_id"), target.get("work_kind_name"), seconds)
+            if target.get("type") == "subtask":
+                add("subtask", target.get("subtask_id"), target.get("subtask_name"), seconds)
+                add("brigade", target.get("brigade_id"), None, seconds)
+
+        for rows in groups.values():
+            for row in rows.values():
+                row["hours"] = row["seconds"] / 3600
+        return {
+            "total_seconds": total,
+            "total_hours": total / 3600,
+            **{f"by_{name}": sorted(rows.values(), key=lambda row: row["id"]) for name, rows in groups.items()},
+        }
+
+    async def _worked_time_buckets(self, query: Dict[str, Any], time_zone: str) -> AsyncIterator[Dict[str, Any]]:
+        """Корзины (target_key, день) с суммой duration_seconds, постранично через after_key."""
+        after_key = None
+        while True:
+            composite: Dict[str, Any] = {
+                "size": WORKED_TIME_BUCKETS_PAGE_SIZE,
+                "sources": [
+                    {"target_key": {"terms": {"field": "target_key"}}},
+                    {"day": {"date_histogram": {
+                        "field": "start_time",
+                        "calendar_interval": "day",
+                        "time_zone": time_zone,
+                        "format": "yyyy-MM-dd",
+                    }}},
+                ],
+            }
+            if after_key is not None:
+                composite["after"] = after_key
+            resp = await self.client.search(
+                index=self.events_index,
+                size=0,
+                query=query,
+                aggs={"worked": {
+                    "composite": composite,
+                    "aggs": {"seconds": {"sum": {"field": "duration_seconds"}}},
+                }},
+                ignore_unavailable=True,
+                request_timeout=self.timeout,
+            )
+            worked = (resp.get("aggregations") or {}).get("worked") or {}
+            for bucket in worked.get("buckets", []):
+                yield bucket
+            after_key = worked.get("after_key")
+            if after_key is None or not worked.get("buckets"):
+                return
+
+    async def get_progress(self, project_id: str) -> Optional[Dict[str, Any]]:
+        """Сводка прогресса проекта одним get; если её ещё нет — собирается по проекту."""
+        if self.rollups is None:
+            raise RuntimeError("Project rollups are not configured")
+        rollup = await self.rollups.get_rollup(project_id)
+        if rollup is None:
+            rollup = await self.rollups.rebuild(project_id)
+        return rollup
 
     async def create_project(self, project_data: Dict[str, Any]) -> Dict[str, Any]:
+        project_data = {**project_data, PATH_INDEX_FIELD: self.build_path_index(project_data)}
         response = await self.client.index(
             index=self.index,
             id=project_data["project_id"],
             document=project_data,
             refresh="wait_for",
         )
+        if self.rollups is not None:
+            await self.rollups.write_tree(project_data["project_id"], response["_seq_no"], project_data)
         return response
 
+    async def import_projects(
+            self, projects: AsyncIterator[Tuple[int, Dict[str, Any]]], overwrite: bool = True
+    ) -> Dict[str, Any]:
+        """
+        Потоковый импорт проектов (номер строки, проект) через _bulk index — или create,
+        если существующие проекты перезаписывать нельзя. Куски собираются по байтам: пока ES
+        отвечает быстрее IMPORT_TARGET_SECONDS, размер растёт вдвое, при медленном ответе или
+        429 — уменьшается. Одновременно пишется не больше IMPORT_CONCURRENCY кусков, refresh —
+        один раз в конце. Ошибки записываются по строкам, импорт при этом не прерывается:
+        неожиданное исключение куска тоже становится ошибкой его ещё не учтённых строк.
+        """
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        report: Dict[str, Any] = {
+            "created": 0, "updated": 0, "failed": 0, "errors": [], "chunks": 0, "bytes": 0,
+            "chunk_bytes": IMPORT_CHUNK_BYTES,
+        }
+        op_type = "index" if overwrite else "create"
+        semaphore = asyncio.Semaphore(IMPORT_CONCURRENCY)
+        pending: Set[asyncio.Task] = set()
+
+        async def send(chunk: List[Dict[str, Any]]) -> None:
+            # задача не завершается с исключением: ошибка попадает в отчёт, а не теряется
+            # вместе с задачей, уже убранной из pending
+            try:
+                await self._import_chunk(chunk, report)
+            except Exception as e:
+                logger.exception(f"Project import chunk failed: {e}")
+                self._import_failed(report, [item for item in chunk if not item.get("reported")], f"import failed: {e}")
+            finally:
+                semaphore.release()
+
+        async def submit(chunk: List[Dict[str, Any]]) -> None:
+            await semaphore.acquire()
+            task = asyncio.create_task(send(chunk))
+            pending.add(task)
+            task.add_done_callback(pending.discard)
+
+        chunk: List[Dict[str, Any]] = []
+        chunk_bytes = 0
+        try:
+            async for line, project in projects:
+                documents = [(meta, orjson.dumps(document)) for meta, document in self._import_documents(project)]
+                size = sum(len(body) for _, body in documents)
+                chunk.append({
+                    "line": line,
+                    "project_id": project["project_id"],
+                    "op": op_type,
+                    "documents": documents,
+                    "project": project,
+                })
+                chunk_bytes += size
+                report["bytes"] += size
+                if chunk_bytes >= report["chunk_bytes"] or len(chunk) >= IMPORT_CHUNK_MAX_DOCS:
+                    await submit(chunk)
+                    chunk, chunk_bytes = [], 0
+            if chunk:
+                await submit(chunk)
+        finally:
+            await asyncio.gather(*pending, return_exceptions=True)
+
+        if report["created"] or report["updated"]:
+            await self.client.indices.refresh(index=self.index, request_timeout=IMPORT_BULK_TIMEOUT)
+        return {**report, "seconds": loop.time() - started}
+
+    def _import_documents(self, project: Dict[str, Any]) -> List[Tuple[Dict[str, Any], Dict[str, Any]]]:
+        """Документы проекта для _bulk: (метаданные операции, документ); первый — сам проект."""
+        return [
+            ({"_index": self.index, "_id": project["project_id"]}, {
+                **project, PATH_INDEX_FIELD: self.build_path_index(project)
+            })
+        ]
+
+    async def _import_chunk(self, chunk: List[Dict[str, Any]], report: Dict[str, Any]) -> None:
+        loop = asyncio.get_running_loop()
+        for attempt in range(IMPORT_MAX_RETRIES + 1):
+            if attempt:
+                await asyncio.sleep(IMPORT_RETRY_SECONDS * 2 ** (attempt - 1))
+            operations: List[Any] = []
+            for item in chunk:
+                for meta, body in item["documents"]:
+                    operations.append({item["op"]: meta})
+                    operations.append(body)
+            started = loop.time()
+            try:
+                resp = await self.client.bulk(operations=operations, request_timeout=IMPORT_BULK_TIMEOUT)
+            except ApiError as e:
+                if e.status_code in (413, 429) and attempt < IMPORT_MAX_RETRIES:
+                    self._adapt_import_chunk(report, None)
+                    continue
+                self._import_failed(report, chunk, f"bulk request failed: {e}")
+                return
+            except TransportError as e:
+                self._import_failed(report, chunk, f"bulk request failed: {e}")
+                return
+            report["chunks"] += 1
+
+            rejected, written = [], []
+            results = iter(resp["items"])
+            for item in chunk:
+                infos = [next(iter(next(results).values())) for _ in item["documents"]]
+                errors = [info for info in infos if info.get("error")]
+                if any(info.get("status") == 429 for info in errors):
+                    rejected.append(item)
+                elif errors:
+                    error = errors[0]["error"]
+                    self._import_failed(report, [item], f"{error.get('type')}: {error.get('reason')}")
+                else:
+                    # результат проекта — по его первому документу
+                    report[infos[0]["result"]] = report.get(infos[0]["result"], 0) + 1
+                    item["reported"] = True
+                    written.append(item)
+                    item["seq_no"] = infos[0]["_seq_no"]
+            if self.rollups is not None and written:
+                await self._import_rollups(report, written)
+            self._adapt_import_chunk(report, None if rejected else loop.time() - started)
+            if not rejected:
+                return
+            chunk = rejected
+        self._import_failed(report, chunk, "rejected by Elasticsearch: too many requests")
+
+    @staticmethod
+    def _adapt_import_chunk(report: Dict[str, Any], seconds: Optional[float]) -> None:
+        """Размер следующих кусков: seconds — время ответа на кусок, None — ES отклонил запись."""
+        size = report["chunk_bytes"]
+        if seconds is None or seconds > IMPORT_TARGET_SECONDS:
+            size //= 2
+        elif seconds < IMPORT_TARGET_SECONDS / 2:
+            size *= 2
+        report["chunk_bytes"] = min(max(size, IMPORT_CHUNK_MIN_BYTES), IMPORT_CHUNK_MAX_BYTES)
+
+    async def _import_rollups(self, report: Dict[str, Any], written: List[Dict[str, Any]]) -> None:
+        """Сводки записанных проектов; ошибка — в отчёт по строкам, проекты при этом уже записаны."""
+        try:
+            await self.rollups.write_trees([
+                {"project_id": item["project_id"], "seq_no": item["seq_no"], "src": item["project"]}
+                for item in written
+            ])
+        except Exception as e:
+            logger.error(f"Project rollups error: {e}")
+            self._import_errors(report, written, f"project written, progress rollup not updated: {e}")
+
+    @classmethod
+    def _import_failed(cls, report: Dict[str, Any], items: List[Dict[str, Any]], error: str) -> None:
+        report["failed"] += len(items)
+        for item in items:
+            item["reported"] = True
+        cls._import_errors(report, items, error)
+
+    @staticmethod
+    def _import_errors(report: Dict[str, Any], items: List[Dict[str, Any]], error: str) -> None:
+        for item in items[:max(IMPORT_MAX_ERRORS - len(report["errors"]), 0)]:
+            report["errors"].append({"line": item["line"], "project_id": item["project_id"], "error": error})
+
     @staticmethod
-    def _ensure_list_size(lst: List[Any], idx: int):
-        while len(lst) <= idx:
-            lst.append(None)
+    def _script_path(key: str) -> List[Union[str, int]]:
+        """dot-path для скрипта: числовые сегменты — индексы массивов."""
+        return [int(part) if part.isdigit() else part for part in key.split(".")]
+
+    @staticmethod
+    def _touches_path_index(key: str) -> bool:
+        """
+        Меняет ли правка структуру дерева или id, из которых построен path_index: путь идёт
+        только по массивам этапов/видов/типов работ/задач/подзадач и заканчивается элементом
+        такого массива, самим массивом или id. Массивы внутри элементов (reportLinks,
+        time_intervals, properties) структуры не меняют.
+        """
+        parts = key.split(".")
+        containers, indexes = parts[:-1:2], parts[1:-1:2]
+        if parts[0] != "work_stages" or not all(part in PATH_INDEX_CONTAINERS for part in containers):
+            return False
+        if not all(part.isdigit() for part in indexes):
+            return False
+        last = parts[-1]
+        if len(parts) % 2 == 0:
+            return last.isdigit() or last == "-"
+        return last in PATH_INDEX_CONTAINERS or last in PATH_INDEX_ID_FIELDS
 
     @classmethod
-    def _set_by_path(cls, obj: Union[Dict[str, Any], List[Any]], path: str, value: Any):
+    def _patch_touches_path_index(cls, operation: Dict[str, Any]) -> bool:
+        if operation.get("from_path") and cls._touches_path_index(operation["from_path"]):
+            return True
+        return cls._touches_path_index(operation["path"])
+
+    @classmethod
+    def _touches_rollup(cls, key: str, value: Any = None) -> bool:
         """
-        Устанавливает value по dot-path. Поддерживает индексы массивов: "work_stages.0.work_type_name.0.stage_name".
-        Создаёт недостающие словари/списки.
+        Меняет ли правка сводку прогресса: структуру дерева, количества, статусы, бригады, имена.
+        Объект или массив внутри дерева может нести любое из этих полей.
         """
-        parts = path.split(".")
-        cur = obj
-        for i, part in enumerate(parts):
-            is_last = i == len(parts) - 1
-            is_index = part.isdigit()
-
-            if is_index:
-                idx = int(part)
+        parts = key.split(".")
+        return cls._touches_path_index(key) or (
+            parts[0] == "work_stages"
+            and (isinstance(value, (dict, list)) or any(part in PROJECT_ROLLUP_LEAF_FIELDS for part in parts))
+        )
+
+    @classmethod
+    def _patch_touches_rollup(cls, operation: Dict[str, Any]) -> bool:
+        if operation.get("from_path") and cls._touches_rollup(operation["from_path"]):
+            return True
+        return cls._touches_rollup(operation["path"], operation.get("value"))
+
+    @classmethod
+    def _patch_set(cls, doc: Any, parts: List[Union[str, int]], value: Any) -> None:
+        """set из PATCH_PROJECT_SCRIPT: недостающие объекты/массивы создаются, массив дополняется None."""
+        cur = doc
+        for part, following in zip(parts[:-1], parts[1:]):
+            next_is_index = isinstance(following, int)
+            if isinstance(part, int):
                 if not isinstance(cur, list):
-                    new_list = []
-                    cur.clear()
-                    cur = new_list  # NOTE: см. пояснение ниже
-                cls._ensure_list_size(cur, idx)
-                if is_last:
-                    cur[idx] = value
-                else:
-                    if cur[idx] is None:
-                        # следующий уровень по умолчанию — dict
-                        cur[idx] = {}
-                    cur = cur[idx]
-            else:
-                # ключ словаря
-                if not isinstance(cur, dict):
-                    # если тут список — это конфликт структур, создаём dict
-                    # и "перезатираем" текущую позицию
-                    # (в нормальных данных такое не должно происходить)
-                    cur = {}
-                if is_last:
-                    cur[part] = value
+                    raise KeyError(f"{part} is not an array index")
+                cur.extend([None] * (part + 1 - len(cur)))
+            elif not isinstance(cur, dict):
+                raise KeyError(f"{part} is not an object key")
+            child = cur[part] if isinstance(part, int) else cur.get(part)
+            if child is None or (next_is_index and not isinstance(child, list)):
+                child = [] if next_is_index else {}
+                cur[part] = child
+            cur = child
+        last = parts[-1]
+        if isinstance(last, int):
+            if not isinstance(cur, list):
+                raise KeyError(f"{last} is not an array index")
+            cur.extend([None] * (last + 1 - len(cur)))
+        elif not isinstance(cur, dict):
+            raise KeyError(f"{last} is not an object key")
+        cur[last] = value
+
+    @classmethod
+    def _patch_parent(cls, doc: Any, parts: List[Union[str, int]]) -> Any:
+        cur = doc
+        for part in parts[:-1]:
+            cur = cur[part]
+        return cur
+
+    @classmethod
+    def _take(cls, container: Any, key: Union[str, int]) -> Any:
+        if isinstance(container, list):
+            if not isinstance(key, int) or key >= len(container):
+                raise KeyError(f"no array element {key}")
+            return container.pop(key)
+        if not isinstance(container, dict) or key not in container:
+            raise KeyError(f"no key {key}")
+        return container.pop(key)
+
+    @classmethod
+    def _apply_patch_operation(cls, doc: Dict[str, Any], operation: Dict[str, Any]) -> None:
+        """То же, что PATCH_PROJECT_SCRIPT, для одной операции на стороне приложения."""
+        parts = cls._script_path(operation["path"])
+        value = operation.get("value")
+        if operation["op"] == "set":
+            cls._patch_set(doc, parts, value)
+            return
+        if operation["op"] == "move":
+            from_parts = cls._script_path(operation["from_path"])
+            value = cls._take(cls._patch_parent(doc, from_parts), from_parts[-1])
+        target = cls._patch_parent(doc, parts)
+        last = parts[-1]
+        if operation["op"] == "remove":
+            cls._take(target, last)
+        elif isinstance(target, list) and (last == "-" or (isinstance(last, int) and last <= len(target))):
+            target.insert(len(target) if last == "-" else last, value)
+        elif isinstance(target, dict) and not isinstance(last, int):
+            target[last] = value
+        else:
+            raise KeyError(f"cannot insert at {last}")
+
+    @staticmethod
+    def _patch_error(error: BadRequestError) -> Optional[Tuple[int, str]]:
+        """Номер операции и причина из ошибки скрипта (reason где-то в цепочке caused_by)."""
+        stack = [error.body]
+        while stack:
+            node = stack.pop()
+            if isinstance(node, dict):
+                reason = node.get("reason")
+                match = PATCH_ERROR_PATTERN.match(reason) if isinstance(reason, str) else None
+                if match:
+                    return int(match.group(1)), match.group(2)
+                stack.extend(node.values())
+            elif isinstance(node, list):
+                stack.extend(node)
+        return None
+
+    @staticmethod
+    def _patch_results(
+            operations: List[Dict[str, Any]], failed: Optional[Tuple[int, str]] = None
+    ) -> List[Dict[str, Any]]:
+        results = []
+        for i, operation in enumerate(operations):
+            item = {"op": operation["op"], "path": operation["path"], "result": "applied", "error": None}
+            if failed is not None:
+                item["result"] = "error" if i == failed[0] else "not_applied"
+                item["error"] = failed[1] if i == failed[0] else None
+            results.append(item)
+        return results
+
+    async def patch_project(self, project_id: str, operations: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Применяет операции set/add/remove/move по dot-path одним скриптовым _update:
+        либо все, либо ни одной. Запись идёт с if_seq_no/if_primary_term прочитанной
+        версии и повторяется при конфликте. Если операции меняют структуру дерева
+        или id, path_index пересобирается по скелету проекта с теми же операциями
+        и пишется тем же скриптом. Если операции меняют сводку прогресса, поля для её
+        пересчёта приходят в ответе на update (source_includes), без отдельного чтения.
+        """
+        structural = [operation for operation in operations if self._patch_touches_path_index(operation)]
+        update_params: Dict[str, Any] = {}
+        if self.rollups is not None and any(self._patch_touches_rollup(operation) for operation in operations):
+            update_params["source_includes"] = PROJECT_ROLLUP_FIELDS
+        params = {
+            "operations": [
+                {
+                    "op": operation["op"],
+                    "path": self._script_path(operation["path"]),
+                    "value": operation.get("value"),
+                    "from_path": self._script_path(operation["from_path"]) if operation.get("from_path") else None,
+                }
+                for operation in operations
+            ],
+            "path_index_field": PATH_INDEX_FIELD,
+            "path_index": None,
+        }
+        for _ in range(PROJECT_UPDATE_MAX_RETRIES):
+            try:
+                if structural:
+                    got = await self.client.get(
+                        index=self.index,
+                        id=project_id,
+                        _source_includes=PROJECT_TARGET_FIELDS + ["work_stages.stage_id"],
+                        request_timeout=self.timeout,
+                    )
                 else:
-                    if part not in cur or cur[part] is None:
-                        # по умолчанию следующий уровень — dict
-                        cur[part] = {}
-                    # если следующий сегмент — число, то готовим список
-                    if (i + 1) < len(parts) and parts[i + 1].isdigit() and not isinstance(cur[part], list):
-                        cur[part] = []
-                    cur = cur[part]
+                    got = await self.client.get(
+                        index=self.index, id=project_id, _source=False, request_timeout=self.timeout
+                    )
+            except NotFoundError:
+                return {"result": "not_found", "project_id": project_id, "operations": []}
+
+            if structural:
+                skeleton = got["_source"]
+                for operation in structural:
+                    try:
+                        self._apply_patch_operation(skeleton, operation)
+                    except (KeyError, IndexError, TypeError) as e:
+                        failed = (operations.index(operation), str(e).strip("'\""))
+                        return {
+                            "result": "rejected",
+                            "project_id": project_id,
+                            "operations": self._patch_results(operations, failed),
+                        }
+                params["path_index"] = self.build_path_index(skeleton)
+
+            try:
+                resp = await self.client.update(
+                    index=self.index,
+                    id=project_id,
+                    script={"lang": "painless", "source": PATCH_PROJECT_SCRIPT, "params": params},
+                    if_seq_no=got["_seq_no"],
+                    if_primary_term=got["_primary_term"],
+                    refresh="wait_for",
+                    request_timeout=self.timeout,
+                    **update_params,
+                )
+            except ConflictError:
+                continue
+            except BadRequestError as e:
+                failed = self._patch_error(e)
+                if failed is None:
+                    raise
+                return {
+                    "result": "rejected",
+                    "project_id": project_id,
+                    "operations": self._patch_results(operations, failed),
+                }
+            if update_params and "get" in resp:
+                await self.rollups.write_tree(project_id, resp["_seq_no"], resp["get"]["_source"])
+            return {
+                "result": resp["result"],
+                "project_id": project_id,
+                "seq_no": resp["_seq_no"],
+                "version": resp["_version"],
+                "operations": self._patch_results(operations),
+            }
+        raise ConflictError(
+            "Project was modified concurrently", meta=None, body={"project_id": project_id}
+        )
 
     async def change_project(self, project_id: str, key: str, value: Any) -> Dict[str, Any]:
-        try:
-            got = await self.client.get(index=self.index, id=project_id)
-        except NotFoundError:
-            return {"result": "not_found", "project_id": project_id}
+        """Одна операция set по dot-path (см. patch_project)."""
+        resp = await self.patch_project(project_id, [{"op": "set", "path": key, "value": value}])
+        if resp["result"] == "rejected":
+            raise ValueError(f"Cannot set {key}: {resp['operations'][0]['error']}")
+        return {key: resp[key] for key in ("result", "project_id", "seq_no", "version") if key in resp}
 
-        src = got["_source"]
 
-        self._set_by_path(src, key, value)
+class SplitManagerRepository(SplitLayoutMixin, ElasticManagerRepository):
+    """
+    Репозиторий менеджера в раздельной раскладке (см. SplitLayoutMixin): проект пишется
+    заголовком и документами этапов, правка переписывает заголовок и только изменившиеся этапы.
+    """
 
-        resp = await self.client.index(
-            index=self.index,
-            id=project_id,
-            document=src,
-            refresh="wait_for",
+    def __init__(self, *args: Any, stages_index: str, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        self.stages_index = stages_index
+
+    def _import_documents(self, project: Dict[str, Any]) -> List[Tuple[Dict[str, Any], Dict[str, Any]]]:
+        # прежние документы этапов импортируемого поверх проекта остаются, но заголовок на них не ссылается
+        project_id = project["project_id"]
+        header, stages = self.split_project(project_id, project, 0)
+        return [({"_index": self.index, "_id": project_id}, header)] + [
+            ({"_index": self.stages_index, "_id": ref["doc"], "routing": project_id}, document)
+            for ref, document in stages
+        ]
+
+    async def _import_chunk(self, chunk: List[Dict[str, Any]], report: Dict[str, Any]) -> None:
+        """
+        Документы этапов проектов куска — отдельным _bulk до заголовков, как в _write_project:
+        заголовок (его пишет базовый _import_chunk) — только у проектов, чьи этапы записаны все.
+        """
+        operations: List[Any] = []
+        for item in chunk:
+            for meta, body in item["documents"][1:]:
+                operations.append({"index": meta})
+                operations.append(body)
+        if operations:
+            try:
+                resp = await self.client.bulk(operations=operations, request_timeout=IMPORT_BULK_TIMEOUT)
+            except (ApiError, TransportError) as e:
+                self._import_failed(report, chunk, f"stage documents bulk request failed: {e}")
+                return
+            results = iter(resp["items"])
+            ready = []
+            for item in chunk:
+                infos = [next(iter(next(results).values())) for _ in item["documents"][1:]]
+                errors = [info["error"] for info in infos if info.get("error")]
+                if errors:
+                    error = f"stage documents: {errors[0].get('type')}: {errors[0].get('reason')}"
+                    self._import_failed(report, [item], error)
+                    continue
+                item["documents"] = item["documents"][:1]
+                ready.append(item)
+            chunk = ready
+        if chunk:
+            await super()._import_chunk(chunk, report)
+
+    async def create_project(self, project_data: Dict[str, Any]) -> Dict[str, Any]:
+        project_id = project_data["project_id"]
+        old = await self._get_header(project_id, [STAGE_REFS_FIELD, REVISION_FIELD])
+        old_src = old["_source"] if old is not None else {}
+        # все этапы — новые документы; прежние удаляются после записи заголовка
+        revision = old_src.get(REVISION_FIELD, -1) + 1
+        header, stages = self.split_project(project_id, project_data, revision)
+        response = await self._write_project(project_id, header, stages, old_src.get(STAGE_REFS_FIELD) or [])
+        if self.rollups is not None:
+            await self.rollups.write_tree(project_id, response["_seq_no"], project_data)
+        return response
+
+    async def patch_project(self, project_id: str, operations: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Операции применяются по порядку к проекту, собранному из заголовка и всех этапов,
+        на стороне приложения (_apply_patch_operation): при ошибке любой ничего не пишется.
+        Изменённый, заменённый или добавленный этап пишется новым документом, прежний
+        и удалённые — удаляются после записи заголовка. Запись — с if_seq_no заголовка
+        и повтором при конфликте.
+        """
+        touches_rollup = self.rollups is not None and any(
+            self._patch_touches_rollup(operation) for operation in operations
         )
-        return resp
+        for _ in range(PROJECT_UPDATE_MAX_RETRIES):
+            read = await self._read_project_for_write(project_id)
+            if read is None:
+                return {"result": "not_found", "project_id": project_id, "operations": []}
+            src = self.assemble_project(read)
+            refs = read["header"]["_source"].get(STAGE_REFS_FIELD) or []
+            old_refs = {id(stage): ref for stage, ref in zip(src["work_stages"], refs)}
+            before = {ref["doc"]: copy.deepcopy(stage) for stage, ref in zip(src["work_stages"], refs)}
+            for i, operation in enumerate(operations):
+                try:
+                    self._apply_patch_operation(src, operation)
+                except (KeyError, IndexError, TypeError) as e:
+                    return {
+                        "result": "rejected",
+                        "project_id": project_id,
+                        "operations": self._patch_results(operations, (i, str(e).strip("'\""))),
+                    }
+
+            revision = (read["header"]["_source"].get(REVISION_FIELD) or 0) + 1
+            new_refs: List[Optional[Dict[str, Any]]] = []
+            replaced = []
+            for stage in src.get("work_stages") or []:
+                ref = old_refs.pop(id(stage), None)
+                if ref is not None and stage != before[ref["doc"]]:
+                    replaced.append(ref)
+                    ref = None
+                new_refs.append(ref)
+            header, stages = self.split_project(project_id, src, revision, new_refs)
+            changed = [(ref, document) for ref, document in stages if ref[REVISION_FIELD] == revision]
+            try:
+                resp = await self._write_project(
+                    project_id, header, changed, [*old_refs.values(), *replaced], read
+                )
+            except ConflictError:
+                continue
+            if touches_rollup:
+                await self.rollups.write_tree(project_id, resp["_seq_no"], src)
+            return {
+                "result": resp["result"],
+                "project_id": project_id,
+                "seq_no": resp["_seq_no"],
+                "version": resp["_version"],
+                "operations": self._patch_results(operations),
+            }
+        raise ConflictError(
+            "Project was modified concurrently", meta=None, body={"project_id": project_id}
+        )
+
+
+def build_manager_repository(
+    client: AsyncElasticsearch, rollups: Optional[ABCProjectRollupRepository] = None
+) -> ElasticManagerRepository:
+    """Репозиторий менеджера в раскладке проектов из настроек (ELASTIC_STORAGE_LAYOUT)."""
+    args = (
+        client,
+        settings.elasticsearch.index,
+        settings.elasticsearch.shift_events_index,
+        settings.elasticsearch.request_timeout,
+        rollups,
+    )
+    if settings.elasticsearch.storage_layout == STORAGE_LAYOUT_SPLIT:
+        return SplitManagerRepository(*args, stages_index=settings.elasticsearch.project_stages_index)
+    return ElasticManagerRepository(*args)
 
 
 @lru_cache
 def get_manager_elastic_repository(
     client: AsyncElasticsearch = Depends(get_elastic_client),
+    rollups: ABCProjectRollupRepository = Depends(get_project_rollup_repository),
 ) -> ABCManagerRepository:
-    return ElasticManagerRepository(
-        client, settings.elasticsearch.index, settings.elasticsearch.request_timeout
-    )
+    return build_manager_repository(client, rollups)
@@ -0,0 +1,190 @@
+from datetime import datetime, timezone
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+
+import elasticsearch
+from elasticsearch._async.client import AsyncElasticsearch
+from fastapi import Depends
+from loguru import logger
+
+from core.environment_config import settings
+from db.elastic.connection import get_elastic_client
+from repository.abc.project_rollup_repository import ABCProjectRollupRepository
+from repository.base.elastic_repository import PROJECT_ROLLUP_FIELDS, BaseElasticRepository
+from repository.base.split_layout import STORAGE_LAYOUT_SPLIT, SplitLayoutMixin
+
+# Параллельные записи в одну сводку ES повторяет сам: скрипты ниже сравнивают _seq_no и идемпотентны
+ROLLUP_RETRY_ON_CONFLICT = 3
+
+# Итоги по дереву проекта: принимаются, только если _seq_no проекта новее сохранённого.
+# Активные смены перекладываются на новые позиции видов работ (targets).
+ROLLUP_TREE_SCRIPT = """
+def src = ctx._source;
+if (src.project_seq_no != null && src.project_seq_no >= params.seq_no) { ctx.op = 'noop'; return; }
+for (def entry : params.rollup.entrySet()) { src[entry.getKey()] = entry.getValue(); }
+src.project_seq_no = params.seq_no;
+src.updated_at = params.updated_at;
+if (src.active == null) { src.active = new HashMap(); }
+for (def state : src.active.values()) {
+  for (def target : state.targets.entrySet()) { target.setValue(params.rollup.targets[target.getKey()]); }
+}
+"""
+
+# Активные задачи прораба: копия документа состояния смен, если его _seq_no новее сохранённого
+ROLLUP_ACTIVE_SCRIPT = """
+def src = ctx._source;
+if (src.active == null) { src.active = new HashMap(); }
+def state = src.active[params.foreman_id];
+if (state != null && state.seq_no >= params.seq_no) { ctx.op = 'noop'; return; }
+def targets = new HashMap();
+for (def key : params.active) {
+  targets[key] = src.targets == null ? null : src.targets[key];
+}
+src.active[params.foreman_id] = ['seq_no': params.seq_no, 'targets': targets];
+"""
+
+
+class ElasticProjectRollupRepository(ABCProjectRollupRepository, BaseElasticRepository):
+    """
+    Сводки прогресса проектов в отдельном индексе, документ на проект (_id = project_id).
+    Итоги по дереву пишутся после каждой правки проекта из уже известного документа
+    (или update с source_includes), активные смены — после каждой записи состояния смен.
+    Чтение — один get по id. Сводка производная: ошибка её записи логируется и не ломает
+    основную запись; недостающую сводку собирает rebuild или команда build_project_rollups.
+    """
+
+    def __init__(
+            self,
+            client: AsyncElasticsearch,
+            index: str,
+            rollups_index: str,
+            state_index: str,
+            timeout: int = 30,
+    ):
+        self.client = client
+        self.index = index
+        self.rollups_index = rollups_index
+        self.state_index = state_index
+        self.timeout = timeout
+
+    def _update_action(self, project_id: str, source: str, params: Dict[str, Any]) -> Tuple[Dict, Dict]:
+        header = {
+            "update": {"_index": self.rollups_index, "_id": project_id, "retry_on_conflict": ROLLUP_RETRY_ON_CONFLICT}
+        }
+        body = {
+            "script": {"lang": "painless", "source": source, "params": params},
+            "upsert": {"project_id": project_id, "active": {}},
+            "scripted_upsert": True,
+        }
+        return header, body
+
+    def tree_action(self, project_id: str, seq_no: int, src: Dict[str, Any]) -> Tuple[Dict, Dict]:
+        """Строка _bulk с итогами по дереву проекта версии seq_no."""
+        return self._update_action(project_id, ROLLUP_TREE_SCRIPT, {
+            "seq_no": seq_no,
+            "updated_at": datetime.now(timezone.utc).isoformat(),
+            "rollup": {**self.build_project_rollup(src), "project_id": project_id},
+        })
+
+    def active_action(self, project_id: str, foreman_id: str, seq_no: int, active: List[str]) -> Tuple[Dict, Dict]:
+        """Строка _bulk с активными задачами прораба по состоянию смен версии seq_no."""
+        return self._update_action(project_id, ROLLUP_ACTIVE_SCRIPT, {
+            "foreman_id": foreman_id,
+            "seq_no": seq_no,
+            "active": sorted(active),
+        })
+
+    async def _bulk(self, actions: List[Tuple[Dict, Dict]]) -> None:
+        operations: List[Dict[str, Any]] = [part for action in actions for part in action]
+        resp = await self.client.bulk(operations=operations, request_timeout=self.timeout)
+        if resp.get("errors"):
+            failed = [item["update"] for item in resp["items"] if item["update"].get("error")]
+            logger.error(f"Project rollups bulk errors: {failed}")
+
+    async def _write(self, actions: List[Tuple[Dict, Dict]]) -> None:
+        if not actions:
+            return
+        try:
+            await self._bulk(actions)
+        except (elasticsearch.ApiError, elasticsearch.TransportError) as e:
+            logger.error(f"Project rollups write error: {e}")
+
+    async def write_tree(self, project_id: str, seq_no: int, src: Dict[str, Any]) -> None:
+        await self._write([self.tree_action(project_id, seq_no, src)])
+
+    async def write_trees(self, projects: List[Dict[str, Any]]) -> None:
+        """projects: [{"project_id", "seq_no", "src"}, ...] — одним _bulk."""
+        await self._write([
+            self.tree_action(project["project_id"], project["seq_no"], project["src"]) for project in projects
+        ])
+
+    async def write_active(self, states: List[Dict[str, Any]]) -> None:
+        """states: [{"project_id", "foreman_id", "seq_no", "active": [target_key, ...]}, ...]"""
+        await self._write([
+            self.active_action(state["project_id"], state["foreman_id"], state["seq_no"], state["active"])
+            for state in states
+        ])
+
+    async def get_rollup(self, project_id: str) -> Optional[Dict[str, Any]]:
+        try:
+            got = await self.client.get(
+                index=self.rollups_index,
+                id=project_id,
+                _source_excludes=["targets"],
+                request_timeout=self.timeout,
+            )
+        except elasticsearch.NotFoundError:
+            return None
+        if got["_source"].get("project_seq_no") is None:
+            # есть только активные смены: итоги по дереву ещё не записаны
+            return None
+        return self.summarize_project_rollup(got["_source"])
+
+    async def rebuild(self, project_id: str) -> Optional[Dict[str, Any]]:
+        """Сводка заново по документу проекта и его документам состояния смен; None — проекта нет."""
+        got = await self._get_project_source(project_id, PROJECT_ROLLUP_FIELDS)
+        if got is None:
+            return None
+        actions = [self.tree_action(project_id, got["_seq_no"], got["_source"])]
+        resp = await self.client.search(
+            index=self.state_index,
+            size=100,
+            query={"term": {"project_id": project_id}},
+            seq_no_primary_term=True,
+            ignore_unavailable=True,
+            request_timeout=self.timeout,
+        )
+        for hit in resp["hits"]["hits"]:
+            active = [item["target_key"] for item in hit["_source"].get("active") or []]
+            actions.append(self.active_action(project_id, hit["_source"]["foreman_id"], hit["_seq_no"], active))
+        await self._bulk(actions)
+        return await self.get_rollup(project_id)
+
+
+class SplitProjectRollupRepository(SplitLayoutMixin, ElasticProjectRollupRepository):
+    """Сводки проектов в раздельной раскладке: rebuild собирает дерево из документов этапов."""
+
+    def __init__(self, *args: Any, stages_index: str, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        self.stages_index = stages_index
+
+
+def build_project_rollup_repository(client: AsyncElasticsearch) -> ElasticProjectRollupRepository:
+    """Репозиторий сводок в раскладке проектов из настроек (ELASTIC_STORAGE_LAYOUT)."""
+    args = (
+        client,
+        settings.elasticsearch.index,
+        settings.elasticsearch.project_rollups_index,
+        settings.elasticsearch.shift_state_index,
+        settings.elasticsearch.request_timeout,
+    )
+    if settings.elasticsearch.storage_layout == STORAGE_LAYOUT_SPLIT:
+        return SplitProjectRollupRepository(*args, stages_index=settings.elasticsearch.project_stages_index)
+    return ElasticProjectRollupRepository(*args)
+
+
+@lru_cache
+def get_project_rollup_repository(
+    client: AsyncElasticsearch = Depends(get_elastic_client),
+) -> ABCProjectRollupRepository:
+    return build_project_rollup_repository(client)
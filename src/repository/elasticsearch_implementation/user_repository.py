@@ -1,41 +1,134 @@
+import time
 from functools import lru_cache
 from typing import Any, Optional
 
 from elasticsearch._async.client import AsyncElasticsearch
+from elasticsearch.exceptions import ConflictError
 from fastapi import Depends
 from loguru import logger
 
 from core.environment_config import settings
+from core.metrics import metrics
 from db.elastic.connection import get_elastic_client
+from repository.abc.user_cache_repository import ABCUserCacheRepository
 from repository.abc.user_repository import ABCUserRepository
+from repository.redis_implementation.user_cache_repository import (
+    cached_projection,
+    get_user_cache_redis_repository,
+)
 from schemas.user import UserInDB
 
+# Email, занятый несуществующим пользователем, можно занять заново не раньше: регистрация,
+# которая его заняла, ещё могла не записать пользователя
+EMAIL_CLAIM_GRACE_SECONDS = 60
+
+
+def email_key(email: str) -> str:
+    """_id документа в индексе email -> пользователь: как normalizer lowercase_norm поля email в users."""
+    return email.lower()
+
 
 class UserRepository(ABCUserRepository):
-    def __init__(self, client: AsyncElasticsearch, index: str, timeout: int = 30):
+    def __init__(
+            self,
+            client: AsyncElasticsearch,
+            index: str,
+            timeout: int = 30,
+            cache: Optional[ABCUserCacheRepository] = None,
+            emails_index: str = "user_emails",
+    ):
         self.client = client
         self.index = index
         self.timeout = timeout
+        # кэш get_user_profile; каждая запись пользователя ниже его инвалидирует
+        self.cache = cache
+        # email -> user_id: _id документа — email, создаётся op_type=create, читается realtime get
+        self.emails_index = emails_index
+
+    async def _invalidate(self, user_id: str, response: Any) -> None:
+        if self.cache is not None:
+            await self.cache.invalidate_user(user_id, response.get("_seq_no") if response else None)
+
+    async def _claim_email(self, email: str, user_id: str) -> None:
+        """
+        Атомарно занимает email: из параллельных регистраций документ создаст только одна.
+        Занятый email забирается, если его владельца нет или у того уже другой email
+        (запись упала между захватом и пользователем), — но не раньше EMAIL_CLAIM_GRACE_SECONDS.
+        """
+        # claimed_at только в _source: mapping индекса dynamic false
+        claim = {"user_id": user_id, "claimed_at": time.time()}
+        try:
+            await self.client.create(index=self.emails_index, id=email_key(email), document=claim)
+            return
+        except ConflictError as e:
+            conflict = e
+        current = await self.client.get(index=self.emails_index, id=email_key(email), ignore=[404])
+        if current and current.get("found") and current["_source"]["user_id"] == user_id:
+            return
+        if not current or not current.get("found") or not await self._claim_abandoned(email, current["_source"]):
+            raise ValueError("User already exists") from conflict
+        try:
+            await self.client.index(
+                index=self.emails_index,
+                id=email_key(email),
+                document=claim,
+                if_seq_no=current["_seq_no"],
+                if_primary_term=current["_primary_term"],
+            )
+        except ConflictError as e:
+            raise ValueError("User already exists") from e
+        metrics.incr("user_emails.reclaimed")
+        logger.warning(f"Email {email_key(email)} reclaimed from {current['_source']['user_id']} by {user_id}")
+
+    async def _claim_abandoned(self, email: str, claim: dict[str, Any]) -> bool:
+        if time.time() - claim.get("claimed_at", 0) < EMAIL_CLAIM_GRACE_SECONDS:
+            return False
+        owner = await self.get_user_by_id(claim["user_id"])
+        return owner is None or email_key(owner.email) != email_key(email)
+
+    async def _release_email(self, email: str) -> None:
+        await self.client.delete(index=self.emails_index, id=email_key(email), ignore=[404])
 
     async def create_user(self, user: UserInDB) -> None:
-        response = await self.client.index(index=self.index, id=user.id, document=user.dict())
+        await self._claim_email(user.email, user.id)
+        try:
+            response = await self.client.index(index=self.index, id=user.id, document=user.dict())
+        except Exception:
+            await self._release_email(user.email)
+            raise
+        await self._invalidate(user.id, response)
         logger.info(f"Document created: {response['result']}")
         logger.info(f"Document ID: {response['_id']}")
 
     async def get_user_by_email(self, email: str) -> Optional[UserInDB]:
-        query = {"query": {"term": {"email": email}}}
-        resp = await self.client.search(
-            index=self.index,
-            size=100,
-            body=query
-        )
-        hits = resp.get("hits", {}).get("hits", [])
-        if not hits:
+        doc = await self.client.get(index=self.emails_index, id=email_key(email), ignore=[404])
+        if not doc or not doc.get("found"):
             return None
-        source = hits[0]["_source"]
-        return UserInDB(**source)
+        # мимо кэша: в кэше нет hashed_password, а по email пользователя ищет логин
+        user = await self.get_user_by_id(doc["_source"]["user_id"])
+        # документ email мог остаться от пользователя, сменившего email
+        if user is None or email_key(user.email) != email_key(email):
+            return None
+        return user
 
     async def get_user_by_id(self, user_id: str) -> Optional[UserInDB]:
+        doc = await self._get_user_doc(user_id)
+        return UserInDB(**doc["_source"]) if doc is not None else None
+
+    async def get_user_profile(self, user_id: str) -> Optional[UserInDB]:
+        if self.cache is not None:
+            user = await self.cache.get_user(user_id)
+            if user is not None:
+                return user
+        doc = await self._get_user_doc(user_id)
+        if doc is None:
+            return None
+        user = cached_projection(UserInDB(**doc["_source"]))
+        if self.cache is not None:
+            await self.cache.set_user(user, doc["_seq_no"])
+        return user
+
+    async def _get_user_doc(self, user_id: str) -> Optional[dict[str, Any]]:
         doc = await self.client.get(
             index=self.index,
             ignore=[404],
@@ -43,7 +136,7 @@ class UserRepository(ABCUserRepository):
         )
         if not doc or not doc.get("found"):
             return None
-        return UserInDB(**doc["_source"])
+        return doc
 
     async def get_all_users(self) -> list[dict[str, Any]]:
         result = await self.client.search(
@@ -67,7 +160,8 @@ class UserRepository(ABCUserRepository):
                 "params": {"project": project_id}
             }
         }
-        await self.client.update(index=self.index, id=user_id, body=script, ignore=[404])
+        response = await self.client.update(index=self.index, id=user_id, body=script, ignore=[404])
+        await self._invalidate(user_id, response)
 
     async def remove_project_from_user(self, user_id: str, project_id: str) -> None:
         script = {
@@ -81,16 +175,42 @@ class UserRepository(ABCUserRepository):
                 "params": {"project": project_id}
             }
         }
-        await self.client.update(index=self.index, id=user_id, body=script, ignore=[404])
+        response = await self.client.update(index=self.index, id=user_id, body=script, ignore=[404])
+        await self._invalidate(user_id, response)
 
     async def update_user(self, user: UserInDB) -> None:
-        await self.client.index(index=self.index, id=user.id, document=user.dict())
+        current = await self.client.get(
+            index=self.index, id=user.id, _source_includes=["email", "hashed_password"], ignore=[404]
+        )
+        stored = current["_source"] if current and current.get("found") else {}
+        previous = stored.get("email")
+        email_changed = previous is None or email_key(previous) != email_key(user.email)
+        if email_changed:
+            await self._claim_email(user.email, user.id)
+        document = user.dict()
+        # пользователь из get_user_profile мог прийти из кэша без хеша: пароль не затираем
+        if not document["hashed_password"]:
+            document["hashed_password"] = stored.get("hashed_password", "")
+        try:
+            response = await self.client.index(index=self.index, id=user.id, document=document)
+        except Exception:
+            if email_changed:
+                await self._release_email(user.email)
+            raise
+        await self._invalidate(user.id, response)
+        if email_changed and previous is not None:
+            await self._release_email(previous)
 
 
 @lru_cache
 def get_user_elastic_repository(
     client: AsyncElasticsearch = Depends(get_elastic_client),
+    cache: Optional[ABCUserCacheRepository] = Depends(get_user_cache_redis_repository),
 ) -> ABCUserRepository:
     return UserRepository(
-        client, settings.elasticsearch.users_index, settings.elasticsearch.request_timeout
+        client,
+        settings.elasticsearch.users_index,
+        settings.elasticsearch.request_timeout,
+        cache,
+        settings.elasticsearch.user_emails_index,
     )
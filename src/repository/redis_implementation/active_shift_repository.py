@@ -0,0 +1,77 @@
+import json
+from functools import lru_cache
+from typing import List, Optional
+
+from fastapi import Depends
+from redis.asyncio import Redis
+
+from core.environment_config import settings
+from db.redis.connection import get_redis_client
+from repository.abc.active_shift_repository import ABCActiveShiftRepository
+
+# Пишем состояние только если оно новее сохранённого: ответы ES на параллельные старт/стоп
+# могут прийти в любом порядке, а _seq_no документа состояния растёт монотонно
+SET_STATE_SCRIPT = """
+local current = redis.call('HGET', KEYS[1], 'seq_no')
+if current and tonumber(current) >= tonumber(ARGV[1]) then
+    return 0
+end
+redis.call('HSET', KEYS[1], 'seq_no', ARGV[1], 'active_count', ARGV[2], 'active', ARGV[3])
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+return 1
+"""
+
+# seq_no для проекта, по которому смен ещё не было (документа состояния нет)
+EMPTY_STATE_SEQ_NO = -1
+
+
+class RedisActiveShiftRepository(ABCActiveShiftRepository):
+    """
+    Копия документа состояния смен (shift_state) в Redis: по хешу на пару прораб/проект
+    с полями seq_no, active_count и active (JSON-список target_key).
+    Источник истины — ES, Redis можно сбросить и пересобрать командой rebuild_active_shifts.
+    """
+
+    def __init__(self, client: Redis, prefix: str = "shift:active", expire: int = 604800):
+        self.client = client
+        self.prefix = prefix
+        self.expire = expire
+
+    def key(self, foreman_id: str, project_id: str) -> str:
+        return f"{self.prefix}:{project_id}:{foreman_id}"
+
+    async def get_active_count(self, foreman_id: str, project_id: str) -> Optional[int]:
+        """Число активных задач или None, если состояния в Redis нет."""
+        value = await self.client.hget(self.key(foreman_id, project_id), "active_count")
+        return int(value) if value is not None else None
+
+    async def get_state(self, foreman_id: str, project_id: str) -> Optional[dict]:
+        values = await self.client.hgetall(self.key(foreman_id, project_id))
+        if not values:
+            return None
+        return {
+            "seq_no": int(values[b"seq_no"]),
+            "active": json.loads(values[b"active"]),
+        }
+
+    async def set_state(self, foreman_id: str, project_id: str, seq_no: int, active: List[str]) -> bool:
+        written = await self.client.eval(
+            SET_STATE_SCRIPT,
+            1,
+            self.key(foreman_id, project_id),
+            seq_no,
+            len(active),
+            json.dumps(sorted(active)),
+            self.expire,
+        )
+        return bool(written)
+
+    async def delete_state(self, foreman_id: str, project_id: str) -> None:
+        await self.client.delete(self.key(foreman_id, project_id))
+
+
+@lru_cache
+def get_active_shift_redis_repository(
+    client: Redis = Depends(get_redis_client),
+) -> ABCActiveShiftRepository:
+    return RedisActiveShiftRepository(client, expire=settings.redis.shift_state_expire)
@@ -0,0 +1,194 @@
+import asyncio
+import json
+from functools import lru_cache
+from typing import Optional, Tuple
+
+from fastapi import Depends
+from loguru import logger
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+
+from core.cache import TTLCache
+from core.environment_config import settings
+from core.metrics import metrics
+from core.security import mark_user_changed
+from db.redis.connection import get_redis_client
+from db.redis.session_manager import redis_db_manager
+from repository.abc.user_cache_repository import ABCUserCacheRepository
+from schemas.user import UserInDB
+
+# Пользователь пишется, только если его _seq_no не старше сохранённого: чтение из ES,
+# начатое до изменения, не затрёт ни свежую запись, ни метку инвалидации
+SET_USER_SCRIPT = """
+local current = redis.call('HGET', KEYS[1], 'seq_no')
+if current and tonumber(current) > tonumber(ARGV[1]) then
+    return 0
+end
+redis.call('HSET', KEYS[1], 'seq_no', ARGV[1], 'user', ARGV[2])
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+return 1
+"""
+
+# Инвалидация: вместо пользователя остаётся метка с _seq_no записи, которая его изменила
+INVALIDATE_USER_SCRIPT = """
+local current = redis.call('HGET', KEYS[1], 'seq_no')
+if not current or tonumber(current) < tonumber(ARGV[1]) then
+    redis.call('HSET', KEYS[1], 'seq_no', ARGV[1])
+end
+redis.call('HDEL', KEYS[1], 'user')
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+return 1
+"""
+
+# Пауза перед повторной подпиской на канал инвалидаций после ошибки Redis
+USER_CACHE_RESUBSCRIBE_SECONDS = 1.0
+
+# Локальный уровень кэша воркера: user_id -> (_seq_no, пользователь или None — метка инвалидации).
+# Один на процесс: его сбрасывают и репозитории, и подписка на канал инвалидаций.
+local_users: "TTLCache[Tuple[int, Optional[UserInDB]]]" = TTLCache(
+    settings.redis.user_cache_local_size, settings.redis.user_cache_local_ttl
+)
+
+
+def drop_local_user(
+    user_id: str,
+    seq_no: Optional[int] = None,
+    local: "TTLCache[Tuple[int, Optional[UserInDB]]]" = local_users,
+) -> None:
+    """
+    Сбрасывает пользователя в локальном уровне; с seq_no — только записи старше него.
+    Claims его ранее выпущенных access-токенов тоже перестают использоваться.
+    """
+    mark_user_changed(user_id)
+    if seq_no is None:
+        local.pop(user_id)
+        return
+    current = local.get(user_id)
+    if current is None or current[0] < seq_no:
+        local.set(user_id, (seq_no, None))
+
+
+def cached_projection(user: UserInDB) -> UserInDB:
+    """Пользователь для кэша: без хеша пароля — он нужен только логину, а тот читает ES."""
+    return user.copy(update={"hashed_password": ""}, deep=True)
+
+
+class RedisUserCacheRepository(ABCUserCacheRepository):
+    """
+    Двухуровневый кэш пользователей для get_current_user: LRU + TTL в памяти воркера
+    и общий уровень в Redis (хеш с полями seq_no и user). Источник истины — ES:
+    записи пользователя в репозитории вызывают invalidate_user, а та через pub/sub
+    сбрасывает локальный уровень остальных воркеров. Ошибки Redis не ломают запрос —
+    кэш считается пустым. hashed_password в кэш не попадает: у закэшированного
+    пользователя он пустой.
+    """
+
+    def __init__(
+        self,
+        client: Redis,
+        prefix: str = "user:cache",
+        expire: int = 300,
+        channel: str = "user:invalidate",
+        local: "TTLCache[Tuple[int, Optional[UserInDB]]]" = local_users,
+    ):
+        self.client = client
+        self.prefix = prefix
+        self.expire = expire
+        self.channel = channel
+        self.local = local
+
+    def key(self, user_id: str) -> str:
+        return f"{self.prefix}:{user_id}"
+
+    async def get_user(self, user_id: str) -> Optional[UserInDB]:
+        cached = self.local.get(user_id)
+        if cached is not None and cached[1] is not None:
+            metrics.incr("user_cache.local_hits")
+            return cached[1].copy(deep=True)
+        try:
+            values = await self.client.hmget(self.key(user_id), "seq_no", "user")
+        except RedisError as e:
+            metrics.incr("user_cache.redis_errors")
+            logger.warning(f"User cache read failed: {e}")
+            values = [None, None]
+        seq_no, raw = values
+        if raw is None:
+            metrics.incr("user_cache.misses")
+            return None
+        metrics.incr("user_cache.redis_hits")
+        # записи, сделанные до проекции, ещё могут хранить хеш до истечения user_cache_expire
+        user = cached_projection(UserInDB.parse_raw(raw))
+        self._set_local(user, int(seq_no))
+        return user.copy(deep=True)
+
+    async def set_user(self, user: UserInDB, seq_no: int) -> None:
+        # копия: вызывающий может менять свой объект (например, перед update_user)
+        user = cached_projection(user)
+        self._set_local(user, seq_no)
+        try:
+            written = await self.client.eval(SET_USER_SCRIPT, 1, self.key(user.id), seq_no, user.json(), self.expire)
+        except RedisError as e:
+            metrics.incr("user_cache.redis_errors")
+            logger.warning(f"User cache write failed: {e}")
+            return
+        if not written:
+            metrics.incr("user_cache.stale_writes")
+
+    async def invalidate_user(self, user_id: str, seq_no: Optional[int] = None) -> None:
+        metrics.incr("user_cache.invalidations")
+        drop_local_user(user_id, seq_no, self.local)
+        try:
+            if seq_no is None:
+                await self.client.delete(self.key(user_id))
+            else:
+                await self.client.eval(INVALIDATE_USER_SCRIPT, 1, self.key(user_id), seq_no, self.expire)
+            await self.client.publish(self.channel, json.dumps({"user_id": user_id, "seq_no": seq_no}))
+        except RedisError as e:
+            # остальные воркеры увидят изменение не позже user_cache_local_ttl
+            metrics.incr("user_cache.redis_errors")
+            logger.warning(f"User cache invalidation failed: {e}")
+
+    def _set_local(self, user: UserInDB, seq_no: int) -> None:
+        current = self.local.get(user.id)
+        if current is not None and current[0] > seq_no:
+            metrics.incr("user_cache.stale_writes")
+            return
+        self.local.set(user.id, (seq_no, user))
+
+
+async def listen_user_invalidations(channel: str = settings.redis.user_cache_channel) -> None:
+    """
+    Подписка воркера на инвалидации пользователей от других воркеров (задача на время
+    жизни приложения). После (пере)подписки локальный уровень очищается целиком
+    и claims всех ранее выпущенных токенов устаревают: сообщения, отправленные без
+    подписки, потеряны.
+    """
+    while True:
+        try:
+            async with redis_db_manager.session() as client, client.pubsub(ignore_subscribe_messages=True) as pubsub:
+                await pubsub.subscribe(channel)
+                local_users.clear()
+                mark_user_changed()
+                async for message in pubsub.listen():
+                    try:
+                        data = json.loads(message["data"])
+                        drop_local_user(data["user_id"], data.get("seq_no"))
+                    except (ValueError, KeyError, TypeError):
+                        logger.warning(f"Invalid user cache invalidation: {message['data']!r}")
+        except (RedisError, OSError) as e:
+            metrics.incr("user_cache.redis_errors")
+            logger.warning(f"User cache invalidation channel failed: {e}")
+            local_users.clear()
+            mark_user_changed()
+            await asyncio.sleep(USER_CACHE_RESUBSCRIBE_SECONDS)
+
+
+@lru_cache
+def get_user_cache_redis_repository(
+    client: Redis = Depends(get_redis_client),
+) -> Optional[ABCUserCacheRepository]:
+    if not settings.redis.user_cache_enabled:
+        return None
+    return RedisUserCacheRepository(
+        client, expire=settings.redis.user_cache_expire, channel=settings.redis.user_cache_channel
+    )
@@ -1,12 +1,32 @@
-from typing import Any
+from typing import Any, List, Literal, Optional
 
-from pydantic import BaseModel
+from pydantic import BaseModel, Field, root_validator
 
 
 class ChangeProjectRequest(BaseModel):
     key: str
     value: Any
 
+
+class ProjectPatchOperation(BaseModel):
+    op: Literal["set", "add", "remove", "move"]
+    path: str = Field(..., description="dot-path, как key в ChangeProjectRequest; в add/move \"-\" — конец массива")
+    value: Any = None
+    from_path: Optional[str] = Field(None, alias="from", description="Откуда переносить (move)")
+
+    @root_validator(skip_on_failure=True)
+    def check_from(cls, values):
+        if values["op"] == "move" and not values.get("from_path"):
+            raise ValueError("move requires from")
+        return values
+
+    class Config:
+        allow_population_by_field_name = True
+
+
+class ProjectPatchRequest(BaseModel):
+    operations: List[ProjectPatchOperation] = Field(..., min_items=1, max_items=200)
+
 class UploadResult(BaseModel):
     filename: str
     size: int
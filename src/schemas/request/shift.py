@@ -0,0 +1,14 @@
+from typing import List, Literal
+
+from pydantic import BaseModel, Field
+
+
+class ShiftOperation(BaseModel):
+    project_id: str
+    action: Literal["start", "stop"]
+    task_ids: List[str] = []
+    subtask_ids: List[str] = []
+
+
+class BulkShiftRequest(BaseModel):
+    operations: List[ShiftOperation] = Field(..., min_items=1, max_items=500)
@@ -1,13 +1,22 @@
 from __future__ import annotations
 
 from datetime import datetime
-from typing import List, Literal, Optional, Union
+from typing import Dict, List, Literal, Optional, Union
 
 from pydantic import BaseModel, Field, root_validator
 
 from schemas.brigade_member import BrigadeMember
 
 
+# Старт/стоп смены пишутся только в shift_events: интервалы в дереве проекта
+# больше не обновляются и остаются такими, какими были до перехода
+TIME_INTERVALS_DEPRECATED = (
+    "Устарело: не обновляется с переноса смен в события, содержит только интервалы, записанные до него. "
+    "Актуальные интервалы — в истории смен: /api/foreman/projects/{project_id}/shift/history "
+    "и /api/manager/projects/{project_id}/shifts."
+)
+
+
 class TimeInterval(BaseModel):
     start_time: Optional[datetime] = Field(None, description="Начало интервала (ISO datetime)")
     end_time: Optional[datetime] = Field(None, description="Конец интервала (ISO datetime)")
@@ -54,7 +63,9 @@ class Subtask(BaseModel):
     actualQty: Optional[float] = Field(None, description="Фактический объём работ")
     machine: Optional[MachineInfo] = Field(None, description="Информация о задействованной технике")
     reportLinks: List[ReportLink] = Field(default_factory=list, description="Ссылки на отчёты")
-    time_intervals: List[TimeInterval] = Field(default_factory=list, description="Интервалы работы по подзадаче")
+    time_intervals: List[TimeInterval] = Field(
+        default_factory=list, description=f"Интервалы работы по подзадаче. {TIME_INTERVALS_DEPRECATED}", deprecated=True
+    )
 
     @root_validator(pre=True)
     def _merge_deadline(cls, values: dict) -> dict:
@@ -84,7 +95,9 @@ class Task(BaseModel):
     task_name: Optional[str] = Field(None, description="Название задачи")
     task_description: Optional[str] = Field(None, description="Описание задачи")
     task_status: Optional[str] = Field(None, description="Статус задачи")
-    time_intervals: List[TimeInterval] = Field(default_factory=list, description="Интервалы работы по задаче")
+    time_intervals: List[TimeInterval] = Field(
+        default_factory=list, description=f"Интервалы работы по задаче. {TIME_INTERVALS_DEPRECATED}", deprecated=True
+    )
     subtasks: List[Subtask] = Field(default_factory=list, description="Подзадачи")
 
     class Config:
@@ -146,6 +159,28 @@ class StageWithProject(WorkStage):
         extra = "allow"
 
 
+class TaskSearchMatch(BaseModel):
+    project_id: str = Field(..., description="Идентификатор проекта")
+    project_name: Optional[str] = Field(None, description="Название проекта")
+    kind: Literal["task", "subtask"] = Field(..., description="Что совпало: задача или подзадача")
+    path: List[int] = Field(..., description="Индексы [stage, work_kind, work_type, task(, subtask)] в дереве проекта")
+    score: float = Field(..., description="Релевантность")
+    stage_id: Optional[str] = Field(None, description="Идентификатор этапа")
+    stage_name: Optional[str] = Field(None, description="Название этапа")
+    work_kind_id: Optional[str] = Field(None, description="Идентификатор типа работ")
+    work_kind_name: Optional[str] = Field(None, description="Название типа работ")
+    work_type_id: Optional[str] = Field(None, description="Идентификатор вида работ")
+    work_type_name: Optional[str] = Field(None, description="Название вида работ")
+    task_id: Optional[str] = Field(None, description="Идентификатор задачи")
+    task_name: Optional[str] = Field(None, description="Название задачи")
+    subtask_id: Optional[str] = Field(None, description="Идентификатор подзадачи (kind = subtask)")
+    subtask_name: Optional[str] = Field(None, description="Название подзадачи (kind = subtask)")
+    status: Optional[str] = Field(None, description="Статус совпавшей задачи или подзадачи")
+    highlight: Dict[str, List[str]] = Field(
+        default_factory=dict, description="Фрагменты с подсветкой <em> по совпавшим полям"
+    )
+
+
 class ShiftEntryBase(BaseModel):
     project_id: Optional[str] = Field(None, description="Идентификатор проекта")
     task_id: Optional[str] = Field(None, description="Идентификатор задачи")
@@ -176,9 +211,114 @@ class ShiftStatus(BaseModel):
     status: Literal["working", "not_working"] = Field(..., description="Текущий статус смены")
 
 
+class ProjectPatchOperationResult(BaseModel):
+    op: str = Field(..., description="Операция")
+    path: str = Field(..., description="dot-path операции")
+    result: Literal["applied", "error", "not_applied"] = Field(..., description="Результат операции")
+    error: Optional[str] = Field(None, description="Причина, если операция не применима")
+
+
+class ProjectPatchResult(BaseModel):
+    result: str = Field(..., description="updated, noop, rejected или not_found")
+    project_id: str = Field(..., description="Идентификатор проекта")
+    seq_no: Optional[int] = Field(None, description="_seq_no документа после изменения")
+    version: Optional[int] = Field(None, description="_version документа после изменения")
+    operations: List[ProjectPatchOperationResult] = Field(
+        default_factory=list, description="Результаты в порядке операций"
+    )
+
+
+class ShiftOperationResult(BaseModel):
+    project_id: str = Field(..., description="Идентификатор проекта")
+    action: Literal["start", "stop"] = Field(..., description="Операция")
+    result: str = Field(..., description="shift started, shift stopped, not_found, conflict или error")
+    seq_no: Optional[int] = Field(None, description="Версия (_seq_no) состояния смен проекта после операции")
+
+
+class BulkShiftResult(BaseModel):
+    items: List[ShiftOperationResult] = Field(default_factory=list, description="Результаты в порядке операций")
+
+
+class WorkedTime(BaseModel):
+    id: str = Field(..., description="Идентификатор группы (задачи, вида работ, бригады) или день YYYY-MM-DD")
+    name: Optional[str] = Field(None, description="Название группы, если есть")
+    seconds: float = Field(..., description="Отработано, секунд")
+    hours: float = Field(..., description="Отработано, часов")
+
+
+class WorkedHoursReport(BaseModel):
+    project_id: str = Field(..., description="Идентификатор проекта")
+    period: TimeInterval = Field(..., description="Период отчёта по началу интервалов работы")
+    total_seconds: float = Field(..., description="Всего отработано, секунд")
+    total_hours: float = Field(..., description="Всего отработано, часов")
+    by_task: List[WorkedTime] = Field(default_factory=list, description="По задачам (вместе с подзадачами)")
+    by_subtask: List[WorkedTime] = Field(default_factory=list, description="По подзадачам")
+    by_work_type: List[WorkedTime] = Field(default_factory=list, description="По видам работ")
+    by_work_kind: List[WorkedTime] = Field(default_factory=list, description="По типам работ")
+    by_brigade: List[WorkedTime] = Field(default_factory=list, description="По бригадам подзадач")
+    by_day: List[WorkedTime] = Field(default_factory=list, description="По дням")
+
+
+class ProgressMetrics(BaseModel):
+    planned_qty: float = Field(0.0, description="Сумма plannedQty подзадач")
+    actual_qty: float = Field(0.0, description="Сумма actualQty подзадач")
+    progress: Optional[float] = Field(None, description="actual_qty / planned_qty, если план задан")
+    tasks: int = Field(0, description="Задач")
+    subtasks: int = Field(0, description="Подзадач")
+    subtask_status: Dict[str, int] = Field(default_factory=dict, description="Подзадач по subtask_status")
+    report_links: int = Field(0, description="Ссылок на отчёты")
+    active_tasks: int = Field(0, description="Задач с активной сменой")
+    active_subtasks: int = Field(0, description="Подзадач с активной сменой")
+    active_crews: int = Field(0, description="Разных бригад на подзадачах с активной сменой")
+
+
+class StageProgress(ProgressMetrics):
+    stage_id: Optional[str] = Field(None, description="Идентификатор этапа")
+    stage_name: Optional[str] = Field(None, description="Название этапа")
+
+
+class WorkTypeProgress(ProgressMetrics):
+    stage_id: Optional[str] = Field(None, description="Идентификатор этапа")
+    work_kind_id: Optional[str] = Field(None, description="Идентификатор типа работ")
+    work_type_id: Optional[str] = Field(None, description="Идентификатор вида работ")
+    work_type_name: Optional[str] = Field(None, description="Название вида работ")
+
+
+class ProjectProgress(BaseModel):
+    project_id: str = Field(..., description="Идентификатор проекта")
+    seq_no: Optional[int] = Field(None, description="_seq_no документа проекта, по которому посчитана сводка")
+    updated_at: Optional[datetime] = Field(None, description="Когда сводка пересчитана")
+    totals: ProgressMetrics = Field(..., description="По проекту")
+    by_stage: List[StageProgress] = Field(default_factory=list, description="По этапам")
+    by_work_type: List[WorkTypeProgress] = Field(default_factory=list, description="По видам работ")
+
+
+class ProjectImportError(BaseModel):
+    line: int = Field(..., description="Номер строки NDJSON (с 1)")
+    project_id: Optional[str] = Field(None, description="Идентификатор проекта, если строку удалось разобрать")
+    error: str = Field(..., description="Причина")
+
+
+class ProjectImportResult(BaseModel):
+    lines: int = Field(..., description="Непустых строк")
+    created: int = Field(0, description="Создано проектов")
+    updated: int = Field(0, description="Перезаписано проектов")
+    failed: int = Field(0, description="Строк с ошибкой")
+    errors: List[ProjectImportError] = Field(
+        default_factory=list, description="Ошибки по строкам (не больше 1000 первых)"
+    )
+    chunks: int = Field(0, description="Запросов _bulk")
+    bytes: int = Field(0, description="Объём записанных документов, байт")
+    seconds: float = Field(..., description="Длительность импорта")
+    projects_per_second: float = Field(0.0, description="Записано проектов в секунду")
+    megabytes_per_second: float = Field(0.0, description="Записано МБ в секунду")
+
+
 class OperationResult(BaseModel):
     result: str = Field(..., description="Результат операции")
     project_id: Optional[str] = Field(None, description="Идентификатор проекта, если применимо")
+    seq_no: Optional[int] = Field(None, description="Версия (_seq_no) записанного состояния, если применимо")
+    version: Optional[int] = Field(None, description="_version документа после изменения, если применимо")
 
     class Config:
         extra = "allow"
@@ -0,0 +1,54 @@
+"""
+Строки выгрузок задач и истории смен в NDJSON и CSV.
+
+Строки приходят из репозитория уже плоскими (iter_task_rows, записи истории смен),
+поэтому здесь только кодирование одной строки; поток собирает сервис.
+"""
+import csv
+import io
+from typing import Any, Dict, Iterable, List
+
+import orjson
+
+from schemas.response.shift_history import SubtaskShiftRow, dump_shift_history_line, shift_history_row
+
+EXPORT_MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv; charset=utf-8",
+}
+
+TASK_EXPORT_COLUMNS: List[str] = [
+    "type", "project_id", "project_name", "stage_id", "stage_name",
+    "work_kind_id", "work_kind_name", "work_type_id", "work_type_name",
+    "task_id", "task_name", "subtask_id", "subtask_name", "status", "brigade_id",
+    "planned_qty", "actual_qty", "start_time", "end_time",
+]
+
+# те же поля, что в JSON истории смен; у строк задач subtask_* пустые
+SHIFT_EXPORT_COLUMNS: List[str] = list(SubtaskShiftRow.__slots__)
+
+# BOM: Excel иначе открывает UTF-8 без него в локальной кодировке и портит кириллицу
+CSV_BOM = b"\xef\xbb\xbf"
+
+
+def dump_csv_line(values: Iterable[Any]) -> bytes:
+    buffer = io.StringIO()
+    csv.writer(buffer).writerow(["" if value is None else value for value in values])
+    return buffer.getvalue().encode()
+
+
+def dump_task_row(row: Dict[str, Any], export_format: str) -> bytes:
+    if export_format == "csv":
+        return dump_csv_line(row.get(column) for column in TASK_EXPORT_COLUMNS)
+    return orjson.dumps({column: row.get(column) for column in TASK_EXPORT_COLUMNS}) + b"\n"
+
+
+def dump_shift_row(item: Dict[str, Any], export_format: str) -> bytes:
+    if export_format == "csv":
+        row = shift_history_row(item)
+        return dump_csv_line(getattr(row, column, None) for column in SHIFT_EXPORT_COLUMNS)
+    return dump_shift_history_line(item)
+
+
+def csv_header(columns: List[str]) -> bytes:
+    return CSV_BOM + dump_csv_line(columns)
@@ -0,0 +1,94 @@
+"""
+Быстрая сериализация истории смен без pydantic.
+
+Записи истории собирает сам репозиторий из событий ES, поэтому повторная валидация
+(parse_obj на строку и response_model в FastAPI) им не нужна. Строки превращаются в
+компактные записи со __slots__ и сериализуются orjson за один вызов. Порядок и состав
+полей совпадают с TaskShiftEntry/SubtaskShiftEntry — публичная схема не меняется.
+"""
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Dict, Iterable, Optional, Union
+
+import orjson
+
+
+@dataclass
+class TaskShiftRow:
+    __slots__ = (
+        "project_id", "task_id", "task_name", "work_type_id", "work_type_name",
+        "work_kind_id", "work_kind_name", "start_time", "end_time", "status", "type",
+    )
+    project_id: Optional[str]
+    task_id: Optional[str]
+    task_name: Optional[str]
+    work_type_id: Optional[str]
+    work_type_name: Optional[str]
+    work_kind_id: Optional[str]
+    work_kind_name: Optional[str]
+    start_time: Optional[str]
+    end_time: Optional[str]
+    status: Optional[str]
+    type: str
+
+
+@dataclass
+class SubtaskShiftRow:
+    __slots__ = (
+        "project_id", "task_id", "task_name", "work_type_id", "work_type_name",
+        "work_kind_id", "work_kind_name", "start_time", "end_time", "status", "type",
+        "subtask_id", "subtask_name",
+    )
+    project_id: Optional[str]
+    task_id: Optional[str]
+    task_name: Optional[str]
+    work_type_id: Optional[str]
+    work_type_name: Optional[str]
+    work_kind_id: Optional[str]
+    work_kind_name: Optional[str]
+    start_time: Optional[str]
+    end_time: Optional[str]
+    status: Optional[str]
+    type: str
+    subtask_id: Optional[str]
+    subtask_name: Optional[str]
+
+
+ShiftHistoryRow = Union[TaskShiftRow, SubtaskShiftRow]
+
+
+def _iso(value: Optional[str]) -> Optional[str]:
+    """Дата в том виде, в каком её отдал бы pydantic (datetime.isoformat)."""
+    if value is None:
+        return None
+    # так пишет репозиторий: datetime.now(timezone.utc).isoformat()
+    if value.endswith("+00:00") and (
+        len(value) == 25 or (len(value) == 32 and value[19] == "." and value[20:26] != "000000")
+    ):
+        return value
+    return datetime.fromisoformat(value.replace("Z", "+00:00")).isoformat()
+
+
+def shift_history_row(item: Dict[str, Any]) -> ShiftHistoryRow:
+    get = item.get
+    if get("type") == "subtask":
+        return SubtaskShiftRow(
+            get("project_id"), get("task_id"), get("task_name"), get("work_type_id"), get("work_type_name"),
+            get("work_kind_id"), get("work_kind_name"), _iso(get("start_time")), _iso(get("end_time")),
+            get("status"), "subtask", get("subtask_id"), get("subtask_name"),
+        )
+    return TaskShiftRow(
+        get("project_id"), get("task_id"), get("task_name"), get("work_type_id"), get("work_type_name"),
+        get("work_kind_id"), get("work_kind_name"), _iso(get("start_time")), _iso(get("end_time")),
+        get("status"), "task",
+    )
+
+
+def dump_shift_history(history: Iterable[Dict[str, Any]]) -> bytes:
+    """JSON-массив истории смен — тело ответа целиком."""
+    return orjson.dumps([shift_history_row(item) for item in history])
+
+
+def dump_shift_history_line(item: Dict[str, Any]) -> bytes:
+    """Одна строка NDJSON."""
+    return orjson.dumps(shift_history_row(item)) + b"\n"
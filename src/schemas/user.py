@@ -1,5 +1,5 @@
 from datetime import datetime, timezone
-from typing import Optional, List
+from typing import Optional, List, Union
 
 from pydantic import BaseModel, EmailStr, Field
 
@@ -17,6 +17,16 @@ class UserInDB(BaseModel):
     created_at: Optional[datetime] = Field(default=datetime.now(timezone.utc))
     managed_projects: List[str] = Field(default_factory=list)
 
+class TokenUser(BaseModel):
+    """Пользователь из claims access-токена — для решений о доступе без чтения индекса users."""
+    id: str
+    role: Optional[str]
+    is_active: Optional[bool] = Field(default=True)
+    managed_projects: List[str] = Field(default_factory=list)
+
+# Текущий пользователь для проверки прав: из токена или из ES
+AccessUser = Union[TokenUser, UserInDB]
+
 class UserPublic(BaseModel):
     id: str
     email: EmailStr
@@ -4,7 +4,13 @@ from typing import Optional
 from fastapi import Depends
 
 from common.exceptions.authorisation import AuthorisationException
-from core.security import create_access_token, create_refresh_token, hash_password, verify_password
+from core.security import (
+    access_claims_enabled,
+    create_access_token,
+    create_refresh_token,
+    hash_password_async,
+    verify_password_async,
+)
 from repository.abc.user_repository import ABCUserRepository
 from repository.elasticsearch_implementation.user_repository import get_user_elastic_repository
 from schemas.auth import Token
@@ -26,17 +32,17 @@ class AuthService:
         user = UserInDB(
             id=str(uuid.uuid4()),
             email=user_data.email,
-            hashed_password=hash_password(user_data.password),
+            hashed_password=await hash_password_async(user_data.password),
         )
         await self.user_repo.create_user(user)
         return UserPublic(id=user.id, email=user.email, role=user.role, is_active=user.is_active)
 
     async def authenticate_user(self, email: str, password: str) -> Token:
         user = await self.user_repo.get_user_by_email(email)
-        if not user or not verify_password(password, user.hashed_password):
+        if not user or not await verify_password_async(password, user.hashed_password):
             raise AuthorisationException("Invalid credentials")
 
-        access_token = create_access_token(user.id)
+        access_token = create_access_token(user.id, user)
         refresh_token = create_refresh_token(user.id)
 
         return Token(access_token=access_token, refresh_token=refresh_token)
@@ -44,9 +50,10 @@ class AuthService:
     async def get_user_by_id(self, user_id: str) -> Optional[UserInDB]:
         return await self.user_repo.get_user_by_id(user_id)
 
-    @staticmethod
-    async def refresh_tokens(user_id: str) -> Token:
-        access_token = create_access_token(user_id)
+    async def refresh_tokens(self, user_id: str) -> Token:
+        # роль и проекты для claims — только если они пишутся в токен
+        user = await self.user_repo.get_user_profile(user_id) if access_claims_enabled() else None
+        access_token = create_access_token(user_id, user)
         refresh_token = create_refresh_token(user_id)
         return Token(access_token=access_token, refresh_token=refresh_token)
 
@@ -59,6 +66,13 @@ class AuthService:
     async def remove_project_from_user(self, user_id: str, project_id: str) -> None:
         return await self.user_repo.remove_project_from_user(user_id, project_id)
 
+    async def reissue_access_token(self, user_id: str) -> Optional[str]:
+        """Access-токен с актуальными правами после их изменения; None, если права в токен не пишутся."""
+        if not access_claims_enabled():
+            return None
+        user = await self.user_repo.get_user_profile(user_id)
+        return create_access_token(user_id, user) if user else None
+
     async def update_user(self, user: UserInDB) -> None:
         return await self.user_repo.update_user(user)
 
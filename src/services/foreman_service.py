@@ -1,49 +1,129 @@
-from typing import Any, Dict, List
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
 
 from fastapi import Depends
 
+from common.exceptions.not_implemented import NotImplementedException
+from core.functions import decode_cursor
 from repository.abc.foreman_repository import ABCForemanRepository
 from repository.elasticsearch_implementation.foreman_repository import get_foreman_elastic_repository
+from schemas.request.shift import BulkShiftRequest
 from schemas.response.construction import (
+    BulkShiftResult,
     ProjectSummary,
-    ShiftHistoryEntry,
     ShiftStatus,
-    TaskShiftEntry,
-    SubtaskShiftEntry,
+    TaskSearchMatch,
     WorkStage,
 )
+from schemas.response.shift_history import dump_shift_history, dump_shift_history_line
 
 
 class ForemanService:
     def __init__(self, repo: ABCForemanRepository):
         self.repo = repo
 
-    async def list_projects(self, foreman_id: str) -> List[ProjectSummary]:
-        projects = await self.repo.get_projects(foreman_id)
-        return [ProjectSummary.parse_obj(project) for project in projects]
+    async def list_projects(
+            self,
+            foreman_id: str,
+            status: Optional[str] = None,
+            name_prefix: Optional[str] = None,
+            cursor: Optional[str] = None,
+            limit: int = 100,
+            use_pit: bool = False,
+    ) -> Tuple[List[ProjectSummary], Optional[str]]:
+        projects, next_cursor = await self.repo.get_projects(foreman_id, status, name_prefix, cursor, limit, use_pit)
+        return [ProjectSummary.parse_obj(project) for project in projects], next_cursor
 
-    async def list_tasks(self, foreman_id: str, project_id: str) -> List[WorkStage]:
-        tasks = await self.repo.get_tasks(foreman_id, project_id)
-        return [WorkStage.parse_obj(stage) for stage in tasks]
+    async def list_tasks(
+            self,
+            foreman_id: str,
+            project_id: str,
+            fields: Optional[List[str]] = None,
+            exclude: Optional[List[str]] = None,
+            stage_id: Optional[str] = None,
+            work_kind_id: Optional[str] = None,
+    ) -> Tuple[List[WorkStage], Optional[str]]:
+        tasks, version = await self.repo.get_tasks(foreman_id, project_id, fields, exclude, stage_id, work_kind_id)
+        return [WorkStage.parse_obj(stage) for stage in tasks], version
 
-    async def start_shift(self, foreman_id: str, project_id: str, task_ids: List[str], subtask_ids: List[str]) -> None:
+    async def search_tasks(
+            self,
+            foreman_id: str,
+            text: str,
+            project_id: Optional[str] = None,
+            cursor: Optional[str] = None,
+            limit: int = 20,
+    ) -> Tuple[List[TaskSearchMatch], Optional[str]]:
+        if not self.repo.supports_task_search:
+            raise NotImplementedException("Task search is not available in the current storage layout")
+        matches, next_cursor = await self.repo.search_tasks(foreman_id, text, project_id, cursor, limit)
+        return [TaskSearchMatch.parse_obj(match) for match in matches], next_cursor
+
+    async def project_version(self, foreman_id: str, project_id: str) -> Optional[str]:
+        return await self.repo.get_project_version(project_id, foreman_id)
+
+    async def start_shift(
+            self, foreman_id: str, project_id: str, task_ids: List[str], subtask_ids: List[str]
+    ) -> Optional[int]:
         return await self.repo.start_shift(foreman_id, project_id, task_ids, subtask_ids)
 
-    async def stop_shift(self, foreman_id: str, project_id: str, task_ids: List[str], subtask_ids: List[str]) -> None:
+    async def stop_shift(
+            self, foreman_id: str, project_id: str, task_ids: List[str], subtask_ids: List[str]
+    ) -> Optional[int]:
         return await self.repo.stop_shift(foreman_id, project_id, task_ids, subtask_ids)
 
-    async def shift_history(self, foreman_id: str, project_id: str) -> List[ShiftHistoryEntry]:
-        history = await self.repo.get_shift_history(foreman_id, project_id)
-        parsed: List[ShiftHistoryEntry] = []
-        for item in history:
-            entry_type = item.get("type")
-            if entry_type == "task":
-                parsed.append(TaskShiftEntry.parse_obj(item))
-            elif entry_type == "subtask":
-                parsed.append(SubtaskShiftEntry.parse_obj(item))
-            else:
-                parsed.append(TaskShiftEntry.parse_obj(item))
-        return parsed
+    async def bulk_shift(self, foreman_id: str, request: BulkShiftRequest) -> BulkShiftResult:
+        items = await self.repo.bulk_shift(foreman_id, [op.dict() for op in request.operations])
+        return BulkShiftResult(items=items)
+
+    async def shift_history(
+            self,
+            foreman_id: str,
+            project_id: str,
+            min_seq_no: Optional[int] = None,
+            date_from: Optional[datetime] = None,
+            date_to: Optional[datetime] = None,
+            cursor: Optional[str] = None,
+            limit: Optional[int] = None,
+    ) -> Tuple[bytes, Optional[str]]:
+        """JSON-тело страницы истории (готовые байты, без повторной валидации) и курсор следующей."""
+        if cursor is not None:
+            decode_cursor(cursor)
+        history, next_cursor = await self.repo.get_shift_history(
+            foreman_id, project_id, min_seq_no, date_from, date_to, cursor, limit
+        )
+        return dump_shift_history(history), next_cursor
+
+    async def stream_shift_history(
+            self,
+            foreman_id: str,
+            project_id: str,
+            min_seq_no: Optional[int] = None,
+            date_from: Optional[datetime] = None,
+            date_to: Optional[datetime] = None,
+            cursor: Optional[str] = None,
+    ) -> AsyncIterator[bytes]:
+        """
+        NDJSON-строки истории смен. Курсор проверяется, а первая запись читается до начала
+        ответа: ожидание min_seq_no (503) и ошибки запроса приходят статусом, а не обрывом потока.
+        """
+        if cursor is not None:
+            decode_cursor(cursor)
+        history = self.repo.iter_shift_history(foreman_id, project_id, min_seq_no, date_from, date_to, cursor)
+        try:
+            first = await history.__anext__()
+        except StopAsyncIteration:
+            first = None
+        return self._ndjson(first, history)
+
+    async def _ndjson(
+            self, first: Optional[Dict[str, Any]], history: AsyncIterator[Dict[str, Any]]
+    ) -> AsyncIterator[bytes]:
+        if first is None:
+            return
+        yield dump_shift_history_line(first)
+        async for item in history:
+            yield dump_shift_history_line(item)
 
     async def shift_status(self, foreman_id: str, project_id: str) -> ShiftStatus:
         status = await self.repo.get_shift_status(foreman_id, project_id)
@@ -1,55 +1,237 @@
-from typing import Any, Dict, List
+from datetime import datetime
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, List, Optional, Tuple, Union
 
+import orjson
 from fastapi import Depends
+from pydantic import ValidationError
 
+from common.exceptions.not_implemented import NotImplementedException
+from core.functions import check_time_zone, decode_cursor, iter_lines
 from repository.abc.manager_repository import ABCManagerRepository
-from repository.elasticsearch_implementation.manager_repository import get_manager_elastic_repository
+from repository.elasticsearch_implementation.manager_repository import (
+    IMPORT_MAX_ERRORS,
+    get_manager_elastic_repository,
+)
+from schemas.request.project_change import ProjectPatchRequest
 from schemas.request.project_create import ProjectCreate
 from schemas.response.construction import (
     OperationResult,
+    ProjectImportResult,
+    ProjectPatchResult,
+    ProjectProgress,
     ProjectSummary,
-    ShiftHistoryEntry,
     StageWithProject,
-    SubtaskShiftEntry,
-    TaskShiftEntry,
+    TaskSearchMatch,
+    WorkedHoursReport,
+)
+from schemas.response.export import (
+    SHIFT_EXPORT_COLUMNS,
+    TASK_EXPORT_COLUMNS,
+    csv_header,
+    dump_shift_row,
+    dump_task_row,
 )
+from schemas.response.shift_history import dump_shift_history, dump_shift_history_line
+
+# Строки выгрузки отдаются клиенту кусками не меньше этого размера
+EXPORT_FLUSH_BYTES = 64 << 10
 
 
 class ManagerService:
     def __init__(self, repo: ABCManagerRepository):
         self.repo = repo
 
-    async def list_projects(self) -> List[ProjectSummary]:
-        projects = await self.repo.get_projects()
-        return [ProjectSummary.parse_obj(project) for project in projects]
-
-    async def list_tasks(self, project_id: str) -> List[StageWithProject]:
-        stages = await self.repo.get_tasks(project_id)
-        return [StageWithProject.parse_obj(stage) for stage in stages]
-
-    async def shift_history(self, project_id: str) -> List[ShiftHistoryEntry]:
-        history = await self.repo.get_shift_history(project_id)
-        parsed: List[ShiftHistoryEntry] = []
-        for item in history:
-            entry_type = item.get("type")
-            if entry_type == "task":
-                parsed.append(TaskShiftEntry.parse_obj(item))
-            elif entry_type == "subtask":
-                parsed.append(SubtaskShiftEntry.parse_obj(item))
-            else:
-                parsed.append(TaskShiftEntry.parse_obj(item))
-        return parsed
+    async def list_projects(
+            self,
+            foreman_id: Optional[str] = None,
+            project_ids: Optional[List[str]] = None,
+            status: Optional[str] = None,
+            name_prefix: Optional[str] = None,
+            cursor: Optional[str] = None,
+            limit: int = 100,
+            use_pit: bool = False,
+    ) -> Tuple[List[ProjectSummary], Optional[str]]:
+        projects, next_cursor = await self.repo.get_projects(
+            foreman_id, project_ids, status, name_prefix, cursor, limit, use_pit
+        )
+        return [ProjectSummary.parse_obj(project) for project in projects], next_cursor
+
+    async def list_tasks(
+            self,
+            project_id: str,
+            fields: Optional[List[str]] = None,
+            exclude: Optional[List[str]] = None,
+            stage_id: Optional[str] = None,
+            work_kind_id: Optional[str] = None,
+    ) -> Tuple[List[StageWithProject], Optional[str]]:
+        stages, version = await self.repo.get_tasks(project_id, fields, exclude, stage_id, work_kind_id)
+        return [StageWithProject.parse_obj(stage) for stage in stages], version
+
+    async def search_tasks(
+            self,
+            text: str,
+            project_ids: Optional[List[str]] = None,
+            project_id: Optional[str] = None,
+            cursor: Optional[str] = None,
+            limit: int = 20,
+    ) -> Tuple[List[TaskSearchMatch], Optional[str]]:
+        if not self.repo.supports_task_search:
+            raise NotImplementedException("Task search is not available in the current storage layout")
+        matches, next_cursor = await self.repo.search_tasks(text, project_ids, project_id, cursor, limit)
+        return [TaskSearchMatch.parse_obj(match) for match in matches], next_cursor
+
+    async def project_version(self, project_id: str) -> Optional[str]:
+        return await self.repo.get_project_version(project_id)
+
+    async def shift_history(
+            self,
+            project_id: str,
+            date_from: Optional[datetime] = None,
+            date_to: Optional[datetime] = None,
+            cursor: Optional[str] = None,
+            limit: Optional[int] = None,
+    ) -> Tuple[bytes, Optional[str]]:
+        if cursor is not None:
+            decode_cursor(cursor)
+        history, next_cursor = await self.repo.get_shift_history(project_id, date_from, date_to, cursor, limit)
+        return dump_shift_history(history), next_cursor
+
+    async def stream_shift_history(
+            self,
+            project_id: str,
+            date_from: Optional[datetime] = None,
+            date_to: Optional[datetime] = None,
+            cursor: Optional[str] = None,
+    ) -> AsyncIterator[bytes]:
+        """NDJSON-строки истории смен; курсор проверяется до начала ответа."""
+        if cursor is not None:
+            decode_cursor(cursor)
+        return self._ndjson(self.repo.iter_shift_history(project_id, date_from, date_to, cursor))
+
+    async def _ndjson(self, history: AsyncIterator[Dict[str, Any]]) -> AsyncIterator[bytes]:
+        async for item in history:
+            yield dump_shift_history_line(item)
+
+    async def export_tasks(self, project_id: str, export_format: str = "ndjson") -> Optional[AsyncIterator[bytes]]:
+        rows = await self.repo.export_tasks(project_id)
+        if rows is None:
+            return None
+        header = csv_header(TASK_EXPORT_COLUMNS) if export_format == "csv" else None
+        return self._export(rows, lambda row: dump_task_row(row, export_format), header)
+
+    async def export_shift_history(
+            self,
+            project_id: str,
+            export_format: str = "ndjson",
+            date_from: Optional[datetime] = None,
+            date_to: Optional[datetime] = None,
+    ) -> Optional[AsyncIterator[bytes]]:
+        history = await self.repo.export_shift_history(project_id, date_from, date_to)
+        if history is None:
+            return None
+        header = csv_header(SHIFT_EXPORT_COLUMNS) if export_format == "csv" else None
+        return self._export(history, lambda item: dump_shift_row(item, export_format), header)
+
+    @staticmethod
+    async def _export(
+            rows: Union[Iterable[Dict[str, Any]], AsyncIterator[Dict[str, Any]]],
+            dump: Callable[[Dict[str, Any]], bytes],
+            header: Optional[bytes] = None,
+    ) -> AsyncIterator[bytes]:
+        """Строки выгрузки по мере чтения, склеенные в куски по EXPORT_FLUSH_BYTES."""
+        buffer = bytearray(header or b"")
+        if isinstance(rows, AsyncIterator):
+            async for row in rows:
+                buffer += dump(row)
+                if len(buffer) >= EXPORT_FLUSH_BYTES:
+                    yield bytes(buffer)
+                    buffer.clear()
+        else:
+            for row in rows:
+                buffer += dump(row)
+                if len(buffer) >= EXPORT_FLUSH_BYTES:
+                    yield bytes(buffer)
+                    buffer.clear()
+        if buffer:
+            yield bytes(buffer)
+
+    async def worked_hours(
+            self,
+            project_id: str,
+            date_from: Optional[datetime] = None,
+            date_to: Optional[datetime] = None,
+            time_zone: str = "UTC",
+    ) -> Optional[WorkedHoursReport]:
+        report = await self.repo.get_worked_hours(project_id, date_from, date_to, check_time_zone(time_zone))
+        return WorkedHoursReport.parse_obj(report) if report is not None else None
+
+    async def progress(self, project_id: str) -> Optional[ProjectProgress]:
+        rollup = await self.repo.get_progress(project_id)
+        return ProjectProgress.parse_obj(rollup) if rollup is not None else None
 
     async def create_project(self, project: ProjectCreate) -> OperationResult:
         response = await self.repo.create_project(project.dict())
         result = response.get("result") or "created"
         return OperationResult(result=result, project_id=project.project_id)
 
+    async def import_projects(self, body: AsyncIterator[bytes], overwrite: bool = True) -> ProjectImportResult:
+        """
+        NDJSON-поток проектов (по ProjectCreate на строку) -> repo.import_projects. Строки
+        разбираются по мере чтения; невалидные попадают в ошибки и в ES не уходят.
+        """
+        counters = {"lines": 0, "invalid": 0}
+        invalid: List[Dict[str, Any]] = []
+
+        async def projects() -> AsyncIterator[Tuple[int, Dict[str, Any]]]:
+            line_no = 0
+            async for line in iter_lines(body):
+                line_no += 1
+                if not line.strip():
+                    continue
+                counters["lines"] += 1
+                try:
+                    project = ProjectCreate.parse_obj(orjson.loads(line))
+                except orjson.JSONDecodeError as e:
+                    error = f"invalid JSON: {e}"
+                except ValidationError as e:
+                    error = "; ".join(f"{'.'.join(map(str, item['loc']))}: {item['msg']}" for item in e.errors())
+                else:
+                    yield line_no, project.dict()
+                    continue
+                counters["invalid"] += 1
+                if len(invalid) < IMPORT_MAX_ERRORS:
+                    invalid.append({"line": line_no, "project_id": None, "error": error})
+
+        report = await self.repo.import_projects(projects(), overwrite)
+        seconds = report["seconds"]
+        written = report["created"] + report["updated"]
+        return ProjectImportResult(
+            lines=counters["lines"],
+            created=report["created"],
+            updated=report["updated"],
+            failed=report["failed"] + counters["invalid"],
+            errors=sorted(invalid + report["errors"], key=lambda item: item["line"])[:IMPORT_MAX_ERRORS],
+            chunks=report["chunks"],
+            bytes=report["bytes"],
+            seconds=seconds,
+            projects_per_second=written / seconds if seconds else 0.0,
+            megabytes_per_second=report["bytes"] / (1 << 20) / seconds if seconds else 0.0,
+        )
+
     async def change_project(self, project_id: str, key: str, value: Any) -> OperationResult:
         response = await self.repo.change_project(project_id, key, value)
         result = response.get("result") or "updated"
         response_project_id = response.get("project_id") or project_id
-        return OperationResult(result=result, project_id=response_project_id)
+        return OperationResult(
+            result=result,
+            project_id=response_project_id,
+            seq_no=response.get("seq_no"),
+            version=response.get("version"),
+        )
+
+    async def patch_project(self, project_id: str, request: ProjectPatchRequest) -> ProjectPatchResult:
+        operations = [operation.dict() for operation in request.operations]
+        return ProjectPatchResult.parse_obj(await self.repo.patch_project(project_id, operations))
 
 
 def get_manager_service(
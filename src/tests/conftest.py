@@ -0,0 +1,38 @@
+from typing import Any, Dict
+
+import pytest
+
+from tests.fake_elastic import FakeElasticsearch, load_index_mappings
+from benchmarks.synthetic import make_project
+from repository.base.elastic_repository import PATH_INDEX_FIELD, BaseElasticRepository
+from repository.elasticsearch_implementation.foreman_repository import ElasticForemanRepository
+
+FOREMAN_ID = "f1"
+PROJECT_ID = "p1"
+
+
+@pytest.fixture
+def anyio_backend() -> str:
+    return "asyncio"
+
+
+@pytest.fixture
+async def es() -> FakeElasticsearch:
+    """FakeElasticsearch с индексами по mapping из dev-data (имена индексов — как в dev-data)."""
+    client = FakeElasticsearch()
+    for index, mappings in load_index_mappings().items():
+        await client.indices.create(index=index, mappings=mappings)
+    return client
+
+
+def small_project(project_id: str = PROJECT_ID, foreman_id: str = FOREMAN_ID) -> Dict[str, Any]:
+    """Проект 1 * 1 * 1 * 2 * 2: подзадачи s0-k0-t0-a{0,1}-b{0,1}."""
+    src = make_project(project_id, foreman_id, stages=1, work_kinds=1, work_types=1, tasks=2, subtasks=2)
+    src[PATH_INDEX_FIELD] = BaseElasticRepository.build_path_index(src)
+    return src
+
+
+@pytest.fixture
+async def foreman_repo(es: FakeElasticsearch) -> ElasticForemanRepository:
+    await es.index(index="construction", id=PROJECT_ID, document=small_project())
+    return ElasticForemanRepository(es, "construction", "shift_events", "shift_state")
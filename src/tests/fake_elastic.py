@@ -0,0 +1,414 @@
+"""
+Elasticsearch в памяти процесса для тестов и бенчмарков.
+
+Реализует только те вызовы AsyncElasticsearch, которые делает ElasticForemanRepository:
+get/mget (с _source_includes), search/count/msearch (bool.filter из term/terms/range,
+sort, search_after), create/update/index (с if_seq_no/if_primary_term) и bulk (в том числе delete).
+Типы полей берутся из mapping индекса (dev-data/actual_es_commands): поля date
+сравниваются как даты, а не как строки.
+"""
+import asyncio
+import copy
+import json
+import re
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import elasticsearch
+from elastic_transport import ApiResponseMeta, HttpHeaders, NodeConfig
+
+from core.functions import parse_datetime
+
+ES_COMMANDS_PATH = Path(__file__).resolve().parents[2] / "dev-data" / "actual_es_commands"
+PRIMARY_TERM = 1
+
+
+def load_index_mappings(path: Path = ES_COMMANDS_PATH) -> Dict[str, Dict[str, Any]]:
+    """mappings из команд вида `PUT <index>` + JSON-тело (dev console Kibana)."""
+    text = path.read_text(encoding="utf-8")
+    decoder = json.JSONDecoder()
+    mappings = {}
+    for match in re.finditer(r"^PUT (\w+)\s*$", text, flags=re.M):
+        body, _ = decoder.raw_decode(text[match.end():].lstrip())
+        mappings[match.group(1)] = body.get("mappings", {})
+    return mappings
+
+
+def _error(cls, status: int, message: str):
+    meta = ApiResponseMeta(status, "1.1", HttpHeaders(), 0.0, NodeConfig("http", "fake", 9200))
+    return cls(message, meta=meta, body={"error": {"type": message}, "status": status})
+
+
+def _field_types(properties: Dict[str, Any], prefix: str = "") -> Dict[str, str]:
+    types = {}
+    for name, spec in properties.items():
+        if "properties" in spec:
+            types.update(_field_types(spec["properties"], f"{prefix}{name}."))
+        if "type" in spec:
+            types[f"{prefix}{name}"] = spec["type"]
+    return types
+
+
+def _get_path(src: Any, path: str) -> Any:
+    for part in path.split("."):
+        if not isinstance(src, dict):
+            return None
+        src = src.get(part)
+    return src
+
+
+def _filter_source(src: Any, paths: List[List[str]]) -> Any:
+    """Source filtering по includes; списки (nested) фильтруются поэлементно."""
+    if any(not path for path in paths):
+        return copy.deepcopy(src)
+    if isinstance(src, list):
+        return [_filter_source(item, paths) for item in src]
+    if not isinstance(src, dict):
+        return None
+    grouped: Dict[str, List[List[str]]] = {}
+    for path in paths:
+        grouped.setdefault(path[0], []).append(path[1:])
+    return {key: _filter_source(src[key], rest) for key, rest in grouped.items() if key in src}
+
+
+def _sort_value(data: "_Index", src: Dict[str, Any], field: str) -> Any:
+    """Значение sort в hit: даты, как в ES, — epoch millis (точность date — миллисекунды)."""
+    value = data.value(src, field)
+    if isinstance(value, datetime):
+        return _sort_date(value)
+    return value
+
+
+def _sort_date(value: Any) -> int:
+    if isinstance(value, int):
+        return value
+    if not isinstance(value, datetime):
+        value = parse_datetime(value)
+    return int(value.timestamp() * 1000)
+
+
+class _Index:
+    def __init__(self, mappings: Dict[str, Any]):
+        self.types = _field_types(mappings.get("properties", {}))
+        self.docs: Dict[str, Tuple[Dict[str, Any], int]] = {}
+        self.seq_no = -1
+        self.versions: Dict[str, int] = {}
+        # keyword-поле -> значение -> id документов, чтобы term-фильтры не сканировали весь индекс
+        self.terms: Dict[str, Dict[Any, set]] = {}
+
+    def put(self, doc_id: str, src: Dict[str, Any]) -> None:
+        previous = self.docs.get(doc_id)
+        for field, kind in self.types.items():
+            if kind != "keyword":
+                continue
+            values = self.terms.setdefault(field, {})
+            if previous is not None:
+                self._unindex_term(values, _get_path(previous[0], field), doc_id)
+            value = _get_path(src, field)
+            if value is not None and not isinstance(value, (list, dict)):
+                values.setdefault(value, set()).add(doc_id)
+        self.seq_no += 1
+        self.docs[doc_id] = (src, self.seq_no)
+        self.versions[doc_id] = self.versions.get(doc_id, 0) + 1
+
+    def remove(self, doc_id: str) -> bool:
+        previous = self.docs.pop(doc_id, None)
+        if previous is None:
+            return False
+        for field, values in self.terms.items():
+            self._unindex_term(values, _get_path(previous[0], field), doc_id)
+        self.seq_no += 1
+        return True
+
+    @staticmethod
+    def _unindex_term(values: Dict[Any, set], value: Any, doc_id: str) -> None:
+        # списки и объекты в terms не попадают (см. put)
+        if not isinstance(value, (list, dict)):
+            values.get(value, set()).discard(doc_id)
+
+    def candidates(self, query: Dict[str, Any]) -> Iterable[str]:
+        """Самый узкий набор id по term/terms из bool.filter; без них — весь индекс."""
+        best = None
+        for clause in query.get("bool", {}).get("filter") or []:
+            (kind, spec), = clause.items()
+            if kind not in ("term", "terms"):
+                continue
+            (field, value), = spec.items()
+            if self.types.get(field) != "keyword":
+                continue
+            values = self.terms.get(field, {})
+            if kind == "term":
+                ids = values.get(value["value"] if isinstance(value, dict) else value, set())
+            else:
+                ids = set().union(*(values.get(item, set()) for item in value))
+            if best is None or len(ids) < len(best):
+                best = ids
+        return list(best) if best is not None else list(self.docs)
+
+    def value(self, src: Dict[str, Any], field: str) -> Any:
+        value = _get_path(src, field)
+        if value is not None and self.types.get(field) == "date":
+            return parse_datetime(value)
+        return value
+
+
+class _Indices:
+    def __init__(self, client: "FakeElasticsearch"):
+        self.client = client
+
+    async def create(self, index: str, mappings: Optional[Dict[str, Any]] = None, **kwargs):
+        if index in self.client.indices_data:
+            raise _error(elasticsearch.BadRequestError, 400, "resource_already_exists_exception")
+        self.client.indices_data[index] = _Index(mappings or {})
+        return {"acknowledged": True, "index": index}
+
+    async def exists(self, index: str, **kwargs) -> bool:
+        return index in self.client.indices_data
+
+    async def put_mapping(self, index: str, properties: Dict[str, Any], **kwargs):
+        self.client._index(index).types.update(_field_types(properties))
+        return {"acknowledged": True}
+
+    async def refresh(self, index: Optional[str] = None, **kwargs):
+        return {}
+
+
+class FakeElasticsearch:
+    def __init__(self, latency_ms: float = 0.0):
+        """latency_ms — искусственная задержка на каждый запрос (сеть до ES)."""
+        self.indices_data: Dict[str, _Index] = {}
+        self.indices = _Indices(self)
+        self.latency = latency_ms / 1000
+        self.requests = 0
+
+    async def _roundtrip(self) -> None:
+        self.requests += 1
+        await asyncio.sleep(self.latency)
+
+    def _index(self, name: str) -> _Index:
+        if name not in self.indices_data:
+            raise _error(elasticsearch.NotFoundError, 404, "index_not_found_exception")
+        return self.indices_data[name]
+
+    # --- запись
+
+    def _write(
+            self,
+            index: str,
+            doc_id: str,
+            document: Dict[str, Any],
+            create: bool = False,
+            if_seq_no: Optional[int] = None,
+            partial: bool = False,
+    ) -> Dict[str, Any]:
+        data = self.indices_data.setdefault(index, _Index({}))
+        current = data.docs.get(doc_id)
+        if create and current is not None:
+            raise _error(elasticsearch.ConflictError, 409, "version_conflict_engine_exception")
+        if if_seq_no is not None and (current is None or current[1] != if_seq_no):
+            raise _error(elasticsearch.ConflictError, 409, "version_conflict_engine_exception")
+        if partial:
+            if current is None:
+                raise _error(elasticsearch.NotFoundError, 404, "document_missing_exception")
+            document = {**current[0], **document}
+        data.put(doc_id, copy.deepcopy(document))
+        return {
+            "_index": index,
+            "_id": doc_id,
+            "_version": data.versions[doc_id],
+            "_seq_no": data.seq_no,
+            "_primary_term": PRIMARY_TERM,
+            "result": "created" if current is None else "updated",
+        }
+
+    def _delete(self, index: str, doc_id: str) -> Dict[str, Any]:
+        data = self.indices_data.get(index)
+        if data is None or not data.remove(doc_id):
+            return {"_index": index, "_id": doc_id, "result": "not_found", "status": 404}
+        return {"_index": index, "_id": doc_id, "_seq_no": data.seq_no, "result": "deleted", "status": 200}
+
+    async def create(self, index: str, id: str, document: Dict[str, Any], **kwargs):
+        await self._roundtrip()
+        return self._write(index, id, document, create=True)
+
+    async def index(self, index: str, id: str, document: Dict[str, Any], if_seq_no: Optional[int] = None, **kwargs):
+        await self._roundtrip()
+        return self._write(index, id, document, if_seq_no=if_seq_no)
+
+    async def update(self, index: str, id: str, doc: Dict[str, Any], if_seq_no: Optional[int] = None, **kwargs):
+        await self._roundtrip()
+        return self._write(index, id, doc, if_seq_no=if_seq_no, partial=True)
+
+    async def delete(self, index: str, id: str, ignore: Optional[List[int]] = None, **kwargs):
+        await self._roundtrip()
+        result = self._delete(index, id)
+        if result["result"] == "not_found" and not (ignore and 404 in ignore):
+            raise _error(elasticsearch.NotFoundError, 404, "not_found")
+        return result
+
+    async def bulk(self, operations: List[Dict[str, Any]], **kwargs):
+        await self._roundtrip()
+        items = []
+        operations = iter(operations)
+        for header in operations:
+            (op_type, meta), = header.items()
+            if op_type == "delete":
+                items.append({op_type: self._delete(meta["_index"], meta["_id"])})
+                continue
+            body = next(operations)
+            if isinstance(body, (bytes, str)):
+                body = json.loads(body)
+            try:
+                result = self._write(
+                    meta["_index"],
+                    meta["_id"],
+                    body["doc"] if op_type == "update" else body,
+                    create=op_type == "create",
+                    if_seq_no=meta.get("if_seq_no"),
+                    partial=op_type == "update",
+                )
+                result["status"] = 201 if result["result"] == "created" else 200
+            except elasticsearch.ApiError as e:
+                result = {"_index": meta["_index"], "_id": meta["_id"], "status": e.meta.status, "error": e.body}
+            items.append({op_type: result})
+        return {"errors": any("error" in next(iter(item.values())) for item in items), "items": items}
+
+    # --- чтение
+
+    def _hit(self, index: str, doc_id: str, includes: Optional[Iterable[str]] = None) -> Dict[str, Any]:
+        src, seq_no = self._index(index).docs[doc_id]
+        source = _filter_source(src, [path.split(".") for path in includes]) if includes else copy.deepcopy(src)
+        return {
+            "_index": index,
+            "_id": doc_id,
+            "_seq_no": seq_no,
+            "_primary_term": PRIMARY_TERM,
+            "found": True,
+            "_source": source,
+        }
+
+    async def get(
+            self,
+            index: str,
+            id: str,
+            _source_includes: Optional[List[str]] = None,
+            ignore: Optional[List[int]] = None,
+            **kwargs,
+    ):
+        await self._roundtrip()
+        if id not in self._index(index).docs:
+            if ignore and 404 in ignore:
+                return {"_index": index, "_id": id, "found": False}
+            raise _error(elasticsearch.NotFoundError, 404, "not_found")
+        return self._hit(index, id, _source_includes)
+
+    async def mget(
+            self,
+            docs: Optional[List[Dict[str, Any]]] = None,
+            index: Optional[str] = None,
+            ids: Optional[List[str]] = None,
+            **kwargs,
+    ):
+        await self._roundtrip()
+        requests = docs or [{"_index": index, "_id": doc_id} for doc_id in ids or []]
+        result = []
+        for request in requests:
+            data = self.indices_data.get(request["_index"])
+            if data is None or request["_id"] not in data.docs:
+                result.append({"_index": request["_index"], "_id": request["_id"], "found": False})
+                continue
+            includes = (request.get("_source") or {}).get("includes")
+            result.append(self._hit(request["_index"], request["_id"], includes))
+        return {"docs": result}
+
+    def _matches(self, data: _Index, src: Dict[str, Any], query: Dict[str, Any]) -> bool:
+        (kind, spec), = query.items()
+        if kind == "match_all":
+            return True
+        if kind == "bool":
+            clauses = (spec.get("filter") or []) + (spec.get("must") or [])
+            return all(self._matches(data, src, clause) for clause in clauses)
+        (field, condition), = spec.items()
+        value = _get_path(src, field)
+        if kind == "term":
+            return value == (condition["value"] if isinstance(condition, dict) else condition)
+        if kind == "terms":
+            return value in condition
+        if kind == "range":
+            value = data.value(src, field)
+            if value is None:
+                return False
+            for op, bound in condition.items():
+                if data.types.get(field) == "date":
+                    bound = parse_datetime(bound)
+                if not {"gte": value >= bound, "gt": value > bound, "lte": value <= bound, "lt": value < bound}[op]:
+                    return False
+            return True
+        raise NotImplementedError(f"Query {kind} is not supported by FakeElasticsearch")
+
+    def _search(
+            self,
+            index: str,
+            query: Optional[Dict[str, Any]] = None,
+            size: int = 10,
+            sort: Optional[List[Dict[str, str]]] = None,
+            search_after: Optional[List[Any]] = None,
+            _source: Any = None,
+            ignore_unavailable: bool = False,
+            **kwargs,
+    ) -> Dict[str, Any]:
+        if index not in self.indices_data and ignore_unavailable:
+            return {"hits": {"total": {"value": 0}, "hits": []}}
+        data = self._index(index)
+        query = query or {"match_all": {}}
+        matched = [doc_id for doc_id in data.candidates(query) if self._matches(data, data.docs[doc_id][0], query)]
+        hits = []
+        sort_fields = [next(iter(item.items())) for item in sort or []]
+        for doc_id in matched:
+            hit = {"_id": doc_id, "_index": index}
+            if sort_fields:
+                hit["sort"] = [_sort_value(data, data.docs[doc_id][0], field) for field, _ in sort_fields]
+            hits.append(hit)
+        # поля сортировки здесь только asc, как в запросах репозитория
+        if sort_fields:
+            hits.sort(key=lambda hit: tuple(hit["sort"]))
+            if search_after is not None:
+                after = tuple(
+                    _sort_date(value) if data.types.get(field) == "date" else value
+                    for value, (field, _) in zip(search_after, sort_fields)
+                )
+                hits = [hit for hit in hits if tuple(hit["sort"]) > after]
+        includes = _source.get("includes") if isinstance(_source, dict) else _source
+        result = []
+        for hit in hits[:size]:
+            hit.update(self._hit(index, hit["_id"], includes))
+            del hit["found"]
+            result.append(hit)
+        return {"hits": {"total": {"value": len(matched)}, "hits": result}}
+
+    async def search(self, index: str, **kwargs):
+        await self._roundtrip()
+        return self._search(index, **kwargs)
+
+    async def count(
+            self, index: str, query: Optional[Dict[str, Any]] = None, ignore_unavailable: bool = False, **kwargs
+    ):
+        await self._roundtrip()
+        if index not in self.indices_data and ignore_unavailable:
+            return {"count": 0}
+        data = self._index(index)
+        query = query or {"match_all": {}}
+        matched = [doc_id for doc_id in data.candidates(query) if self._matches(data, data.docs[doc_id][0], query)]
+        return {"count": len(matched)}
+
+    async def msearch(self, searches: List[Dict[str, Any]], **kwargs):
+        await self._roundtrip()
+        responses = []
+        for header, body in zip(searches[::2], searches[1::2]):
+            ignore_unavailable = header.get("ignore_unavailable", False)
+            responses.append(self._search(header["index"], ignore_unavailable=ignore_unavailable, **body))
+        return {"responses": responses}
+
+    async def close(self) -> None:
+        return None
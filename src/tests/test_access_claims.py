@@ -0,0 +1,70 @@
+import time
+
+import pytest
+
+from core import security
+from core.environment_config import settings
+from schemas.user import UserInDB
+
+
+@pytest.fixture(autouse=True)
+def claims_mode(monkeypatch):
+    monkeypatch.setattr(settings.jwt, "access_token_claims", True)
+    monkeypatch.setattr(settings.redis, "user_cache_enabled", True)
+    monkeypatch.setattr(security, "changed_users", {})
+    monkeypatch.setattr(security, "claims_valid_since", 0.0)
+
+
+def claims_payload(user_id: str) -> dict:
+    user = UserInDB(id=user_id, email=f"{user_id}@example.com", hashed_password="", role="root")
+    return security.decode_jwt_token(security.create_access_token(user_id, user))
+
+
+def issued_after_now() -> None:
+    # iat и время изменения — одни и те же часы с микросекундами
+    time.sleep(0.001)
+
+
+def test_change_outdates_earlier_tokens_only():
+    payload = claims_payload("u1")
+    issued_after_now()
+
+    security.mark_user_changed("u1")
+    issued_after_now()
+
+    assert security.claims_outdated(payload)
+    assert security.token_user(payload) is None
+    assert not security.claims_outdated(claims_payload("u1"))
+    assert not security.claims_outdated(claims_payload("u2"))
+
+
+@pytest.mark.parametrize("verified_token_cache_size", [0, 1])
+def test_changes_do_not_depend_on_token_cache_size(monkeypatch, verified_token_cache_size):
+    monkeypatch.setattr(settings.jwt, "verified_token_cache_size", verified_token_cache_size)
+    payload = claims_payload("u1")
+    issued_after_now()
+
+    for user_id in ("u1", "u2", "u3"):
+        security.mark_user_changed(user_id)
+
+    assert security.claims_outdated(payload)
+
+
+def test_overflow_outdates_all_claims(monkeypatch):
+    monkeypatch.setattr(settings.jwt, "access_token_claims_changes_max", 2)
+    untouched = claims_payload("u9")
+    issued_after_now()
+
+    for user_id in ("u1", "u2", "u3"):
+        security.mark_user_changed(user_id)
+
+    assert security.claims_outdated(untouched)
+    assert security.changed_users == {}
+
+
+def test_changes_older_than_token_lifetime_are_dropped():
+    security.changed_users["old"] = time.time() - settings.jwt.access_token_expire_minutes * 60 - 1
+
+    security.mark_user_changed("u1")
+
+    assert list(security.changed_users) == ["u1"]
@@ -0,0 +1,49 @@
+import pytest
+
+from core.functions import encode_cursor
+from tests.conftest import FOREMAN_ID, PROJECT_ID
+
+pytestmark = pytest.mark.anyio
+
+SUBTASKS = ["s0-k0-t0-a0-b0", "s0-k0-t0-a0-b1", "s0-k0-t0-a1-b0"]
+
+
+@pytest.mark.parametrize("cursor", [
+    "not base64 json!",
+    encode_cursor([]),
+    encode_cursor([1]),
+    encode_cursor(["2025-01-01", "event"]),
+    encode_cursor([True, "event"]),
+    encode_cursor([1, 2]),
+    encode_cursor([1, "event", "extra"]),
+])
+async def test_shift_history_rejects_malformed_cursor(foreman_repo, cursor):
+    with pytest.raises(ValueError, match="Invalid cursor"):
+        await foreman_repo.get_shift_history(FOREMAN_ID, PROJECT_ID, cursor=cursor, limit=10)
+
+
+async def test_shift_history_pages_with_cursor(foreman_repo):
+    for subtask_id in SUBTASKS:
+        await foreman_repo.start_shift(FOREMAN_ID, PROJECT_ID, [], [subtask_id])
+
+    first, cursor = await foreman_repo.get_shift_history(FOREMAN_ID, PROJECT_ID, limit=2)
+    second, last_cursor = await foreman_repo.get_shift_history(FOREMAN_ID, PROJECT_ID, cursor=cursor, limit=2)
+
+    assert [entry["subtask_id"] for entry in first + second] == SUBTASKS
+    assert last_cursor is None
+
+
+@pytest.mark.parametrize("cursor", [
+    encode_cursor([[PROJECT_ID]]),
+    encode_cursor(["p1", None]),
+    encode_cursor([[PROJECT_ID], 1]),
+])
+async def test_projects_page_rejects_malformed_cursor(foreman_repo, cursor):
+    with pytest.raises(ValueError, match="Invalid cursor"):
+        await foreman_repo.get_projects(FOREMAN_ID, cursor=cursor)
+
+
+@pytest.mark.parametrize("cursor", [encode_cursor([-1]), encode_cursor(["10"]), encode_cursor([1, 2])])
+async def test_task_search_rejects_malformed_cursor(foreman_repo, cursor):
+    with pytest.raises(ValueError, match="Invalid cursor"):
+        await foreman_repo.search_tasks(FOREMAN_ID, "task", cursor=cursor)
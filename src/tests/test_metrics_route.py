@@ -0,0 +1,22 @@
+import pytest
+from fastapi import HTTPException
+
+from api import index
+from core.dependencies import get_access_user
+from schemas.user import TokenUser
+
+pytestmark = pytest.mark.anyio
+
+
+def test_metrics_route_requires_authenticated_user():
+    route = next(route for route in index.router.routes if route.path == "/metrics")
+
+    assert get_access_user in [dependency.call for dependency in route.dependant.dependencies]
+
+
+async def test_metrics_are_for_root_only():
+    with pytest.raises(HTTPException) as error:
+        await index.get_metrics(TokenUser(id="u1", role="project_manager"))
+
+    assert error.value.status_code == 403
+    assert isinstance(await index.get_metrics(TokenUser(id="root", role="root")), dict)
@@ -0,0 +1,94 @@
+import elasticsearch
+import pytest
+from elastic_transport import ApiResponseMeta, HttpHeaders, NodeConfig
+
+from repository.elasticsearch_implementation import manager_repository as manager_module
+from repository.elasticsearch_implementation.manager_repository import ElasticManagerRepository
+from tests.conftest import small_project
+
+pytestmark = pytest.mark.anyio
+
+
+async def numbered(projects):
+    for line, project in enumerate(projects, 1):
+        yield line, project
+
+
+def projects(count):
+    return [small_project(f"p{i}") for i in range(count)]
+
+
+@pytest.fixture
+def manager_repo(es, monkeypatch):
+    # по куску на проект: ошибки одного куска не задевают остальные
+    monkeypatch.setattr(manager_module, "IMPORT_CHUNK_MAX_DOCS", 1)
+    return ElasticManagerRepository(es, "construction", "shift_events")
+
+
+def failing_bulk(es, fail_on, error):
+    original = es.bulk
+    calls = {"n": 0}
+
+    async def bulk(*args, **kwargs):
+        calls["n"] += 1
+        if calls["n"] == fail_on:
+            raise error
+        return await original(*args, **kwargs)
+
+    return bulk
+
+
+async def test_existing_projects_are_reported_per_line_without_overwrite(es, manager_repo):
+    await es.index(index="construction", id="p1", document=small_project("p1"))
+
+    report = await manager_repo.import_projects(numbered(projects(3)), overwrite=False)
+
+    assert (report["created"], report["failed"]) == (2, 1)
+    assert [(error["line"], error["project_id"]) for error in report["errors"]] == [(2, "p1")]
+
+
+async def test_failed_bulk_request_fails_its_lines(es, manager_repo, monkeypatch):
+    error = elasticsearch.ConnectionError("connection refused")
+    monkeypatch.setattr(es, "bulk", failing_bulk(es, 2, error))
+
+    report = await manager_repo.import_projects(numbered(projects(3)))
+
+    assert (report["created"], report["failed"]) == (2, 1)
+    assert report["errors"][0]["line"] == 2
+    assert "bulk request failed" in report["errors"][0]["error"]
+
+
+async def test_unexpected_chunk_error_is_reported_not_lost(es, manager_repo, monkeypatch):
+    monkeypatch.setattr(es, "bulk", failing_bulk(es, 1, KeyError("items")))
+
+    report = await manager_repo.import_projects(numbered(projects(3)))
+
+    assert (report["created"], report["failed"]) == (2, 1)
+    assert report["errors"] == [{"line": 1, "project_id": "p0", "error": "import failed: 'items'"}]
+
+
+async def test_rejected_items_are_retried(es, manager_repo, monkeypatch):
+    monkeypatch.setattr(manager_module, "IMPORT_RETRY_SECONDS", 0)
+    meta = ApiResponseMeta(429, "1.1", HttpHeaders(), 0.0, NodeConfig("http", "localhost", 9200))
+    error = elasticsearch.ApiError("too many requests", meta=meta, body={})
+    monkeypatch.setattr(es, "bulk", failing_bulk(es, 1, error))
+
+    report = await manager_repo.import_projects(numbered(projects(2)))
+
+    assert (report["created"], report["failed"]) == (2, 0)
+
+
+async def test_rollup_failure_is_reported_for_written_lines(es, monkeypatch):
+    monkeypatch.setattr(manager_module, "IMPORT_CHUNK_MAX_DOCS", 1)
+
+    class BrokenRollups:
+        async def write_trees(self, trees):
+            raise RuntimeError("rollups index is read-only")
+
+    repo = ElasticManagerRepository(es, "construction", "shift_events", rollups=BrokenRollups())
+
+    report = await repo.import_projects(numbered(projects(2)))
+
+    assert (report["created"], report["failed"]) == (2, 0)
+    assert [error["line"] for error in report["errors"]] == [1, 2]
+    assert "progress rollup not updated" in report["errors"][0]["error"]
@@ -0,0 +1,105 @@
+import pytest
+
+from repository.base.elastic_repository import PATH_INDEX_FIELD
+from repository.elasticsearch_implementation.manager_repository import ElasticManagerRepository
+from tests.conftest import PROJECT_ID, small_project
+
+pytestmark = pytest.mark.anyio
+
+TASK_PATH = "work_stages.0.work_kinds.0.work_types.0.tasks.0"
+SUBTASK_PATH = f"{TASK_PATH}.subtasks.0"
+
+
+@pytest.fixture
+async def manager(es, monkeypatch):
+    await es.index(index="construction", id=PROJECT_ID, document=small_project())
+    scripts = []
+
+    async def scripted_update(index, id, script, if_seq_no=None, **kwargs):
+        # fake не исполняет painless: операции применяются тем же _apply_patch_operation
+        params = script["params"]
+        scripts.append(params)
+        src = (await es.get(index=index, id=id))["_source"]
+        for operation in params["operations"]:
+            ElasticManagerRepository._apply_patch_operation(src, {
+                **operation,
+                "path": ".".join(map(str, operation["path"])),
+                "from_path": ".".join(map(str, operation["from_path"])) if operation["from_path"] else None,
+            })
+        if params["path_index"] is not None:
+            src[params["path_index_field"]] = params["path_index"]
+        return await es.index(index=index, id=id, document=src, if_seq_no=if_seq_no)
+
+    monkeypatch.setattr(es, "update", scripted_update)
+    repo = ElasticManagerRepository(es, "construction", "shift_events")
+    repo.scripts = scripts
+    return repo
+
+
+async def project(es):
+    return (await es.get(index="construction", id=PROJECT_ID))["_source"]
+
+
+async def patch(manager, *operations):
+    resp = await manager.patch_project(PROJECT_ID, list(operations))
+    assert resp["result"] == "updated", resp
+    assert [item["result"] for item in resp["operations"]] == ["applied"] * len(operations)
+    return resp
+
+
+async def test_report_link_add_and_remove_reach_elastic(es, manager):
+    await patch(manager, {"op": "add", "path": f"{SUBTASK_PATH}.reportLinks.-", "value": "https://r/1"})
+    await patch(manager, {"op": "add", "path": f"{SUBTASK_PATH}.reportLinks.-", "value": "https://r/2"})
+    await patch(manager, {"op": "remove", "path": f"{SUBTASK_PATH}.reportLinks.0"})
+
+    subtask = (await project(es))["work_stages"][0]["work_kinds"][0]["work_types"][0]["tasks"][0]["subtasks"][0]
+    assert subtask["reportLinks"] == ["https://r/2"]
+    assert all(params["path_index"] is None for params in manager.scripts)
+
+
+async def test_time_interval_remove_reaches_elastic(es, manager):
+    intervals = [
+        {"start_time": f"2025-01-0{day}T08:00:00+00:00", "end_time": f"2025-01-0{day}T17:00:00+00:00"}
+        for day in (1, 2)
+    ]
+    await patch(manager, {"op": "set", "path": f"{TASK_PATH}.time_intervals", "value": intervals})
+
+    await patch(manager, {"op": "remove", "path": f"{TASK_PATH}.time_intervals.0"})
+
+    task = (await project(es))["work_stages"][0]["work_kinds"][0]["work_types"][0]["tasks"][0]
+    assert task["time_intervals"] == intervals[1:]
+    assert manager.scripts[-1]["path_index"] is None
+
+
+async def test_change_project_sets_leaf_array(es, manager):
+    resp = await manager.change_project(PROJECT_ID, f"{SUBTASK_PATH}.reportLinks", ["https://r/1"])
+
+    assert resp["result"] == "updated"
+    subtask = (await project(es))["work_stages"][0]["work_kinds"][0]["work_types"][0]["tasks"][0]["subtasks"][0]
+    assert subtask["reportLinks"] == ["https://r/1"]
+    assert manager.scripts[-1]["path_index"] is None
+
+
+async def test_subtask_remove_rebuilds_path_index(es, manager):
+    await patch(manager, {"op": "remove", "path": SUBTASK_PATH})
+
+    src = await project(es)
+    assert manager.scripts[-1]["path_index"] == ElasticManagerRepository.build_path_index(src)
+    assert src[PATH_INDEX_FIELD] == manager.scripts[-1]["path_index"]
+
+
+@pytest.mark.parametrize("key, structural", [
+    ("work_stages", True),
+    ("work_stages.-", True),
+    (f"{TASK_PATH}.subtasks.1", True),
+    (f"{SUBTASK_PATH}.subtask_id", True),
+    (f"{TASK_PATH}.subtasks", True),
+    (f"{SUBTASK_PATH}.reportLinks.-", False),
+    (f"{SUBTASK_PATH}.reportLinks", False),
+    (f"{TASK_PATH}.time_intervals.0", False),
+    (f"{SUBTASK_PATH}.properties.0", False),
+    (f"{SUBTASK_PATH}.subtask_name", False),
+    ("project_name", False),
+])
+def test_only_tree_container_paths_are_structural(key, structural):
+    assert ElasticManagerRepository._touches_path_index(key) is structural
@@ -0,0 +1,41 @@
+import pytest
+
+from common.exceptions.service_unavailable import ServiceUnavailableException
+from repository.base import elastic_repository
+from services.foreman_service import ForemanService
+from tests.conftest import FOREMAN_ID, PROJECT_ID
+
+pytestmark = pytest.mark.anyio
+
+SUBTASK_ID = "s0-k0-t0-a0-b0"
+
+
+async def test_min_seq_no_waits_for_written_events(foreman_repo):
+    seq_no = await foreman_repo.start_shift(FOREMAN_ID, PROJECT_ID, [], [SUBTASK_ID])
+
+    history, _ = await foreman_repo.get_shift_history(FOREMAN_ID, PROJECT_ID, min_seq_no=seq_no)
+
+    assert [entry["subtask_id"] for entry in history] == [SUBTASK_ID]
+
+
+async def test_min_seq_no_not_visible_answers_503(foreman_repo, monkeypatch):
+    monkeypatch.setattr(elastic_repository, "SHIFT_READ_WAIT_SECONDS", 0.05)
+    monkeypatch.setattr(elastic_repository, "SHIFT_READ_POLL_SECONDS", 0.01)
+    seq_no = await foreman_repo.start_shift(FOREMAN_ID, PROJECT_ID, [], [SUBTASK_ID])
+
+    with pytest.raises(ServiceUnavailableException):
+        await foreman_repo.get_shift_history(FOREMAN_ID, PROJECT_ID, min_seq_no=seq_no + 100)
+
+
+async def test_ndjson_stream_fails_before_response(foreman_repo, monkeypatch):
+    monkeypatch.setattr(elastic_repository, "SHIFT_READ_WAIT_SECONDS", 0.05)
+    monkeypatch.setattr(elastic_repository, "SHIFT_READ_POLL_SECONDS", 0.01)
+    seq_no = await foreman_repo.start_shift(FOREMAN_ID, PROJECT_ID, [], [SUBTASK_ID])
+    service = ForemanService(foreman_repo)
+
+    with pytest.raises(ServiceUnavailableException):
+        await service.stream_shift_history(FOREMAN_ID, PROJECT_ID, min_seq_no=seq_no + 100)
+
+    stream = await service.stream_shift_history(FOREMAN_ID, PROJECT_ID, min_seq_no=seq_no)
+    lines = [line async for line in stream]
+    assert len(lines) == 1
@@ -0,0 +1,144 @@
+import elasticsearch
+import pytest
+
+from common.exception_handlers.handlers import NotFoundExceptionHandler
+from common.exceptions.not_found import NotFoundException
+from repository.elasticsearch_implementation import foreman_repository as foreman_module
+from repository.elasticsearch_implementation.foreman_repository import ElasticForemanRepository
+from tests.conftest import FOREMAN_ID, PROJECT_ID
+
+pytestmark = pytest.mark.anyio
+
+SUBTASK_A = "s0-k0-t0-a0-b0"
+SUBTASK_B = "s0-k0-t0-a0-b1"
+STATE_ID = f"{PROJECT_ID}:{FOREMAN_ID}"
+
+
+async def events(es):
+    resp = await es.search(index="shift_events", query={"match_all": {}}, size=100)
+    hits = sorted(resp["hits"]["hits"], key=lambda hit: hit["_source"]["timestamp"])
+    return [hit["_source"]["event"] for hit in hits]
+
+
+async def active(es):
+    state = await es.get(index="shift_state", id=STATE_ID)
+    return sorted(item["target_key"] for item in state["_source"]["active"])
+
+
+def concurrent_write(es, method, target_key):
+    """Перед первым вызовом es.<method> другой воркер успевает записать состояние."""
+    original = getattr(es, method)
+    calls = {"n": 0}
+
+    async def wrapped(*args, **kwargs):
+        calls["n"] += 1
+        if calls["n"] == 1:
+            state = await es.get(index="shift_state", id=STATE_ID)
+            doc = state["_source"]
+            doc["active"] = doc["active"] + [{"target_key": target_key, "start_time": "2025-01-01T00:00:00+00:00"}]
+            await es.index(index="shift_state", id=STATE_ID, document=doc)
+        return await original(*args, **kwargs)
+
+    return wrapped, calls
+
+
+async def test_toggle_retries_on_conflict(es, foreman_repo, monkeypatch):
+    await foreman_repo.start_shift(FOREMAN_ID, PROJECT_ID, [], [SUBTASK_A])
+    wrapped, calls = concurrent_write(es, "update", f"subtask:{SUBTASK_B}")
+    monkeypatch.setattr(es, "update", wrapped)
+
+    await foreman_repo.stop_shift(FOREMAN_ID, PROJECT_ID, [], [SUBTASK_A])
+
+    assert calls["n"] == 2
+    # изменение другого воркера не потеряно, stop применён к перечитанному состоянию
+    assert await active(es) == [f"subtask:{SUBTASK_B}"]
+    assert await events(es) == ["start", "stop"]
+
+
+async def test_toggle_gives_up_after_max_retries(es, foreman_repo, monkeypatch):
+    await foreman_repo.start_shift(FOREMAN_ID, PROJECT_ID, [], [SUBTASK_A])
+
+    async def always_conflict(*args, **kwargs):
+        raise elasticsearch.ConflictError("conflict", meta=None, body={})
+
+    monkeypatch.setattr(es, "update", always_conflict)
+
+    with pytest.raises(elasticsearch.ConflictError):
+        await foreman_repo.stop_shift(FOREMAN_ID, PROJECT_ID, [], [SUBTASK_A])
+    assert len(await events(es)) == 1
+
+
+async def test_bulk_shift_retries_conflicting_states(es, foreman_repo, monkeypatch):
+    await foreman_repo.start_shift(FOREMAN_ID, PROJECT_ID, [], [SUBTASK_A])
+    wrapped, calls = concurrent_write(es, "bulk", f"subtask:{SUBTASK_B}")
+    monkeypatch.setattr(es, "bulk", wrapped)
+
+    results = await foreman_repo.bulk_shift(FOREMAN_ID, [
+        {"project_id": PROJECT_ID, "action": "stop", "task_ids": [], "subtask_ids": [SUBTASK_A]},
+    ])
+
+    assert results[0]["result"] == "shift stopped"
+    assert await active(es) == [f"subtask:{SUBTASK_B}"]
+    assert len(await events(es)) == 2
+
+
+async def test_bulk_shift_reports_exhausted_retries(es, foreman_repo, monkeypatch):
+    monkeypatch.setattr(foreman_module, "SHIFT_STATE_MAX_RETRIES", 1)
+    await foreman_repo.start_shift(FOREMAN_ID, PROJECT_ID, [], [SUBTASK_A])
+    wrapped, _ = concurrent_write(es, "bulk", f"subtask:{SUBTASK_B}")
+    monkeypatch.setattr(es, "bulk", wrapped)
+
+    results = await foreman_repo.bulk_shift(FOREMAN_ID, [
+        {"project_id": PROJECT_ID, "action": "stop", "task_ids": [], "subtask_ids": [SUBTASK_A]},
+    ])
+
+    assert results[0]["result"] == "conflict"
+    assert len(await events(es)) == 1
+
+
+async def test_failed_event_write_is_replayed_by_history_read(es, foreman_repo, monkeypatch):
+    async def broken_events(events):
+        raise RuntimeError("Failed to write shift events")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(foreman_repo, "_write_shift_events", broken_events)
+        seq_no = await foreman_repo.start_shift(FOREMAN_ID, PROJECT_ID, [], [SUBTASK_A])
+
+    # состояние записано, события ждут в pending_events
+    assert await active(es) == [f"subtask:{SUBTASK_A}"]
+    assert await events(es) == []
+
+    history, _ = await foreman_repo.get_shift_history(FOREMAN_ID, PROJECT_ID, min_seq_no=seq_no)
+    assert [entry["subtask_id"] for entry in history] == [SUBTASK_A]
+
+
+async def test_failed_event_write_is_replayed_by_next_toggle(es, foreman_repo, monkeypatch):
+    async def broken_events(events):
+        raise RuntimeError("Failed to write shift events")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(foreman_repo, "_write_shift_events", broken_events)
+        await foreman_repo.start_shift(FOREMAN_ID, PROJECT_ID, [], [SUBTASK_A])
+
+    await foreman_repo.bulk_shift(FOREMAN_ID, [
+        {"project_id": PROJECT_ID, "action": "stop", "task_ids": [], "subtask_ids": [SUBTASK_A]},
+    ])
+
+    assert await events(es) == ["start", "stop"]
+
+
+@pytest.mark.parametrize("write_buffer_ms", [0, 20])
+@pytest.mark.parametrize("foreman_id, project_id", [(FOREMAN_ID, "missing"), ("f2", PROJECT_ID)])
+async def test_shift_toggle_of_unknown_or_foreign_project_is_not_found(
+        es, foreman_repo, write_buffer_ms, foreman_id, project_id
+):
+    repo = ElasticForemanRepository(es, "construction", "shift_events", "shift_state", write_buffer_ms=write_buffer_ms)
+
+    with pytest.raises(NotFoundException):
+        await repo.start_shift(foreman_id, project_id, [], [SUBTASK_A])
+    with pytest.raises(NotFoundException):
+        await repo.stop_shift(foreman_id, project_id, [], [SUBTASK_A])
+    await repo.close()
+
+    assert NotFoundExceptionHandler.status_code == 404
+    assert await events(es) == []
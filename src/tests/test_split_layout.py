@@ -0,0 +1,157 @@
+import elasticsearch
+import pytest
+
+from db.elastic.mappings import PROJECT_HEADER_MAPPING
+from repository.base.split_layout import REVISION_FIELD, STAGE_REFS_FIELD
+from repository.elasticsearch_implementation.foreman_repository import SplitForemanRepository
+from repository.elasticsearch_implementation.manager_repository import SplitManagerRepository
+from tests.conftest import FOREMAN_ID, PROJECT_ID, small_project
+
+pytestmark = pytest.mark.anyio
+
+STAGES_INDEX = "project_stages"
+NAME_PATH = "work_stages.0.work_kinds.0.work_types.0.tasks.0.subtasks.0.subtask_name"
+
+
+@pytest.fixture
+async def manager(es):
+    await es.indices.put_mapping(index="construction", **PROJECT_HEADER_MAPPING)
+    repo = SplitManagerRepository(es, "construction", "shift_events", stages_index=STAGES_INDEX)
+    project = small_project()
+    project["work_stages"].append({**project["work_stages"][0], "stage_id": "s1", "work_kinds": []})
+    await repo.create_project(project)
+    return repo
+
+
+@pytest.fixture
+def foreman(es, manager):
+    return SplitForemanRepository(es, "construction", "shift_events", "shift_state", stages_index=STAGES_INDEX)
+
+
+async def header(es):
+    return (await es.get(index="construction", id=PROJECT_ID))["_source"]
+
+
+def stage_doc_ids(es):
+    return set(es.indices_data[STAGES_INDEX].docs)
+
+
+async def rename(manager, name):
+    return await manager.patch_project(PROJECT_ID, [{"op": "set", "path": NAME_PATH, "value": name}])
+
+
+async def subtask_name(foreman):
+    stages, _ = await foreman.get_tasks(FOREMAN_ID, PROJECT_ID)
+    return stages[0]["work_kinds"][0]["work_types"][0]["tasks"][0]["subtasks"][0]["subtask_name"]
+
+
+async def test_patch_writes_new_stage_doc_and_drops_replaced_one(es, manager, foreman):
+    before = (await header(es))[STAGE_REFS_FIELD]
+
+    await rename(manager, "renamed")
+
+    after = await header(es)
+    refs = after[STAGE_REFS_FIELD]
+    assert after[REVISION_FIELD] == 1
+    # изменённый этап — новый документ ревизии 1, нетронутый — прежний
+    assert refs[0]["doc"] != before[0]["doc"] and refs[0][REVISION_FIELD] == 1
+    assert refs[1] == before[1]
+    assert stage_doc_ids(es) == {ref["doc"] for ref in refs}
+    assert await subtask_name(foreman) == "renamed"
+
+
+async def test_header_conflict_rolls_back_new_stage_docs(es, manager, monkeypatch):
+    original = es.index
+    calls = {"n": 0}
+
+    async def conflicting_index(*args, **kwargs):
+        calls["n"] += 1
+        if calls["n"] == 1:
+            # другой писатель успел переписать заголовок
+            await es.update(index="construction", id=PROJECT_ID, doc={"project_name": "other"})
+        return await original(*args, **kwargs)
+
+    monkeypatch.setattr(es, "index", conflicting_index)
+
+    await rename(manager, "renamed")
+
+    refs = (await header(es))[STAGE_REFS_FIELD]
+    assert calls["n"] == 2
+    assert stage_doc_ids(es) == {ref["doc"] for ref in refs}
+
+
+async def test_failed_stage_write_leaves_project_readable(es, manager, foreman, monkeypatch):
+    before = await header(es)
+    original = es.bulk
+
+    async def failing_bulk(operations, **kwargs):
+        if any("index" in operation for operation in operations[::2]):
+            raise elasticsearch.ConnectionError("connection lost")
+        return await original(operations=operations, **kwargs)
+
+    monkeypatch.setattr(es, "bulk", failing_bulk)
+
+    with pytest.raises(elasticsearch.ConnectionError):
+        await rename(manager, "renamed")
+
+    assert await header(es) == before
+    assert await subtask_name(foreman) == "Subtask 0.0.0.0.0"
+    monkeypatch.setattr(es, "bulk", original)
+    await rename(manager, "renamed")
+    assert await subtask_name(foreman) == "renamed"
+
+
+async def test_reader_with_stale_header_rereads_it(es, manager, foreman, monkeypatch):
+    stale = await es.get(index="construction", id=PROJECT_ID)
+    await rename(manager, "renamed")
+    original = foreman._get_header
+    calls = {"n": 0}
+
+    async def stale_first(project_id, includes=None):
+        calls["n"] += 1
+        if calls["n"] == 1:
+            # заголовок прочитан до записи, документы его этапов уже удалены
+            return stale
+        return await original(project_id, includes)
+
+    monkeypatch.setattr(foreman, "_get_header", stale_first)
+
+    assert await subtask_name(foreman) == "renamed"
+    assert calls["n"] == 2
+
+
+async def test_report_links_replace_stage_doc(es, manager, foreman):
+    subtask_id = "s0-k0-t0-a0-b0"
+
+    await foreman.add_report_links(
+        PROJECT_ID, "s0", "s0-k0-t0", "s0-k0", "s0-k0-t0-a0", subtask_id, [{"title": "t", "href": "h"}]
+    )
+
+    refs = (await header(es))[STAGE_REFS_FIELD]
+    assert stage_doc_ids(es) == {ref["doc"] for ref in refs}
+    stages, _ = await foreman.get_tasks(FOREMAN_ID, PROJECT_ID)
+    subtask = stages[0]["work_kinds"][0]["work_types"][0]["tasks"][0]["subtasks"][0]
+    assert subtask["reportLinks"] == [{"title": "t", "href": "h"}]
+
+
+async def test_import_skips_header_when_stage_docs_fail(es, manager, monkeypatch):
+    original = es.bulk
+
+    async def failing_stage_bulk(operations, **kwargs):
+        resp = await original(operations=operations, **kwargs)
+        if operations[0]["index"]["_index"] == STAGES_INDEX:
+            resp["errors"] = True
+            resp["items"][0]["index"].update(status=500, error={"type": "boom", "reason": "disk"})
+        return resp
+
+    monkeypatch.setattr(es, "bulk", failing_stage_bulk)
+    before = await header(es)
+
+    async def projects():
+        yield 1, small_project()
+
+    report = await manager.import_projects(projects())
+
+    assert report["failed"] == 1
+    assert report["errors"][0]["error"] == "stage documents: boom: disk"
+    assert await header(es) == before
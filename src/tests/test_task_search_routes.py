@@ -0,0 +1,47 @@
+import pytest
+
+from api.v1 import foreman, manager
+from common.exception_handlers.handlers import NotImplementedExceptionHandler
+from common.exceptions.not_implemented import NotImplementedException
+from core.environment_config import settings
+from repository.base.split_layout import STORAGE_LAYOUT_NESTED, STORAGE_LAYOUT_SPLIT
+from repository.elasticsearch_implementation.foreman_repository import build_foreman_repository
+from repository.elasticsearch_implementation.manager_repository import build_manager_repository
+from services.foreman_service import ForemanService
+from services.manager_service import ManagerService
+from tests.conftest import FOREMAN_ID
+
+pytestmark = pytest.mark.anyio
+
+
+def services(es):
+    return ForemanService(build_foreman_repository(es)), ManagerService(build_manager_repository(es))
+
+
+@pytest.mark.parametrize("module", [foreman, manager])
+@pytest.mark.parametrize("layout", [STORAGE_LAYOUT_NESTED, STORAGE_LAYOUT_SPLIT])
+def test_task_search_is_registered_for_every_layout(module, layout, monkeypatch):
+    monkeypatch.setattr(settings.elasticsearch, "storage_layout", layout)
+
+    assert [route.path for route in module.router.routes if route.path.endswith("/tasks/search")]
+
+
+async def test_split_layout_search_is_not_implemented(es, monkeypatch):
+    monkeypatch.setattr(settings.elasticsearch, "storage_layout", STORAGE_LAYOUT_SPLIT)
+    foreman_service, manager_service = services(es)
+
+    async def unexpected_search(*args, **kwargs):
+        raise AssertionError("search must not reach elasticsearch")
+
+    monkeypatch.setattr(es, "search", unexpected_search)
+    with pytest.raises(NotImplementedException):
+        await foreman_service.search_tasks(FOREMAN_ID, "task")
+    with pytest.raises(NotImplementedException):
+        await manager_service.search_tasks("task")
+    assert NotImplementedExceptionHandler.status_code == 501
+
+
+async def test_nested_layout_supports_search(es, monkeypatch):
+    monkeypatch.setattr(settings.elasticsearch, "storage_layout", STORAGE_LAYOUT_NESTED)
+
+    assert all(service.repo.supports_task_search for service in services(es))
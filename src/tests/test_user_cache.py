@@ -0,0 +1,100 @@
+import json
+from typing import Any, Dict, List, Optional
+
+import pytest
+
+from tests.fake_elastic import FakeElasticsearch
+from core.cache import TTLCache
+from repository.elasticsearch_implementation.user_repository import UserRepository
+from repository.redis_implementation.user_cache_repository import RedisUserCacheRepository
+from schemas.user import UserInDB
+
+pytestmark = pytest.mark.anyio
+
+HASH = "$2b$12$stored-hash"
+
+
+class RecordingRedis:
+    """Ровно то, что нужно RedisUserCacheRepository: хеши user:cache и записи в них."""
+
+    def __init__(self):
+        self.hashes: Dict[str, Dict[str, Any]] = {}
+        self.written: List[str] = []
+
+    async def hmget(self, key: str, *fields: str) -> List[Optional[Any]]:
+        return [self.hashes.get(key, {}).get(field) for field in fields]
+
+    async def eval(self, script: str, numkeys: int, key: str, seq_no: int, *args: Any) -> int:
+        entry = self.hashes.setdefault(key, {})
+        entry["seq_no"] = seq_no
+        if len(args) == 2:
+            entry["user"] = args[0]
+            self.written.append(args[0])
+        else:
+            entry.pop("user", None)
+        return 1
+
+    async def delete(self, key: str) -> None:
+        self.hashes.pop(key, None)
+
+    async def publish(self, channel: str, message: str) -> None:
+        pass
+
+
+@pytest.fixture
+def redis() -> RecordingRedis:
+    return RecordingRedis()
+
+
+@pytest.fixture
+def cache(redis: RecordingRedis) -> RedisUserCacheRepository:
+    return RedisUserCacheRepository(redis, local=TTLCache(16, 60))
+
+
+@pytest.fixture
+async def users(es: FakeElasticsearch, cache: RedisUserCacheRepository) -> UserRepository:
+    repo = UserRepository(es, "users", cache=cache, emails_index="user_emails")
+    await repo.create_user(UserInDB(id="u1", email="u1@example.com", hashed_password=HASH))
+    return repo
+
+
+async def test_cache_never_stores_password_hash(users: UserRepository, redis: RecordingRedis):
+    user = await users.get_user_profile("u1")
+
+    assert user.hashed_password == ""
+    assert redis.written and all(json.loads(raw)["hashed_password"] == "" for raw in redis.written)
+    assert (await users.get_user_profile("u1")).hashed_password == ""
+
+
+async def test_get_user_by_id_keeps_password_hash(users: UserRepository, redis: RecordingRedis):
+    await users.get_user_profile("u1")
+
+    assert (await users.get_user_by_id("u1")).hashed_password == HASH
+
+
+async def test_login_lookup_reads_hash_from_elastic(users: UserRepository):
+    await users.get_user_profile("u1")
+
+    user = await users.get_user_by_email("U1@example.com")
+
+    assert user.hashed_password == HASH
+
+
+async def test_redis_entries_written_before_projection_lose_the_hash(
+        cache: RedisUserCacheRepository, redis: RecordingRedis
+):
+    old = UserInDB(id="u2", email="u2@example.com", hashed_password=HASH)
+    redis.hashes[cache.key("u2")] = {"seq_no": "1", "user": old.json()}
+
+    assert (await cache.get_user("u2")).hashed_password == ""
+
+
+async def test_update_with_cached_user_keeps_stored_hash(users: UserRepository, es: FakeElasticsearch):
+    user = await users.get_user_profile("u1")
+    user.role = "project_manager"
+
+    await users.update_user(user)
+
+    stored = (await es.get(index="users", id="u1"))["_source"]
+    assert stored["role"] == "project_manager"
+    assert stored["hashed_password"] == HASH
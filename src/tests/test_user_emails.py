@@ -0,0 +1,83 @@
+import time
+
+import elasticsearch
+import pytest
+
+from tests.fake_elastic import FakeElasticsearch
+from repository.elasticsearch_implementation.user_repository import EMAIL_CLAIM_GRACE_SECONDS, UserRepository
+from schemas.user import UserInDB
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def users(es: FakeElasticsearch) -> UserRepository:
+    return UserRepository(es, "users", emails_index="user_emails")
+
+
+def user(user_id: str, email: str) -> UserInDB:
+    return UserInDB(id=user_id, email=email, hashed_password="hash")
+
+
+async def claim_of(es: FakeElasticsearch, email: str):
+    doc = await es.get(index="user_emails", id=email, ignore=[404])
+    return doc["_source"]["user_id"] if doc.get("found") else None
+
+
+async def test_failed_update_releases_new_email(users: UserRepository, es: FakeElasticsearch, monkeypatch):
+    await users.create_user(user("u1", "old@example.com"))
+    original = es.index
+
+    async def failing_index(*args, **kwargs):
+        if kwargs.get("index") == "users":
+            raise elasticsearch.ConnectionError("connection lost")
+        return await original(*args, **kwargs)
+
+    monkeypatch.setattr(es, "index", failing_index)
+
+    with pytest.raises(elasticsearch.ConnectionError):
+        await users.update_user(user("u1", "new@example.com"))
+
+    assert await claim_of(es, "new@example.com") is None
+    assert await claim_of(es, "old@example.com") == "u1"
+
+
+async def test_email_of_missing_user_is_reclaimed_after_grace(users: UserRepository, es: FakeElasticsearch):
+    stale = time.time() - EMAIL_CLAIM_GRACE_SECONDS - 1
+    await es.create(index="user_emails", id="a@example.com", document={"user_id": "ghost", "claimed_at": stale})
+
+    await users.create_user(user("u1", "a@example.com"))
+
+    assert await claim_of(es, "a@example.com") == "u1"
+    assert (await users.get_user_by_email("a@example.com")).id == "u1"
+
+
+async def test_fresh_claim_of_missing_user_is_kept(users: UserRepository, es: FakeElasticsearch):
+    # регистрация, занявшая email, ещё могла не записать пользователя
+    await es.create(index="user_emails", id="a@example.com", document={"user_id": "pending", "claimed_at": time.time()})
+
+    with pytest.raises(ValueError):
+        await users.create_user(user("u1", "a@example.com"))
+
+    assert await claim_of(es, "a@example.com") == "pending"
+
+
+async def test_email_of_existing_owner_is_not_reclaimed(users: UserRepository, es: FakeElasticsearch):
+    await users.create_user(user("u1", "a@example.com"))
+    await es.index(index="user_emails", id="a@example.com", document={"user_id": "u1"})
+
+    with pytest.raises(ValueError):
+        await users.create_user(user("u2", "A@example.com"))
+
+    assert await claim_of(es, "a@example.com") == "u1"
+
+
+async def test_email_left_by_owner_who_moved_is_reclaimed(users: UserRepository, es: FakeElasticsearch):
+    await users.create_user(user("u1", "a@example.com"))
+    # смена email, после которой старый документ не удалось освободить
+    await es.index(index="users", id="u1", document=user("u1", "b@example.com").dict())
+    await es.index(index="user_emails", id="a@example.com", document={"user_id": "u1"})
+
+    await users.create_user(user("u2", "a@example.com"))
+
+    assert await claim_of(es, "a@example.com") == "u2"
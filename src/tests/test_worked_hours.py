@@ -0,0 +1,31 @@
+import pytest
+
+from services.manager_service import ManagerService
+
+pytestmark = pytest.mark.anyio
+
+
+class WorkedHoursRepository:
+    def __init__(self):
+        self.time_zones = []
+
+    async def get_worked_hours(self, project_id, date_from, date_to, time_zone):
+        self.time_zones.append(time_zone)
+        return None
+
+
+@pytest.mark.parametrize("time_zone", ["Mars/Olympus", "../../etc/passwd", "", "Europe/"])
+async def test_unknown_time_zone_is_rejected_before_es(time_zone):
+    repo = WorkedHoursRepository()
+
+    with pytest.raises(ValueError, match="Unknown time zone"):
+        await ManagerService(repo).worked_hours("p1", time_zone=time_zone)
+    assert repo.time_zones == []
+
+
+async def test_known_time_zone_reaches_repository():
+    repo = WorkedHoursRepository()
+
+    await ManagerService(repo).worked_hours("p1", time_zone="Europe/Moscow")
+
+    assert repo.time_zones == ["Europe/Moscow"]
@@ -0,0 +1,124 @@
+import asyncio
+from typing import Any, Dict, List
+
+import pytest
+
+from repository.base.write_buffer import CoalescingWriteBuffer, drain_write_buffers
+from repository.elasticsearch_implementation.foreman_repository import ElasticForemanRepository
+from tests.conftest import FOREMAN_ID, PROJECT_ID, small_project
+
+pytestmark = pytest.mark.anyio
+
+
+class RecordingFlush:
+    def __init__(self, error: Exception = None):
+        self.batches: List[List[Dict[str, Any]]] = []
+        self.error = error
+
+    async def __call__(self, batch: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        self.batches.append(batch)
+        await asyncio.sleep(0)
+        if self.error is not None:
+            raise self.error
+        return [{"result": "ok", "n": operation["n"]} for operation in batch]
+
+
+async def test_operations_within_window_share_one_flush():
+    flush = RecordingFlush()
+    buffer = CoalescingWriteBuffer(flush, window_ms=20, max_batch=100, metrics_prefix="test_buffer")
+
+    results = await asyncio.gather(*(buffer.submit({"n": n}) for n in range(5)))
+
+    assert [result["n"] for result in results] == list(range(5))
+    assert [len(batch) for batch in flush.batches] == [5]
+
+
+async def test_full_batch_is_flushed_before_window():
+    flush = RecordingFlush()
+    # окно заведомо больше таймаута: дождаться можно только сброса по max_batch
+    buffer = CoalescingWriteBuffer(flush, window_ms=60000, max_batch=3, metrics_prefix="test_buffer")
+
+    results = await asyncio.wait_for(asyncio.gather(*(buffer.submit({"n": n}) for n in range(3))), timeout=1)
+
+    assert [result["n"] for result in results] == [0, 1, 2]
+    assert [len(batch) for batch in flush.batches] == [3]
+
+
+async def test_flush_error_reaches_every_submitter():
+    flush = RecordingFlush(RuntimeError("bulk failed"))
+    buffer = CoalescingWriteBuffer(flush, window_ms=5, max_batch=100, metrics_prefix="test_buffer")
+
+    results = await asyncio.gather(*(buffer.submit({"n": n}) for n in range(3)), return_exceptions=True)
+
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert len(flush.batches) == 1
+
+
+async def test_drain_flushes_pending_operations():
+    flush = RecordingFlush()
+    buffer = CoalescingWriteBuffer(flush, window_ms=60000, max_batch=100, metrics_prefix="test_buffer")
+    submitted = [asyncio.ensure_future(buffer.submit({"n": n})) for n in range(2)]
+    await asyncio.sleep(0)
+
+    await drain_write_buffers()
+
+    assert all(task.done() for task in submitted)
+    assert [result["n"] for result in await asyncio.gather(*submitted)] == [0, 1]
+
+
+async def test_buffered_shift_starts_of_two_foremen_share_one_bulk(es, monkeypatch):
+    await es.index(index="construction", id=PROJECT_ID, document=small_project())
+    await es.index(index="construction", id="p2", document=small_project("p2", "f2"))
+    repo = ElasticForemanRepository(es, "construction", "shift_events", "shift_state", write_buffer_ms=20)
+    original = es.bulk
+    bulk_indices = []
+
+    async def recording_bulk(operations, **kwargs):
+        bulk_indices.append({next(iter(header.values()))["_index"] for header in operations[::2]})
+        return await original(operations, **kwargs)
+
+    monkeypatch.setattr(es, "bulk", recording_bulk)
+
+    seq_nos = await asyncio.gather(
+        repo.start_shift(FOREMAN_ID, PROJECT_ID, [], ["s0-k0-t0-a0-b0"]),
+        repo.start_shift("f2", "p2", [], ["s0-k0-t0-a0-b0"]),
+    )
+
+    assert all(isinstance(seq_no, int) for seq_no in seq_nos)
+    assert [indices for indices in bulk_indices if "shift_state" in indices] == [{"shift_state"}]
+    for state_id in (f"{PROJECT_ID}:{FOREMAN_ID}", "p2:f2"):
+        state = await es.get(index="shift_state", id=state_id)
+        assert [item["target_key"] for item in state["_source"]["active"]] == ["subtask:s0-k0-t0-a0-b0"]
+    await repo.close()
+
+
+async def test_short_flush_result_fails_the_rest():
+    async def short_flush(batch):
+        return [{"result": "ok"}] * (len(batch) - 1)
+
+    buffer = CoalescingWriteBuffer(short_flush, window_ms=5, max_batch=100, metrics_prefix="test_buffer")
+
+    results = await asyncio.wait_for(
+        asyncio.gather(*(buffer.submit({"n": n}) for n in range(3)), return_exceptions=True), timeout=1
+    )
+
+    assert results[:2] == [{"result": "ok"}] * 2
+    assert isinstance(results[2], RuntimeError)
+
+
+async def test_cancelled_flush_fails_every_submitter():
+    started = asyncio.Event()
+
+    async def hanging_flush(batch):
+        started.set()
+        await asyncio.Event().wait()
+
+    buffer = CoalescingWriteBuffer(hanging_flush, window_ms=5, max_batch=100, metrics_prefix="test_buffer")
+    submitted = [asyncio.ensure_future(buffer.submit({"n": n})) for n in range(2)]
+    await started.wait()
+
+    for flush in list(buffer._flushes):
+        flush.cancel()
+    results = await asyncio.wait_for(asyncio.gather(*submitted, return_exceptions=True), timeout=1)
+
+    assert all(isinstance(result, RuntimeError) for result in results)